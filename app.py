@@ -4,6 +4,7 @@ import aws_cdk as cdk
 from aws_black_belt_infrastructure.storage_layer_stack import StorageLayer
 from aws_black_belt_infrastructure.model_development_stack import ModelDevelopment
 from aws_black_belt_infrastructure.model_inference_stack import InferenceStack
+from aws_black_belt_infrastructure.instance_profiles import load_profiles
 
 
 # Initialize the CDK app
@@ -25,6 +26,9 @@ parameters = {"Owner": "*******",
               "Az1": "*******",
               "Az2": "*******"} 
 
+# Define the instance types and Fargate sizes of the workloads, recommended by tools/rightsizing.py
+parameters["InstanceProfiles"] = load_profiles()
+
 
 # Define the CDK Environment parameters
 environment = cdk.Environment(account=parameters["AccountId"], region=parameters["Region"])
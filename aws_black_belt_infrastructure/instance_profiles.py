@@ -0,0 +1,41 @@
+import os
+import json
+import copy
+
+
+# Instance profiles file at the root of the repository, written by tools/rightsizing.py --apply
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance_profiles.json')
+# Sizes used when the file has no entry for a workload
+DEFAULT_PROFILES = {
+    'training': {'kind': 'sagemaker', 'instance_type': 'ml.c5.2xlarge', 'instance_count': 1, 'volume_size_gb': 30},
+    'inference': {'kind': 'sagemaker', 'instance_type': 'ml.t3.medium', 'instance_count': 1, 'volume_size_gb': 30},
+    'mlflow': {'kind': 'fargate', 'cpu': 1024, 'memory_mib': 4096},
+    'grafana': {'kind': 'fargate', 'cpu': 1024, 'memory_mib': 4096},
+    'scoring': {'kind': 'fargate', 'cpu': 1024, 'memory_mib': 4096}
+}
+
+
+def load_profiles(path: str = PROFILES_PATH) -> dict:
+    """ Loads the instance profiles of the SageMaker jobs and Fargate services, missing entries use the defaults
+        :argument: path - Path of the instance profiles JSON file
+        :return: profiles - Dictionary of workload name to profile
+    """
+    profiles = copy.deepcopy(DEFAULT_PROFILES)
+    if os.path.exists(path):
+        with open(path) as profiles_file:
+            for workload, profile in json.load(profiles_file).items():
+                profiles.setdefault(workload, {}).update(profile)
+    return profiles
+
+def gunicorn_workers(profile: dict) -> int:
+    """ Returns the gunicorn workers of the Fargate profile, 2 * vCPU + 1 and at least 2 for fractional vCPUs
+        :argument: profile - Fargate profile with cpu in CPU units, 1024 per vCPU
+        :return: workers - Number of gunicorn workers
+    """
+    return max(2, 2 * profile['cpu'] // 1024 + 1)
+
+def save_profiles(profiles: dict, path: str = PROFILES_PATH) -> None:
+    """ Saves the instance profiles JSON file read by app.py """
+    with open(path, 'w') as profiles_file:
+        json.dump(profiles, profiles_file, indent=4)
+        profiles_file.write('\n')
@@ -6,15 +6,17 @@ from aws_cdk import (
     aws_rds,
     aws_ecs,
     aws_ecs_patterns,
-    aws_lambda,
-    aws_ecr,
-    aws_codecommit, aws_events_targets,
+    aws_lambda, aws_sqs, aws_dynamodb,
+    aws_ecr, aws_cloudwatch, aws_s3_deployment,
+    aws_codecommit, aws_events, aws_events_targets,
     aws_codebuild, aws_apigateway,
     RemovalPolicy, Duration,
     Tags, Stack, CfnOutput
 )
 from constructs import Construct
 
+from aws_black_belt_infrastructure.instance_profiles import gunicorn_workers
+
 class ModelDevelopment(Stack):
     def __init__(self, scope: Construct, construct_id: str, parameters: dict, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -28,6 +30,7 @@ class ModelDevelopment(Stack):
         self.vpc_security_group_id = parameters["VPCSecurityGroupId"]
         self.owner = parameters["Owner"]
         self.project = parameters["Project"]
+        self.profiles = parameters["InstanceProfiles"]
         
         # Define Tags for all resources (where they apply)
         Tags.of(self).add("Project", self.project)
@@ -243,6 +246,17 @@ class ModelDevelopment(Stack):
                                                             "*"
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="DynamoDBWindowsReadAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "dynamodb:BatchGetItem",
+                                                            "dynamodb:GetItem"
+                                                        ],
+                                                        resources=[
+                                                            f"arn:aws:dynamodb:{self.acc_region}:{self.account_id}:table/mlops-unit-windows"
+                                                        ]
+                                                    ),
                                                     aws_iam.PolicyStatement(
                                                         sid="AthenaS3Access",
                                                         effect=aws_iam.Effect.ALLOW,
@@ -284,12 +298,37 @@ class ModelDevelopment(Stack):
         #===========================================================================================================================
         
         # Define Mlflow Task Definition
-        mlflow_task_definition = aws_ecs.FargateTaskDefinition(self, "MLflowTaskDefinition", cpu=1024, ephemeral_storage_gib=30,
-                                                               memory_limit_mib=4096, execution_role=fargate_role,
+        mlflow_task_definition = aws_ecs.FargateTaskDefinition(self, "MLflowTaskDefinition", cpu=self.profiles["mlflow"]["cpu"],
+                                                               ephemeral_storage_gib=30,
+                                                               memory_limit_mib=self.profiles["mlflow"]["memory_mib"],
+                                                               execution_role=fargate_role,
                                                                family="mlops-mlflow-task", task_role=fargate_role)
         
+        # Define the PgBouncer sidecar pooling MLflow connections to the Aurora backend
+        mlflow_pgbouncer_container = mlflow_task_definition.add_container("MLflowPgBouncerContainer",
+                                             image=aws_ecs.ContainerImage.from_asset(directory="pgbouncer"),
+                                             container_name="mlflow-pgbouncer-container", privileged=False,
+                                             port_mappings=[aws_ecs.PortMapping(container_port=6432, protocol=aws_ecs.Protocol.TCP)],
+                                             logging=aws_ecs.LogDriver.aws_logs(stream_prefix="mlflow-pgbouncer"),
+                                             health_check=aws_ecs.HealthCheck(command=["CMD-SHELL", "nc -z 127.0.0.1 6432 || exit 1"],
+                                                                              interval=Duration.seconds(10),
+                                                                              start_period=Duration.seconds(15)),
+                                             secrets={
+                                                 "DB_USERNAME": aws_ecs.Secret.from_secrets_manager(mlflow_db_secret, "username"),
+                                                 "DB_PASSWORD": aws_ecs.Secret.from_secrets_manager(mlflow_db_secret, "password")
+                                             },
+                                             environment={
+                                                 "DB_HOST": mlflow_db_endpoint.hostname,
+                                                 "DB_PORT": "5432",
+                                                 "DATABASE": mlflow_database_name,
+                                                 "SERVICE_NAME": "mlflow",
+                                                 "POOL_MODE": "transaction",
+                                                 "DEFAULT_POOL_SIZE": "10",
+                                                 "MAX_CLIENT_CONN": "400"
+                                             })
+        
         # Define the MLflow Task Container 
-        mlflow_task_definition.add_container("MLflowImageContainer",
+        mlflow_container = mlflow_task_definition.add_container("MLflowImageContainer",
                                              image=aws_ecs.ContainerImage.from_asset(directory="mlflow"),
                                              container_name="mlflow-task-container", privileged=False,
                                              port_mappings=[aws_ecs.PortMapping(container_port=5000, protocol=aws_ecs.Protocol.TCP)],
@@ -299,19 +338,25 @@ class ModelDevelopment(Stack):
                                                  "DB_PASSWORD": aws_ecs.Secret.from_secrets_manager(mlflow_db_secret, "password")
                                              },
                                              environment={
-                                                 "HOST": mlflow_db_endpoint.hostname,
-                                                 "PORT": "5432",
+                                                 "HOST": "127.0.0.1",
+                                                 "PORT": "6432",
                                                  "DATABASE": mlflow_database_name,
-                                                 "BUCKET": artifacts_bucket.bucket_name
+                                                 "BUCKET": artifacts_bucket.bucket_name,
+                                                 # The workers follow the vCPU of the task size in the instance profiles
+                                                 "MLFLOW_WORKERS": str(gunicorn_workers(self.profiles["mlflow"])),
+                                                 "MLFLOW_SQLALCHEMYSTORE_POOL_SIZE": "5",
+                                                 "MLFLOW_SQLALCHEMYSTORE_MAX_OVERFLOW": "5"
                                              })
+        mlflow_container.add_container_dependencies(aws_ecs.ContainerDependency(
+            container=mlflow_pgbouncer_container, condition=aws_ecs.ContainerDependencyCondition.HEALTHY))
         
         # Define the Load Balanced Service for MLflow
         mlflow_load_balanced_service = aws_ecs_patterns.ApplicationLoadBalancedFargateService(
-            self, "MLflowLoadBalancedService", assign_public_ip=False, cpu=1024, 
-            memory_limit_mib=4096, security_groups=[fargate_security_group],
+            self, "MLflowLoadBalancedService", assign_public_ip=False, cpu=self.profiles["mlflow"]["cpu"], 
+            memory_limit_mib=self.profiles["mlflow"]["memory_mib"], security_groups=[fargate_security_group],
             task_definition=mlflow_task_definition, cluster=fargate_cluster,
             task_subnets=subnet_selection,
-            desired_count=1, listener_port=80, 
+            desired_count=2, listener_port=80, 
             load_balancer_name="mlops-mlflow-load-balancer",
             open_listener=False, public_load_balancer=True, 
             service_name="mlops-mlflow-service",
@@ -319,6 +364,18 @@ class ModelDevelopment(Stack):
         )
         # Attach Fargate Security Group to the MLflow Load Balancer
         mlflow_load_balanced_service.load_balancer.add_security_group(fargate_security_group)
+        mlflow_load_balanced_service.target_group.configure_health_check(path="/health", interval=Duration.seconds(30),
+                                                                        timeout=Duration.seconds(10))
+        
+        # Define the MLflow Service autoscaling on CPU and request count
+        mlflow_scaling = mlflow_load_balanced_service.service.auto_scale_task_count(min_capacity=2, max_capacity=6)
+        mlflow_scaling.scale_on_cpu_utilization("MLflowCPUScaling", target_utilization_percent=60,
+                                                scale_in_cooldown=Duration.minutes(5),
+                                                scale_out_cooldown=Duration.minutes(1))
+        mlflow_scaling.scale_on_request_count("MLflowRequestScaling", requests_per_target=3000,
+                                              target_group=mlflow_load_balanced_service.target_group,
+                                              scale_in_cooldown=Duration.minutes(5),
+                                              scale_out_cooldown=Duration.minutes(1))
         
         #===========================================================================================================================
         #=========================================================CI/CD============================================================
@@ -454,6 +511,26 @@ class ModelDevelopment(Stack):
                                     managed_policies=[aws_iam.ManagedPolicy.from_aws_managed_policy_name("AmazonSageMakerFullAccess"),
                                                       sagemaker_policy])
         
+        #===========================================================================================================================
+        #=========================================================SQS===============================================================
+        #===========================================================================================================================
+        
+        # Define the admission Queue of trainings waiting for a free training job slot
+        training_dead_letter_queue = aws_sqs.Queue(self, "TrainingAdmissionDeadLetterQueue",
+                                                   queue_name="mlops-training-admission-dlq",
+                                                   retention_period=Duration.days(14))
+        training_queue = aws_sqs.Queue(self, "TrainingAdmissionQueue", queue_name="mlops-training-admission-queue",
+                                       retention_period=Duration.days(14),
+                                       visibility_timeout=Duration.minutes(5),
+                                       dead_letter_queue=aws_sqs.DeadLetterQueue(max_receive_count=100,
+                                                                                 queue=training_dead_letter_queue))
+        
+        # Define the Table with the new training data waiting for retraining, updated atomically by concurrent events
+        retraining_state_table = aws_dynamodb.Table(self, "RetrainingStateTable", table_name="mlops-retraining-state",
+                                                    partition_key=aws_dynamodb.Attribute(name="name", type=aws_dynamodb.AttributeType.STRING),
+                                                    billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                                    removal_policy=RemovalPolicy.DESTROY)
+        
         #===========================================================================================================================
         #=========================================================LAMBDA============================================================
         #===========================================================================================================================
@@ -513,12 +590,24 @@ class ModelDevelopment(Stack):
                                                             "sagemaker:*TransformJobs",
                                                             "sagemaker:*ProcessingJob",
                                                             "sagemaker:*ProcessingJobs",
+                                                            "sagemaker:*TrainingJob",
+                                                            "sagemaker:*TrainingJobs",
                                                             "iam:PassRole",
                                                         ],
                                                         resources=[
                                                             "*"
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="CloudWatchMetricsAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "cloudwatch:PutMetricData"
+                                                        ],
+                                                        resources=[
+                                                            "*"
+                                                        ]
+                                                    ),
                                                     aws_iam.PolicyStatement(
                                                         sid="S3Access",
                                                         effect=aws_iam.Effect.ALLOW,
@@ -540,6 +629,54 @@ class ModelDevelopment(Stack):
                                                             "*"
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="AdmissionQueueAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "sqs:SendMessage",
+                                                            "sqs:ReceiveMessage",
+                                                            "sqs:DeleteMessage",
+                                                            "sqs:ChangeMessageVisibility",
+                                                            "sqs:GetQueueAttributes"
+                                                        ],
+                                                        resources=[
+                                                            training_queue.queue_arn
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="RetrainingStateAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "dynamodb:GetItem",
+                                                            "dynamodb:UpdateItem"
+                                                        ],
+                                                        resources=[
+                                                            retraining_state_table.table_arn
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="DriftSketchAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "s3:GetObject",
+                                                            "s3:PutObject",
+                                                            "s3:ListBucket"
+                                                        ],
+                                                        resources=[
+                                                            "arn:aws:s3:::mlops-storage-bucket",
+                                                            "arn:aws:s3:::mlops-storage-bucket/drift/*"
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="TrainingMatricesAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "s3:GetObject"
+                                                        ],
+                                                        resources=[
+                                                            "arn:aws:s3:::mlops-storage-bucket/curated/total/matrices/*"
+                                                        ]
+                                                    ),
                                                ]
                                             )
         
@@ -548,6 +685,22 @@ class ModelDevelopment(Stack):
                                     assumed_by=aws_iam.ServicePrincipal("lambda.amazonaws.com"),
                                     managed_policies=[lambda_policy])
         
+        # Define the Lambda Layer with the shared/python modules, exported for the Lambdas of the other Stacks
+        shared_layer = aws_lambda.LayerVersion(self, "SharedLayer", layer_version_name="mlops-shared",
+                                               code=aws_lambda.Code.from_asset("shared"),
+                                               compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_8],
+                                               description="Timing spans, admission queues, raw file ledger and drift sketches shared by the Lambdas")
+        
+        # Deploy the training matrices loader for the training jobs, the matrices themselves are written by the ETL
+        training_matrices_prefix = "code/training_matrices/"
+        aws_s3_deployment.BucketDeployment(self, "TrainingMatricesDeployment", destination_bucket=artifacts_bucket,
+                                           destination_key_prefix=training_matrices_prefix,
+                                           sources=[aws_s3_deployment.Source.asset("shared/python",
+                                                                                   exclude=["*", "!training_matrices.py"])])
+        
+        # Number of drifted sensors retraining the model, also the threshold of the drift Alarm
+        drift_min_sensors = 3
+        
         # Define Lambda function
         training_lambda_name = "mlops-training-lambda"
         training_lambda = aws_lambda.Function(self, "TrainingLambda", role=lambda_role,
@@ -556,6 +709,7 @@ class ModelDevelopment(Stack):
                                               vpc=self.vpc, vpc_subnets=aws_ec2.SubnetType.PRIVATE_WITH_NAT,
                                               security_groups=[self.outbound_security_group],
                                               code=aws_lambda.Code.from_asset("lambda_code/training_lambda"),
+                                              layers=[shared_layer],
                                               environment={
                                                         "SagemakerRoleArn": sagemaker_role.role_arn,
                                                         "EventRole": events_role.role_arn,
@@ -568,6 +722,23 @@ class ModelDevelopment(Stack):
                                                         "AccountId": self.account_id,
                                                         "ArtifactsBucket": artifacts_bucket.bucket_name,
                                                         "SelfLambdaName": training_lambda_name,
+                                                        "TrainingInstanceType": self.profiles["training"]["instance_type"],
+                                                        "TrainingInstanceCount": str(self.profiles["training"]["instance_count"]),
+                                                        "TrainingVolumeSizeInGB": str(self.profiles["training"]["volume_size_gb"]),
+                                                        "WarmPoolKeepAliveSeconds": "1800",
+                                                        "SpotMaxWaitSeconds": "172800",
+                                                        "SpotMaxResumes": "3",
+                                                        "MinNewTrainingRows": "10000",
+                                                        "RetrainingQuietSeconds": "900",
+                                                        "RetrainingStateTable": retraining_state_table.table_name,
+                                                        "AdmissionQueueUrl": training_queue.queue_url,
+                                                        "MaxConcurrentTrainingJobs": "2",
+                                                        "StorageBucketName": "mlops-storage-bucket",
+                                                        "TrainingMatricesLoaderUri": f"s3://{artifacts_bucket.bucket_name}/{training_matrices_prefix}",
+                                                        "DriftWindowDays": "7",
+                                                        "DriftKSThreshold": "0.1",
+                                                        "DriftMinSensors": str(drift_min_sensors),
+                                                        "DriftRetrainingCooldownSeconds": "86400",
                                                         "Owner": self.owner,
                                                         "Project": self.project
                                                   },
@@ -579,6 +750,72 @@ class ModelDevelopment(Stack):
         events_principal = aws_iam.ServicePrincipal("events.amazonaws.com")
         training_lambda.grant_invoke(events_principal)
         
+        # Define the Rules to publish phase timings of finished training jobs
+        aws_events.Rule(self, "TrainingJobFinishedRule", rule_name="mlops-training-job-finished",
+                        description="Publishes phase timings of finished warm pool and spot Training Jobs",
+                        event_pattern=aws_events.EventPattern(
+                            source=["aws.sagemaker"],
+                            detail_type=["SageMaker Training Job State Change"],
+                            detail={
+                                "TrainingJobName": [{"prefix": "model-training-warm-"},
+                                                    {"prefix": "model-training-spot-"}],
+                                "TrainingJobStatus": ["Completed", "Failed", "Stopped"]
+                            }
+                        ),
+                        targets=[aws_events_targets.LambdaFunction(training_lambda)])
+        
+        # Define the Rules for retraining triggered by new curated training data, debounced by a periodic check
+        aws_events.Rule(self, "TrainingDataArrivedRule", rule_name="mlops-training-data-arrived",
+                        description="Records new curated training data from the ETL completion events",
+                        event_pattern=aws_events.EventPattern(
+                            source=["mlops.etl"],
+                            detail_type=["ETL Completed"],
+                            detail={
+                                "table": ["mlops-curated-train-data"]
+                            }
+                        ),
+                        targets=[aws_events_targets.LambdaFunction(training_lambda)])
+        
+        # Define the Rule checking the sensor drift of new inference data against the training baseline
+        aws_events.Rule(self, "InferenceDataArrivedRule", rule_name="mlops-inference-data-drift",
+                        description="Compares the sensor sketches of new inference data with the training baseline",
+                        event_pattern=aws_events.EventPattern(
+                            source=["mlops.etl"],
+                            detail_type=["ETL Completed"],
+                            detail={
+                                "table": ["mlops-curated-inference-data"]
+                            }
+                        ),
+                        targets=[aws_events_targets.LambdaFunction(training_lambda)])
+        
+        # Define the Alarm on drifted sensors, retraining on drift is started by the Lambda itself
+        aws_cloudwatch.Alarm(self, "SensorDriftAlarm", alarm_name="mlops-sensor-drift",
+                             alarm_description="Sensors of the recent inference data drifted from the training data",
+                             metric=aws_cloudwatch.Metric(namespace="MLOps/Drift", metric_name="DriftedSensors",
+                                                          statistic="Maximum", period=Duration.hours(1)),
+                             threshold=drift_min_sensors, evaluation_periods=1,
+                             comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                             treat_missing_data=aws_cloudwatch.TreatMissingData.NOT_BREACHING)
+        
+        aws_events.Rule(self, "RetrainingDebounceRule", rule_name="mlops-retraining-debounce",
+                        description="Starts retraining once enough new training data arrived and uploads stopped",
+                        schedule=aws_events.Schedule.rate(Duration.minutes(5)),
+                        targets=[aws_events_targets.LambdaFunction(training_lambda, 
+                                                                   event=aws_events.RuleTargetInput.from_object(
+                                                                       {"source": "mlops.retraining-debounce"}))])
+        
+        aws_events.Rule(self, "ProcessingJobFinishedRule", rule_name="mlops-processing-training-finished",
+                        description="Publishes phase timings of finished training Processing Jobs",
+                        event_pattern=aws_events.EventPattern(
+                            source=["aws.sagemaker"],
+                            detail_type=["SageMaker Processing Job State Change"],
+                            detail={
+                                "ProcessingJobName": [{"prefix": "model-training-"}],
+                                "ProcessingJobStatus": ["Completed", "Failed", "Stopped"]
+                            }
+                        ),
+                        targets=[aws_events_targets.LambdaFunction(training_lambda)])
+        
         #===========================================================================================================================
         #=========================================================APIGATEWAY========================================================
         #===========================================================================================================================
@@ -626,6 +863,9 @@ class ModelDevelopment(Stack):
         schedule_resource = api.root.add_resource("training_schedule")
         schedule_resource.add_method("POST", training_integration)
         
+        status_resource = api.root.add_resource("training_status")
+        status_resource.add_method("POST", training_integration)
+        
         #===========================================================================================================================
         #=========================================================STACK EXPORTS=====================================================
         #===========================================================================================================================
@@ -685,4 +925,12 @@ class ModelDevelopment(Stack):
         CfnOutput(self, "EventRoleArn", description="ARN of the Event Role",
                   value=events_role.role_arn,
                   export_name="EventRoleArn")
+        
+        CfnOutput(self, "SharedLayerArnExport", description="ARN of the Lambda Layer with the shared/python modules",
+                  value=shared_layer.layer_version_arn,
+                  export_name="SharedLayerArn")
+        
+        CfnOutput(self, "MLflowTrackingUriExport", description="URI of the MLflow Tracking server",
+                  value=f"http://{mlflow_load_balanced_service.load_balancer.load_balancer_dns_name}",
+                  export_name="MLflowTrackingUri")
         
\ No newline at end of file
@@ -3,9 +3,10 @@ from aws_cdk import (
     aws_ecr,
     aws_ecs,
     aws_iam, aws_secretsmanager,
-    aws_ec2, aws_rds,
-    aws_lambda,
+    aws_ec2, aws_rds, aws_elasticache,
+    aws_lambda, aws_events, aws_events_targets, aws_sqs,
     aws_ecs_patterns,
+    aws_s3, aws_s3_deployment, aws_glue,
     Tags, Stack, Duration, Fn
 )
 from constructs import Construct
@@ -21,6 +22,7 @@ class InferenceStack(Stack):
         self.acc_region = parameters["Region"]
         self.owner = parameters["Owner"]
         self.project = parameters["Project"]
+        self.profiles = parameters["InstanceProfiles"]
         
         # Define Tags for all resources (where they apply)
         Tags.of(self).add("Project", self.project)
@@ -56,6 +58,20 @@ class InferenceStack(Stack):
                                                                 repository_arn=Fn.import_value("ECRRepositoryArn"),
                                                                 repository_name=Fn.import_value("ECRRepositoryName"))
         
+        #===========================================================================================================================
+        #=========================================================SQS===============================================================
+        #===========================================================================================================================
+        
+        # Define the admission Queue of inferences waiting for a free inference job slot
+        inference_dead_letter_queue = aws_sqs.Queue(self, "InferenceAdmissionDeadLetterQueue",
+                                                    queue_name="mlops-inference-admission-dlq",
+                                                    retention_period=Duration.days(14))
+        inference_queue = aws_sqs.Queue(self, "InferenceAdmissionQueue", queue_name="mlops-inference-admission-queue",
+                                        retention_period=Duration.days(14),
+                                        visibility_timeout=Duration.minutes(5),
+                                        dead_letter_queue=aws_sqs.DeadLetterQueue(max_receive_count=100,
+                                                                                  queue=inference_dead_letter_queue))
+        
         #===========================================================================================================================
         #=======================================================LAMBDA==============================================================
         #===========================================================================================================================
@@ -116,6 +132,27 @@ class InferenceStack(Stack):
                                                             "*"
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="S3ArtifactsAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "s3:*"
+                                                        ],
+                                                        resources=[
+                                                            f"arn:aws:s3:::{Fn.import_value('ArtifactsBucketName')}",
+                                                            f"arn:aws:s3:::{Fn.import_value('ArtifactsBucketName')}/*"
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="CloudWatchMetricsAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "cloudwatch:PutMetricData"
+                                                        ],
+                                                        resources=[
+                                                            "*"
+                                                        ]
+                                                    ),
                                                     aws_iam.PolicyStatement(
                                                         sid="EventsAccess",
                                                         effect=aws_iam.Effect.ALLOW,
@@ -126,6 +163,20 @@ class InferenceStack(Stack):
                                                             "*"
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="AdmissionQueueAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "sqs:SendMessage",
+                                                            "sqs:ReceiveMessage",
+                                                            "sqs:DeleteMessage",
+                                                            "sqs:ChangeMessageVisibility",
+                                                            "sqs:GetQueueAttributes"
+                                                        ],
+                                                        resources=[
+                                                            inference_queue.queue_arn
+                                                        ]
+                                                    ),
                                                ]
                                             )
         
@@ -134,6 +185,10 @@ class InferenceStack(Stack):
                                     assumed_by=aws_iam.ServicePrincipal("lambda.amazonaws.com"),
                                     managed_policies=[lambda_policy])
         
+        # Import the Lambda Layer with the shared/python modules from the Model Development Stack
+        shared_layer = aws_lambda.LayerVersion.from_layer_version_arn(self, "ImportedSharedLayer",
+                                                                      layer_version_arn=Fn.import_value("SharedLayerArn"))
+        
         # Define Lambda function
         inference_lambda_name = "mlops-inference-lambda"
         inference_lambda = aws_lambda.Function(self, "InferenceLambda", role=lambda_role,
@@ -142,6 +197,7 @@ class InferenceStack(Stack):
                                               vpc=self.vpc, vpc_subnets=aws_ec2.SubnetType.PRIVATE_WITH_NAT,
                                               security_groups=[self.outbound_security_group],
                                               code=aws_lambda.Code.from_asset("lambda_code/inference_lambda"),
+                                              layers=[shared_layer],
                                               environment={
                                                         "SagemakerRoleArn": Fn.import_value("SagemakerRoleArn"),
                                                         "ImageUri": ecr_repository.repository_uri,
@@ -154,6 +210,12 @@ class InferenceStack(Stack):
                                                         "ArtifactsBucket": Fn.import_value("ArtifactsBucketName"),
                                                         "SelfLambdaName": inference_lambda_name,
                                                         "EventRole": Fn.import_value("EventRoleArn"),
+                                                        "MLflowTrackingUri": Fn.import_value("MLflowTrackingUri"),
+                                                        "AdmissionQueueUrl": inference_queue.queue_url,
+                                                        "MaxConcurrentInferenceJobs": "2",
+                                                        "InferenceInstanceType": self.profiles["inference"]["instance_type"],
+                                                        "InferenceInstanceCount": str(self.profiles["inference"]["instance_count"]),
+                                                        "InferenceVolumeSizeInGB": str(self.profiles["inference"]["volume_size_gb"]),
                                                         "Owner": self.owner,
                                                         "Project": self.project
                                                   },
@@ -164,6 +226,27 @@ class InferenceStack(Stack):
         # Add invocation permission for EventBridge
         events_principal = aws_iam.ServicePrincipal("events.amazonaws.com")
         inference_lambda.grant_invoke(events_principal)
+        
+        # Define the Rule to publish the phase spans of finished inference jobs
+        aws_events.Rule(self, "InferenceJobFinishedRule", rule_name="mlops-inference-job-finished",
+                        description="Publishes start-up and run spans of finished inference Processing Jobs",
+                        event_pattern=aws_events.EventPattern(
+                            source=["aws.sagemaker"],
+                            detail_type=["SageMaker Processing Job State Change"],
+                            detail={
+                                "ProcessingJobName": [{"prefix": "model-inference-"}],
+                                "ProcessingJobStatus": ["Completed", "Failed", "Stopped"]
+                            }
+                        ),
+                        targets=[aws_events_targets.LambdaFunction(inference_lambda)])
+        
+        # Define the Rule starting queued inferences whose retry delay passed
+        aws_events.Rule(self, "InferenceAdmissionDispatchRule", rule_name="mlops-inference-admission-dispatch",
+                        description="Starts queued inferences once the concurrent inference jobs allow it",
+                        schedule=aws_events.Schedule.rate(Duration.minutes(5)),
+                        targets=[aws_events_targets.LambdaFunction(inference_lambda,
+                                                                   event=aws_events.RuleTargetInput.from_object(
+                                                                       {"source": "mlops.admission"}))])
         #===========================================================================================================================
         #=======================================================SECRET==============================================================
         #===========================================================================================================================
@@ -183,7 +266,8 @@ class InferenceStack(Stack):
         # Define Grafana backend Aurora Database
         grafana_database_name = "Grafana"
         grafana_backend_db = aws_rds.ServerlessCluster(self, "GrafanaBackendDB",
-                                                      engine=aws_rds.DatabaseClusterEngine.AURORA_MYSQL,
+                                                      engine=aws_rds.DatabaseClusterEngine.aurora_postgres(version=
+                                                                                                           aws_rds.AuroraPostgresEngineVersion.VER_10_14),
                                                       credentials=aws_rds.Credentials.from_secret(grafana_db_secret),
                                                       vpc=self.vpc,
                                                       vpc_subnets=subnet_selection,
@@ -193,6 +277,122 @@ class InferenceStack(Stack):
         # Define the Grafana DB endpoint
         grafana_db_endpoint = grafana_backend_db.cluster_endpoint
         
+        #===========================================================================================================================
+        #=====================================================PREDICTIONS===========================================================
+        #===========================================================================================================================
+        
+        # Define the prediction output contract: parquet files partitioned by prediction date in the Storage Bucket
+        predictions_bucket_name = "mlops-storage-bucket"
+        predictions_prefix = "predictions"
+        
+        # Define the Glue Table over the predictions, partitions are projected so no crawler or partition registration is needed
+        aws_glue.CfnTable(self, "PredictionsTable", catalog_id=self.account_id, database_name="mlops-glue-database",
+                          table_input=aws_glue.CfnTable.TableInputProperty(
+                              name="mlops-predictions-data",
+                              description="Batch inference predictions written by the inference Processing Jobs",
+                              table_type="EXTERNAL_TABLE",
+                              partition_keys=[aws_glue.CfnTable.ColumnProperty(name="prediction_date", type="string")],
+                              parameters={
+                                  "classification": "parquet",
+                                  "parquet.compression": "ZSTD",
+                                  "projection.enabled": "true",
+                                  "projection.prediction_date.type": "date",
+                                  "projection.prediction_date.format": "yyyy-MM-dd",
+                                  "projection.prediction_date.range": "2022-01-01,NOW",
+                                  "projection.prediction_date.interval": "1",
+                                  "projection.prediction_date.interval.unit": "DAYS",
+                                  "storage.location.template": f"s3://{predictions_bucket_name}/{predictions_prefix}/prediction_date=${{prediction_date}}"
+                              },
+                              storage_descriptor=aws_glue.CfnTable.StorageDescriptorProperty(
+                                  location=f"s3://{predictions_bucket_name}/{predictions_prefix}/",
+                                  input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                                  output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                                  serde_info=aws_glue.CfnTable.SerdeInfoProperty(
+                                      serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"),
+                                  columns=[
+                                      aws_glue.CfnTable.ColumnProperty(name="unit", type="int"),
+                                      aws_glue.CfnTable.ColumnProperty(name="cycle", type="int"),
+                                      aws_glue.CfnTable.ColumnProperty(name="timestamp", type="timestamp"),
+                                      aws_glue.CfnTable.ColumnProperty(name="predicted_rul", type="float"),
+                                      aws_glue.CfnTable.ColumnProperty(name="model_version", type="string")
+                                  ]
+                              )
+                          ))
+        
+        # Deploy the prediction sink, model loading and curated table reader modules for the inference Processing Jobs
+        artifacts_bucket = aws_s3.Bucket.from_bucket_name(self, "ImportedArtifactsBucket", Fn.import_value("ArtifactsBucketName"))
+        prediction_sink_prefix = "code/prediction_sink/"
+        aws_s3_deployment.BucketDeployment(self, "PredictionSinkDeployment", destination_bucket=artifacts_bucket,
+                                           destination_key_prefix=prediction_sink_prefix,
+                                           sources=[aws_s3_deployment.Source.asset("shared/python",
+                                                                                   exclude=["*", "!prediction_sink.py",
+                                                                                            "!model_loading.py",
+                                                                                            "!pipeline_timing.py"]),
+                                                    aws_s3_deployment.Source.asset("glue_code",
+                                                                                   exclude=["*", "!curated_iceberg.py"])])
+        
+        # Allow the inference Processing Jobs to read the Grafana DB secret for the optional bulk load
+        aws_iam.ManagedPolicy(self, "SagemakerPredictionsPolicy", description="Used for loading predictions into Grafana DB",
+                              managed_policy_name="mlops-sagemaker-predictions-policy",
+                              statements=[
+                                  aws_iam.PolicyStatement(
+                                       sid="GrafanaSecretAccess",
+                                       effect=aws_iam.Effect.ALLOW,
+                                       actions=[
+                                           "secretsmanager:GetSecretValue"
+                                       ],
+                                       resources=[
+                                           grafana_db_secret.secret_arn
+                                       ]
+                                   ),
+                                  aws_iam.PolicyStatement(
+                                       sid="CuratedIcebergReadAccess",
+                                       effect=aws_iam.Effect.ALLOW,
+                                       actions=[
+                                           "athena:StartQueryExecution",
+                                           "athena:GetQueryExecution",
+                                           "athena:GetQueryResults",
+                                           "athena:GetWorkGroup"
+                                       ],
+                                       resources=[
+                                           f"arn:aws:athena:{self.acc_region}:{self.account_id}:workgroup/mlops-iceberg"
+                                       ]
+                                   )
+                              ],
+                              roles=[aws_iam.Role.from_role_arn(self, "ImportedSagemakerRole",
+                                                                role_arn=Fn.import_value("SagemakerRoleArn"))])
+        
+        # Allow the inference Lambda to read the latest inference data ingest, whose trace and snapshot the inference continues
+        lambda_policy.add_statements(aws_iam.PolicyStatement(sid="ETLSummaryAccess", effect=aws_iam.Effect.ALLOW,
+                                                             actions=["s3:GetObject", "s3:ListBucket"],
+                                                             resources=[f"arn:aws:s3:::{predictions_bucket_name}",
+                                                                        f"arn:aws:s3:::{predictions_bucket_name}/etl/summaries/latest/*"]))
+        curated_snapshot_key = "inference/state/curated_snapshot.json"
+        lambda_policy.add_statements(aws_iam.PolicyStatement(sid="CuratedSnapshotAccess", effect=aws_iam.Effect.ALLOW,
+                                                             actions=["s3:GetObject", "s3:PutObject"],
+                                                             resources=[f"arn:aws:s3:::{predictions_bucket_name}/{curated_snapshot_key}"]))
+        
+        # Allow the inference Lambda to start the rollup of the prediction dates of a completed inference job
+        prediction_rollup_arn = f"arn:aws:states:{self.acc_region}:{self.account_id}:stateMachine:mlops-prediction-rollup"
+        lambda_policy.add_statements(aws_iam.PolicyStatement(sid="PredictionRollupAccess", effect=aws_iam.Effect.ALLOW,
+                                                             actions=["states:StartExecution"],
+                                                             resources=[prediction_rollup_arn]))
+        
+        # Pass the prediction output contract to the inference Lambda
+        for name, value in {"PredictionsBucket": predictions_bucket_name,
+                            "StorageBucketName": predictions_bucket_name,
+                            "PredictionsPrefix": predictions_prefix,
+                            "PredictionSinkUri": f"s3://{artifacts_bucket.bucket_name}/{prediction_sink_prefix}",
+                            "PredictionCopyEnabled": "false",
+                            "GrafanaDBSecretArn": grafana_db_secret.secret_arn,
+                            "GrafanaDBHost": grafana_db_endpoint.hostname,
+                            "GrafanaDatabase": grafana_database_name,
+                            "GlueDatabaseName": "mlops-glue-database",
+                            "AthenaWorkgroup": "mlops-iceberg",
+                            "CuratedSnapshotKey": curated_snapshot_key,
+                            "PredictionRollupStateMachineArn": prediction_rollup_arn}.items():
+            inference_lambda.add_environment(name, value)
+        
         #===========================================================================================================================
         #=======================================================FARGATE=============================================================
         #===========================================================================================================================
@@ -212,17 +412,66 @@ class InferenceStack(Stack):
         fargate_security_group =  aws_ec2.SecurityGroup.from_security_group_id(self, "ImportedFargateSecurityGroup",
                                                      security_group_id=Fn.import_value("FargateSecurityGroupId"))
         
+        #===========================================================================================================================
+        #=======================================================ELASTICACHE=========================================================
+        #===========================================================================================================================
+        
+        # Define Security Group for the Grafana remote cache
+        cache_security_group = aws_ec2.SecurityGroup(self, "CacheSecurityGroup", vpc=self.vpc,
+                                                     description="Security Group used for connecting to the Grafana Redis cache",
+                                                     allow_all_outbound=True, security_group_name="mlops-cache-security-group")
+        cache_security_group.add_ingress_rule(fargate_security_group, aws_ec2.Port.tcp(6379),
+                                              "Allow access from Fargate tasks to the Redis")
+        
+        # Define the Subnet Group for the Redis cache
+        cache_subnet_group = aws_elasticache.CfnSubnetGroup(self, "CacheSubnetGroup", subnet_ids=subnets_ids,
+                                                            cache_subnet_group_name="mlops-cache-subnet-group",
+                                                            description="Subnets used by the Grafana Redis cache")
+        
+        # Define the Redis cache shared by all Grafana tasks
+        grafana_cache = aws_elasticache.CfnCacheCluster(self, "GrafanaCache", engine="redis",
+                                                        cache_node_type="cache.t3.micro", num_cache_nodes=1,
+                                                        cluster_name="mlops-grafana-cache",
+                                                        cache_subnet_group_name=cache_subnet_group.cache_subnet_group_name,
+                                                        vpc_security_group_ids=[cache_security_group.security_group_id])
+        grafana_cache.add_dependency(cache_subnet_group)
+        
         #===========================================================================================================================
         #=======================================================GRAFANA=============================================================
         #===========================================================================================================================
         
         # Define Grafana Task Definition
-        grafana_task_definition = aws_ecs.FargateTaskDefinition(self, "GrafanaTaskDefinition", cpu=1024, ephemeral_storage_gib=30,
-                                                               memory_limit_mib=4096, execution_role=fargate_role,
+        grafana_task_definition = aws_ecs.FargateTaskDefinition(self, "GrafanaTaskDefinition", cpu=self.profiles["grafana"]["cpu"],
+                                                               ephemeral_storage_gib=30,
+                                                               memory_limit_mib=self.profiles["grafana"]["memory_mib"],
+                                                               execution_role=fargate_role,
                                                                family="mlops-grafana-task", task_role=fargate_role)
         
+        # Define the PgBouncer sidecar pooling Grafana connections to the Aurora backend
+        grafana_pgbouncer_container = grafana_task_definition.add_container("GrafanaPgBouncerContainer",
+                                             image=aws_ecs.ContainerImage.from_asset(directory="pgbouncer"),
+                                             container_name="grafana-pgbouncer-container", privileged=False,
+                                             port_mappings=[aws_ecs.PortMapping(container_port=6432, protocol=aws_ecs.Protocol.TCP)],
+                                             logging=aws_ecs.LogDriver.aws_logs(stream_prefix="grafana-pgbouncer"),
+                                             health_check=aws_ecs.HealthCheck(command=["CMD-SHELL", "nc -z 127.0.0.1 6432 || exit 1"],
+                                                                              interval=Duration.seconds(10),
+                                                                              start_period=Duration.seconds(15)),
+                                             secrets={
+                                                 "DB_USERNAME": aws_ecs.Secret.from_secrets_manager(grafana_db_secret, "username"),
+                                                 "DB_PASSWORD": aws_ecs.Secret.from_secrets_manager(grafana_db_secret, "password")
+                                             },
+                                             environment={
+                                                 "DB_HOST": grafana_db_endpoint.hostname,
+                                                 "DB_PORT": "5432",
+                                                 "DATABASE": grafana_database_name,
+                                                 "SERVICE_NAME": "grafana",
+                                                 "POOL_MODE": "session",
+                                                 "DEFAULT_POOL_SIZE": "10",
+                                                 "MAX_CLIENT_CONN": "100"
+                                             })
+        
         # Define the Grafana Task Container 
-        grafana_task_definition.add_container("GrafanaImageContainer",
+        grafana_container = grafana_task_definition.add_container("GrafanaImageContainer",
                                              image=aws_ecs.ContainerImage.from_asset(directory="grafana"),
                                              container_name="grafana-task-container", privileged=False,
                                              port_mappings=[aws_ecs.PortMapping(container_port=3000, protocol=aws_ecs.Protocol.TCP)],
@@ -231,18 +480,23 @@ class InferenceStack(Stack):
                                                  "DB_PASSWORD": aws_ecs.Secret.from_secrets_manager(grafana_db_secret, "password")
                                              },
                                              environment={
-                                                 "HOST": grafana_db_endpoint.hostname,
-                                                 "PORT": "3306",
+                                                 "HOST": "127.0.0.1",
+                                                 "PORT": "6432",
                                                  "DATABASE": grafana_database_name,
+                                                 "AWS_REGION": self.acc_region,
+                                                 "REDIS_HOST": grafana_cache.attr_redis_endpoint_address,
+                                                 "REDIS_PORT": grafana_cache.attr_redis_endpoint_port
                                              })
+        grafana_container.add_container_dependencies(aws_ecs.ContainerDependency(
+            container=grafana_pgbouncer_container, condition=aws_ecs.ContainerDependencyCondition.HEALTHY))
         
         # Define the Load Balanced Service for Grafana
         grafana_load_balanced_service = aws_ecs_patterns.ApplicationLoadBalancedFargateService(
-            self, "GrafanaLoadBalancedService", assign_public_ip=False, cpu=1024, 
-            memory_limit_mib=4096, security_groups=[fargate_security_group],
+            self, "GrafanaLoadBalancedService", assign_public_ip=False, cpu=self.profiles["grafana"]["cpu"], 
+            memory_limit_mib=self.profiles["grafana"]["memory_mib"], security_groups=[fargate_security_group],
             task_definition=grafana_task_definition, cluster=fargate_cluster,
             task_subnets=subnet_selection,
-            desired_count=1, listener_port=80, load_balancer_name="mlops-grafana-load-balancer",
+            desired_count=2, listener_port=80, load_balancer_name="mlops-grafana-load-balancer",
             open_listener=False, public_load_balancer=True, 
             service_name="mlops-grafana-service",
             health_check_grace_period=Duration.minutes(3)
@@ -252,6 +506,65 @@ class InferenceStack(Stack):
         grafana_load_balanced_service.target_group.configure_health_check(path="/login", interval=Duration.seconds(120),
                                                                          timeout=Duration.seconds(10))
         
+        # Define the Grafana Service autoscaling on CPU
+        grafana_scaling = grafana_load_balanced_service.service.auto_scale_task_count(min_capacity=2, max_capacity=4)
+        grafana_scaling.scale_on_cpu_utilization("GrafanaCPUScaling", target_utilization_percent=60,
+                                                 scale_in_cooldown=Duration.minutes(5),
+                                                 scale_out_cooldown=Duration.minutes(1))
+        
+        #===========================================================================================================================
+        #=======================================================SCORING=============================================================
+        #===========================================================================================================================
+        
+        # Allow the Load Balancer to reach the real-time scoring containers
+        fargate_security_group.add_ingress_rule(aws_ec2.Peer.ipv4("0.0.0.0/0"), aws_ec2.Port.tcp(8080),
+                                                "Allow access from VPC for the real-time scoring")
+        
+        # Define Scoring Task Definition
+        scoring_task_definition = aws_ecs.FargateTaskDefinition(self, "ScoringTaskDefinition", cpu=self.profiles["scoring"]["cpu"],
+                                                               ephemeral_storage_gib=30,
+                                                               memory_limit_mib=self.profiles["scoring"]["memory_mib"],
+                                                               execution_role=fargate_role,
+                                                               family="mlops-scoring-task", task_role=fargate_role)
+        
+        # Define the Scoring Task Container 
+        scoring_task_definition.add_container("ScoringImageContainer",
+                                             image=aws_ecs.ContainerImage.from_asset(directory="scoring"),
+                                             container_name="scoring-task-container", privileged=False,
+                                             port_mappings=[aws_ecs.PortMapping(container_port=8080, protocol=aws_ecs.Protocol.TCP)],
+                                             logging=aws_ecs.LogDriver.aws_logs(stream_prefix="scoring-task"),
+                                             environment={
+                                                 "MLFLOW_TRACKING_URI": Fn.import_value("MLflowTrackingUri"),
+                                                 "MAX_BATCH_SIZE": "64",
+                                                 "MAX_BATCH_WAIT_MS": "5",
+                                                 "MODEL_REFRESH_SECONDS": "300",
+                                                 "MAX_CACHED_MODELS": "2",
+                                                 "WINDOW_TABLE": "mlops-unit-windows"
+                                             })
+        
+        # Define the Load Balanced Service for real-time scoring
+        scoring_load_balanced_service = aws_ecs_patterns.ApplicationLoadBalancedFargateService(
+            self, "ScoringLoadBalancedService", assign_public_ip=False, cpu=self.profiles["scoring"]["cpu"], 
+            memory_limit_mib=self.profiles["scoring"]["memory_mib"], security_groups=[fargate_security_group],
+            task_definition=scoring_task_definition, cluster=fargate_cluster,
+            task_subnets=subnet_selection,
+            desired_count=2, listener_port=80, load_balancer_name="mlops-scoring-load-balancer",
+            open_listener=False, public_load_balancer=True, 
+            service_name="mlops-scoring-service",
+            health_check_grace_period=Duration.minutes(3)
+        )
+        # Attach Fargate Security Group to the Scoring Load Balancer
+        scoring_load_balanced_service.load_balancer.add_security_group(fargate_security_group)
+        scoring_load_balanced_service.target_group.configure_health_check(path="/health", interval=Duration.seconds(30),
+                                                                         timeout=Duration.seconds(5))
+        
+        # Define the Scoring Service autoscaling on request count
+        scoring_scaling = scoring_load_balanced_service.service.auto_scale_task_count(min_capacity=2, max_capacity=8)
+        scoring_scaling.scale_on_request_count("ScoringRequestScaling", requests_per_target=5000,
+                                               target_group=scoring_load_balanced_service.target_group,
+                                               scale_in_cooldown=Duration.minutes(5),
+                                               scale_out_cooldown=Duration.minutes(1))
+        
         #===========================================================================================================================
         #=========================================================APIGATEWAY========================================================
         #===========================================================================================================================
@@ -268,4 +581,12 @@ class InferenceStack(Stack):
         inference_resource.add_method("POST", inference_integration)
         
         schedule_resource = api.root.add_resource("inference_schedule")
-        schedule_resource.add_method("POST", inference_integration)
\ No newline at end of file
+        schedule_resource.add_method("POST", inference_integration)
+        
+        # Define Integration of the real-time scoring service with API Gateway
+        scoring_integration = aws_apigateway.HttpIntegration(
+            f"http://{scoring_load_balanced_service.load_balancer.load_balancer_dns_name}/predict",
+            http_method="POST", proxy=True)
+        
+        predict_resource = api.root.add_resource("predict")
+        predict_resource.add_method("POST", scoring_integration)
\ No newline at end of file
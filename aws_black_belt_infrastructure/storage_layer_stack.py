@@ -1,11 +1,13 @@
 from aws_cdk import (
     aws_s3,
-    aws_logs,
+    aws_logs, aws_dynamodb,
     aws_glue_alpha as aws_glue,
     aws_iam,
     aws_ec2,
-    aws_lambda, aws_s3_notifications,
+    aws_lambda, aws_s3_notifications, aws_sqs,
+    aws_events, aws_events_targets,
     aws_stepfunctions_tasks, aws_stepfunctions,
+    aws_cloudwatch, aws_athena,
     RemovalPolicy,
     Tags, Stack, Duration,Fn
 )
@@ -57,6 +59,16 @@ class StorageLayer(Stack):
                                        public_read_access=False, removal_policy=RemovalPolicy.DESTROY,
                                        versioned=False, encryption=aws_s3.BucketEncryption.S3_MANAGED)
         
+        #===========================================================================================================================
+        #=========================================================DYNAMODB==========================================================
+        #===========================================================================================================================
+        
+        # Define the Table with the window of last cycles per unit for online scoring
+        window_table = aws_dynamodb.Table(self, "UnitWindowTable", table_name="mlops-unit-windows",
+                                          partition_key=aws_dynamodb.Attribute(name="unit", type=aws_dynamodb.AttributeType.NUMBER),
+                                          billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                          removal_policy=RemovalPolicy.DESTROY)
+        
         #===========================================================================================================================
         #=========================================================GLUE==============================================================
         #===========================================================================================================================
@@ -64,6 +76,18 @@ class StorageLayer(Stack):
         # Define Glue Database
         glue_database = aws_glue.Database(self, "GlueDatabase", database_name="mlops-glue-database")
         
+        # Define the Athena Workgroup used by the Glue Jobs for the Iceberg table statements (MERGE needs engine version 3)
+        iceberg_workgroup = aws_athena.CfnWorkGroup(self, "IcebergWorkGroup", name="mlops-iceberg",
+                                                    description="Used for MERGE upserts into the curated Iceberg tables",
+                                                    recursive_delete_option=True,
+                                                    work_group_configuration=aws_athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+                                                        enforce_work_group_configuration=True,
+                                                        engine_version=aws_athena.CfnWorkGroup.EngineVersionProperty(
+                                                            selected_engine_version="Athena engine version 3"),
+                                                        result_configuration=aws_athena.CfnWorkGroup.ResultConfigurationProperty(
+                                                            output_location=f"s3://{storage_bucket.bucket_name}/athena-results/iceberg/")
+                                                    ))
+        
         # Define the Policy for Glue Jobs
         glue_job_policy = aws_iam.ManagedPolicy(self, "GlueJobPolicy",
                                                 description="Policy used for Glue Jobs",
@@ -92,6 +116,58 @@ class StorageLayer(Stack):
                                                             storage_bucket.bucket_arn + "/*"
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="CloudWatchMetricsAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "cloudwatch:PutMetricData"
+                                                        ],
+                                                        resources=[
+                                                            "*"
+                                                        ],
+                                                        conditions={
+                                                            "StringEquals": {
+                                                                "cloudwatch:namespace": "MLOps/Pipeline"
+                                                            }
+                                                        }
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="AthenaIcebergAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "athena:StartQueryExecution",
+                                                            "athena:GetQueryExecution",
+                                                            "athena:GetQueryResults",
+                                                            "athena:StopQueryExecution",
+                                                            "athena:GetWorkGroup"
+                                                        ],
+                                                        resources=[
+                                                            f"arn:aws:athena:{self.acc_region}:{self.account_id}:workgroup/{iceberg_workgroup.name}"
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="S3ProfilesAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "s3:PutObject"
+                                                        ],
+                                                        resources=[
+                                                            f"arn:aws:s3:::{Fn.import_value('ArtifactsBucketName')}/profiles/*"
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="DynamoDBWindowsAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "dynamodb:BatchGetItem",
+                                                            "dynamodb:BatchWriteItem",
+                                                            "dynamodb:GetItem",
+                                                            "dynamodb:PutItem"
+                                                        ],
+                                                        resources=[
+                                                            window_table.table_arn
+                                                        ]
+                                                    ),
                                                     aws_iam.PolicyStatement(
                                                         sid="GlueTablesAccess",
                                                         effect=aws_iam.Effect.ALLOW,
@@ -121,20 +197,31 @@ class StorageLayer(Stack):
                                          glue_job_policy
                                          ])
         
+        # Define the concurrent runs of the convert Glue Jobs, the ETL Lambda admits as many ETL executions.
+        # The transform Glue Jobs write the curated Iceberg tables and the window store and run one at a time,
+        # starts of the other executions are retried by the state machine until the running transform finished
+        etl_concurrency = 4
+        transform_concurrency = 1
+        
         # Define the Glue Job for converting .csv to .parquet
         convert_job = aws_glue.Job(self, "ConvertGlueJob", 
                                    executable=aws_glue.JobExecutable.python_etl(
                                        glue_version=aws_glue.GlueVersion.V3_0,
                                        python_version=aws_glue.PythonVersion.THREE,
-                                       script=aws_glue.Code.from_asset(path="glue_code/convert_job.py")
+                                       script=aws_glue.Code.from_asset(path="glue_code/convert_job.py"),
+                                       extra_python_files=[aws_glue.Code.from_asset(path="shared/python/pipeline_timing.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/job_profiler.py")]
                                    ),
-                                   default_arguments={"--additional-python-modules": "awswrangler"},
+                                   default_arguments={"--additional-python-modules": "awswrangler",
+                                                      "--profile": "off",
+                                                      "--profile_bucket": Fn.import_value("ArtifactsBucketName")},
                                    description="Job used to convert data format from CSV to the Parquet",
                                    continuous_logging=aws_glue.ContinuousLoggingProps(enabled=True,
                                                                                       log_group=aws_logs.LogGroup(self, 
                                                                                         'ConvertJobLogGroup', 
                                                                                         log_group_name="/aws-glue/mlops-jobs/convert-job/")),
                                    job_name="mlops-convert-job",
+                                   max_concurrent_runs=etl_concurrency,
                                    worker_type=aws_glue.WorkerType.STANDARD,
                                    worker_count=1,
                                    role=glue_job_role,
@@ -148,15 +235,133 @@ class StorageLayer(Stack):
                                    executable=aws_glue.JobExecutable.python_etl(
                                        glue_version=aws_glue.GlueVersion.V3_0,
                                        python_version=aws_glue.PythonVersion.THREE,
-                                       script=aws_glue.Code.from_asset(path="glue_code/transform_job.py")
+                                       script=aws_glue.Code.from_asset(path="glue_code/transform_job.py"),
+                                       extra_python_files=[aws_glue.Code.from_asset(path="glue_code/window_store.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/curated_iceberg.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/data_quality.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/drift_stats.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/drift_sketch.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/rolling_features.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/training_matrices.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/pipeline_timing.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/job_profiler.py")]
                                    ),
-                                   default_arguments={"--additional-python-modules": "awswrangler"},
+                                   default_arguments={"--additional-python-modules": "awswrangler",
+                                                      "--window_table": window_table.table_name,
+                                                      "--window_size": "50",
+                                                      "--curated_format": "iceberg",
+                                                      "--athena_workgroup": iceberg_workgroup.name,
+                                                      "--quality_max_bad_rate": "0.1",
+                                                      "--feature_windows": "10,30",
+                                                      "--profile": "off",
+                                                      "--profile_bucket": Fn.import_value("ArtifactsBucketName")},
                                    description="Job used to transform raw data into curated data",
                                    continuous_logging=aws_glue.ContinuousLoggingProps(enabled=True,
                                                                                       log_group=aws_logs.LogGroup(self, 
                                                                                         'TransformJobLogGroup', 
                                                                                         log_group_name="/aws-glue/mlops-jobs/transform-job/")),
                                    job_name="mlops-transform-job",
+                                   max_concurrent_runs=transform_concurrency,
+                                   worker_type=aws_glue.WorkerType.STANDARD,
+                                   worker_count=1,
+                                   role=glue_job_role,
+                                   tags={
+                                       "Project": self.project,
+                                       "Owner": self.owner 
+                                   })
+        
+        # Define the Spark Glue Jobs with the same convert and transform logic distributed over the workers, the
+        # worker count is the maximum of the Glue auto-scaling, engine and worker type are selected per execution
+        convert_spark_job = aws_glue.Job(self, "ConvertSparkGlueJob", 
+                                   executable=aws_glue.JobExecutable.python_etl(
+                                       glue_version=aws_glue.GlueVersion.V3_0,
+                                       python_version=aws_glue.PythonVersion.THREE,
+                                       script=aws_glue.Code.from_asset(path="glue_code/convert_spark_job.py"),
+                                       extra_python_files=[aws_glue.Code.from_asset(path="glue_code/spark_transforms.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/data_quality.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/drift_stats.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/rolling_features.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/drift_sketch.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/pipeline_timing.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/job_profiler.py")]
+                                   ),
+                                   default_arguments={"--additional-python-modules": "awswrangler",
+                                                      "--enable-auto-scaling": "true",
+                                                      "--profile": "off",
+                                                      "--profile_bucket": Fn.import_value("ArtifactsBucketName")},
+                                   description="Job used to convert data format from CSV to the Parquet with Spark",
+                                   continuous_logging=aws_glue.ContinuousLoggingProps(enabled=True,
+                                                                                      log_group=aws_logs.LogGroup(self, 
+                                                                                        'ConvertSparkJobLogGroup', 
+                                                                                        log_group_name="/aws-glue/mlops-jobs/convert-spark-job/")),
+                                   job_name="mlops-convert-spark-job",
+                                   max_concurrent_runs=etl_concurrency,
+                                   worker_type=aws_glue.WorkerType.G_1_X,
+                                   worker_count=10,
+                                   role=glue_job_role,
+                                   tags={
+                                       "Project": self.project,
+                                       "Owner": self.owner
+                                   })
+        
+        transform_spark_job = aws_glue.Job(self, "TransformSparkGlueJob", 
+                                   executable=aws_glue.JobExecutable.python_etl(
+                                       glue_version=aws_glue.GlueVersion.V3_0,
+                                       python_version=aws_glue.PythonVersion.THREE,
+                                       script=aws_glue.Code.from_asset(path="glue_code/transform_spark_job.py"),
+                                       extra_python_files=[aws_glue.Code.from_asset(path="glue_code/spark_transforms.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/transform_job.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/window_store.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/curated_iceberg.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/data_quality.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/drift_stats.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/drift_sketch.py"),
+                                                           aws_glue.Code.from_asset(path="glue_code/rolling_features.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/training_matrices.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/pipeline_timing.py"),
+                                                           aws_glue.Code.from_asset(path="shared/python/job_profiler.py")]
+                                   ),
+                                   default_arguments={"--additional-python-modules": "awswrangler",
+                                                      "--enable-auto-scaling": "true",
+                                                      "--window_table": window_table.table_name,
+                                                      "--window_size": "50",
+                                                      "--curated_format": "iceberg",
+                                                      "--athena_workgroup": iceberg_workgroup.name,
+                                                      "--quality_max_bad_rate": "0.1",
+                                                      "--feature_windows": "10,30",
+                                                      "--matrices_max_rows": "10000000",
+                                                      "--profile": "off",
+                                                      "--profile_bucket": Fn.import_value("ArtifactsBucketName")},
+                                   description="Job used to transform raw data into curated data with Spark",
+                                   continuous_logging=aws_glue.ContinuousLoggingProps(enabled=True,
+                                                                                      log_group=aws_logs.LogGroup(self, 
+                                                                                        'TransformSparkJobLogGroup', 
+                                                                                        log_group_name="/aws-glue/mlops-jobs/transform-spark-job/")),
+                                   job_name="mlops-transform-spark-job",
+                                   max_concurrent_runs=transform_concurrency,
+                                   worker_type=aws_glue.WorkerType.G_1_X,
+                                   worker_count=10,
+                                   role=glue_job_role,
+                                   tags={
+                                       "Project": self.project,
+                                       "Owner": self.owner 
+                                   })
+        
+        # Define the Glue Job for updating the telemetry rollup tables, runs read and rewrite the rollups so one runs at a time
+        rollup_job = aws_glue.Job(self, "RollupGlueJob", 
+                                   executable=aws_glue.JobExecutable.python_etl(
+                                       glue_version=aws_glue.GlueVersion.V3_0,
+                                       python_version=aws_glue.PythonVersion.THREE,
+                                       script=aws_glue.Code.from_asset(path="glue_code/rollup_job.py")
+                                   ),
+                                   default_arguments={"--additional-python-modules": "awswrangler"},
+                                   description="Job used to update hourly and daily telemetry rollups from curated data",
+                                   continuous_logging=aws_glue.ContinuousLoggingProps(enabled=True,
+                                                                                      log_group=aws_logs.LogGroup(self, 
+                                                                                        'RollupJobLogGroup', 
+                                                                                        log_group_name="/aws-glue/mlops-jobs/rollup-job/")),
+                                   job_name="mlops-rollup-job",
+                                   max_concurrent_runs=1,
                                    worker_type=aws_glue.WorkerType.STANDARD,
                                    worker_count=1,
                                    role=glue_job_role,
@@ -179,7 +384,15 @@ class StorageLayer(Stack):
                                                         actions=[
                                                             "logs:CreateLogGroup",
                                                             "logs:PutLogEvents",
-                                                            "logs:CreateLogStream"
+                                                            "logs:CreateLogStream",
+                                                            "logs:CreateLogDelivery",
+                                                            "logs:GetLogDelivery",
+                                                            "logs:UpdateLogDelivery",
+                                                            "logs:DeleteLogDelivery",
+                                                            "logs:ListLogDeliveries",
+                                                            "logs:PutResourcePolicy",
+                                                            "logs:DescribeResourcePolicies",
+                                                            "logs:DescribeLogGroups"
                                                         ],
                                                         resources=[
                                                             "*"
@@ -229,12 +442,110 @@ class StorageLayer(Stack):
                                                                             "--bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
                                                                             "--file_name": aws_stepfunctions.JsonPath.string_at("$.file_name"),
                                                                             "--ingest_type": aws_stepfunctions.JsonPath.string_at("$.ingest_type"),
+                                                                            "--trace_id": aws_stepfunctions.JsonPath.string_at("$.trace_id"),
+                                                                            "--submitted_at": aws_stepfunctions.JsonPath.string_at("$$.State.EnteredTime"),
+                                                                            "--execution_id": aws_stepfunctions.JsonPath.string_at("$$.Execution.Name"),
+                                                                            "--profile": aws_stepfunctions.JsonPath.string_at("$.profile"),
                                                                             "--additional-python-modules": aws_stepfunctions.JsonPath.string_at("$.--additional-python-modules")
                                                                        }
                                                                    ),
                                                                    result_path=aws_stepfunctions.JsonPath.DISCARD)
         
         transform_job_step = aws_stepfunctions_tasks.GlueStartJobRun(self, "TransformGlueJobStep", glue_job_name=transform_job.job_name,
+                                                                   arguments=aws_stepfunctions.TaskInput.from_object(
+                                                                       {
+                                                                           "--database_name": aws_stepfunctions.JsonPath.string_at("$.database_name"),
+                                                                           "--file_key": aws_stepfunctions.JsonPath.string_at("$.file_key"),
+                                                                           "--bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
+                                                                           "--file_name": aws_stepfunctions.JsonPath.string_at("$.file_name"),
+                                                                           "--ingest_type": aws_stepfunctions.JsonPath.string_at("$.ingest_type"),
+                                                                           "--execution_id": aws_stepfunctions.JsonPath.string_at("$$.Execution.Name"),
+                                                                           "--trace_id": aws_stepfunctions.JsonPath.string_at("$.trace_id"),
+                                                                           "--submitted_at": aws_stepfunctions.JsonPath.string_at("$$.State.EnteredTime"),
+                                                                           "--profile": aws_stepfunctions.JsonPath.string_at("$.profile"),
+                                                                           "--additional-python-modules": aws_stepfunctions.JsonPath.string_at("$.--additional-python-modules")
+                                                                       }
+                                                                   ),
+                                                                   integration_pattern=aws_stepfunctions.IntegrationPattern.RUN_JOB,
+                                                                   result_path=aws_stepfunctions.JsonPath.DISCARD)
+        
+        # Define the Spark Steps, worker type and maximum workers of the auto-scaling come from the execution input
+        spark_workers = aws_stepfunctions_tasks.WorkerConfigurationProperty(
+            worker_type_v2=aws_stepfunctions_tasks.WorkerTypeV2.of(aws_stepfunctions.JsonPath.string_at("$.spark_worker_type")),
+            number_of_workers=aws_stepfunctions.JsonPath.number_at("$.spark_max_workers"))
+        convert_spark_job_step = aws_stepfunctions_tasks.GlueStartJobRun(self, "ConvertSparkGlueJobStep", glue_job_name=convert_spark_job.job_name,
+                                                                   arguments=aws_stepfunctions.TaskInput.from_object(
+                                                                       {
+                                                                            "--database_name": aws_stepfunctions.JsonPath.string_at("$.database_name"),
+                                                                            "--file_key": aws_stepfunctions.JsonPath.string_at("$.file_key"),
+                                                                            "--bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
+                                                                            "--file_name": aws_stepfunctions.JsonPath.string_at("$.file_name"),
+                                                                            "--ingest_type": aws_stepfunctions.JsonPath.string_at("$.ingest_type"),
+                                                                            "--trace_id": aws_stepfunctions.JsonPath.string_at("$.trace_id"),
+                                                                            "--submitted_at": aws_stepfunctions.JsonPath.string_at("$$.State.EnteredTime"),
+                                                                            "--execution_id": aws_stepfunctions.JsonPath.string_at("$$.Execution.Name"),
+                                                                            "--profile": aws_stepfunctions.JsonPath.string_at("$.profile"),
+                                                                            "--additional-python-modules": aws_stepfunctions.JsonPath.string_at("$.--additional-python-modules")
+                                                                       }
+                                                                   ),
+                                                                   worker_configuration=spark_workers,
+                                                                   result_path=aws_stepfunctions.JsonPath.DISCARD)
+        
+        transform_spark_job_step = aws_stepfunctions_tasks.GlueStartJobRun(self, "TransformSparkGlueJobStep", glue_job_name=transform_spark_job.job_name,
+                                                                   arguments=aws_stepfunctions.TaskInput.from_object(
+                                                                       {
+                                                                           "--database_name": aws_stepfunctions.JsonPath.string_at("$.database_name"),
+                                                                           "--file_key": aws_stepfunctions.JsonPath.string_at("$.file_key"),
+                                                                           "--bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
+                                                                           "--file_name": aws_stepfunctions.JsonPath.string_at("$.file_name"),
+                                                                           "--ingest_type": aws_stepfunctions.JsonPath.string_at("$.ingest_type"),
+                                                                           "--execution_id": aws_stepfunctions.JsonPath.string_at("$$.Execution.Name"),
+                                                                           "--trace_id": aws_stepfunctions.JsonPath.string_at("$.trace_id"),
+                                                                           "--submitted_at": aws_stepfunctions.JsonPath.string_at("$$.State.EnteredTime"),
+                                                                           "--profile": aws_stepfunctions.JsonPath.string_at("$.profile"),
+                                                                           "--additional-python-modules": aws_stepfunctions.JsonPath.string_at("$.--additional-python-modules")
+                                                                       }
+                                                                   ),
+                                                                   worker_configuration=spark_workers,
+                                                                   integration_pattern=aws_stepfunctions.IntegrationPattern.RUN_JOB,
+                                                                   result_path=aws_stepfunctions.JsonPath.DISCARD)
+        
+        # Define the Steps emitting the ETL completion event with the row counts written by the transform job
+        summary_step = aws_stepfunctions_tasks.CallAwsService(self, "GetETLSummaryStep", service="s3", action="getObject",
+                                                              parameters={
+                                                                  "Bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
+                                                                  "Key": aws_stepfunctions.JsonPath.format("etl/summaries/{}.json",
+                                                                                                           aws_stepfunctions.JsonPath.string_at("$$.Execution.Name"))
+                                                              },
+                                                              iam_resources=[storage_bucket.arn_for_objects("etl/summaries/*")],
+                                                              result_selector={
+                                                                  "summary": aws_stepfunctions.JsonPath.string_to_json(
+                                                                      aws_stepfunctions.JsonPath.string_at("$.Body"))
+                                                              },
+                                                              result_path="$.etl_summary")
+        
+        completion_event_step = aws_stepfunctions_tasks.EventBridgePutEvents(self, "ETLCompletedEventStep", entries=[
+                                                                  aws_stepfunctions_tasks.EventBridgePutEventsEntry(
+                                                                      detail=aws_stepfunctions.TaskInput.from_json_path_at("$.etl_summary.summary"),
+                                                                      detail_type="ETL Completed",
+                                                                      source="mlops.etl")
+                                                              ],
+                                                              result_path=aws_stepfunctions.JsonPath.DISCARD)
+        
+        # Define the Step recording the processed version of the raw file in the ledger, keyed by file key and ETag
+        mark_processed_step = aws_stepfunctions_tasks.CallAwsService(self, "MarkProcessedStep", service="s3", action="putObject",
+                                                              parameters={
+                                                                  "Bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
+                                                                  "Key": aws_stepfunctions.JsonPath.format("manifests/processed/{}/{}",
+                                                                                                           aws_stepfunctions.JsonPath.string_at("$.file_key"),
+                                                                                                           aws_stepfunctions.JsonPath.string_at("$.etag")),
+                                                                  "Body": aws_stepfunctions.JsonPath.json_to_string(
+                                                                      aws_stepfunctions.JsonPath.object_at("$.etl_summary.summary"))
+                                                              },
+                                                              iam_resources=[storage_bucket.arn_for_objects("manifests/processed/*")],
+                                                              result_path=aws_stepfunctions.JsonPath.DISCARD)
+        
+        rollup_job_step = aws_stepfunctions_tasks.GlueStartJobRun(self, "RollupGlueJobStep", glue_job_name=rollup_job.job_name,
                                                                    arguments=aws_stepfunctions.TaskInput.from_object(
                                                                        {
                                                                            "--database_name": aws_stepfunctions.JsonPath.string_at("$.database_name"),
@@ -244,15 +555,73 @@ class StorageLayer(Stack):
                                                                            "--ingest_type": aws_stepfunctions.JsonPath.string_at("$.ingest_type"),
                                                                            "--additional-python-modules": aws_stepfunctions.JsonPath.string_at("$.--additional-python-modules")
                                                                        }
-                                                                   ))
+                                                                   ),
+                                                                   integration_pattern=aws_stepfunctions.IntegrationPattern.RUN_JOB,
+                                                                   result_path=aws_stepfunctions.JsonPath.DISCARD)
+        
+        # Define the Step updating the last RUL of the rollups once an inference job wrote predictions for their dates
+        prediction_rollup_step = aws_stepfunctions_tasks.GlueStartJobRun(self, "PredictionRollupGlueJobStep", glue_job_name=rollup_job.job_name,
+                                                                          arguments=aws_stepfunctions.TaskInput.from_object(
+                                                                              {
+                                                                                  "--database_name": aws_stepfunctions.JsonPath.string_at("$.database_name"),
+                                                                                  "--bucket": aws_stepfunctions.JsonPath.string_at("$.bucket"),
+                                                                                  "--prediction_dates": aws_stepfunctions.JsonPath.string_at("$.prediction_dates"),
+                                                                                  "--additional-python-modules": "awswrangler"
+                                                                              }
+                                                                          ),
+                                                                          integration_pattern=aws_stepfunctions.IntegrationPattern.RUN_JOB,
+                                                                          result_path=aws_stepfunctions.JsonPath.DISCARD)
         
-        # Define StateMachine Definition of Steps
-        state_definition = aws_stepfunctions.Chain.start(convert_job_step).next(transform_job_step).next(aws_stepfunctions.Succeed(
-                        self, "ETLProcessSuccess", comment="ETL Process finished Successfully"))
+        # Retry Glue Job starts rejected at the concurrent runs limit, full jitter spreads the retries of a burst
+        for glue_step in [convert_job_step, transform_job_step, convert_spark_job_step, transform_spark_job_step, rollup_job_step,
+                          prediction_rollup_step]:
+            glue_step.add_retry(errors=["Glue.ConcurrentRunsExceededException"],
+                                interval=Duration.seconds(30), max_attempts=10, backoff_rate=2,
+                                max_delay=Duration.minutes(5), jitter_strategy=aws_stepfunctions.JitterType.FULL)
         
-        # Define StateMachine
+        # Define StateMachine Definition of Steps, rollups are kept only for timestamped inference data
+        etl_success = aws_stepfunctions.Succeed(self, "ETLProcessSuccess", comment="ETL Process finished Successfully")
+        rollup_choice = aws_stepfunctions.Choice(self, "RollupChoice", comment="Update rollups for partitioned ingest")
+        rollup_choice.when(aws_stepfunctions.Condition.string_equals("$.ingest_type", "partitioned"),
+                           rollup_job_step.next(etl_success))
+        rollup_choice.otherwise(etl_success)
+        summary_step.next(completion_event_step).next(mark_processed_step).next(rollup_choice)
+        # Both engines write the same tables and summary, pandas on one worker stays the default
+        engine_choice = aws_stepfunctions.Choice(self, "EngineChoice", comment="Select pandas or Spark convert and transform jobs")
+        engine_choice.when(aws_stepfunctions.Condition.string_equals("$.engine", "spark"),
+                           convert_spark_job_step.next(transform_spark_job_step).next(summary_step))
+        engine_choice.otherwise(convert_job_step.next(transform_job_step).next(summary_step))
+        state_definition = aws_stepfunctions.Chain.start(engine_choice)
+        
+        # Define StateMachine, state transitions are logged with their timestamps for the per-stage timings
+        states_log_group = aws_logs.LogGroup(self, "ETLStateMachineLogGroup", log_group_name="/aws/states/mlops-etl-process",
+                                             retention=aws_logs.RetentionDays.ONE_MONTH)
         state_machine = aws_stepfunctions.StateMachine(self, "ETLStateMachine", state_machine_name="mlops-etl-process",
-                                                       definition=state_definition, role=states_role)
+                                                       definition=state_definition, role=states_role,
+                                                       logs=aws_stepfunctions.LogOptions(destination=states_log_group,
+                                                                                         level=aws_stepfunctions.LogLevel.ALL,
+                                                                                         include_execution_data=False))
+        
+        # Define the StateMachine started by the inference Lambda with the prediction dates of a finished inference job,
+        # the rollup job allows one run so starts next to an ETL rollup are retried
+        aws_stepfunctions.StateMachine(self, "PredictionRollupStateMachine", state_machine_name="mlops-prediction-rollup",
+                                       definition=prediction_rollup_step, role=states_role,
+                                       logs=aws_stepfunctions.LogOptions(destination=states_log_group,
+                                                                         level=aws_stepfunctions.LogLevel.ERROR))
+        
+        #===========================================================================================================================
+        #=======================================================SQS=================================================================
+        #===========================================================================================================================
+        
+        # Define the admission Queue of landed files waiting for a free ETL execution slot, files failing to start
+        # are moved to the dead-letter Queue, starts rejected for capacity count as receives too so the limit is high
+        admission_dead_letter_queue = aws_sqs.Queue(self, "ETLAdmissionDeadLetterQueue", queue_name="mlops-etl-admission-dlq",
+                                                    retention_period=Duration.days(14))
+        admission_queue = aws_sqs.Queue(self, "ETLAdmissionQueue", queue_name="mlops-etl-admission-queue",
+                                        retention_period=Duration.days(14),
+                                        visibility_timeout=Duration.minutes(5),
+                                        dead_letter_queue=aws_sqs.DeadLetterQueue(max_receive_count=100,
+                                                                                  queue=admission_dead_letter_queue))
         
         #===========================================================================================================================
         #=======================================================LAMBDA==============================================================
@@ -300,6 +669,43 @@ class StorageLayer(Stack):
                                                             state_machine.state_machine_arn
                                                         ]
                                                     ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="StepFunctionsListAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "states:ListExecutions"
+                                                        ],
+                                                        resources=[
+                                                            state_machine.state_machine_arn
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="AdmissionQueueAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "sqs:SendMessage",
+                                                            "sqs:ReceiveMessage",
+                                                            "sqs:DeleteMessage",
+                                                            "sqs:ChangeMessageVisibility",
+                                                            "sqs:GetQueueAttributes"
+                                                        ],
+                                                        resources=[
+                                                            admission_queue.queue_arn
+                                                        ]
+                                                    ),
+                                                    aws_iam.PolicyStatement(
+                                                        sid="ProcessedLedgerAccess",
+                                                        effect=aws_iam.Effect.ALLOW,
+                                                        actions=[
+                                                            "s3:ListBucket",
+                                                            "s3:GetObject"
+                                                        ],
+                                                        resources=[
+                                                            storage_bucket.bucket_arn,
+                                                            storage_bucket.arn_for_objects("raw/*"),
+                                                            storage_bucket.arn_for_objects("manifests/processed/*")
+                                                        ]
+                                                    ),
                                                ]
                                             )
         
@@ -308,6 +714,10 @@ class StorageLayer(Stack):
                                     assumed_by=aws_iam.ServicePrincipal("lambda.amazonaws.com"),
                                     managed_policies=[lambda_policy])
         
+        # Import the Lambda Layer with the shared/python modules from the Model Development Stack
+        shared_layer = aws_lambda.LayerVersion.from_layer_version_arn(self, "ImportedSharedLayer",
+                                                                      layer_version_arn=Fn.import_value("SharedLayerArn"))
+        
         # Define Lambda function
         etl_lambda = aws_lambda.Function(self, "ETLLambda", role=lambda_role,
                                               runtime=aws_lambda.Runtime.PYTHON_3_8,
@@ -315,10 +725,19 @@ class StorageLayer(Stack):
                                               vpc=self.vpc, vpc_subnets=aws_ec2.SubnetType.PRIVATE_WITH_NAT,
                                               security_groups=[self.outbound_security_group],
                                               code=aws_lambda.Code.from_asset("lambda_code/etl_lambda"),
+                                              layers=[shared_layer],
                                               environment={
                                                         "SecurityGroupId": self.outbound_security_group.security_group_id,
                                                         "StateMachineArn": state_machine.state_machine_arn,
-                                                        "GlueDatabaseName": glue_database.database_name
+                                                        "CatchUpBatchSize": "200",
+                                                        "AdmissionQueueUrl": admission_queue.queue_url,
+                                                        "MaxConcurrentExecutions": str(etl_concurrency),
+                                                        "StorageBucketName": storage_bucket.bucket_name,
+                                                        "GlueDatabaseName": glue_database.database_name,
+                                                        "ProfileMode": "off",
+                                                        "ETLEngine": "pandas",
+                                                        "SparkWorkerType": "G.1X",
+                                                        "SparkMaxWorkers": "10"
                                                   },
                                               timeout=Duration.minutes(5), 
                                               function_name="mlops-etl-lambda",
@@ -333,4 +752,64 @@ class StorageLayer(Stack):
         storage_bucket.add_event_notification(aws_s3.EventType.OBJECT_CREATED, 
                                               aws_s3_notifications.LambdaDestination(etl_lambda),
                                               aws_s3.NotificationKeyFilter(prefix="raw/total/csv/"))
-        
\ No newline at end of file
+        
+        # Define the Rules dispatching queued files when an ETL execution finished, and periodically for delayed retries
+        aws_events.Rule(self, "ETLExecutionFinishedRule", rule_name="mlops-etl-execution-finished",
+                        description="Starts queued ETL processes when an ETL execution finished",
+                        event_pattern=aws_events.EventPattern(
+                            source=["aws.states"],
+                            detail_type=["Step Functions Execution Status Change"],
+                            detail={
+                                "stateMachineArn": [state_machine.state_machine_arn],
+                                "status": ["SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED"]
+                            }
+                        ),
+                        targets=[aws_events_targets.LambdaFunction(etl_lambda)])
+        
+        aws_events.Rule(self, "ETLAdmissionDispatchRule", rule_name="mlops-etl-admission-dispatch",
+                        description="Starts queued ETL processes whose retry delay passed",
+                        schedule=aws_events.Schedule.rate(Duration.minutes(1)),
+                        targets=[aws_events_targets.LambdaFunction(etl_lambda,
+                                                                   event=aws_events.RuleTargetInput.from_object(
+                                                                       {"action": "dispatch"}))])
+        
+        
+        #===========================================================================================================================
+        #=======================================================DASHBOARD===========================================================
+        #===========================================================================================================================
+        
+        # Define the Dashboard with the per-stage timings of the pipeline, from landing in raw/ until predictions.
+        # The model stages are emitted by the inference Lambda and the inference container, the model load is part of the run
+        pipeline_stages = ["landing_to_lambda", "etl_lambda", "convert_startup", "convert_read", "convert_transform",
+                           "convert_write", "transform_startup", "transform_wait", "transform_read", "transform_validate",
+                           "transform_transform", "transform_write", "transform_features", "transform_sketch",
+                           "transform_matrices", "model_resolve", "model_staging", "inference_startup",
+                           "inference_model_load", "inference_run"]
+        stage_metrics = lambda statistic: [aws_cloudwatch.Metric(namespace="MLOps/Pipeline", metric_name="StageDuration",
+                                                                 dimensions_map={"Stage": stage}, statistic=statistic,
+                                                                 label=stage, period=Duration.minutes(5))
+                                           for stage in pipeline_stages]
+        # Admission metrics of the queues in front of the ETL executions, training and inference jobs
+        admission_metrics = lambda metric_name, statistic: [aws_cloudwatch.Metric(namespace="MLOps/Admission", metric_name=metric_name,
+                                                                                  dimensions_map={"Queue": queue}, statistic=statistic,
+                                                                                  label=queue, period=Duration.minutes(5))
+                                                            for queue in ["etl", "training", "inference"]]
+        aws_cloudwatch.Dashboard(self, "PipelineLatencyDashboard", dashboard_name="mlops-pipeline-latency",
+                                 widgets=[
+                                     [aws_cloudwatch.GraphWidget(title="Stage duration (p50)", left=stage_metrics("p50"),
+                                                                 stacked=True, width=12),
+                                      aws_cloudwatch.GraphWidget(title="Stage duration (p95)", left=stage_metrics("p95"),
+                                                                 width=12)],
+                                     [aws_cloudwatch.GraphWidget(title="ETL state machine execution time",
+                                                                 left=[state_machine.metric_time(statistic="p50", label="p50"),
+                                                                       state_machine.metric_time(statistic="p95", label="p95")],
+                                                                 width=12),
+                                      aws_cloudwatch.GraphWidget(title="ETL state machine executions",
+                                                                 left=[state_machine.metric_succeeded(),
+                                                                       state_machine.metric_failed()],
+                                                                 width=12)],
+                                     [aws_cloudwatch.GraphWidget(title="Admission queue depth",
+                                                                 left=admission_metrics("QueueDepth", "max"), width=12),
+                                      aws_cloudwatch.GraphWidget(title="Admission wait time (p95)",
+                                                                 left=admission_metrics("WaitSeconds", "p95"), width=12)]
+                                 ])
@@ -0,0 +1,127 @@
+""" Shared helpers of the offline benchmarks: synthetic C-MAPSS like data, loading of the
+    Glue and Lambda code outside of AWS and timing of repeated runs
+"""
+import io
+import os
+import sys
+import time
+import types
+import argparse
+import importlib.util
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+SETTING_COLUMNS = ['altitude', 'mach', 'tra']
+SENSOR_COLUMNS = [f'sensor_{i}' for i in range(1, 22)]
+RAW_COLUMNS = ['unit', 'cycle'] + SETTING_COLUMNS + SENSOR_COLUMNS
+SCALES = {'small': {'units': 20, 'cycles': 200, 'images': 20},
+          'medium': {'units': 100, 'cycles': 250, 'images': 100},
+          'large': {'units': 500, 'cycles': 300, 'images': 500}}
+
+
+def synthetic_cmapss(units: int, cycles: int, seed: int = 0) -> pd.DataFrame:
+    """ Creates C-MAPSS like raw engine data with one row per unit and cycle
+        :argument: units - Number of engine units
+        :argument: cycles - Number of cycles per unit
+        :argument: seed - Random seed of the setting and sensor values
+        :return: data - Pandas DataFrame with RAW_COLUMNS columns
+    """
+    generator = np.random.default_rng(seed)
+    rows = units * cycles
+    data = pd.DataFrame({'unit': np.repeat(np.arange(1, units + 1), cycles),
+                         'cycle': np.tile(np.arange(1, cycles + 1), units)})
+    data['altitude'] = generator.uniform(0, 42000, rows).round(0)
+    data['mach'] = generator.uniform(0, 0.84, rows).round(4)
+    data['tra'] = generator.choice([60.0, 80.0, 100.0], rows)
+    sensors = generator.normal(500, 50, (rows, len(SENSOR_COLUMNS))).round(4)
+    return pd.concat([data, pd.DataFrame(sensors, columns=SENSOR_COLUMNS)], axis=1)
+
+def synthetic_csv(units: int, cycles: int, seed: int = 0) -> bytes:
+    """ Creates the headerless CSV file landing in raw/*/csv/ """
+    return synthetic_cmapss(units, cycles, seed).to_csv(header=False, index=False).encode('utf-8')
+
+
+def get_resolved_options(args: list, options: list) -> dict:
+    """ Parses the job arguments like awsglue.utils.getResolvedOptions of the Glue runtime
+        :argument: args - Command line arguments, usually sys.argv
+        :argument: options - Names of the required arguments
+        :return: resolved - Dictionary of argument name to value
+    """
+    parser = argparse.ArgumentParser()
+    for option in options:
+        parser.add_argument(f'--{option}', required=True)
+    parsed, _ = parser.parse_known_args(args[1:])
+    return vars(parsed)
+
+def install_glue_runtime() -> None:
+    """ Makes the Glue job scripts importable outside of Glue, the awsglue library only exists in the
+        Glue runtime. The Glue extra python files and Lambda layer code are added to the module path.
+    """
+    for path in [os.path.join(ROOT, 'glue_code'), os.path.join(ROOT, 'shared', 'python')]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    # The stand-in module has no spec, find_spec raises for it once it is installed
+    if 'awsglue' not in sys.modules and importlib.util.find_spec('awsglue') is None:
+        awsglue = types.ModuleType('awsglue')
+        utils = types.ModuleType('awsglue.utils')
+        utils.getResolvedOptions = get_resolved_options
+        awsglue.utils = utils
+        sys.modules['awsglue'] = awsglue
+        sys.modules['awsglue.utils'] = utils
+
+def load_module(relative_path: str, name: str) -> types.ModuleType:
+    """ Loads the Lambda or Glue module from its file
+        :argument: relative_path - Path of the module file relative to the repository root
+        :argument: name - Name of the loaded module
+        :return: module - Loaded module
+    """
+    install_glue_runtime()
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def aws_environment(**variables) -> None:
+    """ Sets fake credentials and the region used by the mocked AWS services, plus the given variables """
+    os.environ.update({'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                       'AWS_SECURITY_TOKEN': 'testing', 'AWS_SESSION_TOKEN': 'testing',
+                       'AWS_DEFAULT_REGION': 'us-east-1'})
+    os.environ.update(variables)
+
+
+def timed_runs(function, repeat: int, setup=None, warmup: int = 1) -> list:
+    """ Runs the function repeatedly with its output silenced
+        :argument: function - Function to measure, called with the setup result if setup is given
+        :argument: repeat - Number of measured runs
+        :argument: setup - Optional function called before every run, not included in the timing
+        :argument: warmup - Number of runs before measuring
+        :return: seconds - List of wall times of the measured runs
+    """
+    seconds = []
+    for i in range(warmup + repeat):
+        argument = setup() if setup is not None else None
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            if setup is not None:
+                function(argument)
+            else:
+                function()
+            elapsed = time.perf_counter() - start
+        if i >= warmup:
+            seconds.append(elapsed)
+    return seconds
+
+def summarize(seconds: list, **properties) -> dict:
+    """ Summarizes the wall times of the runs as the benchmark result
+        :argument: seconds - List returned by timed_runs
+        :argument: properties - Additional properties of the benchmark, e.g. row count
+        :return: result - Dictionary with median, min and p95 seconds
+    """
+    result = {'median_seconds': float(np.median(seconds)), 'min_seconds': float(np.min(seconds)),
+              'p95_seconds': float(np.percentile(seconds, 95)), 'runs': len(seconds)}
+    result.update(properties)
+    return result
@@ -0,0 +1,97 @@
+""" Overhead of the data quality validation on the transform job
+
+    Times the transform job phases on a local raw parquet file (read with the column projection, table types,
+    transform and the curated parquet write) with and without data_quality.validate, on a clean file and on
+    a file with bad rows that are quarantined. Exits with 1 when the validation adds more than the budget to
+    the clean file, the dirty file also pays for copying the valid rows and writing the quarantine file.
+    Run with: python benchmarks/data_quality_benchmark.py --units 4000 --cycles 250 --budget 0.05
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import synthetic_cmapss, load_module, timed_runs, summarize
+
+
+def dirty_cmapss(units: int, cycles: int, bad_share: float, seed: int = 0) -> pd.DataFrame:
+    """ Creates raw data with nulls, out of range values, duplicate keys and steps back in cycles
+        :argument: units - Number of engine units
+        :argument: cycles - Number of cycles per unit
+        :argument: bad_share - Share of rows with one of the problems
+        :argument: seed - Random seed of the data and the bad rows
+        :return: data - Pandas DataFrame with the raw columns in file order
+    """
+    data = synthetic_cmapss(units, cycles, seed)
+    generator = np.random.default_rng(seed)
+    rows = generator.choice(np.arange(1, len(data)), int(bad_share * len(data)), replace=False)
+    for problem, chunk in enumerate(np.array_split(rows, 4)):
+        if problem == 0:
+            data.loc[chunk, 'sensor_7'] = np.nan
+        elif problem == 1:
+            data.loc[chunk, 'mach'] = 3.0
+        elif problem == 2:
+            data.loc[chunk, 'cycle'] = data['cycle'].to_numpy()[chunk - 1]
+        else:
+            data.loc[chunk, 'cycle'] = 0
+    return data
+
+
+def run_transform(transform_job, data_quality, path: str, output: str, schema: dict, validate: bool) -> int:
+    """ Runs the read, optional validation, transform and write phases of the transform job on local files
+        :return: rows - Number of curated rows
+    """
+    raw_data = pd.read_parquet(path, columns=list(schema))
+    if validate:
+        raw_data, quarantined, report = data_quality.validate(raw_data, max_bad_rate=0.1)
+        if quarantined is not None:
+            quarantined.to_parquet(output + '.quarantine', index=False)
+    raw_data = transform_job.apply_schema(raw_data, schema)
+    curated_data = transform_job.add_timestamp(raw_data)
+    curated_data.to_parquet(output, index=False)
+    return len(curated_data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the data quality validation overhead of the transform job")
+    parser.add_argument('--units', type=int, default=4000)
+    parser.add_argument('--cycles', type=int, default=250)
+    parser.add_argument('--bad-share', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.05, help="Maximum added share of the transform time")
+    args = parser.parse_args()
+
+    transform_job = load_module('glue_code/transform_job.py', 'transform_job')
+    # Imported by the transform job from the Glue code folder
+    data_quality = sys.modules['data_quality']
+    schema = {"unit": "int", "cycle": "int", "altitude": "double", "mach": "double", "tra": "double"}
+    for i in range(1, 22):
+        schema[f'sensor_{i}'] = "double"
+
+    exceeded = False
+    with tempfile.TemporaryDirectory() as directory:
+        for name, raw_data in [('clean', synthetic_cmapss(args.units, args.cycles)),
+                               ('dirty', dirty_cmapss(args.units, args.cycles, args.bad_share))]:
+            path = os.path.join(directory, f'{name}.parquet')
+            raw_data.to_parquet(path, index=False)
+            output = os.path.join(directory, f'{name}_curated.parquet')
+            _, _, report = data_quality.validate(raw_data, max_bad_rate=0.1)
+            results = {}
+            for validate in [False, True]:
+                seconds = timed_runs(lambda: run_transform(transform_job, data_quality, path, output, schema, validate),
+                                     args.repeat)
+                results[validate] = summarize(seconds)
+            validate_seconds = summarize(timed_runs(lambda: data_quality.validate(raw_data, max_bad_rate=0.1), args.repeat))
+            overhead = results[True]['median_seconds'] / results[False]['median_seconds'] - 1
+            print(f"{name}: rows={len(raw_data)} quarantined={report['quarantined_rows']} status={report['status']}")
+            print(f"  transform            {results[False]['median_seconds']:8.3f} s")
+            print(f"  transform + validate {results[True]['median_seconds']:8.3f} s")
+            print(f"  validate alone       {validate_seconds['median_seconds']:8.3f} s "
+                  f"({validate_seconds['median_seconds'] / results[False]['median_seconds']:.1%} of transform)")
+            print(f"  overhead             {overhead:8.1%} (budget {args.budget:.0%})")
+            exceeded = exceeded or (name == 'clean' and overhead > args.budget)
+    sys.exit(1 if exceeded else 0)
@@ -0,0 +1,91 @@
+""" Cost and accuracy of the sketch based drift check against a rescan of the curated history
+
+    Sketches a training baseline and a history of partitioned inference ingests like the transform job,
+    then checks the drift of every sensor twice: by merging the ingest sketches and comparing them with
+    the baseline sketch, and by the exact Kolmogorov-Smirnov statistic on all rows. Some sensors of the
+    latest ingests are shifted. Exits with 1 if the sketch check misses a drifted sensor, flags a
+    stable one or its statistic is off by more than the tolerance.
+    Run with: python benchmarks/drift_sketch_benchmark.py --ingests 200 --units 100 --cycles 24
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import SENSOR_COLUMNS, synthetic_cmapss, install_glue_runtime
+
+install_glue_runtime()
+from drift_stats import sensor_sketches
+from drift_sketch import QuantileSketch, compare, merge_sketches, sketch_file
+
+
+def exact_ks(baseline: np.ndarray, current: np.ndarray) -> float:
+    """ Returns the two sample Kolmogorov-Smirnov statistic of the rows """
+    baseline, current = np.sort(baseline), np.sort(current)
+    points = np.concatenate([baseline, current])
+    return float(np.abs(np.searchsorted(baseline, points, side='right') / len(baseline)
+                        - np.searchsorted(current, points, side='right') / len(current)).max())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the sketch drift check with a rescan of the history")
+    parser.add_argument('--ingests', type=int, default=200, help="Partitioned inference ingests in the window")
+    parser.add_argument('--units', type=int, default=100)
+    parser.add_argument('--cycles', type=int, default=24, help="Cycles per unit of one ingest")
+    parser.add_argument('--drifted-ingests', type=int, default=100, help="Latest ingests with shifted sensors")
+    parser.add_argument('--shift', type=float, default=50.0, help="Shift of the drifted sensors")
+    parser.add_argument('--ks-threshold', type=float, default=0.1)
+    parser.add_argument('--tolerance', type=float, default=0.02, help="Maximum error of the sketch statistic")
+    args = parser.parse_args()
+
+    drifted_sensors = SENSOR_COLUMNS[:3]
+    train = synthetic_cmapss(args.units, 200, seed=0)
+    ingests = []
+    for i in range(args.ingests):
+        ingest = synthetic_cmapss(args.units, args.cycles, seed=i + 1)
+        if i >= args.ingests - args.drifted_ingests:
+            ingest[drifted_sensors] += args.shift
+        ingests.append(ingest)
+
+    # Sketches written by the transform job on every ingest, stored as JSON
+    start = time.perf_counter()
+    stored = [json.loads(json.dumps(sketch_file(sensor_sketches(ingest), 'inference', f'ingest-{i}')))
+              for i, ingest in enumerate(ingests)]
+    baseline = json.loads(json.dumps(sketch_file(sensor_sketches(train), 'train', 'train')))
+    sketch_seconds = (time.perf_counter() - start) / (args.ingests + 1)
+
+    # Drift check on the stored sketches, what the training Lambda does on every inference ingest
+    start = time.perf_counter()
+    report = compare({column: QuantileSketch.from_dict(sketch) for column, sketch in baseline['columns'].items()},
+                     merge_sketches(stored), ks_threshold=args.ks_threshold)
+    check_seconds = time.perf_counter() - start
+    # The Lambda reads one compacted sketch per past day of the window
+    daily = [sketch_file(merge_sketches(stored[day::7]), 'inference', f'daily-{day}') for day in range(7)]
+    start = time.perf_counter()
+    compare({column: QuantileSketch.from_dict(sketch) for column, sketch in baseline['columns'].items()},
+            merge_sketches(json.loads(json.dumps(daily))), ks_threshold=args.ks_threshold)
+    daily_seconds = time.perf_counter() - start
+
+    # Drift check on all rows of the history
+    start = time.perf_counter()
+    history = np.concatenate([ingest[SENSOR_COLUMNS].to_numpy() for ingest in ingests])
+    exact = {column: exact_ks(train[column].to_numpy(), history[:, i]) for i, column in enumerate(SENSOR_COLUMNS)}
+    rescan_seconds = time.perf_counter() - start
+
+    errors = {column: abs(report['columns'][column]['ks'] - exact[column]) for column in SENSOR_COLUMNS}
+    expected = sorted(column for column in SENSOR_COLUMNS if exact[column] > args.ks_threshold)
+    sketch_bytes = len(json.dumps(stored[0]))
+    print(f"history rows          {len(history):12d}")
+    print(f"sketch per ingest     {sketch_bytes:12d} bytes, {sketch_seconds * 1000:8.1f} ms")
+    print(f"sketch check          {check_seconds:12.3f} s ({args.ingests} ingest sketches)")
+    print(f"sketch check          {daily_seconds:12.3f} s (7 daily sketches)")
+    print(f"rescan check          {rescan_seconds:12.3f} s")
+    print(f"max statistic error   {max(errors.values()):12.4f}")
+    print(f"drifted (sketch)      {report['drifted']}")
+    print(f"drifted (exact)       {expected}")
+    ok = report['drifted'] == expected and max(errors.values()) <= args.tolerance
+    sys.exit(0 if ok else 1)
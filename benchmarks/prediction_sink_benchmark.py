@@ -0,0 +1,135 @@
+""" Throughput of the batch inference prediction sink, row-by-row writes against batched writes
+
+    The row-by-row sink appends every prediction to a parquet writer as it is produced, the batched
+    sink is shared/python/prediction_sink.py. With --postgres-dsn the latest prediction per unit is
+    also loaded into Postgres with row-by-row INSERTs and with COPY.
+    Run with: python benchmarks/prediction_sink_benchmark.py --units 2000 --cycles 300 --row-limit 20000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'shared', 'python'))
+from prediction_sink import PREDICTION_SCHEMA, LATEST_TABLE, PredictionSink, latest_table_sql, copy_latest
+
+
+def synthetic_predictions(units: int, cycles: int, chunk_rows: int):
+    """ Yields predictions in the chunks a model produces them, hourly timestamps per unit
+        :argument: units - Number of engine units
+        :argument: cycles - Number of cycles per unit
+        :argument: chunk_rows - Rows per predicted chunk
+        :return: chunks - Generator of Pandas DataFrames with unit, cycle, timestamp and predicted_rul
+    """
+    generator = np.random.default_rng(0)
+    unit = np.repeat(np.arange(1, units + 1, dtype=np.int32), cycles)
+    cycle = np.tile(np.arange(1, cycles + 1, dtype=np.int32), units)
+    start = np.datetime64(datetime(2024, 1, 1), 'ms')
+    timestamp = start + (cycle.astype('int64') * 3600 * 1000).astype('timedelta64[ms]')
+    predicted_rul = generator.uniform(0, 300, len(unit)).astype(np.float32)
+    for begin in range(0, len(unit), chunk_rows):
+        end = begin + chunk_rows
+        yield pd.DataFrame({'unit': unit[begin:end], 'cycle': cycle[begin:end], 'timestamp': timestamp[begin:end],
+                            'predicted_rul': predicted_rul[begin:end]})
+
+def row_by_row(directory: str, chunks, limit: int) -> int:
+    """ Writes every prediction as its own row group, the way a per-row sink appends to parquet """
+    writer = pq.ParquetWriter(os.path.join(directory, 'row-by-row.parquet'), PREDICTION_SCHEMA, compression='zstd')
+    rows = 0
+    for chunk in chunks:
+        for record in chunk.itertuples(index=False):
+            row = {'unit': [record.unit], 'cycle': [record.cycle], 'timestamp': [record.timestamp],
+                   'predicted_rul': [record.predicted_rul], 'model_version': ['1']}
+            writer.write_table(pa.Table.from_pydict(row, schema=PREDICTION_SCHEMA))
+            rows += 1
+            if rows >= limit:
+                writer.close()
+                return rows
+    writer.close()
+    return rows
+
+def batched(directory: str, chunks, batch_rows: int) -> tuple:
+    """ Writes the predictions with the batched sink """
+    sink = PredictionSink(directory, model_version='1', job_name='benchmark', batch_rows=batch_rows)
+    for chunk in chunks:
+        sink.write(chunk)
+    return sink.close(), sink.latest
+
+def directory_mb(directory: str) -> float:
+    """ Returns the size of all files under the directory in MB """
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(directory)
+               for name in names) / 1024 ** 2
+
+def postgres_load(dsn: str, latest: pd.DataFrame) -> dict:
+    """ Loads the latest predictions with row-by-row INSERTs and with COPY
+        :argument: dsn - Connection string of a test Postgres database
+        :argument: latest - Latest prediction per unit kept by the sink
+        :return: seconds - Dictionary of method to wall seconds
+    """
+    import psycopg2
+    connection = psycopg2.connect(dsn)
+    seconds = {}
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {LATEST_TABLE}")
+        cursor.execute(latest_table_sql())
+    connection.commit()
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        for record in latest.itertuples(index=False):
+            cursor.execute(f"INSERT INTO {LATEST_TABLE} (unit, cycle, timestamp, predicted_rul, model_version) "
+                           "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (unit) DO UPDATE SET cycle = EXCLUDED.cycle, "
+                           "timestamp = EXCLUDED.timestamp, predicted_rul = EXCLUDED.predicted_rul, "
+                           "model_version = EXCLUDED.model_version",
+                           (int(record.unit), int(record.cycle), record.timestamp.to_pydatetime(),
+                            float(record.predicted_rul), record.model_version))
+            connection.commit()
+    seconds['insert'] = time.perf_counter() - start
+    start = time.perf_counter()
+    copy_latest(connection, latest)
+    seconds['copy'] = time.perf_counter() - start
+    connection.close()
+    return seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare row-by-row and batched prediction sink throughput")
+    parser.add_argument('--units', type=int, default=2000)
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--chunk-rows', type=int, default=10000, help="Rows per predicted chunk")
+    parser.add_argument('--batch-rows', type=int, default=1000000, help="Rows buffered by the batched sink")
+    parser.add_argument('--row-limit', type=int, default=20000, help="Rows written by the slow row-by-row sink")
+    parser.add_argument('--postgres-dsn', default=None)
+    args = parser.parse_args()
+    total_rows = args.units * args.cycles
+
+    with tempfile.TemporaryDirectory() as row_directory, tempfile.TemporaryDirectory() as batch_directory:
+        start = time.perf_counter()
+        row_rows = row_by_row(row_directory, synthetic_predictions(args.units, args.cycles, args.chunk_rows),
+                              args.row_limit)
+        row_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        summary, latest = batched(batch_directory, synthetic_predictions(args.units, args.cycles, args.chunk_rows),
+                                  args.batch_rows)
+        batch_seconds = time.perf_counter() - start
+        row_mb, batch_mb = directory_mb(row_directory), directory_mb(batch_directory)
+
+    row_throughput, batch_throughput = row_rows / row_seconds, summary['rows'] / batch_seconds
+    print(f"rows={total_rows} chunk={args.chunk_rows} batch={args.batch_rows}")
+    print(f"row-by-row  {row_rows:>9d} rows {row_seconds:8.2f} s {row_throughput:>12.0f} rows/s "
+          f"{row_mb * 1024 ** 2 / row_rows:8.1f} bytes/row")
+    print(f"batched     {summary['rows']:>9d} rows {batch_seconds:8.2f} s {batch_throughput:>12.0f} rows/s "
+          f"{batch_mb * 1024 ** 2 / summary['rows']:8.1f} bytes/row in {summary['files']} files")
+    print(f"batched sink is {batch_throughput / row_throughput:.0f}x faster")
+    if args.postgres_dsn:
+        seconds = postgres_load(args.postgres_dsn, latest)
+        print(f"latest per unit ({len(latest)} rows): INSERT {seconds['insert']:.2f} s, COPY {seconds['copy']:.2f} s")
@@ -0,0 +1,89 @@
+""" Throughput of the rolling window features of the transform job against pandas groupby rolling
+
+    Computes the mean, standard deviation and slope features of all sensors for the configured windows
+    on a curated train dataset and on one inference ingest continued from the window store:
+     * vectorized: glue_code/rolling_features.py, cumulative sums over all units and sensors at once
+     * groupby: pandas groupby().rolling() per sensor and window, the slope from rolling sums of cycle products
+    Exits with 1 if the two differ.
+    Run with: python benchmarks/rolling_features_benchmark.py --units 1000 --cycles 300 --windows 10,30
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import SENSOR_COLUMNS, synthetic_cmapss, install_glue_runtime
+
+install_glue_runtime()
+from rolling_features import feature_columns, parse_windows, rolling_features
+from window_store import LocalWindowStore
+
+
+def groupby_features(data: pd.DataFrame, windows: list) -> pd.DataFrame:
+    """ Computes the features with pandas groupby rolling windows """
+    data = data.sort_values(['unit', 'cycle']).reset_index(drop=True)
+    cycle = data['cycle'].astype('float64')
+    products = pd.concat([data[['unit']], data[SENSOR_COLUMNS].mul(cycle, axis=0),
+                          pd.DataFrame({'cycle': cycle, 'cycle_squared': cycle * cycle})], axis=1)
+    features = {}
+    for window in windows:
+        rolling = data.groupby('unit')[SENSOR_COLUMNS].rolling(window, min_periods=1)
+        means, stds = rolling.mean().to_numpy(), rolling.std().to_numpy()
+        sums = products.groupby('unit').rolling(window, min_periods=1).sum().to_numpy()
+        count = data.groupby('unit')['cycle'].rolling(window, min_periods=1).count().to_numpy()[:, None]
+        sum_tx, sum_t, sum_tt = sums[:, :len(SENSOR_COLUMNS)], sums[:, -2:-1], sums[:, -1:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slopes = (count * sum_tx - sum_t * means * count) / (count * sum_tt - sum_t * sum_t)
+        slopes[count[:, 0] < 2] = np.nan
+        for i, column in enumerate(SENSOR_COLUMNS):
+            features[f"{column}_mean_{window}"] = means[:, i]
+            features[f"{column}_std_{window}"] = stds[:, i]
+            features[f"{column}_slope_{window}"] = slopes[:, i]
+    return pd.concat([data[['unit', 'cycle']], pd.DataFrame(features)[feature_columns(windows)]], axis=1)
+
+def timed(function, repeat: int) -> tuple:
+    """ Returns the best time in seconds of the calls and the last result """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the vectorized rolling features with pandas groupby rolling")
+    parser.add_argument('--units', type=int, default=1000)
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--windows', default='10,30')
+    parser.add_argument('--window-size', type=int, default=50, help="Cycles kept per unit by the window store")
+    parser.add_argument('--batch-cycles', type=int, default=24, help="Cycles per unit of one inference ingest")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    windows = parse_windows(args.windows, max_window=args.window_size)
+
+    data = synthetic_cmapss(args.units, args.cycles)
+    vectorized_seconds, actual = timed(lambda: rolling_features(data, windows), args.repeat)
+    groupby_seconds, expected = timed(lambda: groupby_features(data, windows), args.repeat)
+    difference = np.nanmax(np.abs(actual.iloc[:, 2:].to_numpy() - expected.iloc[:, 2:].to_numpy()))
+    same_nulls = (actual.iloc[:, 2:].isna().to_numpy() == expected.iloc[:, 2:].isna().to_numpy()).all()
+
+    # One inference ingest per unit, continued from the windows of the previous cycles
+    store = LocalWindowStore(window_size=args.window_size)
+    store.update(data[data['cycle'] <= args.cycles - args.batch_cycles])
+    batch = data[data['cycle'] > args.cycles - args.batch_cycles]
+    incremental_seconds, _ = timed(lambda: rolling_features(batch, windows,
+                                                            history=store.get_frame(list(range(1, args.units + 1)))),
+                                   args.repeat)
+
+    print(f"rows={len(data)} features={len(actual.columns) - 2} windows={windows}")
+    print(f"vectorized   {vectorized_seconds:8.3f} s  {len(data) / vectorized_seconds:12.0f} rows/s")
+    print(f"groupby      {groupby_seconds:8.3f} s  {len(data) / groupby_seconds:12.0f} rows/s")
+    print(f"incremental  {incremental_seconds:8.3f} s  {len(batch) / incremental_seconds:12.0f} rows/s "
+          f"({len(batch)} rows with the store windows)")
+    print(f"speedup {groupby_seconds / vectorized_seconds:.1f}x, max difference {difference:.2e}")
+    sys.exit(0 if same_nulls and difference < 1e-5 else 1)
@@ -0,0 +1,327 @@
+""" Performance regression benchmarks of the data pipeline and Lambdas, runnable offline with moto
+
+    Record a baseline with:
+        python benchmarks/suite.py run --scale small --scale medium --output benchmarks/baselines/baseline.json
+    Compare a new run against it, exits with 1 when a benchmark regressed more than the threshold:
+        python benchmarks/suite.py run --scale small --scale medium --output /tmp/current.json
+        python benchmarks/suite.py compare benchmarks/baselines/baseline.json /tmp/current.json --threshold 0.2
+"""
+import io
+import os
+import sys
+import json
+import runpy
+import hashlib
+import argparse
+import platform
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import boto3
+import pandas as pd
+from moto import mock_aws
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (ROOT, SCALES, synthetic_cmapss, synthetic_csv, install_glue_runtime, load_module,
+                    aws_environment, timed_runs, summarize)
+
+
+BUCKET = 'mlops-storage-bucket'
+ARTIFACTS_BUCKET = 'mlops-artifacts-bucket'
+DATABASE = 'mlops-glue-database'
+WINDOW_TABLE = 'mlops-unit-windows'
+REPOSITORY = 'mlops-model-repository'
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """ Registers the benchmark function under the name """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def create_storage() -> None:
+    """ Creates the storage bucket, Glue database and window table of the StorageLayer in the mocked account """
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    boto3.client('s3').create_bucket(Bucket=ARTIFACTS_BUCKET)
+    boto3.client('glue').create_database(DatabaseInput={'Name': DATABASE})
+    boto3.client('dynamodb').create_table(TableName=WINDOW_TABLE, BillingMode='PAY_PER_REQUEST',
+                                          KeySchema=[{'AttributeName': 'unit', 'KeyType': 'HASH'}],
+                                          AttributeDefinitions=[{'AttributeName': 'unit', 'AttributeType': 'N'}])
+
+def create_admission_queue(name: str) -> str:
+    """ Creates the SQS admission queue of the Lambda in the mocked account
+        :argument: name - Name of the queue
+        :return: queue_url - URL of the queue, set as AdmissionQueueUrl
+    """
+    return boto3.client('sqs').create_queue(QueueName=name)['QueueUrl']
+
+def job_arguments(file_key: str, ingest_type: str, **extra) -> list:
+    """ Creates the command line of the Glue job as passed by the ETL state machine
+        :argument: file_key - S3 path of the landed raw file
+        :argument: ingest_type - 'total' or 'partitioned'
+        :argument: extra - Additional job arguments
+        :return: argv - List of command line arguments
+    """
+    arguments = {'JOB_NAME': 'benchmark', 'database_name': DATABASE, 'file_key': file_key,
+                 'file_name': file_key.rsplit('/')[-1], 'ingest_type': ingest_type, 'bucket': BUCKET,
+                 'trace_id': 'benchmark', 'submitted_at': '', 'execution_id': 'benchmark',
+                 'profile': 'off', 'profile_bucket': ARTIFACTS_BUCKET, 'curated_format': 'parquet',
+                 'athena_workgroup': 'primary', 'quality_max_bad_rate': '0.1', 'feature_windows': '10,30'}
+    arguments.update(extra)
+    argv = ['job']
+    for name, value in arguments.items():
+        argv += [f'--{name}', str(value)]
+    return argv
+
+def run_script(relative_path: str, argv: list) -> None:
+    """ Runs the Glue job script as __main__ with the given command line """
+    previous = sys.argv
+    sys.argv = argv
+    try:
+        runpy.run_path(os.path.join(ROOT, relative_path), run_name='__main__')
+    finally:
+        sys.argv = previous
+
+def push_images(count: int) -> None:
+    """ Pushes the number of tagged images to the mocked ECR repository, the last one is the latest """
+    ecr = boto3.client('ecr', region_name='us-east-1')
+    ecr.create_repository(repositoryName=REPOSITORY)
+    for i in range(count):
+        tag = f"v{i}"
+        manifest = {'schemaVersion': 2, 'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+                    'config': {'mediaType': 'application/vnd.docker.container.image.v1+json', 'size': 100,
+                               'digest': 'sha256:' + hashlib.sha256(tag.encode('utf-8')).hexdigest()},
+                    'layers': []}
+        ecr.put_image(repositoryName=REPOSITORY, imageManifest=json.dumps(manifest), imageTag=tag)
+
+def lambda_environment() -> dict:
+    """ Returns the environment shared by the training and inference Lambdas """
+    return {'ECRRepositoryName': REPOSITORY, 'ImageUri': f"123456789012.dkr.ecr.us-east-1.amazonaws.com/{REPOSITORY}",
+            'SecurityGroupId': 'sg-12345678', 'Subnet0': 'subnet-12345678', 'Subnet1': 'subnet-87654321',
+            'SagemakerRoleArn': 'arn:aws:iam::123456789012:role/mlops-sagemaker-role', 'Project': 'benchmark',
+            'Owner': 'benchmark', 'ArtifactsBucket': ARTIFACTS_BUCKET, 'WarmPoolKeepAliveSeconds': '1800',
+            'Region': 'us-east-1', 'AccountId': '123456789012', 'EventRole': 'arn:aws:iam::123456789012:role/events',
+            'SelfLambdaName': 'benchmark', 'PredictionsBucket': BUCKET, 'PredictionsPrefix': 'predictions',
+            'StorageBucketName': BUCKET,
+            'PredictionSinkUri': f"s3://{ARTIFACTS_BUCKET}/code/prediction_sink/", 'PredictionCopyEnabled': 'false',
+            'GrafanaDBSecretArn': 'arn:aws:secretsmanager:us-east-1:123456789012:secret:mlops-db',
+            'GrafanaDBHost': 'localhost', 'GrafanaDatabase': 'Grafana',
+            'TrainingInstanceType': 'ml.c5.2xlarge', 'TrainingInstanceCount': '1', 'TrainingVolumeSizeInGB': '30',
+            'InferenceInstanceType': 'ml.t3.medium', 'InferenceInstanceCount': '1', 'InferenceVolumeSizeInGB': '30',
+            # Every benchmark run starts its job instead of queueing behind the mocked jobs, which stay in progress
+            'MaxConcurrentTrainingJobs': '1000', 'MaxConcurrentInferenceJobs': '1000'}
+
+
+class MLflowStandIn(BaseHTTPRequestHandler):
+    """ Answers the MLflow model registry requests of the inference Lambda """
+    source = f"s3://{ARTIFACTS_BUCKET}/mlflow/1/run/artifacts/model"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        content = json.dumps({'model_versions': [{'name': 'benchmark', 'version': '1', 'run_id': 'run',
+                                                  'source': self.source}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@benchmark('convert_parse')
+def bench_convert_parse(scale: dict, repeat: int) -> dict:
+    content = synthetic_csv(scale['units'], scale['cycles'])
+    seconds = timed_runs(lambda: pd.read_csv(io.BytesIO(content), header=None), repeat)
+    return summarize(seconds, rows=scale['units'] * scale['cycles'])
+
+@benchmark('add_timestamp')
+def bench_add_timestamp(scale: dict, repeat: int) -> dict:
+    transform_job = load_module('glue_code/transform_job.py', 'transform_job')
+    data = synthetic_cmapss(scale['units'], scale['cycles'])
+    seconds = timed_runs(lambda: transform_job.add_timestamp(data), repeat)
+    return summarize(seconds, rows=len(data))
+
+@benchmark('create_target')
+def bench_create_target(scale: dict, repeat: int) -> dict:
+    transform_job = load_module('glue_code/transform_job.py', 'transform_job')
+    data = synthetic_cmapss(scale['units'], scale['cycles'])
+    seconds = timed_runs(lambda: transform_job.create_target(data), repeat)
+    return summarize(seconds, rows=len(data))
+
+@benchmark('convert_job')
+def bench_convert_job(scale: dict, repeat: int) -> dict:
+    install_glue_runtime()
+    with mock_aws():
+        aws_environment()
+        create_storage()
+        file_key = 'raw/total/csv/train/train_benchmark.csv'
+        boto3.client('s3').put_object(Bucket=BUCKET, Key=file_key, Body=synthetic_csv(scale['units'], scale['cycles']))
+        seconds = timed_runs(lambda: run_script('glue_code/convert_job.py', job_arguments(file_key, 'total')), repeat)
+    return summarize(seconds, rows=scale['units'] * scale['cycles'])
+
+def bench_transform_job(scale: dict, repeat: int, ingest_type: str, folder: str) -> dict:
+    install_glue_runtime()
+    with mock_aws():
+        aws_environment()
+        create_storage()
+        file_key = f"raw/{ingest_type}/csv/{folder}/{folder}_benchmark.csv"
+        raw_key = file_key.replace('/csv/', '/parquet/').replace('.csv', '.parquet')
+        buffer = io.BytesIO()
+        synthetic_cmapss(scale['units'], scale['cycles']).to_parquet(buffer, index=False)
+        boto3.client('s3').put_object(Bucket=BUCKET, Key=raw_key, Body=buffer.getvalue())
+        argv = job_arguments(file_key, ingest_type, window_table=WINDOW_TABLE, window_size=50)
+        seconds = timed_runs(lambda: run_script('glue_code/transform_job.py', argv), repeat)
+    return summarize(seconds, rows=scale['units'] * scale['cycles'])
+
+@benchmark('transform_job_total')
+def bench_transform_job_total(scale: dict, repeat: int) -> dict:
+    return bench_transform_job(scale, repeat, 'total', 'train')
+
+@benchmark('transform_job_partitioned')
+def bench_transform_job_partitioned(scale: dict, repeat: int) -> dict:
+    return bench_transform_job(scale, repeat, 'partitioned', 'inference')
+
+@benchmark('get_latest_image')
+def bench_get_latest_image(scale: dict, repeat: int) -> dict:
+    with mock_aws():
+        aws_environment(**lambda_environment())
+        os.environ['AdmissionQueueUrl'] = create_admission_queue('mlops-training-admission-queue')
+        training_lambda = load_module('lambda_code/training_lambda/training_lambda.py', 'training_lambda')
+        push_images(scale['images'])
+        seconds = timed_runs(training_lambda.get_latest_image, repeat)
+    return summarize(seconds, images=scale['images'])
+
+@benchmark('etl_lambda_handler')
+def bench_etl_lambda_handler(scale: dict, repeat: int) -> dict:
+    with mock_aws():
+        aws_environment(GlueDatabaseName=DATABASE)
+        os.environ['AdmissionQueueUrl'] = create_admission_queue('mlops-etl-admission-queue')
+        # The ledger lookup needs the storage bucket, errors other than a missing entry are raised
+        boto3.client('s3').create_bucket(Bucket=BUCKET)
+        etl_lambda = load_module('lambda_code/etl_lambda/etl_lambda.py', 'etl_lambda')
+        step_functions = boto3.client('stepfunctions')
+        event = {'Records': [{'eventTime': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                              's3': {'bucket': {'name': BUCKET},
+                                     'object': {'key': 'raw/partitioned/csv/inference/benchmark.csv',
+                                                'eTag': 'benchmark'}}}]}
+
+        def new_state_machine():
+            # Execution names have a one second resolution, so every run gets its own state machine
+            count = len(step_functions.list_state_machines()['stateMachines'])
+            response = step_functions.create_state_machine(name=f"mlops-etl-process-{count}", definition='{}',
+                                                           roleArn='arn:aws:iam::123456789012:role/mlops-step-function-role')
+            os.environ['StateMachineArn'] = response['stateMachineArn']
+
+        seconds = timed_runs(lambda _: etl_lambda.lambda_handler(event, None), repeat, setup=new_state_machine)
+    return summarize(seconds)
+
+@benchmark('training_lambda_handler')
+def bench_training_lambda_handler(scale: dict, repeat: int) -> dict:
+    with mock_aws():
+        aws_environment(**lambda_environment())
+        os.environ['AdmissionQueueUrl'] = create_admission_queue('mlops-training-admission-queue')
+        training_lambda = load_module('lambda_code/training_lambda/training_lambda.py', 'training_lambda')
+        event = {'resource': '/start_training', 'body': json.dumps({'ImageTag': 'v1'})}
+        seconds = timed_runs(lambda: training_lambda.lambda_handler(event, None), repeat)
+    return summarize(seconds)
+
+@benchmark('inference_lambda_handler')
+def bench_inference_lambda_handler(scale: dict, repeat: int) -> dict:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MLflowStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with mock_aws():
+            aws_environment(MLflowTrackingUri=f"http://127.0.0.1:{server.server_address[1]}", **lambda_environment())
+            os.environ['AdmissionQueueUrl'] = create_admission_queue('mlops-inference-admission-queue')
+            inference_lambda = load_module('lambda_code/inference_lambda/inference_lambda.py', 'inference_lambda')
+            s3 = boto3.client('s3')
+            s3.create_bucket(Bucket=ARTIFACTS_BUCKET)
+            s3.create_bucket(Bucket=BUCKET)
+            for name, size in [('MLmodel', 1024), ('model.pkl', 4 * 1024 * 1024), ('conda.yaml', 512)]:
+                s3.put_object(Bucket=ARTIFACTS_BUCKET, Key=f"mlflow/1/run/artifacts/model/{name}", Body=os.urandom(size))
+            event = {'resource': '/start_batch_inference', 'body': json.dumps({'ModelName': 'benchmark', 'ImageTag': 'v1'})}
+            # Warm-up run stages the model, the measured runs hit the model cache
+            seconds = timed_runs(lambda: inference_lambda.lambda_handler(event, None), repeat)
+    finally:
+        server.shutdown()
+    return summarize(seconds)
+
+
+def run(scales: list, repeat: int, only: list = None) -> dict:
+    """ Runs the benchmarks at the scales
+        :argument: scales - List of scale names from SCALES
+        :argument: repeat - Number of measured runs of every benchmark
+        :argument: only - Optional list of benchmark names to run
+        :return: results - Dictionary with run metadata and results keyed by 'name[scale]'
+    """
+    results = {'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'pandas': pd.__version__, 'repeat': repeat, 'benchmarks': {}}
+    for scale_name in scales:
+        for name, function in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            key = f"{name}[{scale_name}]"
+            results['benchmarks'][key] = function(SCALES[scale_name], repeat)
+            print(f"{key:45s} median={results['benchmarks'][key]['median_seconds'] * 1000:10.2f} ms")
+    return results
+
+def compare(baseline: dict, current: dict, threshold: float, metric: str = 'median_seconds') -> list:
+    """ Compares the current results against the baseline
+        :argument: baseline - Results of the baseline run
+        :argument: current - Results of the current run
+        :argument: threshold - Allowed relative slowdown, 0.2 allows 20% slower runs
+        :argument: metric - Compared result metric
+        :return: regressions - List of benchmark names slower than allowed
+    """
+    regressions = []
+    for key, result in current['benchmarks'].items():
+        if key not in baseline['benchmarks']:
+            print(f"{key:45s} {'new':>10s}")
+            continue
+        ratio = result[metric] / baseline['benchmarks'][key][metric]
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(key)
+        print(f"{key:45s} {baseline['benchmarks'][key][metric] * 1000:10.2f} ms -> {result[metric] * 1000:10.2f} ms "
+              f"({ratio:5.2f}x){'  REGRESSION' if regressed else ''}")
+    for key in baseline['benchmarks']:
+        if key not in current['benchmarks']:
+            print(f"{key:45s} {'missing':>10s}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Performance regression benchmarks of the pipeline and Lambdas")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks and write the results")
+    run_parser.add_argument('--scale', action='append', choices=list(SCALES), help="Data scale, can be repeated")
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help="Benchmark to run, can be repeated")
+    run_parser.add_argument('--output', required=True, help="Path of the results JSON")
+    compare_parser = subparsers.add_parser('compare', help="Compare results against a baseline")
+    compare_parser.add_argument('baseline', help="Path of the baseline results JSON")
+    compare_parser.add_argument('current', help="Path of the current results JSON")
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    compare_parser.add_argument('--metric', default='median_seconds', choices=['median_seconds', 'min_seconds', 'p95_seconds'])
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.scale or ['small'], args.repeat, args.only)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        regressions = compare(baseline, current, args.threshold, args.metric)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}")
+            sys.exit(1)
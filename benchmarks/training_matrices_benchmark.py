@@ -0,0 +1,97 @@
+""" Load time and peak memory of the training data: curated parquet table against the training matrices
+
+    Writes a curated train dataset both as the parquet file of the transform job and as the float32
+    training matrices of shared/python/training_matrices.py. Every variant runs in its own process:
+     * parquet: read the file, order by unit and cycle and build the float32 feature and target arrays
+     * matrices: memory-map the .npy files, then one pass over all features like a training epoch
+    The peak resident memory of the mapped variant counts the touched file pages, which the kernel can
+    drop under memory pressure, unlike the heap of the parquet variant.
+    Run with: python benchmarks/training_matrices_benchmark.py --units 5000 --cycles 300
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import synthetic_cmapss, install_glue_runtime
+
+install_glue_runtime()
+from training_matrices import FEATURE_COLUMNS, TARGET_COLUMN, build_matrices, save_matrices, load_matrices
+
+
+def run_variant(variant: str, path: str) -> dict:
+    """ Loads the training data and makes one pass over the features
+        :argument: variant - 'parquet' or 'matrices'
+        :argument: path - Path of the parquet file or of the matrices directory
+        :return: result - Dictionary with load and pass seconds and peak resident memory in MB
+    """
+    start = time.perf_counter()
+    if variant == 'parquet':
+        data = pd.read_parquet(path).sort_values(['unit', 'cycle'])
+        features = data[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+        target = data[TARGET_COLUMN].to_numpy(dtype=np.float32)
+        del data
+    else:
+        matrices = load_matrices(path)
+        features, target = matrices['features'], matrices['target']
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    checksum = float(features.sum(dtype=np.float64) + target.sum(dtype=np.float64))
+    pass_seconds = time.perf_counter() - start
+    # Linux reports the peak resident memory in KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'variant': variant, 'load_seconds': load_seconds, 'pass_seconds': pass_seconds, 'peak_mb': peak_mb,
+            'rows': len(target), 'checksum': checksum}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare loading the curated parquet with the training matrices")
+    parser.add_argument('--units', type=int, default=5000)
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--variant', choices=['parquet', 'matrices'], default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--path', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.path)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Curated train data like the transform job writes it, with the RUL target
+        data = synthetic_cmapss(args.units, args.cycles)
+        data = data.astype({'unit': 'int32', 'cycle': 'int32'})
+        data['rul'] = (data.groupby('unit')['cycle'].transform('max') - data['cycle']).astype('int32')
+        parquet_path = os.path.join(directory, 'train.parquet')
+        data.to_parquet(parquet_path, index=False)
+        matrices_path = os.path.join(directory, 'matrices')
+        start = time.perf_counter()
+        save_matrices(build_matrices(data), matrices_path)
+        build_seconds = time.perf_counter() - start
+        del data
+
+        results = {}
+        for variant, path in [('parquet', parquet_path), ('matrices', matrices_path)]:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--variant', variant, '--path', path],
+                                    capture_output=True, text=True, check=True)
+            results[variant] = json.loads(output.stdout.strip().splitlines()[-1])
+        parquet_mb = os.path.getsize(parquet_path) / 1024 ** 2
+        matrices_mb = sum(os.path.getsize(os.path.join(matrices_path, name)) for name in os.listdir(matrices_path)) / 1024 ** 2
+
+    parquet, matrices = results['parquet'], results['matrices']
+    assert parquet['rows'] == matrices['rows'] and np.isclose(parquet['checksum'], matrices['checksum'])
+    print(f"rows={parquet['rows']} parquet={parquet_mb:.1f} MB matrices={matrices_mb:.1f} MB "
+          f"(built in {build_seconds:.2f} s by the transform job)")
+    for result in [parquet, matrices]:
+        print(f"{result['variant']:10s} load={result['load_seconds']:8.3f} s  pass={result['pass_seconds']:8.3f} s  "
+              f"peak RSS={result['peak_mb']:8.1f} MB")
+    print(f"load {parquet['load_seconds'] / matrices['load_seconds']:.0f}x faster, "
+          f"load and pass {(parquet['load_seconds'] + parquet['pass_seconds']) / (matrices['load_seconds'] + matrices['pass_seconds']):.1f}x faster, "
+          f"peak memory {parquet['peak_mb'] - matrices['peak_mb']:.1f} MB lower")
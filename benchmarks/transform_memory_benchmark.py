@@ -0,0 +1,114 @@
+""" Peak memory and wall time of the transform job read and transform phases
+
+    Compares the previous full read with defensive copies against the column projection with the
+    table schema and in place transforms, on a large total ingest file. Every variant runs in its own
+    process so the peak resident memory includes the Arrow buffers that tracemalloc does not see.
+    Run with: python benchmarks/transform_memory_benchmark.py --units 5000 --cycles 300
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import synthetic_cmapss, load_module
+
+
+def previous_add_timestamp(input_data: pd.DataFrame) -> pd.DataFrame:
+    """ add_timestamp of the transform job before the column projection change """
+    splitted_data = input_data.copy()
+    current_time = datetime.now()
+    time_list = []
+    unit_length = len(splitted_data[splitted_data['unit']==1])
+    for i in range(unit_length):
+        new_time = current_time - timedelta(hours=i)
+        time_list.append(new_time.strftime('%Y-%m-%d %H:%M:%S'))
+    time_list.reverse()
+    timestamp_data_list = []
+    for unit in splitted_data['unit'].unique():
+        unit_splitted = splitted_data[splitted_data['unit']==unit]
+        end_unit = len(unit_splitted)
+        unit_splitted.loc[:, 'timestamp'] = time_list[:end_unit]
+        timestamp_data_list.append(unit_splitted)
+    return pd.concat(timestamp_data_list)
+
+def previous_create_target(raw_data: pd.DataFrame) -> pd.DataFrame:
+    """ create_target of the transform job before the column projection change """
+    data = raw_data.copy()
+    grouped = data.groupby('unit')
+    max_cycle = grouped['cycle'].max()
+    data = data.merge(max_cycle.to_frame(name='max_cycle'), left_on='unit', right_index=True)
+    data['rul'] = data['max_cycle'] - data['cycle']
+    data.drop('max_cycle', axis=1, inplace=True)
+    return data
+
+def run_variant(variant: str, path: str, ingest_type: str) -> dict:
+    """ Reads and transforms the raw file like the transform job
+        :argument: variant - 'previous' or 'current' implementation
+        :argument: path - Path of the local raw parquet file
+        :argument: ingest_type - 'total' for the train path or 'partitioned' for the inference path
+        :return: result - Dictionary with wall seconds and peak resident memory in MB
+    """
+    transform_job = load_module('glue_code/transform_job.py', 'transform_job')
+    schema = {"unit": "int", "cycle": "int", "altitude": "double", "mach": "double", "tra": "double"}
+    for i in range(1, 22):
+        schema[f'sensor_{i}'] = "double"
+    start = time.perf_counter()
+    if variant == 'previous':
+        raw_data = pd.read_parquet(path)
+        curated_data = previous_create_target(raw_data) if ingest_type == 'total' else previous_add_timestamp(raw_data)
+    else:
+        # Same as transform_job.read_raw on a local file
+        raw_data = transform_job.apply_schema(pd.read_parquet(path, columns=list(schema)), schema)
+        curated_data = transform_job.create_target(raw_data) if ingest_type == 'total' else transform_job.add_timestamp(raw_data)
+    seconds = time.perf_counter() - start
+    # Linux reports the peak resident memory in KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'variant': variant, 'seconds': seconds, 'peak_mb': peak_mb, 'rows': len(curated_data),
+            'curated_mb': curated_data.memory_usage(deep=True).sum() / 1024 ** 2}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare peak memory and wall time of the transform job read")
+    parser.add_argument('--units', type=int, default=5000)
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--ingest-type', choices=['total', 'partitioned'], default='total')
+    parser.add_argument('--variant', choices=['previous', 'current'], default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--file', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.file, args.ingest_type)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Raw C-MAPSS files end with two empty columns, converted as sensor_22 and sensor_23
+        path = os.path.join(directory, 'train_benchmark.parquet')
+        raw_data = synthetic_cmapss(args.units, args.cycles)
+        raw_data['sensor_22'] = np.nan
+        raw_data['sensor_23'] = np.nan
+        raw_data.to_parquet(path, index=False)
+        file_mb = os.path.getsize(path) / 1024 ** 2
+        del raw_data
+
+        results = []
+        for variant in ['previous', 'current']:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--variant', variant, '--file', path,
+                                     '--ingest-type', args.ingest_type], capture_output=True, text=True, check=True)
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"rows={args.units * args.cycles} ingest={args.ingest_type} raw parquet={file_mb:.1f} MB")
+    for result in results:
+        print(f"{result['variant']:10s} wall={result['seconds']:8.2f} s  peak RSS={result['peak_mb']:8.1f} MB  "
+              f"curated frame={result['curated_mb']:8.1f} MB")
+    previous, current = results
+    print(f"wall time {previous['seconds'] / current['seconds']:.1f}x faster, "
+          f"peak memory {previous['peak_mb'] - current['peak_mb']:.1f} MB lower")
@@ -0,0 +1,90 @@
+""" Window fetch latency with and without the online window store
+
+    Compares building the last-N-cycles window of every unit by scanning the whole
+    curated inference history against reading it from the window store.
+    Run with: python benchmarks/window_store_benchmark.py --units 1000 --cycles 300
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'glue_code'))
+from window_store import WINDOW_COLUMNS, LocalWindowStore, DynamoWindowStore
+
+
+def synthetic_history(units: int, cycles: int, seed: int = 0) -> pd.DataFrame:
+    """ Creates C-MAPSS like curated inference history
+        :argument: units - Number of engine units
+        :argument: cycles - Number of cycles per unit
+        :argument: seed - Random seed of the sensor values
+        :return: data - Pandas DataFrame with unit and WINDOW_COLUMNS columns
+    """
+    generator = np.random.default_rng(seed)
+    data = pd.DataFrame(generator.normal(500, 50, (units * cycles, len(WINDOW_COLUMNS))), columns=WINDOW_COLUMNS)
+    data['unit'] = np.repeat(np.arange(1, units + 1), cycles)
+    data['cycle'] = np.tile(np.arange(1, cycles + 1), units)
+    return data
+
+
+def scan_windows(path: str, window_size: int) -> dict:
+    """ Builds the windows by reading the whole history dataset """
+    history = pd.read_parquet(path)
+    tail = history.sort_values(['unit', 'cycle']).groupby('unit').tail(window_size)
+    return {unit: group[WINDOW_COLUMNS].to_numpy(dtype=np.float32) for unit, group in tail.groupby('unit')}
+
+
+def timed(function, repeat: int) -> float:
+    """ Returns the best wall time of the function in milliseconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark window fetch with and without the window store")
+    parser.add_argument('--units', type=int, default=1000)
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--window-size', type=int, default=50)
+    parser.add_argument('--batches', type=int, default=10, help="Number of partitioned ingests of the history")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dynamodb-table', default=None, help="Also measure a real DynamoDB window table")
+    args = parser.parse_args()
+
+    history = synthetic_history(args.units, args.cycles)
+    units = list(range(1, args.units + 1))
+    with tempfile.TemporaryDirectory() as directory:
+        # Write the history as one file per partitioned ingest, like the curated inference dataset
+        store = LocalWindowStore(window_size=args.window_size)
+        batch_cycles = np.array_split(np.arange(1, args.cycles + 1), args.batches)
+        update_seconds = 0.0
+        for i, cycles in enumerate(batch_cycles):
+            batch = history[history['cycle'].isin(cycles)]
+            batch.to_parquet(os.path.join(directory, f"batch_{i}.parquet"))
+            start = time.perf_counter()
+            store.update(batch)
+            update_seconds += time.perf_counter() - start
+
+        scan_ms = timed(lambda: scan_windows(directory, args.window_size), args.repeat)
+        store_ms = timed(lambda: store.get_windows(units), args.repeat)
+        # Both paths must return the same windows
+        expected = scan_windows(directory, args.window_size)
+        fetched = store.get_windows(units)
+        assert all(np.array_equal(expected[unit], fetched[unit]) for unit in units)
+
+    print(f"units={args.units} cycles/unit={args.cycles} window={args.window_size}")
+    print(f"history scan:        {scan_ms:10.1f} ms")
+    print(f"window store fetch:  {store_ms:10.1f} ms ({scan_ms / store_ms:.1f}x faster)")
+    print(f"store update:        {update_seconds / args.batches * 1000:10.1f} ms per ingest")
+    if args.dynamodb_table:
+        dynamo_store = DynamoWindowStore(table_name=args.dynamodb_table, window_size=args.window_size)
+        dynamo_store.update(history)
+        dynamo_ms = timed(lambda: dynamo_store.get_windows(units), args.repeat)
+        print(f"dynamodb fetch:      {dynamo_ms:10.1f} ms")
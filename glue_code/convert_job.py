@@ -6,6 +6,9 @@ import pandas as pd
 from awsglue.utils import getResolvedOptions
 import awswrangler
 
+from pipeline_timing import SpanEmitter
+from job_profiler import JobProfiler, profile_output
+
 
 # Get the Arguments
 args = getResolvedOptions(sys.argv,
@@ -14,39 +17,57 @@ args = getResolvedOptions(sys.argv,
                         'file_key',
                         'file_name',
                         'ingest_type',
-                        'bucket'])
+                        'bucket',
+                        'trace_id',
+                        'submitted_at',
+                        'execution_id',
+                        'profile',
+                        'profile_bucket'])
+# Define the timing spans of the job phases
+timing = SpanEmitter(sink='cloudwatch')
+trace_id = args['trace_id']
+timing.emit_since(trace_id, 'convert_startup', args['submitted_at'])
+# Define the opt-in profiler of the job phases
+profiler = JobProfiler(mode=args['profile'], output=profile_output(args['profile_bucket'], args['execution_id'], 'convert'))
+
 # Get the raw csv data
-s3 = boto3.client('s3')
-obj = s3.get_object(Bucket=args['bucket'], Key=args['file_key'])
-raw_data = pd.read_csv(io.BytesIO(obj['Body'].read()), header=None)
+with timing.span(trace_id, 'convert_read'), profiler.section('read'):
+    s3 = boto3.client('s3')
+    obj = s3.get_object(Bucket=args['bucket'], Key=args['file_key'])
+    raw_data = pd.read_csv(io.BytesIO(obj['Body'].read()), header=None)
 
 # Get ingest type
 ingest_type = args['ingest_type']
 filename = args['file_name']
 
-# Add column names
-# Define number of sensor columns
-sensors_number = len(raw_data.columns) - 5
-# Rename the columns to corrensponding value
-column_names = ['unit', 'cycle', 'altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, sensors_number + 1)]
-raw_data.columns = column_names
-
-if ingest_type == 'total':
-    mode = 'overwrite'
-    if 'test' in filename:
-        raw_data.rename(columns={'sensor_22': 'rul'}, inplace=True)
-        table = f"mlops-raw-test-data"
-        path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/test"
+with timing.span(trace_id, 'convert_transform'), profiler.section('transform'):
+    # Add column names
+    # Define number of sensor columns
+    sensors_number = len(raw_data.columns) - 5
+    # Rename the columns to corrensponding value
+    column_names = ['unit', 'cycle', 'altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, sensors_number + 1)]
+    raw_data.columns = column_names
+
+    if ingest_type == 'total':
+        mode = 'overwrite'
+        if 'test' in filename:
+            raw_data.rename(columns={'sensor_22': 'rul'}, inplace=True)
+            table = f"mlops-raw-test-data"
+            path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/test"
+        else:
+            table = f"mlops-raw-train-data"
+            path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/train"
     else:
-        table = f"mlops-raw-train-data"
-        path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/train"
-else:
-    mode = 'append'
-    table = f"mlops-raw-inference-data"
-    path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/inference"
-    
-awswrangler.s3.to_parquet(raw_data, path=path, dataset=True, mode=mode, compression=None, 
-                          database=args['database_name'], table=table)
-
-file_path = path + f"/{filename.replace('.csv', '.parquet')}"
-awswrangler.s3.to_parquet(raw_data, path=file_path)
\ No newline at end of file
+        mode = 'append'
+        table = f"mlops-raw-inference-data"
+        path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/inference"
+
+with timing.span(trace_id, 'convert_write', rows=len(raw_data)), profiler.section('write'):
+    awswrangler.s3.to_parquet(raw_data, path=path, dataset=True, mode=mode, compression=None, 
+                              database=args['database_name'], table=table)
+
+    file_path = path + f"/{filename.replace('.csv', '.parquet')}"
+    awswrangler.s3.to_parquet(raw_data, path=file_path)
+
+timing.flush()
+profiler.save()
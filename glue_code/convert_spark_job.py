@@ -0,0 +1,69 @@
+import sys
+
+import awswrangler
+from awsglue.utils import getResolvedOptions
+from pyspark.sql import SparkSession
+
+from spark_transforms import name_columns, catalog_types
+from pipeline_timing import SpanEmitter
+from job_profiler import JobProfiler, profile_output
+
+
+# Get the Arguments
+args = getResolvedOptions(sys.argv,
+                        ['JOB_NAME',
+                        'database_name',
+                        'file_key',
+                        'file_name',
+                        'ingest_type',
+                        'bucket',
+                        'trace_id',
+                        'submitted_at',
+                        'execution_id',
+                        'profile',
+                        'profile_bucket'])
+# Define the timing spans of the job phases
+timing = SpanEmitter(sink='cloudwatch')
+trace_id = args['trace_id']
+timing.emit_since(trace_id, 'convert_startup', args['submitted_at'])
+# Define the opt-in profiler of the job phases, only the driver is profiled
+profiler = JobProfiler(mode=args['profile'], output=profile_output(args['profile_bucket'], args['execution_id'], 'convert'))
+spark = SparkSession.builder.config('spark.sql.session.timeZone', 'UTC').getOrCreate()
+
+# Get ingest type
+ingest_type = args['ingest_type']
+filename = args['file_name']
+
+# Get the raw csv data, read lazily and split across the workers
+with timing.span(trace_id, 'convert_read'), profiler.section('read'):
+    raw_data = spark.read.csv(f"s3://{args['bucket']}/{args['file_key']}", header=False, inferSchema=True)
+
+with timing.span(trace_id, 'convert_transform'), profiler.section('transform'):
+    raw_data = name_columns(raw_data, test=ingest_type == 'total' and 'test' in filename)
+    if ingest_type == 'total':
+        mode = 'overwrite'
+        if 'test' in filename:
+            table = f"mlops-raw-test-data"
+            path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/test"
+        else:
+            table = f"mlops-raw-train-data"
+            path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/train"
+    else:
+        mode = 'append'
+        table = f"mlops-raw-inference-data"
+        path = f"s3://{args['bucket']}/raw/{ingest_type}/parquet/inference"
+    # The data is written twice, keep it on the workers
+    raw_data = raw_data.cache()
+    rows = raw_data.count()
+
+with timing.span(trace_id, 'convert_write', rows=rows), profiler.section('write'):
+    raw_data.write.mode(mode).parquet(path)
+    awswrangler.catalog.create_parquet_table(database=args['database_name'], table=table, path=path,
+                                             columns_types=catalog_types(raw_data), mode='overwrite')
+
+    # The file of the ingest is a folder of part files, its _SUCCESS marker is awaited by the transform job
+    file_path = path + f"/{filename.replace('.csv', '.parquet')}"
+    raw_data.write.mode('overwrite').parquet(file_path)
+
+timing.flush()
+profiler.save()
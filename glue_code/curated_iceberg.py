@@ -0,0 +1,184 @@
+import os
+import uuid
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+import awswrangler
+
+
+KEY_COLUMNS = ['unit', 'cycle']
+# Hidden partitioning of the Iceberg tables, queries filter on the source columns
+PARTITIONING = {'inference': 'day(timestamp)', 'train': 'bucket(16, unit)', 'test': 'bucket(16, unit)'}
+ICEBERG_TABLES = {'inference': 'mlops_curated_inference_iceberg', 'train': 'mlops_curated_train_iceberg',
+                  'test': 'mlops_curated_test_iceberg'}
+# Rolling window features of the curated rows, keyed on (unit, cycle) like the curated tables
+FEATURE_TABLES = {dataset: f"mlops_curated_{dataset}_features_iceberg" for dataset in ICEBERG_TABLES}
+FEATURE_PARTITIONING = 'bucket(16, unit)'
+
+
+def prepare_batch(data: pd.DataFrame, updated_at: datetime) -> pd.DataFrame:
+    """ Prepares the curated rows for the upsert, MERGE allows one source row per key
+        :argument: data - Pandas DataFrame with curated rows
+        :argument: updated_at - Time of the write
+        :return: batch - Pandas DataFrame with the last row of every key and updated_at column
+    """
+    batch = data.drop_duplicates(subset=KEY_COLUMNS, keep='last')
+    return batch.assign(updated_at=pd.Timestamp(updated_at))
+
+def create_table_sql(database: str, table: str, schema: dict, location: str, partitioning: str) -> str:
+    """ Creates the Athena DDL of the Iceberg table
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: schema - Dictionary of column name to Athena type
+        :argument: location - S3 location of the table data and metadata
+        :argument: partitioning - Iceberg partition transform
+        :return: sql - CREATE TABLE statement
+    """
+    columns = ', '.join(f"`{column}` {column_type}" for column, column_type in schema.items())
+    return (f"CREATE TABLE IF NOT EXISTS `{database}`.`{table}` ({columns}) PARTITIONED BY ({partitioning}) "
+            f"LOCATION '{location}' TBLPROPERTIES ('table_type'='ICEBERG', 'format'='parquet')")
+
+def merge_sql(database: str, table: str, staging_table: str, columns: list) -> str:
+    """ Creates the MERGE statement upserting the staged rows on the key columns
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: staging_table - Name of the table with the staged rows
+        :argument: columns - List of all table columns
+        :return: sql - MERGE INTO statement
+    """
+    condition = ' AND '.join(f't."{column}" = s."{column}"' for column in KEY_COLUMNS)
+    updates = ', '.join(f'"{column}" = s."{column}"' for column in columns if column not in KEY_COLUMNS)
+    names = ', '.join(f'"{column}"' for column in columns)
+    values = ', '.join(f's."{column}"' for column in columns)
+    return (f'MERGE INTO "{database}"."{table}" t USING "{database}"."{staging_table}" s ON ({condition}) '
+            f'WHEN MATCHED THEN UPDATE SET {updates} '
+            f'WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})')
+
+def replace_sql(database: str, table: str, staging_table: str, columns: list) -> str:
+    """ Creates the MERGE statement replacing all rows of the table with the staged rows in one commit, used for
+        total ingests so units removed upstream do not stay in the table and a failed write keeps the old rows
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: staging_table - Name of the table with the staged rows
+        :argument: columns - List of all table columns
+        :return: sql - MERGE INTO statement
+    """
+    # Athena has no WHEN NOT MATCHED BY SOURCE, the table rows missing from the staged rows are added to the
+    # source flagged for deletion so they match themselves and get deleted by the same MERGE
+    condition = ' AND '.join(f't."{column}" = s."{column}"' for column in KEY_COLUMNS)
+    updates = ', '.join(f'"{column}" = s."{column}"' for column in columns if column not in KEY_COLUMNS)
+    names = ', '.join(f'"{column}"' for column in columns)
+    values = ', '.join(f's."{column}"' for column in columns)
+    table_values = ', '.join(f't."{column}"' for column in columns)
+    source = (f'SELECT {names}, false AS "_delete" FROM "{database}"."{staging_table}" UNION ALL '
+              f'SELECT {table_values}, true AS "_delete" '
+              f'FROM "{database}"."{table}" t WHERE NOT EXISTS '
+              f'(SELECT 1 FROM "{database}"."{staging_table}" s WHERE {condition})')
+    return (f'MERGE INTO "{database}"."{table}" t USING ({source}) s ON ({condition}) '
+            f'WHEN MATCHED AND s."_delete" THEN DELETE '
+            f'WHEN MATCHED THEN UPDATE SET {updates} '
+            f'WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})')
+
+def run_query(sql: str, database: str, workgroup: str) -> dict:
+    """ Runs the Athena statement and waits until it finished """
+    query_id = awswrangler.athena.start_query_execution(sql=sql, database=database, workgroup=workgroup)
+    return awswrangler.athena.wait_query(query_execution_id=query_id)
+
+def current_snapshot(database: str, table: str, workgroup: str) -> Optional[dict]:
+    """ Returns the latest snapshot of the Iceberg table
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: workgroup - Athena workgroup with engine version 3
+        :return: snapshot - Dictionary with snapshot_id and committed_at, None for an empty table
+    """
+    snapshots = awswrangler.athena.read_sql_query(
+        f'SELECT snapshot_id, committed_at FROM "{database}"."{table}$snapshots" ORDER BY committed_at DESC LIMIT 1',
+        database=database, workgroup=workgroup, ctas_approach=False)
+    if snapshots.empty:
+        return None
+    return {'snapshot_id': int(snapshots['snapshot_id'].iloc[0]), 'committed_at': snapshots['committed_at'].iloc[0]}
+
+def read_changes(database: str, table: str, from_snapshot_id: Optional[str], to_snapshot_id: str,
+                 workgroup: str) -> pd.DataFrame:
+    """ Reads the rows inserted or updated between two snapshots of the Iceberg table with time travel, so consumers
+        only read the rows written since the snapshot they last consumed. Deleted rows are not returned
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: from_snapshot_id - Snapshot ID consumed last, None reads all rows of the to snapshot
+        :argument: to_snapshot_id - Snapshot ID to read up to, e.g. snapshot_id of the ETL summary
+        :argument: workgroup - Athena workgroup with engine version 3
+        :return: changes - Pandas DataFrame with the rows of the to snapshot missing from the from snapshot
+    """
+    sql = f'SELECT * FROM "{database}"."{table}" FOR VERSION AS OF {int(to_snapshot_id)}'
+    if from_snapshot_id is not None:
+        sql += f' EXCEPT SELECT * FROM "{database}"."{table}" FOR VERSION AS OF {int(from_snapshot_id)}'
+    return awswrangler.athena.read_sql_query(sql, database=database, workgroup=workgroup, ctas_approach=False)
+
+def changes_from_environment() -> pd.DataFrame:
+    """ Reads the curated rows passed to the job with CuratedDatabase, CuratedTable, FromSnapshotId, ToSnapshotId
+        and AthenaWorkgroup environment variables, set by the Lambda starting the job
+        :argument: None
+        :return: changes - Pandas DataFrame with the rows written since the snapshot consumed last
+    """
+    return read_changes(os.environ['CuratedDatabase'], os.environ['CuratedTable'], os.environ.get('FromSnapshotId'),
+                        os.environ['ToSnapshotId'], os.environ['AthenaWorkgroup'])
+
+def merge_staged(database: str, table: str, schema: dict, location: str, partitioning: str,
+                 staging_table: str, staging_location: str, workgroup: str, replace: bool = False) -> dict:
+    """ Merges the staged rows into the Iceberg table, or replaces the table rows with them, the table is
+        created on first write and the staging table is dropped afterwards
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: schema - Dictionary of column name to Athena type, with updated_at
+        :argument: location - S3 location of the Iceberg table
+        :argument: partitioning - Iceberg partition transform
+        :argument: staging_table - Name of the Glue table with the staged rows
+        :argument: staging_location - S3 location of the staged rows
+        :argument: workgroup - Athena workgroup with engine version 3
+        :argument: replace - Replaces all rows of the table when True, upserts on the key columns otherwise
+        :return: result - Dictionary with total rows and the new snapshot ID
+    """
+    sql_builder = replace_sql if replace else merge_sql
+    try:
+        run_query(create_table_sql(database, table, schema, location, partitioning), database, workgroup)
+        run_query(sql_builder(database, table, staging_table, list(schema)), database, workgroup)
+    finally:
+        awswrangler.catalog.delete_table_if_exists(database=database, table=staging_table)
+        awswrangler.s3.delete_objects(staging_location)
+    total_rows = awswrangler.athena.read_sql_query(f'SELECT COUNT(*) AS total_rows FROM "{database}"."{table}"',
+                                                   database=database, workgroup=workgroup, ctas_approach=False)
+    snapshot = current_snapshot(database, table, workgroup)
+    return {'total_rows': int(total_rows['total_rows'].iloc[0]),
+            'snapshot_id': snapshot['snapshot_id'] if snapshot else None}
+
+def staging_names(table: str, staging_path: str) -> tuple:
+    """ Returns a unique staging table name and its S3 location under the staging path """
+    staging_table = f"{table}_staging_{uuid.uuid4().hex[:8]}"
+    return staging_table, f"{staging_path.rstrip('/')}/{staging_table}/"
+
+def upsert(data: pd.DataFrame, database: str, table: str, schema: dict, location: str, partitioning: str,
+           staging_path: str, workgroup: str, replace: bool = False) -> dict:
+    """ Upserts the curated rows into the Iceberg table on (unit, cycle), the table is created on first write.
+        Total ingests are whole datasets and replace the table rows instead
+        :argument: data - Pandas DataFrame with curated rows
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: schema - Dictionary of column name to Athena type, without updated_at
+        :argument: location - S3 location of the Iceberg table
+        :argument: partitioning - Iceberg partition transform
+        :argument: staging_path - S3 prefix for the staged rows
+        :argument: workgroup - Athena workgroup with engine version 3
+        :argument: replace - Replaces all rows of the table when True, e.g. for total ingests
+        :return: result - Dictionary with written rows, total rows and the new snapshot ID
+    """
+    schema = dict(schema, updated_at='timestamp')
+    batch = prepare_batch(data, datetime.utcnow())
+    # Stage the batch as a plain parquet table to MERGE from
+    staging_table, staging_location = staging_names(table, staging_path)
+    awswrangler.s3.to_parquet(batch[list(schema)], path=staging_location, dataset=True, mode='overwrite',
+                              database=database, table=staging_table, dtype=schema)
+    result = merge_staged(database, table, schema, location, partitioning, staging_table, staging_location, workgroup,
+                          replace=replace)
+    result['rows_written'] = len(batch)
+    return result
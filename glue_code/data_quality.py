@@ -0,0 +1,144 @@
+import json
+import time
+from typing import Optional
+
+import boto3
+import numpy as np
+import pandas as pd
+import awswrangler
+
+
+# Bits of the quality_flags column of the quarantined rows
+NULL_VALUE = 1
+OUT_OF_RANGE = 2
+NON_MONOTONIC = 4
+DUPLICATE = 8
+CHECKS = {'null_value': NULL_VALUE, 'out_of_range': OUT_OF_RANGE, 'non_monotonic_cycle': NON_MONOTONIC,
+          'duplicate_key': DUPLICATE}
+
+# Plausible values of the C-MAPSS settings and sensors, sensors are temperatures, pressures, speeds and ratios
+VALUE_RANGES = {'unit': (1, 100000), 'cycle': (1, 100000), 'altitude': (0, 45000), 'mach': (0, 1), 'tra': (0, 120)}
+for i in range(1, 22):
+    VALUE_RANGES[f'sensor_{i}'] = (0, 100000)
+VALUE_RANGES['rul'] = (0, 100000)
+NUMERIC_TYPES = {'tinyint', 'smallint', 'int', 'bigint', 'float', 'double'}
+
+
+def check_schema(columns_types: dict, schema: dict) -> list:
+    """ Checks the raw parquet columns against the table schema before reading them
+        :argument: columns_types - Dictionary of column name to Athena type of the raw parquet file
+        :argument: schema - Dictionary of column name to Athena type of the target table
+        :return: problems - List of missing or non numeric columns, empty if the schema is valid
+    """
+    problems = []
+    for column in schema:
+        if column not in columns_types:
+            problems.append(f"missing column {column}")
+        elif columns_types[column] not in NUMERIC_TYPES:
+            problems.append(f"column {column} has type {columns_types[column]}")
+    return problems
+
+def quality_flags(data: pd.DataFrame) -> tuple:
+    """ Runs the row checks vectorized column by column, the rows of the data are not copied
+        :argument: data - Pandas DataFrame with the raw columns in file order, before the table types are applied
+        :return: flags - Numpy uint8 array with the failed check bits of every row
+        :return: column_counts - Dictionary of check name to Dictionary of column name to failing rows
+    """
+    flags = np.zeros(len(data), dtype=np.uint8)
+    column_counts = {'null_value': {}, 'out_of_range': {}}
+    for column in data.columns:
+        if column not in VALUE_RANGES:
+            continue
+        values = data[column].to_numpy()
+        low, high = VALUE_RANGES[column]
+        # NaN compares False, one pass finds the null and out of range rows and clean columns stop here
+        in_range = (values >= low) & (values <= high)
+        if in_range.all():
+            continue
+        nulls = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(len(values), dtype=bool)
+        # A null row only counts as null
+        out_of_range = ~in_range & ~nulls
+        flags[out_of_range] |= OUT_OF_RANGE
+        flags[nulls] |= NULL_VALUE
+        column_counts['out_of_range'][column] = int(out_of_range.sum())
+        column_counts['null_value'][column] = int(nulls.sum())
+    # Cycles of a unit must increase in file order. The stable sort keeps the file order within the unit and is
+    # linear on files already grouped by unit, clean files with increasing cycles in every unit stop here.
+    unit = data['unit'].to_numpy()
+    order = np.argsort(unit, kind='stable')
+    sorted_unit = unit[order]
+    if (np.diff(data['cycle'].to_numpy()[order])[sorted_unit[1:] == sorted_unit[:-1]] > 0).all():
+        return flags, column_counts
+    # A key seen before in the file is a duplicate wherever the rows sit, a cycle below the largest earlier cycle
+    # of the unit is a step back, so repeated blocks of a unit are flagged on every row
+    flags[data.duplicated(['unit', 'cycle']).to_numpy()] |= DUPLICATE
+    cycle = data['cycle']
+    previous_max = cycle.groupby(data['unit'], sort=False).cummax().groupby(data['unit'], sort=False).shift()
+    flags[(cycle < previous_max).to_numpy()] |= NON_MONOTONIC
+    return flags, column_counts
+
+def valid_keys(data: pd.DataFrame) -> np.ndarray:
+    """ Returns the rows with a non null unit and cycle in their value ranges, quarantined rows with a valid key
+        still count for the RUL target and the timestamps of their unit
+        :argument: data - Pandas DataFrame with the raw columns
+        :return: valid - Numpy bool array, True for the rows with a valid key
+    """
+    valid = np.ones(len(data), dtype=bool)
+    for column in ['unit', 'cycle']:
+        low, high = VALUE_RANGES[column]
+        values = data[column].to_numpy()
+        # NaN compares False
+        valid &= (values >= low) & (values <= high)
+    return valid
+
+def report_status(rows: int, bad_rows: int, max_bad_rate: float) -> str:
+    """ Returns 'passed' for a clean file, 'quarantined' if only the bad rows are held back and 'rejected'
+        if more than max_bad_rate of the rows are bad, e.g. a NaN-laden sensor, and the whole file fails
+    """
+    if bad_rows == 0:
+        return 'passed'
+    return 'rejected' if bad_rows > max_bad_rate * rows else 'quarantined'
+
+def validate(data: pd.DataFrame, max_bad_rate: float) -> tuple:
+    """ Splits the raw data into valid rows and quarantined rows and creates the quality report
+        :argument: data - Pandas DataFrame with the raw columns in file order
+        :argument: max_bad_rate - Maximum share of quarantined rows before the whole file is rejected
+        :return: valid - Pandas DataFrame with the rows passing all checks
+        :return: quarantined - Pandas DataFrame with the failing rows and their quality_flags, None if all pass
+        :return: report - Dictionary with the check counts and status returned by report_status
+    """
+    start = time.perf_counter()
+    flags, column_counts = quality_flags(data)
+    bad = flags != 0
+    bad_rows = int(bad.sum())
+    report = {'rows': len(data), 'quarantined_rows': bad_rows,
+              'status': report_status(len(data), bad_rows, max_bad_rate),
+              'checks': {name: int(((flags & bit) != 0).sum()) for name, bit in CHECKS.items()},
+              # Only columns with failing rows are listed, the report stays small for clean files
+              'columns': {name: {column: count for column, count in counts.items() if count}
+                          for name, counts in column_counts.items()}}
+    report['null_rates'] = {column: count / len(data) for column, count in report['columns']['null_value'].items()}
+    # Clean files are passed on without copying the rows
+    valid, quarantined = data, None
+    if bad_rows:
+        quarantined = data[bad].assign(quality_flags=flags[bad])
+        valid = data[~bad]
+    report['seconds'] = time.perf_counter() - start
+    return valid, quarantined, report
+
+def write_report(bucket: str, execution_id: str, report: dict, quarantined: Optional[pd.DataFrame],
+                 quarantine_path: str) -> dict:
+    """ Writes the quarantined rows and the quality report of the execution
+        :argument: bucket - Name of the storage bucket
+        :argument: execution_id - Name of the Step Functions execution
+        :argument: report - Dictionary returned by validate
+        :argument: quarantined - Pandas DataFrame with the quarantined rows, nothing is written if empty
+        :argument: quarantine_path - S3 path of the quarantine parquet file
+        :return: report - Dictionary with the report key and quarantine path added
+    """
+    if quarantined is not None and len(quarantined):
+        awswrangler.s3.to_parquet(quarantined, path=quarantine_path)
+        report['quarantine_path'] = quarantine_path
+    report['report_key'] = f"etl/quality/{execution_id}.json"
+    boto3.client('s3').put_object(Bucket=bucket, Key=report['report_key'], Body=json.dumps(report).encode('utf-8'))
+    return report
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from drift_sketch import QuantileSketch, SKETCH_COLUMNS, sketch_file, sketch_key, write_json
+
+
+def column_sketch(values: np.ndarray, compression: float = 200) -> QuantileSketch:
+    """ Builds the sketch of the column in one sort, nulls are left out. The sorted values are cut where
+        the t-digest scale passes a whole number, so the centroids are the same as merging them one by one.
+        :argument: values - Numpy array of the column values
+        :argument: compression - Sketch compression, about compression / 2 centroids are kept
+        :return: sketch - QuantileSketch of the column
+    """
+    values = np.sort(values[~np.isnan(values)] if values.dtype.kind == 'f' else values).astype(np.float64)
+    count = len(values)
+    if count == 0:
+        return QuantileSketch(compression=compression)
+    # Scale of the quantile at the left of every value, the first value of a centroid starts a new whole number
+    k = compression / (2 * np.pi) * np.arcsin(2 * np.arange(count) / count - 1)
+    cluster = np.floor(k - k[0]).astype(np.int64)
+    starts = np.flatnonzero(np.diff(cluster, prepend=-1))
+    weights = np.diff(np.append(starts, count))
+    means = np.add.reduceat(values, starts) / weights
+    mean = float(values.mean())
+    return QuantileSketch(compression=compression, count=count, mean=mean,
+                          m2=float(((values - mean) ** 2).sum()), minimum=float(values[0]), maximum=float(values[-1]),
+                          means=means.tolist(), weights=weights.tolist())
+
+def sensor_sketches(data: pd.DataFrame, columns: list = None, compression: float = 200) -> dict:
+    """ Builds the sketches of the settings and sensor columns of the ingested rows
+        :argument: data - Pandas DataFrame with the curated rows
+        :argument: columns - List of sketched columns, SKETCH_COLUMNS by default
+        :argument: compression - Sketch compression
+        :return: sketches - Dictionary of column name to QuantileSketch
+    """
+    columns = [column for column in (columns or SKETCH_COLUMNS) if column in data.columns]
+    return {column: column_sketch(data[column].to_numpy(), compression) for column in columns}
+
+def write_sketches(bucket: str, dataset: str, execution_id: str, sketches: dict) -> str:
+    """ Writes the sketches of the ingest to the storage bucket
+        :argument: bucket - Name of the storage bucket
+        :argument: dataset - Name of the curated dataset, train replaces the drift baseline
+        :argument: execution_id - Name of the Step Functions execution
+        :argument: sketches - Dictionary of column name to QuantileSketch
+        :return: key - S3 key of the written sketch file
+    """
+    key = sketch_key(dataset, execution_id)
+    write_json(bucket, key, sketch_file(sketches, dataset, execution_id))
+    return key
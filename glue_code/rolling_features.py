@@ -0,0 +1,103 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+SENSOR_COLUMNS = [f'sensor_{i}' for i in range(1, 22)]
+STATISTICS = ['mean', 'std', 'slope']
+
+
+def parse_windows(windows: str, max_window: int) -> list:
+    """ Parses the comma separated window sizes of the feature_windows job argument
+        :argument: windows - Window sizes in cycles, e.g. "10,30"
+        :argument: max_window - Cycles kept per unit by the window store, incremental features need the
+                               previous window_size - 1 cycles of the unit
+        :return: windows - Sorted list of window sizes
+    """
+    sizes = sorted({int(size) for size in windows.split(',') if size.strip()})
+    if not sizes or sizes[0] < 2 or sizes[-1] > max_window:
+        raise ValueError(f"Feature windows must be between 2 and {max_window} cycles, got {windows}")
+    return sizes
+
+def feature_columns(windows: list, columns: list = None) -> list:
+    """ Returns the names of the feature columns, e.g. sensor_2_mean_10 """
+    return [f"{column}_{statistic}_{window}" for window in windows for column in (columns or SENSOR_COLUMNS)
+            for statistic in STATISTICS]
+
+def window_sums(cumulative: np.ndarray, lower: np.ndarray) -> np.ndarray:
+    """ Sums the rows lower[i]..i of every row i as the difference of two cumulative sums
+        :argument: cumulative - Numpy array with a zero row followed by the cumulative sums of the rows,
+                                rows of a unit are contiguous
+        :argument: lower - Numpy array with the first row of the window of every row
+        :return: sums - Numpy array of the window sums
+    """
+    return cumulative[1:] - cumulative[lower]
+
+def rolling_features(data: pd.DataFrame, windows: list, columns: list = None,
+                     history: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """ Computes the mean, standard deviation and least squares slope over cycles of the last cycles of every
+        unit, for all rows and columns at once from cumulative sums. Windows of the first cycles of a unit
+        hold the available cycles, the standard deviation and slope need 2 cycles. The rows are validated
+        before, a null value would spread through the cumulative sums.
+        :argument: data - Pandas DataFrame with unit, cycle and the feature source columns
+        :argument: windows - List of window sizes in cycles
+        :argument: columns - List of source columns, the sensors by default
+        :argument: history - Pandas DataFrame with the previous cycles of the units, e.g. the window store
+                             tail of the previous batch, used as the start of the windows and not returned
+        :return: features - Pandas DataFrame with unit, cycle and the feature columns, ordered by unit and cycle
+    """
+    columns = columns or SENSOR_COLUMNS
+    unit, cycle = data['unit'].to_numpy(), data['cycle'].to_numpy()
+    values = data[columns].to_numpy(dtype=np.float64)
+    new = np.ones(len(data), dtype=bool)
+    if history is not None and len(history):
+        # Cycles ingested again replace their stored copy
+        history_unit, history_cycle = history['unit'].to_numpy(np.int64), history['cycle'].to_numpy(np.int64)
+        stored = pd.MultiIndex.from_arrays([history_unit, history_cycle])
+        kept = ~stored.isin(pd.MultiIndex.from_arrays([unit.astype(np.int64), cycle.astype(np.int64)]))
+        unit = np.concatenate([history_unit[kept], unit])
+        cycle = np.concatenate([history_cycle[kept], cycle])
+        values = np.concatenate([history[columns].to_numpy(dtype=np.float64)[kept], values])
+        new = np.concatenate([np.zeros(kept.sum(), dtype=bool), new])
+    # Curated data is ordered already in most cases, then the rows are used without a gather
+    order = np.lexsort((cycle, unit))
+    if not (order == np.arange(len(order))).all():
+        unit, cycle, values, new = unit[order], cycle[order], values[order], new[order]
+    # Centering keeps the cumulative sums of squares small, only the means get the center added back
+    center = values.mean(axis=0) if len(values) else np.zeros(len(columns))
+    values = values - center
+    times = cycle.astype(np.float64)
+    times = (times - times.mean() if len(times) else times)[:, None]
+    rows = np.arange(len(unit))
+    unit_start = np.maximum.accumulate(np.where(np.diff(unit, prepend=unit[:1] - 1) != 0, rows, 0))
+
+    # One cumulative sum per input serves all windows, the zero row makes the sums of windows starting at row 0
+    inputs = np.concatenate([values, values * values, times * values, times, times * times], axis=1)
+    cumulative = np.concatenate([np.zeros((1, inputs.shape[1])), np.cumsum(inputs, axis=0)])
+    width = len(columns)
+    names = feature_columns(windows, columns)
+    features = np.empty((int(new.sum()), len(names)))
+    # Without history all rows are returned, the window sums are used without a copy
+    new = slice(None) if new.all() else new
+    for w, window in enumerate(windows):
+        lower = np.maximum(rows - window + 1, unit_start)
+        count = (rows - lower + 1).astype(np.float64)[new, None]
+        sums = window_sums(cumulative, lower)[new]
+        sum_x, sum_xx, sum_tx = sums[:, :width], sums[:, width:2 * width], sums[:, 2 * width:3 * width]
+        sum_t, sum_tt = sums[:, -2:-1], sums[:, -1:]
+        mean = sum_x / count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = np.maximum(sum_xx - sum_x * mean, 0) / (count - 1)
+            slope = (count * sum_tx - sum_t * sum_x) / (count * sum_tt - sum_t * sum_t)
+        variance[count[:, 0] < 2] = np.nan
+        slope[count[:, 0] < 2] = np.nan
+        # Columns of a window are ordered column by column, mean, std and slope each
+        block = features[:, w * width * len(STATISTICS):(w + 1) * width * len(STATISTICS)]
+        block[:, 0::3] = mean + center
+        block[:, 1::3] = np.sqrt(variance)
+        block[:, 2::3] = slope
+    result = pd.DataFrame(features, columns=names)
+    result.insert(0, 'cycle', cycle[new])
+    result.insert(0, 'unit', unit[new])
+    return result
@@ -0,0 +1,182 @@
+import sys
+from typing import Optional
+
+import pandas as pd
+from awsglue.utils import getResolvedOptions
+import awswrangler
+
+
+SENSOR_COLUMNS = [f'sensor_{i}' for i in range(1, 22)]
+# Contributions of the predictions written after the ingests, replaced on every prediction rollup
+PREDICTIONS_SOURCE_KEY = 'predictions'
+
+
+def aggregate_sensors(data: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """ Aggregates the timestamped sensor data per unit and time period
+        :argument: data - Pandas DataFrame with curated inference data
+        :argument: freq - Pandas frequency of the rollup period, 'H' for hourly or 'D' for daily
+        :return: rollup - Pandas DataFrame with row count and min/max/mean of each sensor per unit and period
+    """
+    period = pd.to_datetime(data['timestamp']).dt.floor(freq).rename('period')
+    grouped = data.groupby([data['unit'], period])[SENSOR_COLUMNS]
+    rollup = grouped.agg(['min', 'max', 'mean'])
+    rollup.columns = [f'{sensor}_{stat}' for sensor, stat in rollup.columns]
+    rollup['row_count'] = grouped.size()
+    return rollup.reset_index()
+
+def attach_last_rul(rollup: pd.DataFrame, predictions: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """ Adds the last RUL prediction of every unit and period to the rollup
+        :argument: rollup - Pandas DataFrame returned by aggregate_sensors
+        :argument: predictions - Pandas DataFrame with unit, timestamp and predicted_rul columns
+        :argument: freq - Pandas frequency of the rollup period
+        :return: rollup - Pandas DataFrame with last_rul and last_rul_timestamp columns
+    """
+    if predictions.empty:
+        rollup['last_rul'] = float('nan')
+        rollup['last_rul_timestamp'] = pd.NaT
+        return rollup
+    predictions = predictions.sort_values('timestamp')
+    predictions['period'] = pd.to_datetime(predictions['timestamp']).dt.floor(freq)
+    last = predictions.groupby(['unit', 'period']).last()[['predicted_rul', 'timestamp']]
+    last.columns = ['last_rul', 'last_rul_timestamp']
+    return rollup.merge(last, left_on=['unit', 'period'], right_index=True, how='left')
+
+def prediction_rollup(contributions: pd.DataFrame, predictions: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """ Creates rollup rows with only the last RUL prediction of the rolled up units and periods, merged like the
+        rows of another ingest, so predictions written after the ingest reach the rollup
+        :argument: contributions - Pandas DataFrame with the stored rollup rows of the ingests
+        :argument: predictions - Pandas DataFrame with unit, timestamp and predicted_rul columns
+        :argument: freq - Pandas frequency of the rollup period
+        :return: rollup - Pandas DataFrame with zero row_count, empty sensor statistics and last_rul columns
+    """
+    rollup = contributions[['unit', 'period']].drop_duplicates().reset_index(drop=True)
+    rollup['row_count'] = 0
+    for sensor in SENSOR_COLUMNS:
+        for stat in ['min', 'max', 'mean']:
+            rollup[f'{sensor}_{stat}'] = float('nan')
+    rollup = attach_last_rul(rollup, predictions, freq)
+    return rollup.dropna(subset=['last_rul'])
+
+def merge_rollups(combined: pd.DataFrame) -> pd.DataFrame:
+    """ Merges the rollup rows of all ingests of the same unit and period
+        :argument: combined - Pandas DataFrame with the rollup rows contributed by every ingest
+        :return: merged - Pandas DataFrame with one row per unit and period
+    """
+    grouped = combined.groupby(['unit', 'period'])
+    merged = pd.DataFrame({'row_count': grouped['row_count'].sum()})
+    for sensor in SENSOR_COLUMNS:
+        merged[f'{sensor}_min'] = grouped[f'{sensor}_min'].min()
+        merged[f'{sensor}_max'] = grouped[f'{sensor}_max'].max()
+        # Means are merged weighted by the number of rows behind them
+        weighted = (combined[f'{sensor}_mean'] * combined['row_count']).groupby(
+            [combined['unit'], combined['period']]).sum()
+        merged[f'{sensor}_mean'] = weighted / merged['row_count']
+    # Keep the latest RUL prediction seen for the period
+    latest = combined.dropna(subset=['last_rul_timestamp']).sort_values('last_rul_timestamp')
+    latest = latest.groupby(['unit', 'period']).last()[['last_rul', 'last_rul_timestamp']]
+    merged = merged.join(latest, how='left')
+    return merged.reset_index()
+
+def read_dataset(path: str, partition_filter, columns: Optional[list] = None) -> Optional[pd.DataFrame]:
+    """ Reads the partitions of the parquet dataset accepted by the filter
+        :argument: path - S3 prefix of the partitioned dataset
+        :argument: partition_filter - Function of the partition values returning True for partitions to read
+        :argument: columns - List of columns to read, all columns by default
+        :return: data - Pandas DataFrame, None if the dataset has no partition accepted by the filter
+    """
+    # Reading raises NoFilesFound when no partition matches, e.g. the first ingest of a new day
+    try:
+        return awswrangler.s3.read_parquet(path=path, dataset=True, columns=columns, partition_filter=partition_filter)
+    except awswrangler.exceptions.NoFilesFound:
+        return None
+
+
+if __name__ == '__main__':
+    # Run by the ETL state machine for an ingested file, or with the prediction dates of a finished inference job
+    if '--prediction_dates' in sys.argv:
+        args = getResolvedOptions(sys.argv, ['JOB_NAME', 'database_name', 'bucket', 'prediction_dates'])
+        prediction_dates = args['prediction_dates'].split(',')
+        source_key = PREDICTIONS_SOURCE_KEY
+    else:
+        args = getResolvedOptions(sys.argv,
+                                ['JOB_NAME',
+                                'database_name',
+                                'file_key',
+                                'ingest_type',
+                                'file_name',
+                                'bucket'])
+        prediction_dates = None
+        source_key = args['file_key']
+
+    # Predictions of the batch inference jobs, partitioned by prediction date (see shared/python/prediction_sink.py)
+    predictions_path = f"s3://{args['bucket']}/predictions/"
+    if prediction_dates is None:
+        # Define the path to the curated file written by the transform job
+        filename = args['file_name'].replace('.csv', '.parquet')
+        curated_path = f"s3://{args['bucket']}/curated/{args['ingest_type']}/parquet/inference/{filename}"
+        # The Spark transform job writes the file as a folder of part files, so it is read as a prefix
+        curated_data = awswrangler.s3.read_parquet(path=curated_path, path_ignore_suffix='_SUCCESS',
+                                                   columns=['unit', 'timestamp'] + SENSOR_COLUMNS)
+
+    # Define the data schema of the rollup tables
+    data_schema = {"unit": "int", "period": "timestamp", "row_count": "bigint",
+                   "last_rul": "double", "last_rul_timestamp": "timestamp"}
+    for sensor in SENSOR_COLUMNS:
+        for stat in ['min', 'max', 'mean']:
+            data_schema[f'{sensor}_{stat}'] = "double"
+
+    rollups = [('H', 'day', '%Y-%m-%d', "mlops-rollup-hourly", "hourly"),
+               ('D', 'month', '%Y-%m', "mlops-rollup-daily", "daily")]
+    for freq, partition, partition_format, table, name in rollups:
+        path = f"s3://{args['bucket']}/curated/rollups/parquet/{name}/"
+        # Rollup rows of every ingest, keyed by the raw file, so reprocessing a file replaces its rows
+        contributions_path = f"s3://{args['bucket']}/curated/rollups/parquet/{name}_contributions/"
+        if prediction_dates is None:
+            new_rollup = aggregate_sensors(curated_data, freq)
+            new_rollup[partition] = new_rollup['period'].dt.strftime(partition_format)
+            affected = set(new_rollup[partition])
+        else:
+            affected = {pd.Timestamp(date).strftime(partition_format) for date in prediction_dates}
+        contributions = read_dataset(contributions_path, partition_filter=lambda p: p[partition] in affected)
+        if contributions is None:
+            # Partitions rolled up before the contributions were kept count as one earlier ingest
+            contributions = read_dataset(path, partition_filter=lambda p: p[partition] in affected)
+            if contributions is not None:
+                contributions['source_key'] = ''
+        if prediction_dates is None:
+            # Get the predictions of the rolled up periods and stored rollup rows of the affected partitions only,
+            # predictions are written by the inference job after the ingest, so usually none exist yet
+            first_date = new_rollup['period'].min().strftime('%Y-%m-%d')
+            last_date = pd.to_datetime(curated_data['timestamp']).max().strftime('%Y-%m-%d')
+            predictions = read_dataset(predictions_path, columns=['unit', 'timestamp', 'predicted_rul'],
+                                       partition_filter=lambda p: first_date <= p['prediction_date'] <= last_date)
+            if predictions is None:
+                predictions = pd.DataFrame(columns=['unit', 'timestamp', 'predicted_rul'])
+            predictions = predictions[predictions['unit'].isin(new_rollup['unit'])]
+            new_rollup = attach_last_rul(new_rollup, predictions, freq)
+        else:
+            # Nothing was rolled up for the predicted dates yet, the ingest attaches the predictions itself
+            if contributions is None:
+                continue
+            # The prediction rows are rebuilt from all predictions of the affected partitions
+            predictions = read_dataset(predictions_path, columns=['unit', 'timestamp', 'predicted_rul'],
+                                       partition_filter=lambda p: pd.Timestamp(p['prediction_date']).strftime(partition_format) in affected)
+            if predictions is None:
+                predictions = pd.DataFrame(columns=['unit', 'timestamp', 'predicted_rul'])
+            new_rollup = prediction_rollup(contributions, predictions, freq)
+            new_rollup[partition] = new_rollup['period'].dt.strftime(partition_format)
+        new_rollup['source_key'] = source_key
+        if contributions is not None:
+            contributions = contributions[contributions['source_key'] != source_key]
+            contributions = pd.concat([contributions, new_rollup], ignore_index=True)
+        else:
+            contributions = new_rollup
+        rollup = merge_rollups(contributions.drop(columns=[partition, 'source_key']))
+        rollup[partition] = rollup['period'].dt.strftime(partition_format)
+
+        # Rewrite only the affected partitions of the contributions and the rollup table
+        awswrangler.s3.to_parquet(contributions, path=contributions_path, dataset=True, mode='overwrite_partitions',
+                                  partition_cols=[partition], dtype=dict(data_schema, source_key="string"))
+        awswrangler.s3.to_parquet(rollup, path=path, dataset=True, mode='overwrite_partitions',
+                                  partition_cols=[partition], database=args['database_name'], table=table,
+                                  dtype=data_schema)
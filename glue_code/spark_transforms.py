@@ -0,0 +1,197 @@
+import json
+import calendar
+from datetime import datetime
+
+import pandas as pd
+from pyspark.sql import Column, DataFrame, Window
+from pyspark.sql import functions as F
+
+from data_quality import VALUE_RANGES, CHECKS, NULL_VALUE, OUT_OF_RANGE, NON_MONOTONIC, DUPLICATE
+from drift_sketch import QuantileSketch, SKETCH_COLUMNS
+from drift_stats import column_sketch
+from rolling_features import SENSOR_COLUMNS, feature_columns
+
+
+KEY_COLUMNS = ['unit', 'cycle']
+
+
+def name_columns(raw_data: DataFrame, test: bool = False) -> DataFrame:
+    """ Renames the columns of the headerless raw csv like the pandas convert job
+        :argument: raw_data - Spark DataFrame read from the raw csv file
+        :argument: test - True for the test file, where the first extra column holds the RUL
+        :return: named_data - Spark DataFrame with bigint unit and cycle and double settings and sensors
+    """
+    # Define number of sensor columns
+    sensors_number = len(raw_data.columns) - 5
+    column_names = ['unit', 'cycle', 'altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, sensors_number + 1)]
+    if test:
+        column_names[column_names.index('sensor_22')] = 'rul'
+    # Same types as the pandas csv parsing, empty trailing columns are inferred as strings by Spark
+    integer_columns = ['unit', 'cycle', 'rul']
+    return raw_data.toDF(*column_names).select(
+        [F.col(column).cast('bigint' if column in integer_columns else 'double') for column in column_names])
+
+def select_schema(raw_data: DataFrame, schema: dict) -> DataFrame:
+    """ Selects only the columns of the target table, cast to the Athena types of the schema
+        :argument: raw_data - Spark DataFrame read from the raw parquet files
+        :argument: schema - Dictionary of column name to Athena type
+        :return: data - Spark DataFrame with the schema columns
+    """
+    return raw_data.select([F.col(column).cast(column_type) for column, column_type in schema.items()])
+
+def create_target(raw_data: DataFrame) -> DataFrame:
+    """ Creates the RUL target as the difference between the max cycle of the unit and the cycle
+        :argument: raw_data - Spark DataFrame containing training data
+        :return: dataset - Spark DataFrame containing training data and target variable
+    """
+    max_cycle = F.max('cycle').over(Window.partitionBy('unit'))
+    return raw_data.withColumn('rul', (max_cycle - F.col('cycle')).cast('int'))
+
+def add_timestamp(input_data: DataFrame, current_time: datetime) -> DataFrame:
+    """ Adds the simulated timestamps like the pandas transform job, row i of the unit gets the time
+        of unit_length - 1 - i hours before current_time. Rows are numbered in cycle order, the raw
+        files have ascending cycles per unit so this is the file order used by pandas.
+        :argument: input_data - Spark DataFrame with data of all units
+        :argument: current_time - Time of the last cycle, naive in the UTC session time zone
+        :return: timestamp_data - Spark DataFrame with timestamp column
+    """
+    # Get number of rows for one unit
+    unit_length = input_data.filter(F.col('unit') == 1).count()
+    position = F.row_number().over(Window.partitionBy('unit').orderBy('cycle')) - 1
+    seconds = F.lit(calendar.timegm(current_time.timetuple())) - (unit_length - 1 - position) * 3600
+    return input_data.withColumn('timestamp', seconds.cast('timestamp'))
+
+def add_quality_flags(raw_data: DataFrame) -> DataFrame:
+    """ Adds the quality_flags column with the failed check bits of data_quality.quality_flags, the file
+        order of the rows is the order of monotonically_increasing_id as the raw files are read without shuffle
+        :argument: raw_data - Spark DataFrame with the raw columns before the table types are applied
+        :return: flagged_data - Spark DataFrame with the quality_flags column
+    """
+    flags = F.lit(0)
+    for column in raw_data.columns:
+        if column not in VALUE_RANGES:
+            continue
+        low, high = VALUE_RANGES[column]
+        value = F.col(column)
+        flags = flags.bitwiseOR(F.when(value.isNull() | F.isnan(value), NULL_VALUE).otherwise(0))
+        flags = flags.bitwiseOR(F.when((value < low) | (value > high), OUT_OF_RANGE).otherwise(0))
+    # A key seen before in the file is a duplicate, a cycle below the largest earlier cycle of the unit a step back
+    key_order = Window.partitionBy('unit', 'cycle').orderBy('row_id')
+    earlier_rows = Window.partitionBy('unit').orderBy('row_id').rowsBetween(Window.unboundedPreceding, -1)
+    flags = flags.bitwiseOR(F.when(F.row_number().over(key_order) > 1, DUPLICATE).otherwise(0))
+    flags = flags.bitwiseOR(F.when(F.col('cycle') < F.max('cycle').over(earlier_rows), NON_MONOTONIC).otherwise(0))
+    return (raw_data.withColumn('row_id', F.monotonically_increasing_id())
+            .withColumn('quality_flags', flags).drop('row_id'))
+
+def valid_keys() -> Column:
+    """ Returns the condition of rows with a non null unit and cycle in their value ranges like
+        data_quality.valid_keys, quarantined rows with a valid key still count for the RUL target
+        and the timestamps of their unit
+    """
+    condition = F.lit(True)
+    for column in KEY_COLUMNS:
+        low, high = VALUE_RANGES[column]
+        condition = condition & F.col(column).isNotNull() & ~F.isnan(column) & F.col(column).between(low, high)
+    return condition
+
+def drop_quarantined(curated_data: DataFrame, schema: dict) -> DataFrame:
+    """ Drops the quarantined rows once the target and timestamps are created and casts the schema columns
+        to the Athena types, the columns added by the transform are kept
+        :argument: curated_data - Spark DataFrame with the quality_flags column
+        :argument: schema - Dictionary of column name to Athena type
+        :return: data - Spark DataFrame with the rows passing all checks
+    """
+    valid = curated_data.filter(F.col('quality_flags') == 0).drop('quality_flags')
+    return valid.select([F.col(column).cast(schema[column]) if column in schema else F.col(column)
+                         for column in valid.columns])
+
+def quality_report(flagged_data: DataFrame) -> dict:
+    """ Counts the rows failing every check and the failing rows per column in one aggregation
+        :argument: flagged_data - Spark DataFrame returned by add_quality_flags
+        :return: report - Dictionary with rows, quarantined rows and check counts like data_quality.validate
+    """
+    counts = [F.count('*').alias('rows'), F.sum((F.col('quality_flags') != 0).cast('int')).alias('quarantined_rows')]
+    counts += [F.sum(((F.col('quality_flags').bitwiseAND(bit)) != 0).cast('int')).alias(name) for name, bit in CHECKS.items()]
+    columns = [column for column in flagged_data.columns if column in VALUE_RANGES]
+    counts += [F.sum((F.col(column).isNull() | F.isnan(column)).cast('int')).alias(f'null_value:{column}') for column in columns]
+    row = flagged_data.agg(*counts).first().asDict()
+    nulls = {column: row[f'null_value:{column}'] for column in columns if row[f'null_value:{column}']}
+    return {'rows': row['rows'], 'quarantined_rows': row['quarantined_rows'] or 0,
+            'checks': {name: row[name] or 0 for name in CHECKS},
+            'columns': {'null_value': nulls},
+            'null_rates': {column: count / row['rows'] for column, count in nulls.items()}}
+
+def sensor_sketches(data: DataFrame, compression: float = 200) -> dict:
+    """ Builds the sensor sketches like drift_stats.sensor_sketches, every partition is sketched on its worker
+        and only the sketches reach the driver, where they are merged
+        :argument: data - Spark DataFrame with the curated rows
+        :argument: compression - Sketch compression
+        :return: sketches - Dictionary of column name to QuantileSketch
+    """
+    columns = [column for column in SKETCH_COLUMNS if column in data.columns]
+
+    def partition_sketches(batches):
+        sketches = {}
+        for batch in batches:
+            for column in columns:
+                sketch = column_sketch(batch[column].to_numpy(), compression)
+                sketches[column] = sketches[column].merge(sketch) if column in sketches else sketch
+        for column, sketch in sketches.items():
+            yield pd.DataFrame({'column': [column], 'sketch': [json.dumps(sketch.to_dict())]})
+
+    sketches = {column: QuantileSketch(compression=compression) for column in columns}
+    for row in data.select(columns).mapInPandas(partition_sketches, 'column string, sketch string').collect():
+        sketches[row['column']].merge(QuantileSketch.from_dict(json.loads(row['sketch'])))
+    return sketches
+
+def rolling_features(data: DataFrame, windows: list, history: DataFrame = None) -> DataFrame:
+    """ Computes the rolling window features like rolling_features.rolling_features with one window per size
+        over the cycles of every unit, the standard deviation and slope are null below 2 cycles
+        :argument: data - Spark DataFrame with unit, cycle and sensor columns
+        :argument: windows - List of window sizes in cycles
+        :argument: history - Spark DataFrame with the previous cycles of the units, used as the start of the windows
+        :return: features - Spark DataFrame with unit, cycle and the feature columns of the data rows
+    """
+    columns = [column for column in SENSOR_COLUMNS if column in data.columns]
+    rows = data.select(['unit', 'cycle'] + columns).withColumn('new', F.lit(True))
+    if history is not None:
+        # Cycles ingested again replace their stored copy
+        history = history.select(['unit', 'cycle'] + columns).join(rows.select('unit', 'cycle'),
+                                                                    ['unit', 'cycle'], 'left_anti')
+        rows = rows.unionByName(history.withColumn('new', F.lit(False)))
+    cycle = F.col('cycle').cast('double')
+    features = []
+    for window in windows:
+        frame = Window.partitionBy('unit').orderBy('cycle').rowsBetween(-(window - 1), 0)
+        count = F.count(F.lit(1)).over(frame)
+        sum_t, sum_tt = F.sum(cycle).over(frame), F.sum(cycle * cycle).over(frame)
+        for column in columns:
+            sum_x, sum_tx = F.sum(column).over(frame), F.sum(cycle * F.col(column)).over(frame)
+            features += [F.avg(column).over(frame).alias(f"{column}_mean_{window}"),
+                         F.when(count >= 2, F.stddev_samp(column).over(frame)).alias(f"{column}_std_{window}"),
+                         F.when(count >= 2, (count * sum_tx - sum_t * sum_x)
+                                / (count * sum_tt - sum_t * sum_t)).alias(f"{column}_slope_{window}")]
+    features = rows.select('unit', 'cycle', 'new', *features).filter(F.col('new'))
+    return features.select(['unit', 'cycle'] + feature_columns(windows, columns))
+
+def prepare_batch(data: DataFrame, updated_at: datetime) -> DataFrame:
+    """ Prepares the curated rows for the Iceberg upsert like curated_iceberg.prepare_batch
+        :argument: data - Spark DataFrame with curated rows
+        :argument: updated_at - Time of the write, naive UTC
+        :return: batch - Spark DataFrame with one row per key and updated_at column
+    """
+    return data.dropDuplicates(KEY_COLUMNS).withColumn(
+        'updated_at', F.lit(calendar.timegm(updated_at.timetuple())).cast('timestamp'))
+
+def window_tail(data: DataFrame, window_size: int) -> DataFrame:
+    """ Keeps the last window_size cycles of every unit, the only rows the window store needs
+        :argument: data - Spark DataFrame with curated inference data
+        :argument: window_size - Number of cycles kept per unit
+        :return: tail - Spark DataFrame with at most window_size rows per unit
+    """
+    position = F.row_number().over(Window.partitionBy('unit').orderBy(F.col('cycle').desc()))
+    return data.withColumn('position', position).filter(F.col('position') <= window_size).drop('position')
+
+def catalog_types(data: DataFrame) -> dict:
+    """ Returns the Athena column types of the Spark DataFrame, Spark SQL type names are the Hive ones """
+    return dict(data.dtypes)
@@ -1,61 +1,140 @@
 import sys
-from datetime import datetime, timedelta
+import json
+from datetime import datetime
 
 import time
+import boto3
+import numpy as np
 import pandas as pd
 from awsglue.utils import getResolvedOptions
 import awswrangler
 
+from window_store import DynamoWindowStore
+from curated_iceberg import ICEBERG_TABLES, PARTITIONING, FEATURE_TABLES, FEATURE_PARTITIONING, upsert
+from data_quality import check_schema, validate, valid_keys, write_report
+from drift_stats import sensor_sketches, write_sketches
+from training_matrices import publish_matrices
+from rolling_features import parse_windows, rolling_features
+from pipeline_timing import SpanEmitter
+from job_profiler import JobProfiler, profile_output
+
+
+# Pandas types of the Athena column types, applied when reading the raw data
+PANDAS_TYPES = {"int": "int32", "bigint": "int64", "double": "float64"}
+
+
+def read_raw(path: str, schema: dict) -> pd.DataFrame:
+    """ Reads only the columns of the target table from the raw parquet file, the table types are applied
+        with apply_schema after the rows are validated
+        :argument: path - S3 path of the raw parquet file
+        :argument: schema - Dictionary of column name to Athena type of the columns to read
+        :return: raw_data - Pandas DataFrame with the schema columns
+    """
+    return awswrangler.s3.read_parquet(path=[path], columns=list(schema))
+
+def apply_schema(raw_data: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """ Types the columns with the table schema, without copying columns already of the type """
+    return raw_data.astype({column: PANDAS_TYPES[column_type] for column, column_type in schema.items()}, copy=False)
 
 def add_timestamp(input_data: pd.DataFrame) -> pd.DataFrame:
     """ Adds simulated timestamp the the ingested data to replicate 
-        real life scenario
-        :argument: splitted_data - Pandas Dataframe with data of 24 cycle split with all units
+        real life scenario, the column is added in place
+        :argument: input_data - Pandas Dataframe with data of 24 cycle split with all units
         :return: timestamp_data - Pandas Dataframe with timestamps for 24 cycle for all units
     """
-    splitted_data = input_data.copy()
-    current_time = datetime.now()
-    time_list = []
+    current_time = pd.Timestamp(datetime.now().replace(microsecond=0))
+    # Keep the rows of every unit together, in order of the first appearance of the unit
+    unit_codes = pd.factorize(input_data['unit'])[0]
+    if not pd.Index(unit_codes).is_monotonic_increasing:
+        input_data = input_data.take(np.argsort(unit_codes, kind='stable'))
     # Get number of rows for one unit
-    unit_length = len(splitted_data[splitted_data['unit']==1])
-    # Iterate over the length of one unit
-    for i in range(unit_length):
-        # Calculate new time based on difference of current row
-        new_time = current_time - timedelta(hours=i)
-        # Append the new time as string in list
-        time_list.append(new_time.strftime('%Y-%m-%d %H:%M:%S'))
-    # Reverse the time list so that current time is last in unit
-    time_list.reverse()
-    timestamp_data_list = []
-    # Iterate over all units
-    for unit in splitted_data['unit'].unique():
-        # Get rows only for the specified unit
-        unit_splitted = splitted_data[splitted_data['unit']==unit]
-        end_unit = len(unit_splitted)
-        # Add the reversed timestamps as additional column
-        unit_splitted.loc[:, 'timestamp'] = time_list[:end_unit]
-        # Append new dataframe for specified unit
-        timestamp_data_list.append(unit_splitted)
-    # Concatenate all dataframes of specified units into one dataframe
-    timestamp_data = pd.concat(timestamp_data_list)
-    return timestamp_data
+    unit_length = int((input_data['unit'] == 1).sum())
+    # Row i of the unit gets the time of unit_length - 1 - i hours ago, so current time is last in unit
+    position = input_data.groupby('unit', sort=False).cumcount().to_numpy()
+    input_data['timestamp'] = current_time - pd.to_timedelta(unit_length - 1 - position, unit='h')
+    return input_data
 
 def create_target(raw_data: pd.DataFrame) -> pd.DataFrame:
-    """ Creates the RUL target variable based on max cycles from the dataset 
+    """ Creates the RUL target variable based on max cycles from the dataset, 
+        the column is added in place
         :argument: raw_data - Pandas DataFrame containing training data
         :return: dataset - Pandas DataFrame containing training data and target variable
     """
-    data = raw_data.copy()
-    # Group the data by unit column and calculate the max cycle
-    grouped = data.groupby('unit')
-    max_cycle = grouped['cycle'].max()
-    # Merge the max cycle back to the data
-    data = data.merge(max_cycle.to_frame(name='max_cycle'), left_on='unit', right_index=True)
-    # Calculate difference between max cycle and current cycle, create RUL
-    data['rul'] = data['max_cycle'] - data['cycle']
-    # Drop the max cycle column
-    data.drop('max_cycle', axis=1, inplace=True)
-    return data
+    # Calculate difference between max cycle of the unit and current cycle, create RUL
+    raw_data['rul'] = raw_data.groupby('unit')['cycle'].transform('max') - raw_data['cycle']
+    return raw_data
+
+def validate_raw(raw_data: pd.DataFrame, schema_problems: list, max_bad_rate: float, bucket: str,
+                 execution_id: str, quarantine_path: str) -> tuple:
+    """ Validates the raw rows and writes the quality report, bad rows are written to the quarantine path
+        :argument: raw_data - Pandas DataFrame returned by read_raw, None if the schema check failed
+        :argument: schema_problems - List returned by data_quality.check_schema
+        :argument: max_bad_rate - Maximum share of bad rows before the whole file is rejected
+        :argument: bucket - Name of the storage bucket
+        :argument: execution_id - Name of the Step Functions execution
+        :argument: quarantine_path - S3 path of the parquet file with the quarantined rows
+        :return: valid_data - Pandas DataFrame with the rows passing all checks
+        :return: report - Dictionary with the written quality report
+    """
+    if schema_problems:
+        valid_data, quarantined = None, None
+        report = {'rows': None, 'quarantined_rows': None, 'status': 'rejected', 'schema': schema_problems}
+    else:
+        valid_data, quarantined, report = validate(raw_data, max_bad_rate)
+    report = write_report(bucket, execution_id, report, quarantined, quarantine_path)
+    # A rejected file fails the execution, it gets no processed files ledger entry
+    if report['status'] == 'rejected':
+        raise ValueError(f"Data quality check rejected the file: {json.dumps(report)}")
+    return valid_data, report
+
+def write_summary(bucket: str, execution_id: str, table: str, ingest_type: str, 
+                  file_key: str, rows_written: int, mode: str, upsert_result: dict = None,
+                  quality: dict = None, drift_sketch: str = None, matrices: str = None,
+                  trace_id: str = None) -> dict:
+    """ Writes the row counts of the processed file for the ETL completion event
+        :argument: bucket - Name of the storage bucket
+        :argument: execution_id - Name of the Step Functions execution
+        :argument: table - Name of the written curated table
+        :argument: ingest_type - Defines if data ingested is a whole dataset or part of it
+        :argument: file_key - S3 path to the ingested raw file
+        :argument: rows_written - Number of rows written to the table
+        :argument: mode - Write mode of the table, 'append' or 'overwrite', 'upsert' for partitioned Iceberg writes
+        :argument: upsert_result - Dictionary returned by the Iceberg upsert, with the table rows and snapshot
+        :argument: quality - Dictionary with the data quality report of the file
+        :argument: drift_sketch - S3 key of the sensor sketches of the ingest
+        :argument: matrices - S3 prefix of the training matrices of the ingest
+        :argument: trace_id - Correlation ID of the timing spans, continued by the jobs using the ingest
+        :return: summary - Dictionary with the table row counts and delta
+    """
+    s3 = boto3.client('s3')
+    latest_key = f"etl/summaries/latest/{table}.json"
+    # Get the total rows of the table after the previous run
+    try:
+        previous_rows = json.loads(s3.get_object(Bucket=bucket, Key=latest_key)['Body'].read())['total_rows']
+    except s3.exceptions.NoSuchKey:
+        previous_rows = 0
+    if upsert_result is not None:
+        total_rows = upsert_result['total_rows']
+    else:
+        total_rows = rows_written if mode == 'overwrite' else previous_rows + rows_written
+    summary = {'table': table, 'ingest_type': ingest_type, 'file_key': file_key, 'execution_id': execution_id,
+               'rows_written': rows_written, 'total_rows': total_rows, 'row_delta': total_rows - previous_rows,
+               'trace_id': trace_id, 'finished_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+    # The snapshot of the write pins reads of the Iceberg table to this run with time travel
+    if upsert_result is not None:
+        summary['iceberg_table'] = upsert_result['table']
+        summary['snapshot_id'] = upsert_result['snapshot_id']
+    if quality is not None:
+        summary['quarantined_rows'] = quality['quarantined_rows']
+        summary['quality_report'] = quality['report_key']
+    if drift_sketch is not None:
+        summary['drift_sketch'] = drift_sketch
+    if matrices is not None:
+        summary['training_matrices'] = matrices
+    body = json.dumps(summary).encode('utf-8')
+    s3.put_object(Bucket=bucket, Key=f"etl/summaries/{execution_id}.json", Body=body)
+    s3.put_object(Bucket=bucket, Key=latest_key, Body=body)
+    return summary
 
 
 if __name__ == '__main__':
@@ -66,7 +145,27 @@ if __name__ == '__main__':
                             'file_key',
                             'ingest_type',
                             'file_name',
-                            'bucket'])
+                            'bucket',
+                            'window_table',
+                            'window_size',
+                            'execution_id',
+                            'trace_id',
+                            'submitted_at',
+                            'profile',
+                            'profile_bucket',
+                            'curated_format',
+                            'athena_workgroup',
+                            'quality_max_bad_rate',
+                            'feature_windows'])
+    # Define the timing spans of the job phases
+    timing = SpanEmitter(sink='cloudwatch')
+    trace_id = args['trace_id']
+    timing.emit_since(trace_id, 'transform_startup', args['submitted_at'])
+    # Define the opt-in profiler of the job phases
+    profiler = JobProfiler(mode=args['profile'],
+                           output=profile_output(args['profile_bucket'], args['execution_id'], 'transform'))
+    # Incremental features of a unit need the previous cycles kept by the window store
+    feature_windows = parse_windows(args['feature_windows'], max_window=int(args['window_size']))
 
     # Define the path to the raw parquet file
     file_key = args['file_key'].replace('/csv/', '/parquet/').replace('.csv', '.parquet')
@@ -74,40 +173,125 @@ if __name__ == '__main__':
     filename = args['file_name'].replace('.csv', '.parquet')
 
     # Check if object exists
-    exists = awswrangler.s3.does_object_exist(f"s3://{args['bucket']}/{file_key}")
-    while not exists:
+    with timing.span(trace_id, 'transform_wait'):
         exists = awswrangler.s3.does_object_exist(f"s3://{args['bucket']}/{file_key}")
-        time.sleep(30)
-    # Get the raw parquet data
-    raw_data = awswrangler.s3.read_parquet(path=[f"s3://{args['bucket']}/{file_key}"])
-
+        while not exists:
+            exists = awswrangler.s3.does_object_exist(f"s3://{args['bucket']}/{file_key}")
+            time.sleep(30)
     # Define the data schema for Athena table
     data_schema = {"unit": "int", "cycle": "int", "altitude": "double", "mach": "double", "tra": "double"}
     for i in range(1, 22):
         data_schema[f'sensor_{i}'] = "double"
+    # Test data has the RUL from the raw file, train data gets it created
+    if ingest_type != 'partitioned' and 'test' in filename:
+        data_schema['rul'] = 'int'
+
+    # Get only the raw parquet columns of the target table, files not matching the schema are not read
+    raw_path = f"s3://{args['bucket']}/{file_key}"
+    with timing.span(trace_id, 'transform_read'), profiler.section('read'):
+        schema_problems = check_schema(awswrangler.s3.read_parquet_metadata(path=[raw_path])[0], data_schema)
+        raw_data = None if schema_problems else read_raw(raw_path, data_schema)
     
-    if ingest_type == 'partitioned':
-        mode = 'append'
-        curated_data = add_timestamp(raw_data)
-        data_schema['timestamp'] = "timestamp"
-        table = "mlops-curated-inference-data"
-        path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/inference"
-    else:
-        mode = 'overwrite'
-        if 'test' in filename:
-            curated_data = raw_data.copy()
-            table = "mlops-curated-test-data"
-            path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/test"
-            data_schema['rul'] = 'int'
+    # Validate the raw rows in one vectorized pass, bad rows are held back in the quarantine prefix
+    with timing.span(trace_id, 'transform_validate'), profiler.section('validate'):
+        valid_data, quality = validate_raw(raw_data, schema_problems, float(args['quality_max_bad_rate']),
+                                           bucket=args['bucket'], execution_id=args['execution_id'],
+                                           quarantine_path=f"s3://{args['bucket']}/quarantine/{ingest_type}/"
+                                                           f"{args['execution_id']}/{filename}")
+        # The target and timestamps are created on all rows with a valid key, so quarantined rows do not shift
+        # the RUL and timestamps of the kept rows of their unit, the quarantined rows are dropped afterwards
+        raw_data = raw_data[valid_keys(raw_data)].copy() if quality['quarantined_rows'] else valid_data
+    
+    with timing.span(trace_id, 'transform_transform'), profiler.section('transform'):
+        if ingest_type == 'partitioned':
+            mode = 'append'
+            curated_data = add_timestamp(raw_data)
+            data_schema['timestamp'] = "timestamp"
+            dataset = 'inference'
+            table = "mlops-curated-inference-data"
+            path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/inference"
+        else:
+            mode = 'overwrite'
+            if 'test' in filename:
+                curated_data = raw_data
+                dataset = 'test'
+                table = "mlops-curated-test-data"
+                path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/test"
+            else:
+                curated_data = create_target(raw_data)
+                dataset = 'train'
+                table = "mlops-curated-train-data"
+                path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/train"
+                data_schema['rul'] = 'int'
+        if quality['quarantined_rows']:
+            curated_data = curated_data[curated_data.index.isin(valid_data.index)]
+        curated_data = apply_schema(curated_data, {column: column_type for column, column_type in data_schema.items()
+                                                   if column_type in PANDAS_TYPES})
+
+    # Upsert transformed data into the Iceberg table on (unit, cycle), or save it to the parquet table,
+    # total ingests replace the Iceberg table rows like the parquet overwrite
+    upsert_result = None
+    with timing.span(trace_id, 'transform_write', rows=len(curated_data)), profiler.section('write'):
+        if args['curated_format'] == 'iceberg':
+            mode = 'upsert' if ingest_type == 'partitioned' else 'overwrite'
+            upsert_result = upsert(curated_data, database=args['database_name'], table=ICEBERG_TABLES[dataset],
+                                   schema=data_schema, location=f"s3://{args['bucket']}/curated/iceberg/{dataset}/",
+                                   partitioning=PARTITIONING[dataset],
+                                   staging_path=f"s3://{args['bucket']}/curated/iceberg/staging/",
+                                   workgroup=args['athena_workgroup'], replace=ingest_type != 'partitioned')
+            upsert_result['table'] = ICEBERG_TABLES[dataset]
         else:
-            curated_data = create_target(raw_data)
-            table = "mlops-curated-train-data"
-            path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/train"
-            data_schema['rul'] = 'int'
-
-    # Save transformed data to parquet format
-    awswrangler.s3.to_parquet(curated_data, path=path, dataset=True, mode=mode, compression=None, 
-                                database=args['database_name'], table=table, dtype=data_schema)
+            awswrangler.s3.to_parquet(curated_data, path=path, dataset=True, mode=mode, compression=None, 
+                                        database=args['database_name'], table=table, dtype=data_schema)
+        
+        # The file of the ingest is kept for the rollup job
+        file_path = path + f"/{filename}"
+        awswrangler.s3.to_parquet(curated_data, path=file_path)
+    
+    # Compute the rolling window features per unit, inference batches continue the windows of the previous
+    # batch from the trailing cycles in the window store, read before the store gets the new cycles
+    with timing.span(trace_id, 'transform_features'), profiler.section('features'):
+        history = None
+        if ingest_type == 'partitioned':
+            window_store = DynamoWindowStore(table_name=args['window_table'], window_size=int(args['window_size']))
+            history = window_store.get_frame([int(unit) for unit in curated_data['unit'].unique()])
+        features = rolling_features(curated_data, feature_windows, history=history)
+        features_schema = {'unit': 'int', 'cycle': 'int'}
+        features_schema.update({column: 'double' for column in features.columns[2:]})
+        # Reprocessed files replace their feature rows like the curated rows instead of appending them again
+        if args['curated_format'] == 'iceberg':
+            upsert(features, database=args['database_name'], table=FEATURE_TABLES[dataset], schema=features_schema,
+                   location=f"s3://{args['bucket']}/curated/iceberg/{dataset}_features/",
+                   partitioning=FEATURE_PARTITIONING, staging_path=f"s3://{args['bucket']}/curated/iceberg/staging/",
+                   workgroup=args['athena_workgroup'], replace=ingest_type != 'partitioned')
+        else:
+            # Partitioned by the source file, so a reprocessed file overwrites only its own rows
+            awswrangler.s3.to_parquet(features.assign(source_file=filename), path=f"{path}_features", dataset=True,
+                                      mode='overwrite_partitions' if ingest_type == 'partitioned' else 'overwrite',
+                                      compression=None, partition_cols=['source_file'],
+                                      database=args['database_name'], table=f"mlops-curated-{dataset}-features",
+                                      dtype=dict(features_schema, source_file='string'))
+    
+    # Keep the online windows of the last cycles per unit up to date
+    if ingest_type == 'partitioned':
+        with profiler.section('window_store'):
+            window_store.update(curated_data)
+    
+    # Keep the mergeable sensor sketches of the ingest, train data replaces the drift baseline
+    drift_sketch = None
+    if dataset in ['inference', 'train']:
+        with timing.span(trace_id, 'transform_sketch'), profiler.section('sketch'):
+            drift_sketch = write_sketches(args['bucket'], dataset, args['execution_id'], sensor_sketches(curated_data))
+    
+    # Publish the float32 training matrices of total ingests, the trainer memory-maps them instead of parsing parquet
+    matrices = None
+    if dataset in ['train', 'test']:
+        with timing.span(trace_id, 'transform_matrices'), profiler.section('matrices'):
+            matrices = publish_matrices(curated_data, args['bucket'], dataset, args['execution_id'])
     
-    file_path = path + f"/{filename}"
-    awswrangler.s3.to_parquet(curated_data, path=file_path)
+    # Write the row counts used by the ETL completion event
+    write_summary(bucket=args['bucket'], execution_id=args['execution_id'], table=table, ingest_type=ingest_type,
+                  file_key=args['file_key'], rows_written=len(curated_data), mode=mode, upsert_result=upsert_result,
+                  quality=quality, drift_sketch=drift_sketch, matrices=matrices, trace_id=trace_id)
+    timing.flush()
+    profiler.save()
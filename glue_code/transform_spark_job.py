@@ -0,0 +1,231 @@
+import sys
+import json
+import time
+from datetime import datetime
+
+import awswrangler
+from awsglue.utils import getResolvedOptions
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql import functions as F
+
+from spark_transforms import (create_target, add_timestamp, prepare_batch, window_tail, catalog_types, add_quality_flags,
+                              valid_keys, drop_quarantined, quality_report, sensor_sketches, rolling_features)
+from data_quality import check_schema, report_status, write_report
+from transform_job import write_summary
+from drift_stats import write_sketches
+from training_matrices import FEATURE_COLUMNS, TARGET_COLUMN, publish_matrices
+from rolling_features import SENSOR_COLUMNS, parse_windows
+from window_store import DynamoWindowStore
+from curated_iceberg import ICEBERG_TABLES, PARTITIONING, FEATURE_TABLES, FEATURE_PARTITIONING, merge_staged, staging_names
+from pipeline_timing import SpanEmitter
+from job_profiler import JobProfiler, profile_output
+
+
+def upsert(data: DataFrame, database: str, table: str, location: str, partitioning: str, staging_path: str,
+           workgroup: str, replace: bool = False) -> dict:
+    """ Upserts the rows into the Iceberg table on (unit, cycle) like curated_iceberg.upsert, the batch is
+        staged with Spark as a plain parquet table to MERGE from
+        :argument: data - Spark DataFrame with the rows
+        :argument: database - Name of the Glue database
+        :argument: table - Name of the Iceberg table
+        :argument: location - S3 location of the Iceberg table
+        :argument: partitioning - Iceberg partition transform
+        :argument: staging_path - S3 prefix for the staged rows
+        :argument: workgroup - Athena workgroup with engine version 3
+        :argument: replace - Replaces all rows of the table when True, e.g. for total ingests
+        :return: result - Dictionary with total rows and the new snapshot ID
+    """
+    batch = prepare_batch(data, datetime.utcnow())
+    staging_table, staging_location = staging_names(table, staging_path)
+    batch.write.mode('overwrite').parquet(staging_location)
+    awswrangler.catalog.create_parquet_table(database=database, table=staging_table, path=staging_location,
+                                             columns_types=catalog_types(batch))
+    return merge_staged(database, table, catalog_types(batch), location=location, partitioning=partitioning,
+                        staging_table=staging_table, staging_location=staging_location, workgroup=workgroup,
+                        replace=replace)
+
+
+# Get the Arguments
+args = getResolvedOptions(sys.argv,
+                        ['JOB_NAME',
+                        'database_name',
+                        'file_key',
+                        'ingest_type',
+                        'file_name',
+                        'bucket',
+                        'window_table',
+                        'window_size',
+                        'execution_id',
+                        'trace_id',
+                        'submitted_at',
+                        'profile',
+                        'profile_bucket',
+                        'curated_format',
+                        'athena_workgroup',
+                        'quality_max_bad_rate',
+                        'feature_windows',
+                        'matrices_max_rows'])
+# Define the timing spans of the job phases
+timing = SpanEmitter(sink='cloudwatch')
+trace_id = args['trace_id']
+timing.emit_since(trace_id, 'transform_startup', args['submitted_at'])
+# Define the opt-in profiler of the job phases, only the driver is profiled
+profiler = JobProfiler(mode=args['profile'],
+                       output=profile_output(args['profile_bucket'], args['execution_id'], 'transform'))
+# Incremental features of a unit need the previous cycles kept by the window store
+feature_windows = parse_windows(args['feature_windows'], max_window=int(args['window_size']))
+spark = (SparkSession.builder.config('spark.sql.session.timeZone', 'UTC')
+         .config('spark.sql.execution.arrow.pyspark.enabled', 'true').getOrCreate())
+
+# Define the path to the raw parquet folder written by the Spark convert job
+file_key = args['file_key'].replace('/csv/', '/parquet/').replace('.csv', '.parquet')
+ingest_type = args['ingest_type']
+filename = args['file_name'].replace('.csv', '.parquet')
+
+# Check if the convert job finished writing the folder
+with timing.span(trace_id, 'transform_wait'):
+    while not awswrangler.s3.does_object_exist(f"s3://{args['bucket']}/{file_key}/_SUCCESS"):
+        time.sleep(30)
+# Define the data schema for Athena table
+data_schema = {"unit": "int", "cycle": "int", "altitude": "double", "mach": "double", "tra": "double"}
+for i in range(1, 22):
+    data_schema[f'sensor_{i}'] = "double"
+# Test data has the RUL from the raw file, train data gets it created
+if ingest_type != 'partitioned' and 'test' in filename:
+    data_schema['rul'] = 'int'
+
+# Get the raw parquet folder, files not matching the schema of the target table are rejected
+with timing.span(trace_id, 'transform_read'), profiler.section('read'):
+    raw_data = spark.read.parquet(f"s3://{args['bucket']}/{file_key}")
+    schema_problems = check_schema(dict(raw_data.dtypes), data_schema)
+
+# Validate the raw rows, bad rows are held back in the quarantine prefix like in the pandas job
+quarantine_path = f"s3://{args['bucket']}/quarantine/{ingest_type}/{args['execution_id']}/{filename}"
+with timing.span(trace_id, 'transform_validate'), profiler.section('validate'):
+    if schema_problems:
+        quality = {'rows': None, 'quarantined_rows': None, 'status': 'rejected', 'schema': schema_problems}
+    else:
+        # The flags are used by the report, the quarantine and the valid rows, keep them on the workers
+        raw_data = add_quality_flags(raw_data.select(list(data_schema))).cache()
+        quality = quality_report(raw_data)
+        quality['status'] = report_status(quality['rows'], quality['quarantined_rows'],
+                                          float(args['quality_max_bad_rate']))
+        if quality['quarantined_rows']:
+            raw_data.filter(raw_data['quality_flags'] != 0).write.mode('overwrite').parquet(quarantine_path)
+            quality['quarantine_path'] = quarantine_path
+    quality = write_report(args['bucket'], args['execution_id'], quality, None, quarantine_path)
+    # A rejected file fails the execution, it gets no processed files ledger entry
+    if quality['status'] == 'rejected':
+        raise ValueError(f"Data quality check rejected the file: {json.dumps(quality)}")
+    # The target and timestamps are created on all rows with a valid key, so quarantined rows do not shift
+    # the RUL and timestamps of the kept rows of their unit, the quarantined rows are dropped afterwards
+    raw_data = raw_data.filter(valid_keys())
+
+with timing.span(trace_id, 'transform_transform'), profiler.section('transform'):
+    if ingest_type == 'partitioned':
+        mode = 'append'
+        curated_data = add_timestamp(raw_data, datetime.utcnow().replace(microsecond=0))
+        dataset = 'inference'
+        table = "mlops-curated-inference-data"
+        path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/inference"
+    else:
+        mode = 'overwrite'
+        if 'test' in filename:
+            curated_data = raw_data
+            dataset = 'test'
+            table = "mlops-curated-test-data"
+            path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/test"
+        else:
+            curated_data = create_target(raw_data)
+            dataset = 'train'
+            table = "mlops-curated-train-data"
+            path = f"s3://{args['bucket']}/curated/{ingest_type}/parquet/train"
+    # The curated data is written more than once, keep it on the workers
+    curated_data = drop_quarantined(curated_data, data_schema).cache()
+    rows_written = curated_data.count()
+    # The training matrices are built on the driver, fail before anything is written if they would not fit
+    if dataset in ['train', 'test'] and rows_written > int(args['matrices_max_rows']):
+        raise ValueError(f"{rows_written} rows exceed the {args['matrices_max_rows']} rows of the training matrices "
+                         f"built on the driver, raise --matrices_max_rows with a larger worker type")
+
+# Upsert transformed data into the Iceberg table on (unit, cycle), or save it to the parquet table,
+# total ingests replace the Iceberg table rows like the parquet overwrite
+upsert_result = None
+with timing.span(trace_id, 'transform_write', rows=rows_written), profiler.section('write'):
+    if args['curated_format'] == 'iceberg':
+        mode = 'upsert' if ingest_type == 'partitioned' else 'overwrite'
+        upsert_result = upsert(curated_data, args['database_name'], ICEBERG_TABLES[dataset],
+                               location=f"s3://{args['bucket']}/curated/iceberg/{dataset}/",
+                               partitioning=PARTITIONING[dataset],
+                               staging_path=f"s3://{args['bucket']}/curated/iceberg/staging/",
+                               workgroup=args['athena_workgroup'], replace=ingest_type != 'partitioned')
+        upsert_result['table'] = ICEBERG_TABLES[dataset]
+    else:
+        curated_data.write.mode(mode).parquet(path)
+        awswrangler.catalog.create_parquet_table(database=args['database_name'], table=table, path=path,
+                                                 columns_types=catalog_types(curated_data), mode='overwrite')
+
+    # The file of the ingest is kept for the rollup job
+    curated_data.write.mode('overwrite').parquet(path + f"/{filename}")
+
+# Compute the rolling window features per unit, inference batches continue the windows of the previous
+# batch from the trailing cycles in the window store, read before the store gets the new cycles
+with timing.span(trace_id, 'transform_features'), profiler.section('features'):
+    history = None
+    if ingest_type == 'partitioned':
+        window_store = DynamoWindowStore(table_name=args['window_table'], window_size=int(args['window_size']))
+        units = [row['unit'] for row in curated_data.select('unit').distinct().collect()]
+        stored = window_store.get_frame(units)
+        if len(stored):
+            stored = stored[['unit', 'cycle'] + SENSOR_COLUMNS].astype('float64')
+            stored = stored.astype({'unit': 'int32', 'cycle': 'int32'})
+            history = spark.createDataFrame(stored)
+    features = rolling_features(curated_data, feature_windows, history=history)
+    # Reprocessed files replace their feature rows like the curated rows instead of appending them again
+    if args['curated_format'] == 'iceberg':
+        upsert(features, args['database_name'], FEATURE_TABLES[dataset],
+               location=f"s3://{args['bucket']}/curated/iceberg/{dataset}_features/",
+               partitioning=FEATURE_PARTITIONING, staging_path=f"s3://{args['bucket']}/curated/iceberg/staging/",
+               workgroup=args['athena_workgroup'], replace=ingest_type != 'partitioned')
+    else:
+        # Partitioned by the source file, the dynamic overwrite replaces only the partition of a reprocessed file
+        features_path = f"{path}_features"
+        features_table = f"mlops-curated-{dataset}-features"
+        writer = features.withColumn('source_file', F.lit(filename)).write.mode('overwrite').partitionBy('source_file')
+        if ingest_type == 'partitioned':
+            writer = writer.option('partitionOverwriteMode', 'dynamic')
+        writer.parquet(features_path)
+        # The catalog keeps the partitions of earlier files, total ingests recreate the table
+        awswrangler.catalog.create_parquet_table(database=args['database_name'], table=features_table,
+                                                 path=features_path, columns_types=catalog_types(features),
+                                                 partitions_types={'source_file': 'string'},
+                                                 mode='append' if ingest_type == 'partitioned' else 'overwrite')
+        awswrangler.catalog.add_parquet_partitions(database=args['database_name'], table=features_table,
+                                                   partitions_values={f"{features_path}/source_file={filename}/": [filename]})
+
+# Keep the online windows of the last cycles per unit up to date, only the window tail reaches the driver
+if ingest_type == 'partitioned':
+    with profiler.section('window_store'):
+        window_store.update(window_tail(curated_data, int(args['window_size'])).toPandas())
+
+# Keep the mergeable sensor sketches of the ingest, train data replaces the drift baseline
+drift_sketch = None
+if dataset in ['inference', 'train']:
+    with timing.span(trace_id, 'transform_sketch'), profiler.section('sketch'):
+        drift_sketch = write_sketches(args['bucket'], dataset, args['execution_id'], sensor_sketches(curated_data))
+
+# Publish the float32 training matrices of total ingests, the trainer loads the whole dataset on one instance and
+# the rows are bounded by --matrices_max_rows, only the matrix columns reach the driver, already as float32
+matrices = None
+if dataset in ['train', 'test']:
+    with timing.span(trace_id, 'transform_matrices'), profiler.section('matrices'):
+        columns = [column for column in FEATURE_COLUMNS + [TARGET_COLUMN] if column in curated_data.columns]
+        matrix_data = curated_data.select(['unit'] + [F.col(column).cast('float') for column in columns]).toPandas()
+        matrices = publish_matrices(matrix_data, args['bucket'], dataset, args['execution_id'])
+
+# Write the row counts used by the ETL completion event
+write_summary(bucket=args['bucket'], execution_id=args['execution_id'], table=table, ingest_type=ingest_type,
+              file_key=args['file_key'], rows_written=rows_written, mode=mode, upsert_result=upsert_result,
+              quality=quality, drift_sketch=drift_sketch, matrices=matrices, trace_id=trace_id)
+timing.flush()
+profiler.save()
@@ -0,0 +1,142 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+
+import boto3
+import numpy as np
+import pandas as pd
+
+
+WINDOW_COLUMNS = ['cycle', 'altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, 22)]
+
+
+def encode_window(window: np.ndarray) -> bytes:
+    """ Encodes the window of cycles as contiguous float32 bytes
+        :argument: window - Numpy array with one row per cycle and one column per WINDOW_COLUMNS entry
+        :return: data - Bytes of the window
+    """
+    return np.ascontiguousarray(window, dtype=np.float32).tobytes()
+
+def decode_window(data: bytes, columns_number: int) -> np.ndarray:
+    """ Decodes the window of cycles from float32 bytes
+        :argument: data - Bytes returned by encode_window
+        :argument: columns_number - Number of columns of the window
+        :return: window - Numpy array with one row per cycle
+    """
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, columns_number)
+
+def append_window(existing: Optional[np.ndarray], new: np.ndarray, window_size: int) -> np.ndarray:
+    """ Appends the new cycles to the stored window and keeps only the last window_size cycles
+        :argument: existing - Stored window of the unit or None
+        :argument: new - Numpy array with new cycles of the unit, sorted by cycle
+        :argument: window_size - Maximum number of cycles kept per unit
+        :return: window - Numpy array with the updated window
+    """
+    if existing is not None and len(existing):
+        # Skip cycles already in the window when the same data is ingested again
+        new = new[new[:, 0] > existing[-1, 0]]
+        new = np.concatenate([existing, new])
+    return new[-window_size:]
+
+
+class WindowStore(ABC):
+    """ Per unit ring buffer of the last cycles, stored as one compact item per unit """
+    def __init__(self, window_size: int, columns: list = None):
+        self.window_size = window_size
+        self.columns = columns or WINDOW_COLUMNS
+
+    @abstractmethod
+    def get_items(self, units: list) -> dict:
+        """ Fetches the encoded windows of the units
+            :argument: units - List of unit numbers
+            :return: items - Dictionary of unit number to window bytes, missing units are left out
+        """
+
+    @abstractmethod
+    def put_items(self, items: dict) -> None:
+        """ Stores the encoded windows of the units
+            :argument: items - Dictionary of unit number to window bytes
+            :return: None
+        """
+
+    def get_windows(self, units: list) -> dict:
+        """ Fetches the stored windows of the units
+            :argument: units - List of unit numbers
+            :return: windows - Dictionary of unit number to Numpy array window, missing units are left out
+        """
+        return {unit: decode_window(data, len(self.columns)) for unit, data in self.get_items(units).items()}
+
+    def get_frame(self, units: list) -> pd.DataFrame:
+        """ Fetches the stored windows of the units as one DataFrame
+            :argument: units - List of unit numbers
+            :return: frame - Pandas DataFrame with unit and WINDOW_COLUMNS columns
+        """
+        windows = self.get_windows(units)
+        if not windows:
+            return pd.DataFrame(columns=['unit'] + self.columns)
+        # One frame over all windows, the per unit frames dominated the time of large batches
+        frame = pd.DataFrame(np.concatenate(list(windows.values())), columns=self.columns)
+        frame.insert(0, 'unit', np.repeat(list(windows), [len(window) for window in windows.values()]))
+        return frame
+
+    def update(self, data: pd.DataFrame) -> int:
+        """ Appends the ingested cycles to the windows of their units
+            :argument: data - Pandas DataFrame with unit and WINDOW_COLUMNS columns
+            :return: units_number - Number of updated units
+        """
+        # Only the last window_size cycles of every unit can end up in the store
+        tail = data.sort_values(['unit', 'cycle']).groupby('unit').tail(self.window_size)
+        units = tail['unit'].to_numpy()
+        values = tail[self.columns].to_numpy(dtype=np.float32)
+        unique_units, starts = np.unique(units, return_index=True)
+        ends = np.append(starts[1:], len(units))
+        existing = self.get_windows([int(unit) for unit in unique_units])
+        items = {}
+        for unit, start, end in zip(unique_units, starts, ends):
+            window = append_window(existing.get(int(unit)), values[start:end], self.window_size)
+            items[int(unit)] = encode_window(window)
+        self.put_items(items)
+        return len(items)
+
+
+class DynamoWindowStore(WindowStore):
+    """ Window store backed by the DynamoDB table with unit as partition key """
+    def __init__(self, table_name: str, window_size: int, columns: list = None):
+        super().__init__(window_size, columns)
+        self.table_name = table_name
+        self.dynamodb = boto3.resource('dynamodb')
+
+    def get_items(self, units: list) -> dict:
+        items = {}
+        # BatchGetItem accepts at most 100 keys per call
+        for i in range(0, len(units), 100):
+            request = {self.table_name: {'Keys': [{'unit': unit} for unit in units[i:i + 100]],
+                                         'ProjectionExpression': '#unit, #window',
+                                         'ExpressionAttributeNames': {'#unit': 'unit', '#window': 'window'}}}
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    items[int(item['unit'])] = item['window'].value
+                request = response.get('UnprocessedKeys')
+        return items
+
+    def put_items(self, items: dict) -> None:
+        updated_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        table = self.dynamodb.Table(self.table_name)
+        with table.batch_writer() as batch:
+            for unit, data in items.items():
+                batch.put_item(Item={'unit': unit, 'window': data, 'columns': ','.join(self.columns),
+                                     'updated_at': updated_at})
+
+
+class LocalWindowStore(WindowStore):
+    """ In-memory stand-in of the DynamoDB window store for local runs and benchmarks """
+    def __init__(self, window_size: int, columns: list = None):
+        super().__init__(window_size, columns)
+        self.items = {}
+
+    def get_items(self, units: list) -> dict:
+        return {unit: self.items[unit] for unit in units if unit in self.items}
+
+    def put_items(self, items: dict) -> None:
+        self.items.update(items)
@@ -1,40 +1,108 @@
 import json
+import time
 import boto3
 from datetime import datetime
 import os
 
-def start_etl(bucket: str, file_key: str, ingest_type: str, file_name: str) -> dict:
-    """ Starts the Step Functions tasks for ETL process 
+from pipeline_timing import SpanEmitter, trace_id_for
+from raw_manifest import is_processed, list_unprocessed, normalize_etag
+from admission import AdmissionController, SqsAdmissionQueue, running_executions
+
+timing = SpanEmitter(sink='emf')
+
+def ingest_type_of(file_key: str) -> str:
+    """ Returns 'total' for files landed in raw/total/, otherwise 'partitioned' """
+    if file_key.split('/', 2)[1] == 'total':
+        return 'total'
+    return 'partitioned'
+
+def etl_input(bucket: str, file_key: str, etag: str, trace_id: str) -> dict:
+    """ Creates the ETL state machine input of the raw file
         :argument: bucket - Name of the S3 bucket where data lands
         :argument: file_key - S3 path to the file that lands in bucket
-        :argument: ingest_type - Defines if data ingested is a whole dataset or part of it
+        :argument: etag - ETag of the landed object, recorded in the processed files ledger
+        :argument: trace_id - Correlation ID of the timing spans of all pipeline stages
+        :return: input_parameters - Dictionary with the state machine input
+    """
+    return {"bucket": bucket, "file_key": file_key, "etag": normalize_etag(etag),
+            "ingest_type": ingest_type_of(file_key), 'file_name': file_key.rsplit('/')[-1],
+            "database_name": os.environ['GlueDatabaseName'],
+            "trace_id": trace_id,
+            "profile": os.environ.get('ProfileMode', 'off'),
+            "engine": os.environ.get('ETLEngine', 'pandas'),
+            "spark_worker_type": os.environ.get('SparkWorkerType', 'G.1X'),
+            "spark_max_workers": int(os.environ.get('SparkMaxWorkers', 10)),
+            "--additional-python-modules": 'awswrangler'}
+
+def start_etl(input_parameters: dict) -> dict:
+    """ Starts the Step Functions tasks for ETL process 
+        :argument: input_parameters - Dictionary returned by etl_input
         :return: execution_response - dictionary containing info about started SF execution
     """
     step_functions = boto3.client('stepfunctions')
     current_time = datetime.now().strftime("%y-%m-%d-%H-%M-%S")
-    # Define parameters for Step Function
-    input_parameters = {"bucket": bucket, "file_key": file_key, 
-                        "ingest_type": ingest_type, 'file_name': file_name,
-                        "database_name": os.environ['GlueDatabaseName'],
-                        "--additional-python-modules": 'awswrangler'}
-    # Start the Step Function
+    # Start the Step Function, queued files are started together so the name includes the trace ID
     execution_response = step_functions.start_execution(stateMachineArn=os.environ['StateMachineArn'],
-                                                        name=f"ETL-{current_time}",
+                                                        name=f"ETL-{current_time}-{input_parameters['trace_id'][:8]}",
                                                         input=json.dumps(input_parameters))
     return execution_response
 
+def admission_controller() -> AdmissionController:
+    """ Creates the admission controller keeping at most MaxConcurrentExecutions ETL executions running,
+        the Glue Jobs allow as many concurrent runs
+    """
+    return AdmissionController(name='etl', queue=SqsAdmissionQueue(os.environ['AdmissionQueueUrl']),
+                               limit=int(os.environ.get('MaxConcurrentExecutions', 4)),
+                               running=lambda: running_executions(os.environ['StateMachineArn']))
+
+def start_catch_up(bucket: str) -> dict:
+    """ Queues all raw files without a ledger entry for their current ETag on the admission queue, so the catch-up
+        executions count against MaxConcurrentExecutions like the executions of landed files
+        :argument: bucket - Name of the storage bucket
+        :return: result - Dictionary with the number of queued and started files
+    """
+    limit = int(os.environ.get('CatchUpBatchSize', 200))
+    unprocessed = list_unprocessed(bucket, limit=limit + 1)
+    if not unprocessed:
+        return {'files': 0, 'started': 0, 'remaining': False}
+    # Files are queued in landing order and dispatched once, the rest start as running executions finish.
+    # The next catch-up run picks up the files above the batch size
+    admission = admission_controller()
+    for file_key, etag in unprocessed[:limit]:
+        admission.queue.send(etl_input(bucket, file_key, etag, trace_id_for(bucket, file_key)))
+    started = admission.dispatch(start_etl)
+    return {'files': min(len(unprocessed), limit), 'started': len(started), 'remaining': len(unprocessed) > limit}
+
 def lambda_handler(event, context):
     """ Function invoked by the AWS Lambda """
+    start = time.perf_counter()
+    # Invoked with {"action": "catch_up", "bucket": ...} to process every unprocessed raw file in one run
+    if event.get('action') == 'catch_up':
+        result = start_catch_up(event.get('bucket', os.environ.get('StorageBucketName')))
+        print(json.dumps(result))
+        return {'status_code': 200, 'body': json.dumps(result)}
+    # Invoked by finished ETL executions and the dispatch schedule to start queued files
+    if event.get('action') == 'dispatch' or event.get('source') == 'aws.states':
+        started = admission_controller().dispatch(start_etl)
+        return {'status_code': 200, 'body': f'Started {len(started)} queued ETL processes'}
     s3_info = event['Records'][0]['s3']
     # Get Bucket name and file path
     bucket = s3_info['bucket']['name']
     file_key = s3_info['object']['key']
-    # Get name of the file 
-    file_name = file_key.rsplit('/')[-1]
-    if file_key.split('/', 2)[1] == 'total':
-        ingest_type = 'total'
-    else:
-        ingest_type = 'partitioned'
-    # Start ETL Step Function process
-    response = start_etl(bucket=bucket, file_key=file_key, ingest_type=ingest_type, file_name=file_name)
+    trace_id = trace_id_for(bucket, file_key)
+    # Time from the object landing until the handler started
+    timing.emit_since(trace_id, 'landing_to_lambda', event['Records'][0]['eventTime'], file_key=file_key)
+    # Skip versions of the file already processed, e.g. the same content uploaded again
+    etag = s3_info['object'].get('eTag') or boto3.client('s3').head_object(Bucket=bucket, Key=file_key)['ETag']
+    if is_processed(bucket, file_key, etag):
+        return {'status_code': 200, 'body': f'Skipped already processed {file_key}'}
+    # Queue the ETL Step Function process, it starts now unless the concurrency limit is reached
+    admission = admission_controller().submit(etl_input(bucket=bucket, file_key=file_key, etag=etag, trace_id=trace_id),
+                                              start=start_etl)
+    if admission['queued']:
+        timing.emit(trace_id, 'etl_lambda', time.perf_counter() - start, file_key=file_key,
+                    message_id=admission['message_id'])
+        return {'status_code': 200, 'body': 'Queued ETL process'}
+    timing.emit(trace_id, 'etl_lambda', time.perf_counter() - start, file_key=file_key,
+                execution_arn=admission['result']['executionArn'])
     return {'status_code': 200, 'body': 'Successfully started ETL process'}
\ No newline at end of file
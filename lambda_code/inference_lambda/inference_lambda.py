@@ -1,9 +1,16 @@
 import json
+import time
+import uuid
 from typing import Optional
+import urllib.parse
+import urllib.request
 import boto3
 from datetime import datetime
 import os
 
+from pipeline_timing import SpanEmitter
+from admission import AdmissionController, SqsAdmissionQueue, running_sagemaker_jobs
+
 
 def get_latest_image() -> str:
     """ Filter images and return the latest pushed one in ECR Repository
@@ -86,25 +93,260 @@ def schedule_rule(cron: str, action: str = 'create') -> str:
         delete_response = events.delete_rule(Name=rule_name)
         return f'Successfully delete Rule: {rule_name}'
 
-def start_inference(image_tag: str, parameters: dict) -> dict:
+def resolve_model_version(model_name: str, version: str = None, stage: str = 'Production') -> dict:
+    """ Resolves the registered model to the pinned version through the MLflow REST API
+        :argument: model_name - Name of the registered model in MLflow
+        :argument: version - Specific model version, if None the latest version in stage is used
+        :argument: stage - Model stage used when version is not given
+        :return: model_version - Dictionary with name, version, run_id and source artifact URI
+    """
+    tracking_uri = os.environ['MLflowTrackingUri']
+    if version is not None:
+        query = urllib.parse.urlencode({'name': model_name, 'version': version})
+        request = urllib.request.Request(f"{tracking_uri}/api/2.0/mlflow/model-versions/get?{query}")
+    else:
+        payload = json.dumps({'name': model_name, 'stages': [stage]}).encode('utf-8')
+        request = urllib.request.Request(f"{tracking_uri}/api/2.0/mlflow/registered-models/get-latest-versions",
+                                         data=payload, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        content = json.loads(response.read().decode('utf-8'))
+    if version is not None:
+        model_version = content['model_version']
+    else:
+        if not content.get('model_versions'):
+            raise ValueError(f"No version of model {model_name} found in stage {stage}")
+        model_version = content['model_versions'][0]
+    if not model_version['source'].startswith('s3://'):
+        raise ValueError(f"Model source {model_version['source']} is not an S3 artifact URI")
+    return {'name': model_version['name'], 'version': model_version['version'],
+            'run_id': model_version['run_id'], 'source': model_version['source']}
+
+def stage_model_artifacts(model_version: dict) -> dict:
+    """ Copies the model artifacts into the cache prefix keyed by model version and run, 
+        already staged versions are reused without copying
+        :argument: model_version - Dictionary returned by resolve_model_version
+        :return: staged - Dictionary with cache URI and cache hit flag
+    """
+    s3 = boto3.client('s3')
+    cache_bucket = os.environ['ArtifactsBucket']
+    cache_prefix = f"model-cache/{model_version['name']}/{model_version['version']}/{model_version['run_id']}"
+    marker_key = f"{cache_prefix}/_STAGED"
+    cache_uri = f"s3://{cache_bucket}/{cache_prefix}/model/"
+    # Marker is written last, so its presence means the copy is complete
+    try:
+        s3.head_object(Bucket=cache_bucket, Key=marker_key)
+        return {'uri': cache_uri, 'cache_hit': True}
+    except s3.exceptions.ClientError as error:
+        # Only a missing marker means the version is not staged yet, e.g. throttling or denied access is raised
+        if error.response['Error']['Code'] not in ['404', 'NoSuchKey']:
+            raise
+    source_bucket, source_prefix = model_version['source'][len('s3://'):].split('/', 1)
+    source_prefix = source_prefix.rstrip('/') + '/'
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=source_bucket, Prefix=source_prefix):
+        for item in page.get('Contents', []):
+            relative_key = item['Key'][len(source_prefix):]
+            s3.copy_object(Bucket=cache_bucket, Key=f"{cache_prefix}/model/{relative_key}",
+                           CopySource={'Bucket': source_bucket, 'Key': item['Key']})
+    s3.put_object(Bucket=cache_bucket, Key=marker_key, Body=json.dumps(model_version).encode('utf-8'))
+    return {'uri': cache_uri, 'cache_hit': False}
+
+def inference_trace_id(trace_id: Optional[str] = None) -> str:
+    """ Returns the correlation ID of the inference timing spans, the one of the latest inference data ingest
+        unless a trace ID is requested, so the inference spans join the ETL spans of the scored data
+        :argument: trace_id - Requested correlation ID, e.g. TraceId of the start request
+        :return: trace_id - Correlation ID passed to the inference job as TraceId
+    """
+    if trace_id:
+        return trace_id
+    s3 = boto3.client('s3')
+    try:
+        latest = s3.get_object(Bucket=os.environ['StorageBucketName'],
+                               Key="etl/summaries/latest/mlops-curated-inference-data.json")
+        trace_id = json.loads(latest['Body'].read()).get('trace_id')
+    except s3.exceptions.NoSuchKey:
+        trace_id = None
+    # Without an inference data ingest the inference starts a trace of its own
+    return trace_id or uuid.uuid4().hex[:16]
+
+def curated_snapshots() -> dict:
+    """ Gets the snapshot range of the curated inference Iceberg table read by the inference job, from the snapshot
+        consumed by the last completed inference job up to the snapshot of the latest inference data ingest
+        :argument: None
+        :return: environment - Dictionary with CuratedTable, ToSnapshotId and FromSnapshotId for the container,
+                               empty without an Iceberg ingest
+    """
+    s3 = boto3.client('s3')
+    try:
+        latest = s3.get_object(Bucket=os.environ['StorageBucketName'],
+                               Key="etl/summaries/latest/mlops-curated-inference-data.json")
+        latest = json.loads(latest['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+    if latest.get('snapshot_id') is None:
+        return {}
+    environment = {'CuratedTable': latest['iceberg_table'], 'ToSnapshotId': str(latest['snapshot_id'])}
+    # Without a consumed snapshot the job reads all rows of the latest snapshot
+    try:
+        consumed = s3.get_object(Bucket=os.environ['StorageBucketName'], Key=os.environ['CuratedSnapshotKey'])
+        environment['FromSnapshotId'] = str(json.loads(consumed['Body'].read())['snapshot_id'])
+    except s3.exceptions.NoSuchKey:
+        pass
+    return environment
+
+def record_consumed_snapshot(job_name: str) -> Optional[str]:
+    """ Records the snapshot read by the completed inference job, so the next inference job reads the rows
+        written after it. Jobs finishing out of order do not move the consumed snapshot back
+        :argument: job_name - Name of the finished Processing Job
+        :return: snapshot_id - Recorded snapshot ID, None if the job did not complete or read no snapshot
+    """
+    sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+    job = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+    snapshot_id = job.get('Environment', {}).get('ToSnapshotId')
+    if job['ProcessingJobStatus'] != 'Completed' or snapshot_id is None:
+        return None
+    s3 = boto3.client('s3')
+    created_at = job['CreationTime'].isoformat()
+    try:
+        consumed = s3.get_object(Bucket=os.environ['StorageBucketName'], Key=os.environ['CuratedSnapshotKey'])
+        if json.loads(consumed['Body'].read())['created_at'] > created_at:
+            return None
+    except s3.exceptions.NoSuchKey:
+        pass
+    s3.put_object(Bucket=os.environ['StorageBucketName'], Key=os.environ['CuratedSnapshotKey'],
+                  Body=json.dumps({'snapshot_id': snapshot_id, 'job_name': job_name,
+                                   'created_at': created_at}).encode('utf-8'))
+    return snapshot_id
+
+def prediction_dates(job_name: str) -> list:
+    """ Lists the prediction dates written by the inference job, the sink names its files after the job
+        :argument: job_name - Name of the finished Processing Job
+        :return: dates - Sorted list of prediction dates as YYYY-MM-DD
+    """
+    s3 = boto3.client('s3')
+    dates = set()
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=os.environ['PredictionsBucket'], Prefix=f"{os.environ['PredictionsPrefix']}/"):
+        for item in page.get('Contents', []):
+            partition, file_name = item['Key'].split('/')[-2:]
+            if file_name.startswith(f"{job_name}-") and partition.startswith('prediction_date='):
+                dates.add(partition.split('=', 1)[1])
+    return sorted(dates)
+
+def start_prediction_rollup(job_name: str) -> Optional[dict]:
+    """ Starts the rollup of the prediction dates of the completed inference job, so the rollups of the ingested
+        data get the last RUL predictions written after the ingest
+        :argument: job_name - Name of the completed Processing Job
+        :return: execution_response - Information about the started execution, None if the job wrote no predictions
+    """
+    dates = prediction_dates(job_name)
+    if not dates:
+        return None
+    step_functions = boto3.client('stepfunctions')
+    return step_functions.start_execution(stateMachineArn=os.environ['PredictionRollupStateMachineArn'],
+                                          name=f"prediction-rollup-{job_name}",
+                                          input=json.dumps({'prediction_dates': ','.join(dates),
+                                                            'database_name': os.environ['GlueDatabaseName'],
+                                                            'bucket': os.environ['PredictionsBucket']}))
+
+def prepare_model(parameters: dict) -> dict:
+    """ Resolves and stages the model used by the inference job and reports the time spent
+        :argument: parameters - Dictionary with ModelName and optional ModelVersion/ModelStage
+        :return: model - Dictionary with pinned version, cache URI and timings in seconds
+    """
+    start = time.perf_counter()
+    model = resolve_model_version(parameters['ModelName'], version=parameters.get('ModelVersion', None),
+                                  stage=parameters.get('ModelStage', 'Production'))
+    resolved = time.perf_counter()
+    model.update(stage_model_artifacts(model))
+    model['resolve_seconds'] = resolved - start
+    model['staging_seconds'] = time.perf_counter() - resolved
+    return model
+
+def publish_model_load_metrics(job_name: str, model: dict, trace_id: str) -> None:
+    """ Publishes the model resolve and staging time of the inference job as CloudWatch metrics, the load
+        time inside the job is published by the container with model_loading.load_model_from_environment
+        :argument: job_name - Name of the started Processing Job
+        :argument: model - Dictionary returned by prepare_model
+        :argument: trace_id - Correlation ID of the inference timing spans
+        :return: None
+    """
+    cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
+    dimensions = [{'Name': 'ModelName', 'Value': model['name']}]
+    cloudwatch.put_metric_data(Namespace='MLOps/Inference', MetricData=[
+        {'MetricName': 'ModelResolveSeconds', 'Dimensions': dimensions, 'Value': model['resolve_seconds'], 'Unit': 'Seconds'},
+        {'MetricName': 'ModelStagingSeconds', 'Dimensions': dimensions, 'Value': model['staging_seconds'], 'Unit': 'Seconds'},
+        {'MetricName': 'ModelCacheHit', 'Dimensions': dimensions, 'Value': int(model['cache_hit']), 'Unit': 'Count'}
+    ])
+    # The spans log the per job timings so they can be queried by job name
+    timing = SpanEmitter(sink='emf')
+    properties = {'job_name': job_name, 'model_name': model['name'], 'model_version': model['version'],
+                  'cache_hit': model['cache_hit']}
+    timing.emit(trace_id, 'model_resolve', model['resolve_seconds'], **properties)
+    timing.emit(trace_id, 'model_staging', model['staging_seconds'], **properties)
+
+def publish_job_spans(job_name: str) -> dict:
+    """ Publishes the start-up and run spans of the finished inference job as pipeline stage timings
+        :argument: job_name - Name of the finished Processing Job
+        :return: spans - Dictionary of stage name to duration in seconds
+    """
+    sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+    job = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+    # The trace ID is passed to the job by the Lambda, jobs started without one are traced by their name
+    trace_id = job.get('Environment', {}).get('TraceId', job_name)
+    timing = SpanEmitter(sink='emf')
+    spans = {}
+    # Processing Jobs do not report provisioning separately, so queue and image pull count as start-up
+    if 'ProcessingStartTime' in job:
+        spans['inference_startup'] = (job['ProcessingStartTime'] - job['CreationTime']).total_seconds()
+        if 'ProcessingEndTime' in job:
+            spans['inference_run'] = (job['ProcessingEndTime'] - job['ProcessingStartTime']).total_seconds()
+    for stage, seconds in spans.items():
+        timing.emit(trace_id, stage, seconds, status=job['ProcessingJobStatus'], job_name=job_name)
+    return spans
+
+def start_inference(image_tag: str, parameters: dict, model: dict) -> dict:
     """ Starts the Sagemaker Processing Job as Inference compute service with specific image tag 
         :argument: image_tag - Tag of the Image in the ECR Repository
+        :argument: parameters - Dictionary with parameters passed as environment to the container
+        :argument: model - Dictionary returned by prepare_model with the staged model artifacts
         :return: response - Information about the started Processing Job
     """
     sagemaker = boto3.client("sagemaker", region_name='us-east-1')
     current_time = datetime.now().strftime("%y-%m-%d-%H-%M-%S")
-    job_name = f"model-inference-{current_time}"
+    # Inferences admitted in the same second get distinct names
+    job_name = f"model-inference-{current_time}-{uuid.uuid4().hex[:8]}"
     image = os.environ['ImageUri'] + ':' + image_tag
     environment = {}
     for name, value in parameters.items():
         environment[name] = value
+    # Pin the resolved model so the container loads it from local disk instead of through MLflow
+    environment['ModelVersion'] = model['version']
+    environment['ModelRunId'] = model['run_id']
+    environment['ModelSourceUri'] = model['source']
+    environment['ModelArtifactPath'] = "/opt/ml/processing/model"
+    # Predictions are written with prediction_sink under the output path and uploaded at the end of the job
+    environment['ProcessingJobName'] = job_name
+    environment['PredictionOutputPath'] = "/opt/ml/processing/predictions"
+    environment['PredictionSinkPath'] = "/opt/ml/processing/sink"
+    environment['PredictionCopyEnabled'] = os.environ['PredictionCopyEnabled']
+    environment['GrafanaDBSecretArn'] = os.environ['GrafanaDBSecretArn']
+    environment['GrafanaDBHost'] = os.environ['GrafanaDBHost']
+    environment['GrafanaDatabase'] = os.environ['GrafanaDatabase']
+    # The container reads the curated rows written since the last completed inference with
+    # curated_iceberg.changes_from_environment, shipped next to the prediction sink
+    curated = curated_snapshots()
+    if curated:
+        environment.update(curated)
+        environment['CuratedDatabase'] = os.environ['GlueDatabaseName']
+        environment['AthenaWorkgroup'] = os.environ['AthenaWorkgroup']
     # Define the Sagemaker Processing Job parameters
     response = sagemaker.create_processing_job(ProcessingJobName=job_name,
                                                ProcessingResources={
                                                    'ClusterConfig': {
-                                                       'InstanceCount': 1,
-                                                       'InstanceType': 'ml.t3.medium',
-                                                       'VolumeSizeInGB': 30
+                                                       'InstanceCount': int(os.environ['InferenceInstanceCount']),
+                                                       'InstanceType': os.environ['InferenceInstanceType'],
+                                                       'VolumeSizeInGB': int(os.environ['InferenceVolumeSizeInGB'])
                                                    }
                                                },
                                                AppSpecification={
@@ -113,6 +355,40 @@ def start_inference(image_tag: str, parameters: dict) -> dict:
                                                        "python3", "inference/predict.py"
                                                    ]
                                                },
+                                               ProcessingInputs=[
+                                                   {
+                                                       'InputName': 'model',
+                                                       'S3Input': {
+                                                           'S3Uri': model['uri'],
+                                                           'LocalPath': "/opt/ml/processing/model",
+                                                           'S3DataType': 'S3Prefix',
+                                                           'S3InputMode': 'File',
+                                                           'S3DataDistributionType': 'FullyReplicated'
+                                                       }
+                                                   },
+                                                   {
+                                                       'InputName': 'sink',
+                                                       'S3Input': {
+                                                           'S3Uri': os.environ['PredictionSinkUri'],
+                                                           'LocalPath': "/opt/ml/processing/sink",
+                                                           'S3DataType': 'S3Prefix',
+                                                           'S3InputMode': 'File',
+                                                           'S3DataDistributionType': 'FullyReplicated'
+                                                       }
+                                                   }
+                                               ],
+                                               ProcessingOutputConfig={
+                                                   'Outputs': [
+                                                       {
+                                                           'OutputName': 'predictions',
+                                                           'S3Output': {
+                                                               'S3Uri': f"s3://{os.environ['PredictionsBucket']}/{os.environ['PredictionsPrefix']}",
+                                                               'LocalPath': "/opt/ml/processing/predictions",
+                                                               'S3UploadMode': 'EndOfJob'
+                                                           }
+                                                       }
+                                                   ]
+                                               },
                                                NetworkConfig={
                                                    'VpcConfig': {
                                                        'SecurityGroupIds': [os.environ['SecurityGroupId']],
@@ -133,6 +409,34 @@ def start_inference(image_tag: str, parameters: dict) -> dict:
                                                Environment=environment)
     return response
 
+def admission_controller() -> AdmissionController:
+    """ Creates the admission controller keeping at most MaxConcurrentInferenceJobs inference jobs running,
+        starts rejected by the SageMaker instance quotas stay queued
+    """
+    return AdmissionController(name='inference', queue=SqsAdmissionQueue(os.environ['AdmissionQueueUrl']),
+                               limit=int(os.environ.get('MaxConcurrentInferenceJobs', 2)),
+                               running=lambda: running_sagemaker_jobs('model-inference-'))
+
+def start_queued_inference(payload: dict) -> dict:
+    """ Starts the inference of the admission queue message with the model staged when it was queued """
+    response = start_inference(image_tag=payload['ImageTag'], parameters=payload['Parameters'], model=payload['Model'])
+    job_name = response['ProcessingJobArn'].split('/')[-1]
+    publish_model_load_metrics(job_name, payload['Model'], payload['Parameters'].get('TraceId', job_name))
+    return response
+
+def admit_inference(image_tag: str, parameters: dict, model: dict) -> Optional[str]:
+    """ Queues the inference and starts it right away when fewer than MaxConcurrentInferenceJobs jobs run
+        :argument: image_tag - Tag of the Image in the ECR Repository
+        :argument: parameters - Dictionary with parameters passed as environment to the container
+        :argument: model - Dictionary returned by prepare_model with the staged model artifacts
+        :return: job_name - Name of the started Processing Job, None if the inference was queued
+    """
+    admission = admission_controller().submit({'ImageTag': image_tag, 'Parameters': parameters, 'Model': model},
+                                              start=start_queued_inference)
+    if admission['queued']:
+        return None
+    return admission['result']['ProcessingJobArn'].split('/')[-1]
+
 def construct_response(body: dict, status_code: int) -> dict:
     """ Constructs API Response 
         :argument: body - Content of the response body
@@ -155,11 +459,21 @@ def lambda_handler(event, context):
         image_tag = body.get('ImageTag', None)
         if image_tag is None:
             image_tag = get_latest_image()
-        job_info = start_inference(image_tag=image_tag, parameters=body)
-        response = {'Message': 'Inference successfully started!'}
+        body['TraceId'] = inference_trace_id(body.get('TraceId', None))
+        model = prepare_model(body)
+        job_name = admit_inference(image_tag=image_tag, parameters=body, model=model)
+        if job_name is None:
+            # Started by the dispatch once a running inference job finished
+            response = {'Message': 'Inference queued, the concurrent inference jobs limit is reached'}
+        else:
+            response = {'Message': 'Inference successfully started!'}
         response['ImageTag'] = image_tag
         response['ModelName'] = body['ModelName']
-        return construct_response(response, 200)
+        response['ModelVersion'] = model['version']
+        response['ModelCacheHit'] = model['cache_hit']
+        response['ModelStagingSeconds'] = model['resolve_seconds'] + model['staging_seconds']
+        response['TraceId'] = body['TraceId']
+        return construct_response(response, 200 if job_name else 202)
     elif api_resource == '/inference_schedule':
         # Get parameters dictionary
         body = json.loads(event['body'])
@@ -175,6 +489,21 @@ def lambda_handler(event, context):
         message = schedule_rule(cron, action)
         response = {'Message': message}
         return construct_response(response, 200)
+    elif event.get('source') == 'aws.sagemaker':
+        # If triggered by the finished inference job, publish its phase spans and record the snapshot it read
+        job_name = event['detail']['ProcessingJobName']
+        publish_job_spans(job_name)
+        record_consumed_snapshot(job_name)
+        # The rollups of the ingested data were written before the predictions of the completed job existed
+        if event['detail']['ProcessingJobStatus'] == 'Completed':
+            start_prediction_rollup(job_name)
+        # The finished job freed capacity for a queued inference
+        admission_controller().dispatch(start_queued_inference)
+        return {'status_code': 200, 'body': f'Successfully published spans for {job_name}'}
+    elif event.get('source') == 'mlops.admission':
+        # If triggered by the dispatch schedule, start queued inferences whose retry delay passed
+        started = admission_controller().dispatch(start_queued_inference)
+        return {'status_code': 200, 'body': f'Started {len(started)} queued inferences'}
     else:
         # If triggered by a Cron schedule
         resource = event['resources'][0]
@@ -184,5 +513,7 @@ def lambda_handler(event, context):
         image_tag = parameters.get('ImageTag', None)
         if image_tag is None:
             image_tag = get_latest_image()
-        job_info = start_inference(image_tag=image_tag, parameters=parameters)
+        parameters['TraceId'] = inference_trace_id()
+        model = prepare_model(parameters)
+        admit_inference(image_tag=image_tag, parameters=parameters, model=model)
         return {'status_code': 200, 'body': 'Successfully started training on schedule with latest image'}
\ No newline at end of file
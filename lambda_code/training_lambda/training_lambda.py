@@ -1,9 +1,20 @@
 import json
+import uuid
 from typing import Optional
 import boto3
 from datetime import datetime
 import os
 
+from admission import AdmissionController, SqsAdmissionQueue, running_sagemaker_jobs
+from drift_sketch import BASELINE_KEY, QuantileSketch, compare, emit_drift_metrics, read_json, window_sketches, write_json
+
+# Checkpoint directory of the spot training container, synchronized with the checkpoint S3 location
+CHECKPOINT_PATH = '/opt/ml/checkpoints'
+# Container environment set by the launcher on top of the training parameters
+LAUNCHER_ENVIRONMENT = ['ImageTag', 'CheckpointPath', 'TrainMatricesPath', 'TestMatricesPath', 'MatricesLoaderPath']
+# Item of the retraining state table shared by the data and drift triggered retraining
+RETRAINING_STATE_KEY = {'name': 'retraining'}
+
 def get_latest_image() -> str:
     """ Filter images and return the latest pushed one in ECR Repository
         :argument: None
@@ -87,6 +98,60 @@ def schedule_rule(cron: str, action: str = 'create') -> str:
         return f'Successfully delete Rule: {rule_name}'
 
 
+def matrices_inputs() -> dict:
+    """ Gets the S3 prefixes of the latest training matrices written by the transform job and of their loader
+        :argument: None
+        :return: inputs - Dictionary of input name to S3 prefix, empty if the matrices were not built yet
+    """
+    s3 = boto3.client('s3')
+    inputs = {}
+    for dataset in ['train', 'test']:
+        try:
+            latest = s3.get_object(Bucket=os.environ['StorageBucketName'],
+                                   Key=f"curated/total/matrices/{dataset}/latest.json")
+        except s3.exceptions.NoSuchKey:
+            continue
+        inputs[f"{dataset}_matrices"] = json.loads(latest['Body'].read())['uri']
+    if inputs:
+        inputs['matrices_loader'] = os.environ['TrainingMatricesLoaderUri']
+    return inputs
+
+def matrices_path_name(input_name: str) -> str:
+    """ Returns the container environment variable with the local path of the input, e.g. TrainMatricesPath """
+    return f"{input_name.title().replace('_', '')}Path"
+
+def matrices_processing_inputs(environment: dict) -> list:
+    """ Creates the Processing Inputs of the training matrices for a Processing Job, the local paths are added
+        to the container environment
+        :argument: environment - Dictionary with the container environment, updated in place
+        :return: inputs - List with the ProcessingInputs argument, empty if there are no matrices
+    """
+    # Processing Jobs download every input to its LocalPath
+    inputs = []
+    for input_name, uri in matrices_inputs().items():
+        local_path = f"/opt/ml/processing/{input_name}"
+        environment[matrices_path_name(input_name)] = local_path
+        inputs.append({'InputName': input_name,
+                       'S3Input': {'S3Uri': uri, 'LocalPath': local_path, 'S3DataType': 'S3Prefix',
+                                   'S3InputMode': 'File', 'S3DataDistributionType': 'FullyReplicated'}})
+    return inputs
+
+def matrices_channels(environment: dict) -> dict:
+    """ Creates the input channels of the training matrices for a Training Job, the local paths are added
+        to the container environment
+        :argument: environment - Dictionary with the container environment, updated in place
+        :return: optional - Dictionary with the InputDataConfig argument, empty if there are no matrices
+    """
+    # Training Jobs download every channel to /opt/ml/input/data/<channel>
+    channels = []
+    for input_name, uri in matrices_inputs().items():
+        environment[matrices_path_name(input_name)] = f"/opt/ml/input/data/{input_name}"
+        channels.append({'ChannelName': input_name, 'InputMode': 'File',
+                         'DataSource': {'S3DataSource': {'S3DataType': 'S3Prefix', 'S3Uri': uri,
+                                                         'S3DataDistributionType': 'FullyReplicated'}}})
+    # InputDataConfig needs at least one channel when given
+    return {'InputDataConfig': channels} if channels else {}
+
 def start_training(image_tag: str, parameters: dict) -> dict:
     """ Starts the Sagemaker Processing Job as training compute service with specific image tag 
         :argument: image_tag - Tag of the Image in the ECR Repository
@@ -94,18 +159,22 @@ def start_training(image_tag: str, parameters: dict) -> dict:
     """
     sagemaker = boto3.client("sagemaker", region_name='us-east-1')
     current_time = datetime.now().strftime("%y-%m-%d-%H-%M-%S")
-    job_name = f"model-training-{current_time}"
+    # Jobs started in the same second get distinct names
+    job_name = f"model-training-{current_time}-{uuid.uuid4().hex[:8]}"
     image = os.environ['ImageUri'] + ':' + image_tag
     environment = {'ImageTag': image_tag}
     for name, value in parameters.items():
         environment[name] = value
+    # The trainer memory-maps the matrices with training_matrices.load_matrices instead of reading the parquet table
+    inputs = matrices_processing_inputs(environment)
     # Define the Sagemaker Processing Job parameters
     response = sagemaker.create_processing_job(ProcessingJobName=job_name,
+                                               ProcessingInputs=inputs,
                                                ProcessingResources={
                                                    'ClusterConfig': {
-                                                       'InstanceCount': 1,
-                                                       'InstanceType': 'ml.c5.2xlarge',
-                                                       'VolumeSizeInGB': 30
+                                                       'InstanceCount': int(os.environ['TrainingInstanceCount']),
+                                                       'InstanceType': os.environ['TrainingInstanceType'],
+                                                       'VolumeSizeInGB': int(os.environ['TrainingVolumeSizeInGB'])
                                                    }
                                                },
                                                AppSpecification={
@@ -134,6 +203,387 @@ def start_training(image_tag: str, parameters: dict) -> dict:
                                                Environment=environment)
     return response
 
+def start_training_job(image_tag: str, parameters: dict) -> dict:
+    """ Starts the Sagemaker Training Job with warm pool as training compute service with specific image tag,
+        consecutive jobs with the same resource configuration reuse the retained instance
+        :argument: image_tag - Tag of the Image in the ECR Repository
+        :argument: parameters - Dictionary with parameters passed as environment to the container
+        :return: response - Information about the started Training Job
+    """
+    sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+    current_time = datetime.now().strftime("%y-%m-%d-%H-%M-%S")
+    job_name = f"model-training-warm-{current_time}-{uuid.uuid4().hex[:8]}"
+    image = os.environ['ImageUri'] + ':' + image_tag
+    environment = {'ImageTag': image_tag}
+    for name, value in parameters.items():
+        environment[name] = str(value)
+    optional = matrices_channels(environment)
+    # Define the Sagemaker Training Job parameters, KeepAlivePeriod retains the instance after the job ends
+    response = sagemaker.create_training_job(TrainingJobName=job_name,
+                                             AlgorithmSpecification={
+                                                 'TrainingImage': image,
+                                                 'TrainingInputMode': 'File',
+                                                 'ContainerEntrypoint': [
+                                                     "python3", "training/train.py"
+                                                 ]
+                                             },
+                                             ResourceConfig={
+                                                 'InstanceCount': int(os.environ['TrainingInstanceCount']),
+                                                 'InstanceType': os.environ['TrainingInstanceType'],
+                                                 'VolumeSizeInGB': int(os.environ['TrainingVolumeSizeInGB']),
+                                                 'KeepAlivePeriodInSeconds': int(os.environ['WarmPoolKeepAliveSeconds'])
+                                             },
+                                             OutputDataConfig={
+                                                 'S3OutputPath': f"s3://{os.environ['ArtifactsBucket']}/training-jobs/"
+                                             },
+                                             StoppingCondition={
+                                                 'MaxRuntimeInSeconds': 86400
+                                             },
+                                             VpcConfig={
+                                                 'SecurityGroupIds': [os.environ['SecurityGroupId']],
+                                                 'Subnets': [os.environ['Subnet0'], os.environ['Subnet1']]
+                                             },
+                                             RoleArn=os.environ['SagemakerRoleArn'],
+                                             Tags=[
+                                                 {
+                                                     'Key': 'Project',
+                                                     'Value': os.environ["Project"]
+                                                 },
+                                                 {
+                                                     'Key': 'Owner',
+                                                     'Value': os.environ["Owner"]
+                                                 }
+                                             ],
+                                             Environment=environment,
+                                             **optional)
+    return response
+
+def checkpoint_uri(job_name: str, parameters: dict) -> str:
+    """ Returns the S3 checkpoint location of the spot Training Job, a job resuming another one continues
+        from the checkpoints of that job
+        :argument: job_name - Name of the started Training Job
+        :argument: parameters - Dictionary with training parameters, ResumeJobName names the job to resume
+        :return: uri - S3 prefix synchronized with the checkpoint directory of the container
+    """
+    if parameters.get('ResumeJobName'):
+        sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+        return sagemaker.describe_training_job(TrainingJobName=parameters['ResumeJobName'])['CheckpointConfig']['S3Uri']
+    return f"s3://{os.environ['ArtifactsBucket']}/training-checkpoints/{job_name}/"
+
+def start_spot_training_job(image_tag: str, parameters: dict) -> dict:
+    """ Starts the Sagemaker Training Job on managed spot capacity with specific image tag. SageMaker copies
+        the checkpoint directory of the container to S3 while the job runs and back after a spot interruption,
+        so the restarted container continues from the last checkpoint the trainer saved
+        :argument: image_tag - Tag of the Image in the ECR Repository
+        :argument: parameters - Dictionary with parameters passed as environment to the container
+        :return: response - Information about the started Training Job
+    """
+    sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+    current_time = datetime.now().strftime("%y-%m-%d-%H-%M-%S")
+    job_name = f"model-training-spot-{current_time}-{uuid.uuid4().hex[:8]}"
+    image = os.environ['ImageUri'] + ':' + image_tag
+    environment = {'ImageTag': image_tag, 'CheckpointPath': CHECKPOINT_PATH}
+    for name, value in parameters.items():
+        environment[name] = str(value)
+    optional = matrices_channels(environment)
+    # Waiting for spot capacity and interruptions count against MaxWaitTimeInSeconds, the run itself
+    # against MaxRuntimeInSeconds, warm pools are not available for spot capacity
+    max_wait = int(os.environ['SpotMaxWaitSeconds'])
+    response = sagemaker.create_training_job(TrainingJobName=job_name,
+                                             AlgorithmSpecification={
+                                                 'TrainingImage': image,
+                                                 'TrainingInputMode': 'File',
+                                                 'ContainerEntrypoint': [
+                                                     "python3", "training/train.py"
+                                                 ]
+                                             },
+                                             ResourceConfig={
+                                                 'InstanceCount': int(os.environ['TrainingInstanceCount']),
+                                                 'InstanceType': os.environ['TrainingInstanceType'],
+                                                 'VolumeSizeInGB': int(os.environ['TrainingVolumeSizeInGB'])
+                                             },
+                                             OutputDataConfig={
+                                                 'S3OutputPath': f"s3://{os.environ['ArtifactsBucket']}/training-jobs/"
+                                             },
+                                             EnableManagedSpotTraining=True,
+                                             CheckpointConfig={
+                                                 'S3Uri': checkpoint_uri(job_name, parameters),
+                                                 'LocalPath': CHECKPOINT_PATH
+                                             },
+                                             StoppingCondition={
+                                                 'MaxRuntimeInSeconds': min(86400, max_wait),
+                                                 'MaxWaitTimeInSeconds': max_wait
+                                             },
+                                             VpcConfig={
+                                                 'SecurityGroupIds': [os.environ['SecurityGroupId']],
+                                                 'Subnets': [os.environ['Subnet0'], os.environ['Subnet1']]
+                                             },
+                                             RoleArn=os.environ['SagemakerRoleArn'],
+                                             Tags=[
+                                                 {
+                                                     'Key': 'Project',
+                                                     'Value': os.environ["Project"]
+                                                 },
+                                                 {
+                                                     'Key': 'Owner',
+                                                     'Value': os.environ["Owner"]
+                                                 }
+                                             ],
+                                             Environment=environment,
+                                             **optional)
+    return response
+
+def spot_usage(job: dict) -> dict:
+    """ Computes the savings and the time lost to interruptions of the spot Training Job
+        :argument: job - Dictionary returned by describe_training_job
+        :return: usage - Dictionary with training and billable seconds, savings, interruptions and lost seconds
+    """
+    training_seconds = job.get('TrainingTimeInSeconds')
+    billable_seconds = job.get('BillableTimeInSeconds')
+    usage = {'TrainingSeconds': training_seconds, 'BillableSeconds': billable_seconds, 'SpotSavingsPercent': None,
+             'Interruptions': 0, 'InterruptionSeconds': 0.0,
+             'CheckpointUri': job.get('CheckpointConfig', {}).get('S3Uri'),
+             'ResumedFrom': job.get('Environment', {}).get('ResumeJobName')}
+    # Billable time is the training time at the spot price expressed in on-demand seconds
+    if training_seconds and billable_seconds is not None:
+        usage['SpotSavingsPercent'] = round(100 * (1 - billable_seconds / training_seconds), 1)
+    # Everything from an interruption until training runs again is lost, start-up of the new instance included
+    interrupted = False
+    for transition in job.get('SecondaryStatusTransitions', []):
+        if transition['Status'] == 'Interrupted':
+            interrupted = True
+            usage['Interruptions'] += 1
+        elif transition['Status'] == 'Training':
+            interrupted = False
+        if interrupted and 'EndTime' in transition:
+            usage['InterruptionSeconds'] += (transition['EndTime'] - transition['StartTime']).total_seconds()
+    return usage
+
+def get_job_timings(job_name: str) -> dict:
+    """ Splits the wall time of the training job into queue, provisioning, start-up and run phases
+        :argument: job_name - Name of the Processing Job or warm pool Training Job
+        :return: timings - Dictionary with the backend, status and phase durations in seconds
+    """
+    sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+    if job_name.startswith(("model-training-warm-", "model-training-spot-")):
+        job = sagemaker.describe_training_job(TrainingJobName=job_name)
+        backend = 'spot' if job_name.startswith("model-training-spot-") else 'warm_pool'
+        timings = {'JobName': job_name, 'Backend': backend, 'Status': job['TrainingJobStatus'],
+                   'WarmPoolStatus': job.get('WarmPoolStatus', {}).get('Status'),
+                   'QueueSeconds': 0.0, 'ProvisioningSeconds': 0.0, 'StartupSeconds': 0.0, 'RunSeconds': 0.0}
+        transitions = job.get('SecondaryStatusTransitions', [])
+        # The job is queued until it enters its first phase, Starting already provisions the instance
+        if transitions:
+            timings['QueueSeconds'] = max((transitions[0]['StartTime'] - job['CreationTime']).total_seconds(), 0.0)
+        # Pending is waiting for a retained warm pool instance, Downloading is the image pull on a fresh instance
+        phases = {'Pending': 'QueueSeconds', 'Starting': 'ProvisioningSeconds',
+                  'Downloading': 'StartupSeconds', 'Training': 'RunSeconds', 'Uploading': 'RunSeconds'}
+        for transition in transitions:
+            phase = phases.get(transition['Status'])
+            if phase is not None and 'EndTime' in transition:
+                timings[phase] += (transition['EndTime'] - transition['StartTime']).total_seconds()
+        if backend == 'spot':
+            timings.update(spot_usage(job))
+            timings['SecondaryStatus'] = job.get('SecondaryStatus')
+    else:
+        job = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+        timings = {'JobName': job_name, 'Backend': 'processing', 'Status': job['ProcessingJobStatus'],
+                   'WarmPoolStatus': None, 'QueueSeconds': 0.0, 'ProvisioningSeconds': 0.0, 'StartupSeconds': 0.0,
+                   'RunSeconds': 0.0}
+        # Processing Jobs do not report provisioning separately, so queue and image pull count as start-up
+        if 'ProcessingStartTime' in job:
+            timings['StartupSeconds'] = (job['ProcessingStartTime'] - job['CreationTime']).total_seconds()
+            if 'ProcessingEndTime' in job:
+                timings['RunSeconds'] = (job['ProcessingEndTime'] - job['ProcessingStartTime']).total_seconds()
+    return timings
+
+def publish_job_timings(timings: dict) -> None:
+    """ Publishes the phase durations of finished training job as CloudWatch metrics
+        :argument: timings - Dictionary returned by get_job_timings
+        :return: None
+    """
+    cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
+    dimensions = [{'Name': 'Backend', 'Value': timings['Backend']}]
+    metric_data = []
+    for metric_name in ['QueueSeconds', 'ProvisioningSeconds', 'StartupSeconds', 'RunSeconds']:
+        metric_data.append({'MetricName': f"Training{metric_name}", 'Dimensions': dimensions,
+                            'Value': timings[metric_name], 'Unit': 'Seconds'})
+    if timings['Backend'] == 'spot':
+        metric_data.append({'MetricName': 'TrainingInterruptions', 'Dimensions': dimensions,
+                            'Value': timings['Interruptions'], 'Unit': 'Count'})
+        metric_data.append({'MetricName': 'TrainingInterruptionSeconds', 'Dimensions': dimensions,
+                            'Value': timings['InterruptionSeconds'], 'Unit': 'Seconds'})
+        if timings['SpotSavingsPercent'] is not None:
+            metric_data.append({'MetricName': 'TrainingSpotSavings', 'Dimensions': dimensions,
+                                'Value': timings['SpotSavingsPercent'], 'Unit': 'Percent'})
+    cloudwatch.put_metric_data(Namespace='MLOps/Training', MetricData=metric_data)
+
+def launch_training(image_tag: str, parameters: dict) -> dict:
+    """ Starts the training on the backend selected with the Backend parameter
+        :argument: image_tag - Tag of the Image in the ECR Repository
+        :argument: parameters - Dictionary with training parameters, Backend is 'processing' (default), 'warm_pool'
+                             or 'spot', ResumeJobName continues a spot job from the checkpoints of an earlier one
+        :return: job_info - Dictionary with the backend and name of the started job
+    """
+    backend = parameters.get('Backend', 'processing')
+    if backend == 'warm_pool':
+        response = start_training_job(image_tag=image_tag, parameters=parameters)
+        job_name = response['TrainingJobArn'].split('/')[-1]
+    elif backend == 'spot':
+        response = start_spot_training_job(image_tag=image_tag, parameters=parameters)
+        job_name = response['TrainingJobArn'].split('/')[-1]
+    else:
+        response = start_training(image_tag=image_tag, parameters=parameters)
+        job_name = response['ProcessingJobArn'].split('/')[-1]
+    return {'Backend': backend, 'JobName': job_name}
+
+def resume_spot_training(job_name: str) -> Optional[dict]:
+    """ Starts a new spot Training Job from the checkpoints of the finished one, when it ended because spot
+        capacity was not available within the maximum wait time, up to SpotMaxResumes times in a row
+        :argument: job_name - Name of the finished spot Training Job
+        :return: job_info - Dictionary with the queued or started job, None if the job is not resumed
+    """
+    sagemaker = boto3.client("sagemaker", region_name='us-east-1')
+    job = sagemaker.describe_training_job(TrainingJobName=job_name)
+    capacity_lost = (job.get('SecondaryStatus') == 'MaxWaitTimeExceeded'
+                     or 'capacity' in job.get('FailureReason', '').lower())
+    if job['TrainingJobStatus'] == 'Completed' or not capacity_lost:
+        return None
+    # The parameters of the training are the container environment without the values set by the launcher
+    parameters = {name: value for name, value in job.get('Environment', {}).items() if name not in LAUNCHER_ENVIRONMENT}
+    resumes = int(parameters.get('SpotResumes', 0))
+    if resumes >= int(os.environ['SpotMaxResumes']):
+        return None
+    parameters.update({'Backend': 'spot', 'ResumeJobName': job_name, 'SpotResumes': str(resumes + 1)})
+    return admit_training(image_tag=job['Environment']['ImageTag'], parameters=parameters)
+
+def admission_controller() -> AdmissionController:
+    """ Creates the admission controller keeping at most MaxConcurrentTrainingJobs training jobs running,
+        starts rejected by the SageMaker instance quotas stay queued
+    """
+    return AdmissionController(name='training', queue=SqsAdmissionQueue(os.environ['AdmissionQueueUrl']),
+                               limit=int(os.environ.get('MaxConcurrentTrainingJobs', 2)),
+                               running=lambda: running_sagemaker_jobs('model-training-', training=True))
+
+def start_queued_training(payload: dict) -> dict:
+    """ Starts the training of the admission queue message """
+    return launch_training(image_tag=payload['ImageTag'], parameters=payload['Parameters'])
+
+def admit_training(image_tag: str, parameters: dict) -> dict:
+    """ Queues the training and starts it right away when fewer than MaxConcurrentTrainingJobs jobs run
+        :argument: image_tag - Tag of the Image in the ECR Repository
+        :argument: parameters - Dictionary with training parameters
+        :return: job_info - Dictionary with the backend, name of the started job (None if queued) and queued flag
+    """
+    admission = admission_controller().submit({'ImageTag': image_tag, 'Parameters': parameters},
+                                              start=start_queued_training)
+    if admission['queued']:
+        return {'Backend': parameters.get('Backend', 'processing'), 'JobName': None, 'Queued': True}
+    return dict(admission['result'], Queued=False)
+
+def retraining_table():
+    """ Returns the DynamoDB table with the state of new training data waiting for the data triggered retraining """
+    return boto3.resource('dynamodb').Table(os.environ['RetrainingStateTable'])
+
+def retraining_state() -> dict:
+    """ Loads the state of new training data waiting for the data triggered retraining
+        :argument: None
+        :return: state - Dictionary with pending rows, recorded events, event times and last drift retraining time
+    """
+    item = retraining_table().get_item(Key=RETRAINING_STATE_KEY, ConsistentRead=True).get('Item', {})
+    return {'pending_rows': int(item.get('pending_rows', 0)), 'events': int(item.get('events', 0)),
+            'first_event_at': int(item['first_event_at']) if 'first_event_at' in item else None,
+            'last_event_at': int(item['last_event_at']) if 'last_event_at' in item else None,
+            'drift_retrained_at': int(item.get('drift_retrained_at', 0))}
+
+def record_training_data(detail: dict) -> dict:
+    """ Adds the new rows of the ETL completion event to the new training data waiting for retraining
+        :argument: detail - Detail of the ETL completion event with table and row counts
+        :return: state - Dictionary with the updated retraining state
+    """
+    now = int(datetime.utcnow().timestamp())
+    # ADD is applied atomically, so ETL completion events recorded at the same time do not lose rows.
+    # rows_written of a total ingest is the whole dataset, only the rows added to the table are new
+    retraining_table().update_item(Key=RETRAINING_STATE_KEY,
+                                   UpdateExpression="ADD pending_rows :rows, events :one "
+                                                    "SET first_event_at = if_not_exists(first_event_at, :now), last_event_at = :now",
+                                   ExpressionAttributeValues={':rows': max(detail['row_delta'], 0), ':one': 1, ':now': now})
+    return retraining_state()
+
+def check_retraining() -> Optional[dict]:
+    """ Starts the training once enough new training data arrived and no more arrived within the quiet period,
+        so a burst of uploads results in one training run
+        :argument: None
+        :return: job_info - Dictionary with the started job, None if training was not started
+    """
+    state = retraining_state()
+    if state['pending_rows'] < int(os.environ['MinNewTrainingRows']):
+        return None
+    if datetime.utcnow().timestamp() - state['last_event_at'] < int(os.environ['RetrainingQuietSeconds']):
+        return None
+    # The pending rows are reset only if no event was recorded since the read, otherwise the quiet period restarts
+    # and a concurrent check cannot start the same retraining twice
+    table = retraining_table()
+    try:
+        table.update_item(Key=RETRAINING_STATE_KEY,
+                          UpdateExpression="SET pending_rows = :zero, events = :zero REMOVE first_event_at, last_event_at",
+                          ConditionExpression="events = :events AND last_event_at = :last_event_at",
+                          ExpressionAttributeValues={':zero': 0, ':events': state['events'],
+                                                     ':last_event_at': state['last_event_at']})
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    # Use the parameters of the training schedule when defined
+    s3 = boto3.resource('s3')
+    try:
+        parameters = parameters_file(action="GET")
+    except s3.meta.client.exceptions.NoSuchKey:
+        parameters = {}
+    parameters['RetrainingRows'] = str(state['pending_rows'])
+    return admit_training(image_tag=get_latest_image(), parameters=parameters)
+
+def drift_retraining_allowed() -> bool:
+    """ Records a drift retraining unless one was recorded within the cooldown, the new model needs time to see
+        the drifted data. The conditional write lets one of concurrent drift checks retrain
+        :argument: None
+        :return: allowed - True if the drift retraining was recorded and should be started
+    """
+    now = int(datetime.utcnow().timestamp())
+    table = retraining_table()
+    try:
+        table.update_item(Key=RETRAINING_STATE_KEY, UpdateExpression="SET drift_retrained_at = :now",
+                          ConditionExpression="attribute_not_exists(drift_retrained_at) OR drift_retrained_at < :cooldown_start",
+                          ExpressionAttributeValues={':now': now,
+                                                     ':cooldown_start': now - int(os.environ['DriftRetrainingCooldownSeconds'])})
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+def check_drift(detail: dict) -> dict:
+    """ Compares the sensor sketches of the recent inference data with the training baseline, reads only
+        the sketches written by the transform job, and starts retraining when enough sensors drifted
+        :argument: detail - Detail of the ETL completion event of the inference data
+        :return: report - Dictionary with the drift statistics, drifted sensors and started job
+    """
+    bucket = os.environ['StorageBucketName']
+    baseline = read_json(bucket, BASELINE_KEY)
+    if baseline is None:
+        return {'drifted': [], 'columns': {}, 'job_info': None}
+    baseline = {column: QuantileSketch.from_dict(sketch) for column, sketch in baseline['columns'].items()}
+    current = window_sketches(bucket, 'inference', days=int(os.environ['DriftWindowDays']))
+    report = compare(baseline, current, ks_threshold=float(os.environ['DriftKSThreshold']))
+    emit_drift_metrics(report)
+    report['job_info'] = None
+    if len(report['drifted']) >= int(os.environ['DriftMinSensors']) and drift_retraining_allowed():
+        s3 = boto3.resource('s3')
+        try:
+            parameters = parameters_file(action="GET")
+        except s3.meta.client.exceptions.NoSuchKey:
+            parameters = {}
+        parameters['RetrainingReason'] = 'drift: ' + ','.join(report['drifted'])
+        report['job_info'] = admit_training(image_tag=get_latest_image(), parameters=parameters)
+    write_json(bucket, f"drift/reports/{detail['execution_id']}.json", report)
+    return report
+
 def construct_response(body: dict, status_code: int) -> dict:
     """ Constructs API Response 
         :argument: body - Content of the response body
@@ -156,10 +606,21 @@ def lambda_handler(event, context):
         image_tag = body.get('ImageTag', None)
         if image_tag is None:
             image_tag = get_latest_image()
-        job_info = start_training(image_tag=image_tag, parameters=body)
+        job_info = admit_training(image_tag=image_tag, parameters=body)
+        if job_info['Queued']:
+            # Started by the dispatch once a running training job finished
+            response = {'Message': 'Training queued, the concurrent training jobs limit is reached'}
+            response['ImageTag'] = image_tag
+            return construct_response(response, 202)
         response = {'Message': 'Training successfully started!'}
         response['ImageTag'] = image_tag
+        response['JobName'] = job_info['JobName']
         return construct_response(response, 200)
+    elif api_resource == '/training_status':
+        # Get the phase timings of the requested training job
+        body = json.loads(event['body'])
+        timings = get_job_timings(body['JobName'])
+        return construct_response(timings, 200)
     elif api_resource == '/training_schedule':
         # Get parameters dictionary
         body = json.loads(event['body'])
@@ -175,6 +636,34 @@ def lambda_handler(event, context):
         message = schedule_rule(cron, action)
         response = {'Message': message}
         return construct_response(response, 200)
+    elif event.get('source') == 'mlops.etl' and event['detail']['table'] == 'mlops-curated-inference-data':
+        # If triggered by the ETL completion event for new inference data, check the sensor drift
+        report = check_drift(event['detail'])
+        return {'status_code': 200, 'body': f"Drifted sensors {report['drifted']}"}
+    elif event.get('source') == 'mlops.etl':
+        # If triggered by the ETL completion event for new curated training data
+        state = record_training_data(event['detail'])
+        return {'status_code': 200, 'body': f"Recorded {state['pending_rows']} rows pending for retraining"}
+    elif event.get('source') == 'mlops.retraining-debounce':
+        # If triggered by the periodic debounce check, queued trainings whose retry delay passed are started first
+        admission_controller().dispatch(start_queued_training)
+        job_info = check_retraining()
+        if job_info is None:
+            return {'status_code': 200, 'body': 'Retraining not started'}
+        if job_info['Queued']:
+            return {'status_code': 200, 'body': 'Queued retraining'}
+        return {'status_code': 200, 'body': f"Successfully started retraining {job_info['JobName']}"}
+    elif event.get('source') == 'aws.sagemaker':
+        # If triggered by the finished training job, publish its phase timings
+        detail = event['detail']
+        job_name = detail.get('TrainingJobName', detail.get('ProcessingJobName'))
+        publish_job_timings(get_job_timings(job_name))
+        # The finished job freed capacity for a queued training
+        admission_controller().dispatch(start_queued_training)
+        # A spot job that found no capacity continues from its checkpoints in a new job
+        if job_name.startswith("model-training-spot-") and resume_spot_training(job_name) is not None:
+            return {'status_code': 200, 'body': f'Published timings and resumed spot training {job_name}'}
+        return {'status_code': 200, 'body': f'Successfully published timings for {job_name}'}
     else:
         # If triggered by a Cron schedule
         resource = event['resources'][0]
@@ -182,5 +671,7 @@ def lambda_handler(event, context):
         # Get the parameters file as dictionary to start training on schedule
         parameters = parameters_file(action="GET")
         image_tag = get_latest_image()
-        job_info = start_training(image_tag=image_tag, parameters=parameters)
+        job_info = admit_training(image_tag=image_tag, parameters=parameters)
+        if job_info['Queued']:
+            return {'status_code': 200, 'body': 'Queued training on schedule with latest image'}
         return {'status_code': 200, 'body': 'Successfully started training on schedule with latest image'}
\ No newline at end of file
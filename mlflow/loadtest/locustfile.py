@@ -0,0 +1,74 @@
+""" Load test of the MLflow tracking server metric logging
+
+    Start the stand-in with: docker compose -f mlflow/loadtest/docker-compose.yml up --build
+    Run the test with: locust -f mlflow/loadtest/locustfile.py --host http://localhost:5000 --headless -u 50 -r 10 -t 2m
+"""
+import os
+import time
+import uuid
+
+from locust import HttpUser, task, between, events
+
+EXPERIMENT_NAME = os.environ.get('LOADTEST_EXPERIMENT', 'mlops-loadtest')
+METRICS_PER_BATCH = int(os.environ.get('LOADTEST_METRICS_PER_BATCH', 20))
+
+logged_metrics = {'count': 0, 'start': None}
+
+
+def get_experiment_id(client) -> str:
+    """ Gets or creates the experiment used by the load test
+        :argument: client - Locust HTTP client
+        :return: experiment_id - ID of the load test experiment
+    """
+    response = client.get("/api/2.0/mlflow/experiments/get-by-name", params={'experiment_name': EXPERIMENT_NAME},
+                          name="get-experiment")
+    if response.status_code == 200:
+        return response.json()['experiment']['experiment_id']
+    response = client.post("/api/2.0/mlflow/experiments/create", json={'name': EXPERIMENT_NAME},
+                           name="create-experiment")
+    if response.status_code != 200:
+        # Experiment was created by another user in the meantime
+        response = client.get("/api/2.0/mlflow/experiments/get-by-name", params={'experiment_name': EXPERIMENT_NAME},
+                              name="get-experiment")
+        return response.json()['experiment']['experiment_id']
+    return response.json()['experiment_id']
+
+
+class TrainingRunUser(HttpUser):
+    """ Simulates a training run logging batches of metrics every step """
+    wait_time = between(0.05, 0.2)
+
+    def on_start(self):
+        experiment_id = get_experiment_id(self.client)
+        response = self.client.post("/api/2.0/mlflow/runs/create", name="create-run",
+                                    json={'experiment_id': experiment_id, 'start_time': int(time.time() * 1000),
+                                          'run_name': f"loadtest-{uuid.uuid4().hex[:8]}"})
+        self.run_id = response.json()['run']['info']['run_id']
+        self.step = 0
+
+    @task
+    def log_batch(self):
+        timestamp = int(time.time() * 1000)
+        metrics = [{'key': f"metric_{i}", 'value': float(self.step * i), 'timestamp': timestamp, 'step': self.step}
+                   for i in range(METRICS_PER_BATCH)]
+        with self.client.post("/api/2.0/mlflow/runs/log-batch", json={'run_id': self.run_id, 'metrics': metrics},
+                              name="log-batch", catch_response=True) as response:
+            if response.status_code == 200:
+                logged_metrics['count'] += METRICS_PER_BATCH
+                response.success()
+            else:
+                response.failure(f"log-batch returned {response.status_code}")
+        self.step += 1
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    logged_metrics['count'] = 0
+    logged_metrics['start'] = time.perf_counter()
+
+
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    elapsed = time.perf_counter() - logged_metrics['start']
+    print(f"Logged {logged_metrics['count']} metrics in {elapsed:.1f}s "
+          f"({logged_metrics['count'] / elapsed:.1f} metrics/s)")
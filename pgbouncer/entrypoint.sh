@@ -0,0 +1,38 @@
+#!/bin/sh
+# Renders the PgBouncer configuration from the task environment, starts the
+# pool metrics exporter and runs PgBouncer in the foreground
+set -e
+
+cat > /tmp/pgbouncer.ini <<CONFIG
+[databases]
+${DATABASE} = host=${DB_HOST} port=${DB_PORT} dbname=${DATABASE}
+
+[pgbouncer]
+listen_addr = 0.0.0.0
+listen_port = 6432
+auth_type = md5
+auth_file = /tmp/userlist.txt
+admin_users = ${DB_USERNAME}
+stats_users = ${DB_USERNAME}
+pool_mode = ${POOL_MODE:-transaction}
+default_pool_size = ${DEFAULT_POOL_SIZE:-10}
+reserve_pool_size = ${RESERVE_POOL_SIZE:-2}
+reserve_pool_timeout = 3
+max_client_conn = ${MAX_CLIENT_CONN:-200}
+server_idle_timeout = ${SERVER_IDLE_TIMEOUT:-300}
+server_connect_timeout = 30
+query_wait_timeout = 120
+ignore_startup_parameters = extra_float_digits,options
+unix_socket_dir =
+CONFIG
+
+# Userlist values are double quoted and a double quote inside a value is doubled,
+# printf writes backslashes and other characters of the password unchanged
+quote() {
+    printf '"%s"' "$(printf '%s' "$1" | sed 's/"/""/g')"
+}
+printf '%s %s\n' "$(quote "${DB_USERNAME}")" "$(quote "${DB_PASSWORD}")" > /tmp/userlist.txt
+
+python3 /opt/pgbouncer/metrics.py &
+
+exec pgbouncer /tmp/pgbouncer.ini
@@ -0,0 +1,68 @@
+import os
+import json
+import time
+
+import psycopg2
+
+
+def pool_metrics(database: str) -> dict:
+    """ Reads the pool state of the database from the PgBouncer admin console
+        :argument: database - Name of the pooled database
+        :return: metrics - Dictionary with active/waiting connections and wait times
+    """
+    connection = psycopg2.connect(host='127.0.0.1', port=6432, dbname='pgbouncer',
+                                  user=os.environ['DB_USERNAME'], password=os.environ['DB_PASSWORD'])
+    # Admin console does not support transactions
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW POOLS")
+            columns = [column[0] for column in cursor.description]
+            pools = [dict(zip(columns, row)) for row in cursor.fetchall() if row[0] == database]
+            cursor.execute("SHOW STATS")
+            columns = [column[0] for column in cursor.description]
+            stats = [dict(zip(columns, row)) for row in cursor.fetchall() if row[0] == database]
+    finally:
+        connection.close()
+    metrics = {'ClientActive': 0, 'ClientWaiting': 0, 'ServerActive': 0, 'ServerIdle': 0,
+               'MaxWaitSeconds': 0.0, 'AvgWaitSeconds': 0.0}
+    for pool in pools:
+        metrics['ClientActive'] += pool['cl_active']
+        metrics['ClientWaiting'] += pool['cl_waiting']
+        metrics['ServerActive'] += pool['sv_active']
+        metrics['ServerIdle'] += pool['sv_idle']
+        max_wait = pool['maxwait'] + pool.get('maxwait_us', 0) / 1e6
+        metrics['MaxWaitSeconds'] = max(metrics['MaxWaitSeconds'], max_wait)
+    for stat in stats:
+        # Average time clients waited for a server connection, in microseconds
+        metrics['AvgWaitSeconds'] = stat.get('avg_wait_time', 0) / 1e6
+    return metrics
+
+
+def emit(service: str, metrics: dict) -> None:
+    """ Prints the metrics in CloudWatch Embedded Metric Format, extracted from the container logs
+        :argument: service - Name of the service using the pool, used as metric dimension
+        :argument: metrics - Dictionary returned by pool_metrics
+        :return: None
+    """
+    units = {name: 'Seconds' if name.endswith('Seconds') else 'Count' for name in metrics}
+    record = {'_aws': {'Timestamp': int(time.time() * 1000),
+                       'CloudWatchMetrics': [{'Namespace': 'MLOps/ConnectionPool',
+                                              'Dimensions': [['Service']],
+                                              'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]}]},
+              'Service': service}
+    record.update(metrics)
+    print(json.dumps(record), flush=True)
+
+
+if __name__ == '__main__':
+    service = os.environ.get('SERVICE_NAME', 'unknown')
+    interval = int(os.environ.get('METRICS_INTERVAL', 60))
+    # Give PgBouncer time to start listening
+    time.sleep(10)
+    while True:
+        try:
+            emit(service, pool_metrics(os.environ['DATABASE']))
+        except psycopg2.Error as error:
+            print(f"Failed to read PgBouncer pool metrics: {error}", flush=True)
+        time.sleep(interval)
@@ -0,0 +1,70 @@
+""" Latency and throughput benchmark of the real-time scoring service
+
+    Start the containerised stand-in with:
+        docker build -t mlops-scoring scoring && docker run --rm -e STANDIN_MODEL=true -p 8080:8080 mlops-scoring
+    Run the benchmark with:
+        python scoring/benchmark.py --url http://localhost:8080/predict --concurrency 32 --requests 2000
+"""
+import json
+import time
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def make_request(windows: int, window_length: int, seed: int) -> bytes:
+    """ Creates a scoring request with synthetic C-MAPSS like engine windows
+        :argument: windows - Number of engine windows in the request
+        :argument: window_length - Number of cycles in every window
+        :argument: seed - Random seed of the sensor values
+        :return: payload - Encoded JSON request body
+    """
+    generator = np.random.default_rng(seed)
+    body = {'ModelName': 'benchmark', 'Windows': []}
+    for unit in range(1, windows + 1):
+        rows = []
+        for cycle in range(1, window_length + 1):
+            row = {'unit': unit, 'cycle': cycle, 'altitude': 0.0, 'mach': 0.0, 'tra': 100.0}
+            row.update({f'sensor_{i}': float(value) for i, value in enumerate(generator.normal(500, 50, 21), start=1)})
+            rows.append(row)
+        body['Windows'].append(rows)
+    return json.dumps(body).encode('utf-8')
+
+
+def send(url: str, payload: bytes) -> float:
+    """ Sends one scoring request
+        :argument: url - URL of the /predict endpoint
+        :argument: payload - Encoded JSON request body
+        :return: latency - Request latency in seconds
+    """
+    request = urllib.request.Request(url, data=payload, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the real-time scoring service")
+    parser.add_argument('--url', default='http://localhost:8080/predict')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--windows', type=int, default=1, help="Engine windows per request")
+    parser.add_argument('--window-length', type=int, default=30, help="Cycles per engine window")
+    args = parser.parse_args()
+
+    payloads = [make_request(args.windows, args.window_length, seed) for seed in range(16)]
+    # Warm up the model cache before measuring
+    send(args.url, payloads[0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(lambda i: send(args.url, payloads[i % len(payloads)]), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f"requests={args.requests} concurrency={args.concurrency} windows/request={args.windows}")
+    print(f"throughput={args.requests / elapsed:.1f} req/s ({args.requests * args.windows / elapsed:.1f} windows/s)")
+    print(f"latency p50={np.percentile(latencies, 50):.1f}ms p95={np.percentile(latencies, 95):.1f}ms "
+          f"p99={np.percentile(latencies, 99):.1f}ms max={latencies.max():.1f}ms")
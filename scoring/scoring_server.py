@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import boto3
+import numpy as np
+import pandas as pd
+
+
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 64))
+MAX_BATCH_WAIT_MS = float(os.environ.get('MAX_BATCH_WAIT_MS', 5))
+MODEL_REFRESH_SECONDS = int(os.environ.get('MODEL_REFRESH_SECONDS', 300))
+MAX_CACHED_MODELS = int(os.environ.get('MAX_CACHED_MODELS', 2))
+STANDIN_MODEL = os.environ.get('STANDIN_MODEL', 'false').lower() == 'true'
+WINDOW_TABLE = os.environ.get('WINDOW_TABLE', 'mlops-unit-windows')
+DROP_COLUMNS = ['timestamp']
+
+
+class StandInModel:
+    """ Linear model over the sensor columns used for local benchmarks without MLflow """
+    def predict(self, data: pd.DataFrame) -> np.ndarray:
+        sensors = data[[column for column in data.columns if column.startswith('sensor_')]].to_numpy(dtype=np.float64)
+        return np.maximum(0.0, 200.0 - sensors.mean(axis=1) * 0.1 - data['cycle'].to_numpy())
+
+
+class ModelCache:
+    """ In-memory cache of loaded models keyed by name and version, stage lookups are refreshed periodically.
+        Holds the MAX_CACHED_MODELS most recently used models, so versions superseded by a model update are
+        unloaded and their batcher threads stopped
+    """
+    def __init__(self):
+        self.models = OrderedDict()
+        self.stages = {}
+        # Future of every model being loaded, resolved with its batcher
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def resolve_version(self, model_name: str, version: str = None) -> str:
+        """ Resolves the requested model to a version, the latest Production version if None
+            :argument: model_name - Name of the registered model in MLflow
+            :argument: version - Requested model version
+            :return: version - Pinned model version
+        """
+        if version is not None or STANDIN_MODEL:
+            return version or 'standin'
+        cached = self.stages.get(model_name)
+        if cached is not None and time.time() - cached[1] < MODEL_REFRESH_SECONDS:
+            return cached[0]
+        from mlflow.tracking import MlflowClient
+        latest = MlflowClient().get_latest_versions(model_name, stages=['Production'])
+        if not latest:
+            raise KeyError(f"No Production version of model {model_name}")
+        self.stages[model_name] = (latest[0].version, time.time())
+        return latest[0].version
+
+    def get(self, model_name: str, version: str):
+        """ Returns the loaded model, loading it from the MLflow registry on first use. The model is loaded outside
+            the lock, so requests of cached models are not blocked, and concurrent requests of the same model wait
+            for the one load
+            :argument: model_name - Name of the registered model in MLflow
+            :argument: version - Pinned model version
+            :return: batcher - MicroBatcher scoring with the loaded model
+        """
+        key = (model_name, version)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+            loading = self.loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self.loading[key] = Future()
+        # Requests arriving while the model loads wait for the same load
+        if not owner:
+            return loading.result()
+        try:
+            batcher = MicroBatcher(self.load(model_name, version))
+        except Exception as error:
+            # Failed loads are not cached, the next request tries again
+            with self.lock:
+                del self.loading[key]
+            loading.set_exception(error)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.models[key] = batcher
+            # Requests already holding an evicted batcher are still scored before its thread ends
+            while len(self.models) > MAX_CACHED_MODELS:
+                _, evicted = self.models.popitem(last=False)
+                evicted.stop()
+        loading.set_result(batcher)
+        return batcher
+
+    @staticmethod
+    def load(model_name: str, version: str):
+        """ Loads the model version from the MLflow registry, or the stand-in model """
+        if STANDIN_MODEL:
+            return StandInModel()
+        import mlflow.pyfunc
+        return mlflow.pyfunc.load_model(f"models:/{model_name}/{version}")
+
+
+class MicroBatcher:
+    """ Collects concurrent scoring requests and runs them through the model as one batch """
+    def __init__(self, model):
+        self.model = model
+        self.requests = queue.Queue()
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, windows: list) -> Future:
+        """ Queues the windows of one request for scoring, a stopped batcher scores them right away
+            :argument: windows - List of Pandas DataFrames, one per engine window
+            :return: future - Future resolved with the list of window predictions
+        """
+        future = Future()
+        with self.lock:
+            if not self.stopped:
+                self.requests.put((windows, future))
+                return future
+        self.score([(windows, future)])
+        return future
+
+    def stop(self) -> None:
+        """ Ends the batching thread once the requests queued so far are scored """
+        with self.lock:
+            self.stopped = True
+            self.requests.put(None)
+
+    def run(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + MAX_BATCH_WAIT_MS / 1000
+            size = len(batch[0][0])
+            # Wait for more requests until the batch is full or the wait time is over
+            while size < MAX_BATCH_SIZE:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Stopped, nothing is queued after the stop marker
+                    self.score(batch)
+                    return
+                batch.append(item)
+                size += len(item[0])
+            self.score(batch)
+
+    def score(self, batch: list):
+        """ Scores all windows of the batch with one model call and resolves the request futures
+            :argument: batch - List of (windows, future) tuples
+            :return: None
+        """
+        windows = [window for item in batch for window in item[0]]
+        try:
+            predictions = np.asarray(self.model.predict(pd.concat(windows, ignore_index=True))).reshape(-1)
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        # Prediction of the window is the one of its latest cycle
+        ends = np.cumsum([len(window) for window in windows]) - 1
+        window_predictions = predictions[ends].tolist()
+        position = 0
+        for item_windows, future in batch:
+            future.set_result(window_predictions[position:position + len(item_windows)])
+            position += len(item_windows)
+
+
+model_cache = ModelCache()
+
+
+def fetch_windows(units: list) -> list:
+    """ Fetches the windows of last cycles of the units from the online window store
+        :argument: units - List of unit numbers
+        :return: windows - List of Pandas DataFrames, one per stored unit
+    """
+    dynamodb = boto3.resource('dynamodb')
+    windows = []
+    # BatchGetItem accepts at most 100 keys per call
+    for i in range(0, len(units), 100):
+        request = {WINDOW_TABLE: {'Keys': [{'unit': int(unit)} for unit in units[i:i + 100]]}}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(WINDOW_TABLE, []):
+                columns = item['columns'].split(',')
+                values = np.frombuffer(item['window'].value, dtype=np.float32).reshape(-1, len(columns))
+                windows.append(pd.DataFrame(values, columns=columns).assign(unit=int(item['unit'])))
+            request = response.get('UnprocessedKeys')
+    return windows
+
+
+def predict(body: dict) -> dict:
+    """ Scores the engine windows of the request
+        :argument: body - Dictionary with ModelName, optional ModelVersion and either Windows as lists of cycle rows
+                          or Units whose windows are read from the online window store
+        :return: response - Dictionary with model version and RUL prediction of the last cycle of every window
+    """
+    version = model_cache.resolve_version(body['ModelName'], body.get('ModelVersion', None))
+    batcher = model_cache.get(body['ModelName'], version)
+    if 'Units' in body:
+        windows = fetch_windows(body['Units'])
+    else:
+        windows = []
+        for rows in body['Windows']:
+            window = pd.DataFrame(rows).sort_values('cycle')
+            windows.append(window.drop(columns=[column for column in DROP_COLUMNS if column in window.columns]))
+    if not windows:
+        raise ValueError("No engine windows to score")
+    rul = batcher.submit(windows).result(timeout=30)
+    predictions = [{'unit': int(window['unit'].iloc[-1]), 'cycle': int(window['cycle'].iloc[-1]), 'rul': value}
+                   for window, value in zip(windows, rul)]
+    return {'ModelName': body['ModelName'], 'ModelVersion': version, 'Predictions': predictions}
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, body: dict, status_code: int):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json({'status': 'ok'}, 200)
+        else:
+            self.send_json({'Message': 'Not found'}, 404)
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json({'Message': 'Not found'}, 404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self.send_json(predict(body), 200)
+        except (KeyError, ValueError) as error:
+            self.send_json({'Message': f"Invalid request: {error}"}, 400)
+        except Exception as error:
+            self.send_json({'Message': f"Scoring failed: {error}"}, 500)
+
+    def log_message(self, format, *args):
+        # Access logs are too noisy at scoring request rates
+        pass
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('0.0.0.0', int(os.environ.get('PORT', 8080))), ScoringHandler)
+    server.serve_forever()
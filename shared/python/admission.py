@@ -0,0 +1,256 @@
+import json
+import time
+import random
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable
+
+import boto3
+
+
+NAMESPACE = 'MLOps/Admission'
+# Error codes of starts rejected for capacity: Glue job runs, SageMaker instance quotas and Step Functions executions
+CAPACITY_ERRORS = {'ConcurrentRunsExceededException', 'ResourceNumberLimitExceededException',
+                   'ResourceLimitExceeded', 'ExecutionLimitExceeded', 'ThrottlingException'}
+
+
+class CapacityExceeded(Exception):
+    """ Raised by a start function when the job cannot be started now and should stay queued """
+
+
+def is_capacity_error(error: Exception) -> bool:
+    """ Checks if the start failed because of a concurrency limit or quota, other errors are not retried
+        :argument: error - Exception raised by the start function
+        :return: capacity - True if the start should be retried later
+    """
+    if isinstance(error, CapacityExceeded):
+        return True
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in CAPACITY_ERRORS
+
+def backoff_seconds(attempt: int, base: float = 30, cap: float = 900) -> float:
+    """ Returns the full jitter backoff of the retry, spreads retries of a burst instead of retrying in lockstep
+        :argument: attempt - Number of the failed start attempts
+        :argument: base - Backoff of the first retry in seconds
+        :argument: cap - Maximum backoff in seconds
+        :return: seconds - Random delay between 0 and the capped exponential backoff
+    """
+    return random.uniform(0, min(cap, base * 2 ** max(attempt - 1, 0)))
+
+def running_executions(state_machine_arn: str) -> int:
+    """ Counts the running executions of the state machine """
+    step_functions = boto3.client('stepfunctions')
+    running = 0
+    for page in step_functions.get_paginator('list_executions').paginate(stateMachineArn=state_machine_arn,
+                                                                          statusFilter='RUNNING'):
+        running += len(page['executions'])
+    return running
+
+def running_sagemaker_jobs(name_prefix: str, training: bool = False) -> int:
+    """ Counts the in progress SageMaker Processing Jobs, and Training Jobs if requested, with the name prefix
+        :argument: name_prefix - Prefix of the job names, e.g. model-inference-
+        :argument: training - True to count Training Jobs as well
+        :return: running - Number of in progress jobs
+    """
+    sagemaker = boto3.client('sagemaker', region_name='us-east-1')
+    listings = [('list_processing_jobs', 'ProcessingJobSummaries', 'ProcessingJobName')]
+    if training:
+        listings.append(('list_training_jobs', 'TrainingJobSummaries', 'TrainingJobName'))
+    running = 0
+    for operation, summaries, name in listings:
+        for page in sagemaker.get_paginator(operation).paginate(StatusEquals='InProgress', NameContains=name_prefix):
+            running += sum(1 for job in page[summaries] if job[name].startswith(name_prefix))
+    return running
+
+
+class AdmissionQueue(ABC):
+    """ Queue of the job starts waiting for free capacity """
+    @abstractmethod
+    def send(self, payload: dict) -> str:
+        """ Queues the job start
+            :argument: payload - Dictionary with the start parameters
+            :return: message_id - ID of the queued message
+        """
+
+    @abstractmethod
+    def receive(self, max_messages: int) -> list:
+        """ Receives waiting messages as dictionaries with id, handle, payload, sent_at and receive_count
+            :argument: max_messages - Maximum number of messages to receive
+            :return: messages - List of received messages, oldest first
+        """
+
+    @abstractmethod
+    def delete(self, handle: str) -> None:
+        """ Removes the received message of a started job
+            :argument: handle - Handle of the received message
+            :return: None
+        """
+
+    @abstractmethod
+    def retry_later(self, handle: str, seconds: float) -> None:
+        """ Returns the received message to the queue, it is received again after the delay
+            :argument: handle - Handle of the received message
+            :argument: seconds - Delay before the message is visible again
+            :return: None
+        """
+
+    @abstractmethod
+    def depth(self) -> int:
+        """ Returns the number of waiting messages """
+
+
+class SqsAdmissionQueue(AdmissionQueue):
+    """ Admission queue on SQS, received messages stay invisible until deleted or their retry delay passed,
+        so a failed dispatcher does not lose them
+    """
+    def __init__(self, queue_url: str, visibility_seconds: int = 300):
+        self.queue_url = queue_url
+        self.visibility_seconds = visibility_seconds
+        self.sqs = boto3.client('sqs')
+
+    def send(self, payload: dict) -> str:
+        return self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(payload))['MessageId']
+
+    def receive(self, max_messages: int) -> list:
+        messages = []
+        # SQS returns at most 10 messages per call
+        while len(messages) < max_messages:
+            response = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=min(10, max_messages - len(messages)),
+                                                AttributeNames=['SentTimestamp', 'ApproximateReceiveCount'],
+                                                VisibilityTimeout=self.visibility_seconds, WaitTimeSeconds=0)
+            received = response.get('Messages', [])
+            if not received:
+                break
+            for message in received:
+                messages.append({'id': message['MessageId'], 'handle': message['ReceiptHandle'],
+                                 'payload': json.loads(message['Body']),
+                                 'sent_at': int(message['Attributes']['SentTimestamp']) / 1000,
+                                 'receive_count': int(message['Attributes']['ApproximateReceiveCount'])})
+        return messages
+
+    def delete(self, handle: str) -> None:
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=handle)
+
+    def retry_later(self, handle: str, seconds: float) -> None:
+        self.sqs.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=handle, VisibilityTimeout=int(seconds))
+
+    def depth(self) -> int:
+        attributes = self.sqs.get_queue_attributes(QueueUrl=self.queue_url,
+                                                   AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+        return int(attributes['ApproximateNumberOfMessages'])
+
+
+class LocalAdmissionQueue(AdmissionQueue):
+    """ In-memory stand-in of the SQS admission queue for local runs, the clock can be simulated """
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.messages = deque()
+        self.in_flight = {}
+        self.counter = 0
+
+    def send(self, payload: dict) -> str:
+        self.counter += 1
+        message_id = f"local-{self.counter}"
+        self.messages.append({'id': message_id, 'sequence': self.counter, 'payload': payload, 'sent_at': self.clock(),
+                              'receive_count': 0, 'visible_at': 0})
+        return message_id
+
+    def receive(self, max_messages: int) -> list:
+        now = self.clock()
+        received = []
+        for message in list(self.messages):
+            if len(received) == max_messages:
+                break
+            if message['visible_at'] <= now:
+                self.messages.remove(message)
+                message['receive_count'] += 1
+                self.in_flight[message['id']] = message
+                received.append(dict(message, handle=message['id']))
+        return received
+
+    def delete(self, handle: str) -> None:
+        self.in_flight.pop(handle)
+
+    def retry_later(self, handle: str, seconds: float) -> None:
+        message = self.in_flight.pop(handle)
+        message['visible_at'] = self.clock() + seconds
+        # Keep the send order, retried messages are received again before newer ones once visible
+        self.messages = deque(sorted([*self.messages, message], key=lambda waiting: waiting['sequence']))
+
+    def depth(self) -> int:
+        return len(self.messages)
+
+
+class AdmissionController:
+    """ Starts queued jobs while fewer than limit jobs run, emits queue depth and wait time as metrics """
+    def __init__(self, name: str, queue: AdmissionQueue, limit: int, running: Callable[[], int],
+                 sink: str = 'emf', clock: Callable[[], float] = time.time):
+        self.name = name
+        self.queue = queue
+        self.limit = limit
+        self.running = running
+        self.sink = sink
+        self.clock = clock
+        self.records = []
+
+    def emit(self, **metrics) -> dict:
+        """ Emits the admission metrics of the queue as Embedded Metric Format log line
+            :argument: metrics - Metric name to value, WaitSeconds in seconds, others are counts
+            :return: record - Dictionary with the emitted EMF record
+        """
+        definitions = [{'Name': name, 'Unit': 'Seconds' if name.endswith('Seconds') else 'Count'} for name in metrics]
+        record = {'_aws': {'Timestamp': int(self.clock() * 1000),
+                           'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [['Queue']],
+                                                  'Metrics': definitions}]},
+                  'Queue': self.name, **metrics}
+        self.records.append(record)
+        if self.sink == 'emf':
+            print(json.dumps(record), flush=True)
+        return record
+
+    def submit(self, payload: dict, start: Callable[[dict], dict]) -> dict:
+        """ Queues the job start and dispatches right away, so the job starts now when capacity is free
+            and nothing older is waiting
+            :argument: payload - JSON serializable input of the start function
+            :argument: start - Function starting the job from the payload
+            :return: result - Dictionary with the message id, queued flag and start result if started
+        """
+        message_id = self.queue.send(payload)
+        started = self.dispatch(start)
+        if message_id in started:
+            return {'message_id': message_id, 'queued': False, 'result': started[message_id]}
+        return {'message_id': message_id, 'queued': True, 'result': None}
+
+    def dispatch(self, start: Callable[[dict], dict]) -> dict:
+        """ Starts waiting jobs oldest first until the limit is reached, a start rejected for capacity
+            goes back to the queue with a jittered delay and ends the dispatch
+            :argument: start - Function starting the job from the payload
+            :return: started - Dictionary of message id to start result
+        """
+        running = self.running()
+        started = {}
+        failed = 0
+        while running < self.limit:
+            messages = self.queue.receive(self.limit - running)
+            if not messages or failed:
+                break
+            for index, message in enumerate(messages):
+                try:
+                    started[message['id']] = start(message['payload'])
+                except Exception as error:
+                    if not is_capacity_error(error):
+                        # Failing starts are retried until the queue moves them to its dead-letter queue
+                        print(json.dumps({'Queue': self.name, 'MessageId': message['id'], 'Error': repr(error)}), flush=True)
+                        self.queue.retry_later(message['handle'], backoff_seconds(message['receive_count']))
+                        failed += 1
+                        continue
+                    # The received messages not tried yet are released for the next dispatch
+                    for waiting in messages[index:]:
+                        self.queue.retry_later(waiting['handle'], backoff_seconds(waiting['receive_count']))
+                    running = self.limit
+                    break
+                self.queue.delete(message['handle'])
+                running += 1
+                self.emit(WaitSeconds=max(self.clock() - message['sent_at'], 0.0))
+        self.emit(QueueDepth=self.queue.depth(), RunningJobs=running, Started=len(started), Failed=failed)
+        return started
+
@@ -0,0 +1,291 @@
+import json
+import math
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Optional
+
+import boto3
+
+
+NAMESPACE = 'MLOps/Drift'
+SKETCH_PREFIX = 'drift/sketches/'
+BASELINE_KEY = 'drift/sketches/train/baseline.json'
+# Settings and sensors of the C-MAPSS data, unit, cycle and the target are not checked for drift
+SKETCH_COLUMNS = ['altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, 22)]
+
+
+def scale(q: float, compression: float) -> float:
+    """ Returns the t-digest k1 scale of the quantile, centroids are small at the tails and large at the median
+        :argument: q - Quantile between 0 and 1
+        :argument: compression - Sketch compression, about compression / 2 centroids are kept
+        :return: k - Position of the quantile on the scale, one centroid spans at most 1
+    """
+    return compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+def quantile_limit(k: float, compression: float) -> float:
+    """ Returns the quantile at the position of the scale, the inverse of scale """
+    if k >= compression / 4:
+        return 1.0
+    return (math.sin(2 * math.pi * k / compression) + 1) / 2
+
+
+class QuantileSketch:
+    """ Mergeable sketch of one column: count, mean, variance, min and max, and a t-digest of centroids
+        for the quantiles and the distribution function. Merging two sketches gives the sketch of
+        both datasets, so sketches of partitioned ingests add up without reading the rows again.
+    """
+    def __init__(self, compression: float = 200, count: int = 0, mean: float = 0.0, m2: float = 0.0,
+                 minimum: float = math.inf, maximum: float = -math.inf, means: list = None, weights: list = None):
+        self.compression = compression
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.min = minimum
+        self.max = maximum
+        self.means = means or []
+        self.weights = weights or []
+        self.cached = None
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """ Merges the other sketch into this one, moments with the parallel variance formula
+            and centroids with one compression pass over both sorted centroid lists
+            :argument: other - Sketch of another part of the data
+            :return: sketch - This sketch, updated
+        """
+        if other.count == 0:
+            return self
+        centroids = sorted(zip(self.means + other.means, self.weights + other.weights))
+        self.add_moments(other)
+        self.compress(centroids)
+        return self
+
+    def add_moments(self, other: 'QuantileSketch') -> None:
+        """ Adds count, mean, variance, min and max of the other sketch """
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+
+    @classmethod
+    def merged(cls, sketches: list) -> 'QuantileSketch':
+        """ Merges the sketches into a new sketch with one compression pass over all their centroids """
+        sketches = [sketch for sketch in sketches if sketch.count]
+        if not sketches:
+            return cls()
+        result = cls(compression=sketches[0].compression)
+        centroids = []
+        for sketch in sketches:
+            result.add_moments(sketch)
+            centroids += zip(sketch.means, sketch.weights)
+        result.compress(sorted(centroids))
+        return result
+
+    def compress(self, centroids: list) -> None:
+        """ Merges neighbouring centroids while they span at most 1 on the scale, the scale is inverted once
+            per kept centroid so the pass over the centroids only compares weights
+            :argument: centroids - List of (mean, weight) tuples sorted by mean
+        """
+        total = sum(weight for _, weight in centroids)
+        means, weights = [], []
+        mean, weight = centroids[0]
+        merged_weight = 0
+        limit = total * quantile_limit(scale(0.0, self.compression) + 1, self.compression)
+        for next_mean, next_weight in centroids[1:]:
+            if merged_weight + weight + next_weight <= limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+                continue
+            means.append(mean)
+            weights.append(weight)
+            merged_weight += weight
+            limit = total * quantile_limit(scale(merged_weight / total, self.compression) + 1, self.compression)
+            mean, weight = next_mean, next_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+        self.cached = None
+
+    def interpolation(self) -> tuple:
+        """ Returns the points and cumulative weights interpolated by cdf and quantile, centroid i holds
+            half of its weight on each side of its mean. Kept until the next merge.
+        """
+        if self.cached is None:
+            cumulative = [0.0]
+            seen = 0
+            for weight in self.weights:
+                cumulative.append(seen + weight / 2)
+                seen += weight
+            cumulative.append(seen)
+            self.cached = ([self.min] + self.means + [self.max], cumulative)
+        return self.cached
+
+    def cdf(self, value: float) -> float:
+        """ Returns the estimated share of values below the value, interpolated between the centroids
+            :argument: value - Value of the column
+            :return: share - Number between 0 and 1
+        """
+        if self.count == 0 or value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        points, cumulative = self.interpolation()
+        seen = cumulative[-1]
+        right = min(max(bisect_right(points, value), 1), len(points) - 1)
+        left = right - 1
+        if points[right] == points[left]:
+            return cumulative[right] / seen
+        share = (value - points[left]) / (points[right] - points[left])
+        return (cumulative[left] + share * (cumulative[right] - cumulative[left])) / seen
+
+    def quantile(self, q: float) -> float:
+        """ Returns the estimated value at the quantile, interpolated between the centroids """
+        if self.count == 0:
+            return math.nan
+        points, cumulative = self.interpolation()
+        seen = cumulative[-1]
+        target = q * seen
+        right = min(max(bisect_left(cumulative, target), 1), len(points) - 1)
+        left = right - 1
+        if cumulative[right] == cumulative[left]:
+            return points[right]
+        share = (target - cumulative[left]) / (cumulative[right] - cumulative[left])
+        return points[left] + share * (points[right] - points[left])
+
+    def to_dict(self) -> dict:
+        """ Returns the JSON serializable sketch, centroid means are kept with 7 significant digits """
+        return {'compression': self.compression, 'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'means': [float(f"{mean:.7g}") for mean in self.means], 'weights': self.weights}
+
+    @classmethod
+    def from_dict(cls, sketch: dict) -> 'QuantileSketch':
+        if not sketch['count']:
+            return cls(compression=sketch['compression'])
+        return cls(compression=sketch['compression'], count=sketch['count'], mean=sketch['mean'], m2=sketch['m2'],
+                   minimum=sketch['min'], maximum=sketch['max'], means=sketch['means'], weights=sketch['weights'])
+
+
+def merge_sketches(sketch_files: list) -> dict:
+    """ Merges the column sketches of several sketch files, the centroids of a column are compressed once
+        :argument: sketch_files - List of dictionaries with a columns dictionary of column name to sketch dictionary
+        :return: sketches - Dictionary of column name to merged QuantileSketch
+    """
+    parts = {}
+    for stored in sketch_files:
+        for column, sketch in stored['columns'].items():
+            parts.setdefault(column, []).append(QuantileSketch.from_dict(sketch))
+    return {column: QuantileSketch.merged(sketches) for column, sketches in parts.items()}
+
+def sketch_file(sketches: dict, dataset: str, execution_id: str) -> dict:
+    """ Creates the stored sketch file of the ingest
+        :argument: sketches - Dictionary of column name to QuantileSketch
+        :argument: dataset - Name of the curated dataset, inference or train
+        :argument: execution_id - Name of the Step Functions execution
+        :return: sketch_file - JSON serializable dictionary
+    """
+    rows = max((sketch.count for sketch in sketches.values()), default=0)
+    return {'dataset': dataset, 'execution_id': execution_id, 'rows': rows,
+            'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'columns': {column: sketch.to_dict() for column, sketch in sketches.items()}}
+
+def sketch_key(dataset: str, execution_id: str, day: Optional[str] = None) -> str:
+    """ Returns the S3 key of the ingest sketch, the train baseline is replaced by every total ingest and
+        inference sketches are kept per day, so a drift window is read with one listing per day
+    """
+    if dataset == 'train':
+        return BASELINE_KEY
+    day = day or datetime.utcnow().strftime('%Y-%m-%d')
+    return f"{SKETCH_PREFIX}{dataset}/{day}/{execution_id}.json"
+
+def read_json(bucket: str, key: str) -> Optional[dict]:
+    """ Reads the JSON object, None if it does not exist """
+    s3 = boto3.client('s3')
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def write_json(bucket: str, key: str, body: dict) -> None:
+    boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=json.dumps(body).encode('utf-8'))
+
+def window_sketches(bucket: str, dataset: str, days: int, today: Optional[datetime] = None) -> dict:
+    """ Merges the ingest sketches of the last days. Finished days are compacted into one daily sketch
+        the first time they are read, so a check reads one object per past day and the sketches of today.
+        :argument: bucket - Name of the storage bucket
+        :argument: dataset - Name of the curated dataset
+        :argument: days - Number of days in the window, today included
+        :argument: today - Date of the check, now by default
+        :return: sketches - Dictionary of column name to merged QuantileSketch, empty if no data in the window
+    """
+    s3 = boto3.client('s3')
+    today = today or datetime.utcnow()
+    sketch_files = []
+    for offset in range(days):
+        day = (today - timedelta(days=offset)).strftime('%Y-%m-%d')
+        daily_key = f"{SKETCH_PREFIX}{dataset}/daily/{day}.json"
+        if offset > 0:
+            daily = read_json(bucket, daily_key)
+            if daily is not None:
+                sketch_files.append(daily)
+                continue
+        day_files = []
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f"{SKETCH_PREFIX}{dataset}/{day}/"):
+            day_files += [read_json(bucket, item['Key']) for item in page.get('Contents', [])]
+        if not day_files:
+            continue
+        if offset > 0:
+            # The day is over, the compacted sketch is the same whichever check writes it
+            write_json(bucket, daily_key, sketch_file(merge_sketches(day_files), dataset, f"daily-{day}"))
+        sketch_files += day_files
+    return merge_sketches(sketch_files)
+
+def compare(baseline: dict, current: dict, ks_threshold: float, min_rows: int = 100) -> dict:
+    """ Compares the current sketches with the baseline column by column, in time of the sketch size.
+        The Kolmogorov-Smirnov statistic is the largest distance of the distribution functions,
+        evaluated at the centroid means of both sketches, the mean shift is in baseline standard deviations.
+        :argument: baseline - Dictionary of column name to QuantileSketch of the training data
+        :argument: current - Dictionary of column name to QuantileSketch of the recent inference data
+        :argument: ks_threshold - Kolmogorov-Smirnov statistic above which a column drifted
+        :argument: min_rows - Minimum rows of a column in the current sketch to be compared
+        :return: report - Dictionary with the statistics per column and the list of drifted columns
+    """
+    columns = {}
+    for column, reference in baseline.items():
+        sketch = current.get(column)
+        if sketch is None or sketch.count < min_rows or reference.count == 0:
+            continue
+        points = sorted(set(reference.means + sketch.means))
+        ks = max(abs(reference.cdf(point) - sketch.cdf(point)) for point in points)
+        deviation = math.sqrt(reference.variance)
+        mean_shift = abs(sketch.mean - reference.mean) / deviation if deviation > 0 else 0.0
+        columns[column] = {'ks': ks, 'mean_shift': mean_shift, 'rows': sketch.count,
+                           'baseline_mean': reference.mean, 'mean': sketch.mean,
+                           'baseline_std': deviation, 'std': math.sqrt(sketch.variance),
+                           'baseline_median': reference.quantile(0.5), 'median': sketch.quantile(0.5)}
+    drifted = sorted(column for column, statistics in columns.items() if statistics['ks'] > ks_threshold)
+    return {'columns': columns, 'drifted': drifted, 'ks_threshold': ks_threshold}
+
+def emit_drift_metrics(report: dict) -> dict:
+    """ Emits the drift statistics as Embedded Metric Format log lines, per sensor and the drifted count
+        :argument: report - Dictionary returned by compare
+        :return: record - Dictionary with the emitted record of the drifted count
+    """
+    for column, statistics in report['columns'].items():
+        print(json.dumps({'_aws': {'Timestamp': int(datetime.utcnow().timestamp() * 1000),
+                                   'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [['Sensor']],
+                                                          'Metrics': [{'Name': 'KSStatistic', 'Unit': 'None'},
+                                                                      {'Name': 'MeanShift', 'Unit': 'None'}]}]},
+                          'Sensor': column, 'KSStatistic': statistics['ks'], 'MeanShift': statistics['mean_shift']}),
+              flush=True)
+    record = {'_aws': {'Timestamp': int(datetime.utcnow().timestamp() * 1000),
+                       'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [[]],
+                                              'Metrics': [{'Name': 'DriftedSensors', 'Unit': 'Count'}]}]},
+              'DriftedSensors': len(report['drifted'])}
+    print(json.dumps(record), flush=True)
+    return record
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import pstats
+import marshal
+import cProfile
+import threading
+import tracemalloc
+from io import StringIO
+from collections import Counter
+from contextlib import contextmanager
+
+import boto3
+
+
+PROFILE_MODES = ['off', 'cprofile', 'sampling', 'all']
+
+
+def collapse_stack(frame) -> str:
+    """ Formats the call stack of the frame as one collapsed stack line, outermost call first
+        :argument: frame - Innermost frame of the sampled thread
+        :return: stack - Semicolon separated function names as read by flamegraph.pl and speedscope
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class StackSampler:
+    """ Samples the call stack of one thread at a fixed interval and counts the collapsed stacks """
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse_stack(frame)] += 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self) -> str:
+        """ Returns the sampled stacks in the collapsed format, one 'stack count' line per stack """
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class JobProfiler:
+    """ Opt-in profiler of the job sections, collects cProfile statistics and/or sampled collapsed stacks
+        together with the tracemalloc peak memory of every section. Sections should not be nested.
+    """
+    def __init__(self, mode: str = 'off', output: str = None, interval: float = 0.005):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Profile mode {mode} is not one of {PROFILE_MODES}")
+        self.mode = mode
+        self.output = output
+        self.interval = interval
+        self.enabled = mode != 'off'
+        self.sections = {}
+        self.files = {}
+
+    @contextmanager
+    def section(self, name: str):
+        """ Profiles the wrapped block as the job section, does nothing when profiling is off """
+        if not self.enabled:
+            yield
+            return
+        profiler = cProfile.Profile() if self.mode in ['cprofile', 'all'] else None
+        sampler = StackSampler(threading.get_ident(), self.interval) if self.mode in ['sampling', 'all'] else None
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        # Clearing the traces also resets the peak, so the peak covers allocations of this section only
+        tracemalloc.clear_traces()
+        start = time.perf_counter()
+        if sampler is not None:
+            sampler.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            if started_tracing:
+                tracemalloc.stop()
+            summary = {'Seconds': seconds, 'PeakMemoryBytes': peak,
+                       'TopAllocations': [{'Location': str(stat.traceback), 'SizeBytes': stat.size, 'Count': stat.count}
+                                          for stat in top]}
+            if profiler is not None:
+                # Same format as written by cProfile dump_stats, readable by pstats and snakeviz
+                profiler.create_stats()
+                self.files[f"{name}.prof"] = marshal.dumps(profiler.stats)
+                report = StringIO()
+                pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(30)
+                self.files[f"{name}.txt"] = report.getvalue().encode('utf-8')
+            if sampler is not None:
+                summary['Samples'] = sum(sampler.counts.values())
+                self.files[f"{name}.collapsed"] = sampler.collapsed().encode('utf-8')
+            self.sections[name] = summary
+
+    def save(self) -> list:
+        """ Writes the profiles, flamegraph stacks and memory summary to the S3 prefix or local directory output
+            :return: locations - List of written file locations
+        """
+        if not self.enabled or not self.sections:
+            return []
+        files = dict(self.files)
+        files['memory.json'] = json.dumps(self.sections, indent=2).encode('utf-8')
+        locations = []
+        if self.output.startswith('s3://'):
+            bucket, prefix = self.output[len('s3://'):].split('/', 1)
+            s3 = boto3.client('s3')
+            for file_name, body in files.items():
+                key = prefix.rstrip('/') + '/' + file_name
+                s3.put_object(Bucket=bucket, Key=key, Body=body)
+                locations.append(f"s3://{bucket}/{key}")
+        else:
+            os.makedirs(self.output, exist_ok=True)
+            for file_name, body in files.items():
+                location = os.path.join(self.output, file_name)
+                with open(location, 'wb') as file:
+                    file.write(body)
+                locations.append(location)
+        print(json.dumps({'ProfileOutput': self.output, 'Sections': {name: {'Seconds': summary['Seconds'],
+                          'PeakMemoryBytes': summary['PeakMemoryBytes']} for name, summary in self.sections.items()}}))
+        return locations
+
+
+def profile_output(bucket: str, execution_id: str, job: str) -> str:
+    """ Defines the location of the job profiles of the ETL execution
+        :argument: bucket - Name of the artifacts bucket, or local directory when running on sample files
+        :argument: execution_id - Name of the Step Functions execution
+        :argument: job - Name of the profiled job
+        :return: output - S3 prefix or local directory of the profiles
+    """
+    if bucket.startswith('/') or bucket.startswith('.'):
+        return os.path.join(bucket, 'profiles', execution_id, job)
+    return f"s3://{bucket}/profiles/{execution_id}/{job}"
@@ -0,0 +1,32 @@
+import os
+import time
+from typing import Any, Callable
+
+import boto3
+
+from pipeline_timing import SpanEmitter
+
+
+NAMESPACE = 'MLOps/Inference'
+
+
+def load_model_from_environment(load: Callable[[str], Any]) -> Any:
+    """ Loads the model staged by the inference Lambda from the local ProcessingInput and publishes the
+        load time of the job, also as the inference_model_load span of the trace passed by the Lambda
+        :argument: load - Function loading the model from a local directory, e.g. mlflow.pyfunc.load_model
+        :return: model - Model returned by load
+    """
+    start = time.perf_counter()
+    model = load(os.environ['ModelArtifactPath'])
+    seconds = time.perf_counter() - start
+    cloudwatch = boto3.client('cloudwatch')
+    cloudwatch.put_metric_data(Namespace=NAMESPACE, MetricData=[
+        {'MetricName': 'ModelLoadSeconds', 'Dimensions': [{'Name': 'ModelName', 'Value': os.environ['ModelName']}],
+         'Value': seconds, 'Unit': 'Seconds'}
+    ])
+    # Processing Job logs are not parsed as EMF, so the span is published through PutMetricData
+    timing = SpanEmitter(sink='cloudwatch')
+    timing.emit(os.environ['TraceId'], 'inference_model_load', seconds, job_name=os.environ['ProcessingJobName'],
+                model_version=os.environ['ModelVersion'])
+    timing.flush()
+    return model
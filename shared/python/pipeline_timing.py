@@ -0,0 +1,103 @@
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+import boto3
+
+
+NAMESPACE = 'MLOps/Pipeline'
+METRIC_NAME = 'StageDuration'
+
+
+def trace_id_for(bucket: str, file_key: str) -> str:
+    """ Derives the correlation ID of all pipeline stages from the landed source object
+        :argument: bucket - Name of the S3 bucket where data lands
+        :argument: file_key - S3 path of the landed raw file
+        :return: trace_id - Correlation ID of the pipeline run
+    """
+    return hashlib.sha1(f"{bucket}/{file_key}".encode('utf-8')).hexdigest()[:16]
+
+
+class LocalCollector:
+    """ Collects emitted spans in memory so local runs can check the stage timings """
+    def __init__(self):
+        self.records = []
+
+    def add(self, record: dict) -> None:
+        self.records.append(record)
+
+    def durations(self, trace_id: str = None) -> dict:
+        """ Returns the stage durations in seconds, optionally of one trace only
+            :argument: trace_id - Correlation ID of the pipeline run
+            :return: durations - Dictionary of stage name to duration in seconds
+        """
+        return {record['Stage']: record[METRIC_NAME] for record in self.records
+                if trace_id is None or record['TraceId'] == trace_id}
+
+
+class SpanEmitter:
+    """ Emits stage spans as CloudWatch metrics, either as Embedded Metric Format log lines or through
+        the PutMetricData API where log lines are not forwarded unchanged (Glue jobs)
+    """
+    def __init__(self, sink: str = 'emf'):
+        self.sink = sink
+        self.collector = None
+        self.pending = []
+
+    def emit(self, trace_id: str, stage: str, seconds: float, **properties) -> dict:
+        """ Emits the span of the pipeline stage
+            :argument: trace_id - Correlation ID of the pipeline run
+            :argument: stage - Name of the pipeline stage, used as metric dimension
+            :argument: seconds - Duration of the stage
+            :argument: properties - Additional properties logged with the span
+            :return: record - Dictionary with the emitted EMF record
+        """
+        record = {'_aws': {'Timestamp': int(time.time() * 1000),
+                           'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [['Stage']],
+                                                  'Metrics': [{'Name': METRIC_NAME, 'Unit': 'Seconds'}]}]},
+                  'Stage': stage, 'TraceId': trace_id, METRIC_NAME: seconds}
+        record.update(properties)
+        if self.collector is not None:
+            self.collector.add(record)
+        if self.sink == 'emf':
+            print(json.dumps(record), flush=True)
+        elif self.sink == 'cloudwatch':
+            print(json.dumps({'Stage': stage, 'TraceId': trace_id, METRIC_NAME: seconds, **properties}), flush=True)
+            self.pending.append({'MetricName': METRIC_NAME, 'Dimensions': [{'Name': 'Stage', 'Value': stage}],
+                                 'Value': seconds, 'Unit': 'Seconds'})
+        return record
+
+    def flush(self) -> None:
+        """ Publishes the spans buffered by the cloudwatch sink """
+        if self.sink == 'cloudwatch' and self.pending:
+            cloudwatch = boto3.client('cloudwatch')
+            # PutMetricData accepts at most 1000 metrics per call
+            for i in range(0, len(self.pending), 1000):
+                cloudwatch.put_metric_data(Namespace=NAMESPACE, MetricData=self.pending[i:i + 1000])
+        self.pending = []
+
+    @contextmanager
+    def span(self, trace_id: str, stage: str, **properties):
+        """ Times the wrapped block as the span of the pipeline stage """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit(trace_id, stage, time.perf_counter() - start, **properties)
+
+    def emit_since(self, trace_id: str, stage: str, started_at: Optional[str], **properties) -> Optional[dict]:
+        """ Emits the span from the ISO 8601 start time until now, e.g. the Glue start-up after the
+            state machine entered the task
+            :argument: trace_id - Correlation ID of the pipeline run
+            :argument: stage - Name of the pipeline stage
+            :argument: started_at - ISO 8601 time the stage started, no span is emitted if empty
+            :return: record - Dictionary with the emitted EMF record or None
+        """
+        if not started_at:
+            return None
+        start = datetime.fromisoformat(started_at.replace('Z', '+00:00'))
+        seconds = (datetime.now(timezone.utc) - start).total_seconds()
+        return self.emit(trace_id, stage, seconds, **properties)
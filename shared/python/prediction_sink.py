@@ -0,0 +1,147 @@
+import io
+import os
+import json
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Output contract of the batch inference job, matches the Glue table defined in InferenceStack
+PREDICTION_SCHEMA = pa.schema([('unit', pa.int32()), ('cycle', pa.int32()), ('timestamp', pa.timestamp('ms')),
+                               ('predicted_rul', pa.float32()), ('model_version', pa.string())])
+PARTITION_COLUMN = 'prediction_date'
+LATEST_TABLE = 'latest_predictions'
+
+
+class PredictionSink:
+    """ Buffers the predictions of the inference job and writes them as large zstd parquet files
+        partitioned by prediction date, one file per partition and flush
+    """
+    def __init__(self, output_path: str, model_version: str, job_name: str, batch_rows: int = 1000000,
+                 row_group_rows: int = 250000):
+        self.output_path = output_path
+        self.model_version = str(model_version)
+        self.job_name = job_name
+        self.batch_rows = batch_rows
+        self.row_group_rows = row_group_rows
+        self.buffer = []
+        self.buffered_rows = 0
+        self.files = []
+        self.rows = 0
+        self.latest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Buffered rows of a failed job are dropped instead of publishing a partial batch
+        if exc_type is None:
+            self.close()
+
+    def write(self, predictions: pd.DataFrame) -> None:
+        """ Adds the predictions to the buffer and flushes it once it holds batch_rows rows
+            :argument: predictions - Pandas DataFrame with unit, cycle, timestamp and predicted_rul columns
+            :return: None
+        """
+        self.buffer.append(predictions[['unit', 'cycle', 'timestamp', 'predicted_rul']])
+        self.buffered_rows += len(predictions)
+        if self.buffered_rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Writes the buffered predictions, one parquet file per prediction date """
+        if not self.buffer:
+            return
+        data = pd.concat(self.buffer, ignore_index=True) if len(self.buffer) > 1 else self.buffer[0]
+        self.buffer, self.buffered_rows = [], 0
+        data = data.assign(timestamp=pd.to_datetime(data['timestamp']), model_version=self.model_version)
+        table = pa.Table.from_pandas(data, schema=PREDICTION_SCHEMA, preserve_index=False, safe=False)
+        dates = data['timestamp'].dt.strftime('%Y-%m-%d').to_numpy()
+        for date in pd.unique(dates):
+            directory = os.path.join(self.output_path, f"{PARTITION_COLUMN}={date}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.job_name}-{len(self.files):05d}.parquet")
+            pq.write_table(table.filter(pa.array(dates == date)), path, compression='zstd',
+                           row_group_size=self.row_group_rows)
+            self.files.append(path)
+        self.rows += len(data)
+        # Keep only the last cycle of every unit for the Grafana table
+        latest = data if self.latest is None else pd.concat([self.latest, data], ignore_index=True)
+        self.latest = latest.sort_values(['unit', 'cycle'], kind='stable').drop_duplicates('unit', keep='last')
+
+    def close(self) -> dict:
+        """ Flushes the remaining predictions
+            :return: summary - Dictionary with written rows, files and partitions
+        """
+        self.flush()
+        partitions = sorted({os.path.basename(os.path.dirname(path)) for path in self.files})
+        return {'rows': self.rows, 'files': len(self.files), 'partitions': partitions}
+
+
+def latest_table_sql(table: str = LATEST_TABLE) -> str:
+    """ Creates the DDL of the Grafana table with the latest prediction per unit """
+    return (f"CREATE TABLE IF NOT EXISTS {table} (unit INTEGER PRIMARY KEY, cycle INTEGER NOT NULL, "
+            f"timestamp TIMESTAMP NOT NULL, predicted_rul REAL NOT NULL, model_version TEXT NOT NULL, "
+            f"loaded_at TIMESTAMP NOT NULL DEFAULT now())")
+
+def copy_latest(connection, latest: pd.DataFrame, table: str = LATEST_TABLE) -> int:
+    """ Bulk loads the latest prediction per unit into Postgres with COPY through a staging table,
+        then upserts on unit so the table always holds one row per unit
+        :argument: connection - Open psycopg2 connection
+        :argument: latest - Pandas DataFrame kept by PredictionSink.latest
+        :argument: table - Name of the target table
+        :return: rows - Number of loaded rows
+    """
+    columns = ['unit', 'cycle', 'timestamp', 'predicted_rul', 'model_version']
+    buffer = io.StringIO()
+    latest[columns].to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+    buffer.seek(0)
+    names = ', '.join(columns)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != 'unit')
+    with connection.cursor() as cursor:
+        cursor.execute(latest_table_sql(table))
+        cursor.execute(f"CREATE TEMP TABLE {table}_staging (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY {table}_staging ({names}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"INSERT INTO {table} ({names}, loaded_at) SELECT {names}, now() FROM {table}_staging "
+                       f"ON CONFLICT (unit) DO UPDATE SET {updates}, loaded_at = EXCLUDED.loaded_at")
+    connection.commit()
+    return len(latest)
+
+def grafana_connection(secret_arn: str, host: str, database: str, port: int = 5432):
+    """ Opens a connection to the Grafana Aurora backend with the credentials from Secrets Manager
+        :argument: secret_arn - ARN of the database secret
+        :argument: host - Hostname of the Aurora cluster endpoint
+        :argument: database - Name of the Grafana database
+        :argument: port - Port of the Aurora cluster endpoint
+        :return: connection - Open psycopg2 connection
+    """
+    # Only needed when the bulk load is enabled, so the driver is not required by the sink itself
+    import psycopg2
+    secret = json.loads(boto3.client('secretsmanager').get_secret_value(SecretId=secret_arn)['SecretString'])
+    return psycopg2.connect(host=host, port=port, dbname=database, user=secret['username'],
+                            password=secret['password'], connect_timeout=10)
+
+def sink_from_environment() -> PredictionSink:
+    """ Creates the sink with the output path, model version and job name passed by the inference Lambda """
+    return PredictionSink(os.environ['PredictionOutputPath'], model_version=os.environ['ModelVersion'],
+                          job_name=os.environ['ProcessingJobName'],
+                          batch_rows=int(os.environ.get('PredictionBatchRows', 1000000)))
+
+def finish_from_environment(sink: PredictionSink) -> dict:
+    """ Closes the sink and, if enabled by the inference Lambda, loads the latest predictions into Grafana
+        :argument: sink - Sink created by sink_from_environment
+        :return: summary - Dictionary returned by PredictionSink.close with the loaded row count
+    """
+    summary = sink.close()
+    summary['copied_rows'] = 0
+    if os.environ.get('PredictionCopyEnabled', 'false').lower() == 'true' and sink.latest is not None:
+        connection = grafana_connection(os.environ['GrafanaDBSecretArn'], os.environ['GrafanaDBHost'],
+                                        os.environ['GrafanaDatabase'])
+        try:
+            summary['copied_rows'] = copy_latest(connection, sink.latest)
+        finally:
+            connection.close()
+    print(json.dumps(summary))
+    return summary
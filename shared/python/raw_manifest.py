@@ -0,0 +1,71 @@
+from typing import Optional
+
+import boto3
+
+
+MANIFEST_PREFIX = 'manifests/processed/'
+RAW_PREFIXES = ['raw/total/csv/', 'raw/partitioned/csv/']
+
+
+def normalize_etag(etag: str) -> str:
+    """ Removes the quotes S3 listings put around the ETag, S3 events send it without them """
+    return etag.strip('"')
+
+def manifest_key(file_key: str, etag: str) -> str:
+    """ Returns the ledger key of the processed raw object, the ETag is the last path part
+        so one listing of the ledger gives the processed version of every object
+        :argument: file_key - S3 path of the raw file
+        :argument: etag - ETag of the processed version of the raw file
+        :return: key - S3 key of the manifest entry
+    """
+    return f"{MANIFEST_PREFIX}{file_key}/{normalize_etag(etag)}"
+
+def list_objects(bucket: str, prefix: str) -> list:
+    """ Lists all objects under the prefix with their Key, ETag and LastModified """
+    s3 = boto3.client('s3')
+    objects = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        objects += page.get('Contents', [])
+    return objects
+
+def processed_versions(bucket: str) -> set:
+    """ Returns the (file_key, etag) pairs recorded in the ledger of the storage bucket """
+    versions = set()
+    for item in list_objects(bucket, MANIFEST_PREFIX):
+        file_key, etag = item['Key'][len(MANIFEST_PREFIX):].rsplit('/', 1)
+        versions.add((file_key, etag))
+    return versions
+
+def is_processed(bucket: str, file_key: str, etag: str) -> bool:
+    """ Checks if the version of the raw file was already processed by the ETL
+        :argument: bucket - Name of the storage bucket
+        :argument: file_key - S3 path of the raw file
+        :argument: etag - ETag of the raw file
+        :return: processed - True if the ledger has an entry for the version
+    """
+    s3 = boto3.client('s3')
+    try:
+        s3.head_object(Bucket=bucket, Key=manifest_key(file_key, etag))
+        return True
+    except s3.exceptions.ClientError as error:
+        # Only a missing entry means unprocessed, access or throttling errors must not start a duplicate run
+        if error.response['Error']['Code'] in ['404', 'NoSuchKey']:
+            return False
+        raise
+
+def list_unprocessed(bucket: str, limit: Optional[int] = None) -> list:
+    """ Lists the raw csv objects without a ledger entry for their current ETag, oldest first
+        :argument: bucket - Name of the storage bucket
+        :argument: limit - Maximum number of returned objects
+        :return: unprocessed - List of (file_key, etag) tuples
+    """
+    processed = processed_versions(bucket)
+    unprocessed = []
+    for prefix in RAW_PREFIXES:
+        for item in list_objects(bucket, prefix):
+            version = (item['Key'], normalize_etag(item['ETag']))
+            if not item['Key'].endswith('/') and version not in processed:
+                unprocessed.append((item['LastModified'], version))
+    # Keep the landing order, e.g. total train data is processed before later partitions
+    unprocessed.sort(key=lambda entry: entry[0])
+    return [version for _, version in unprocessed][:limit]
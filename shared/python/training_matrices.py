@@ -0,0 +1,96 @@
+import os
+import json
+import tempfile
+from datetime import datetime
+from typing import Optional
+
+import boto3
+import numpy as np
+import pandas as pd
+
+
+MATRICES_PREFIX = 'curated/total/matrices/'
+# Settings and sensors of the C-MAPSS data with the cycle as features, the RUL as target
+FEATURE_COLUMNS = ['cycle', 'altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, 22)]
+TARGET_COLUMN = 'rul'
+FILES = ['features.npy', 'target.npy', 'units.npy', 'offsets.npy']
+
+
+def build_matrices(data: pd.DataFrame) -> dict:
+    """ Builds the training ready arrays of the curated data: rows ordered by unit and cycle, float32
+        features and target in C order, and the row offsets of every unit
+        :argument: data - Pandas DataFrame with the curated train or test rows
+        :return: matrices - Dictionary with features, target, units and offsets arrays and the manifest
+    """
+    unit = data['unit'].to_numpy()
+    # Curated data is ordered already in most cases, then the rows are copied without a gather
+    order = np.lexsort((data['cycle'].to_numpy(), unit))
+    if (order == np.arange(len(order))).all():
+        order = slice(None)
+    columns = [column for column in FEATURE_COLUMNS if column in data.columns]
+    features = np.empty((len(data), len(columns)), dtype=np.float32)
+    for i, column in enumerate(columns):
+        features[:, i] = data[column].to_numpy()[order]
+    target = data[TARGET_COLUMN].to_numpy()[order].astype(np.float32)
+    # Rows of units[i] are offsets[i]:offsets[i + 1]
+    unit = unit[order]
+    starts = np.flatnonzero(np.diff(unit, prepend=unit[:1] - 1))
+    units = unit[starts].astype(np.int32)
+    offsets = np.append(starts, len(data)).astype(np.int64)
+    manifest = {'rows': len(data), 'units': len(units), 'feature_columns': columns, 'target_column': TARGET_COLUMN,
+                'dtype': 'float32', 'files': FILES}
+    return {'features': features, 'target': target, 'units': units, 'offsets': offsets, 'manifest': manifest}
+
+def save_matrices(matrices: dict, directory: str) -> dict:
+    """ Saves the arrays as .npy files with the manifest, np.load with mmap_mode maps them without a copy
+        :argument: matrices - Dictionary returned by build_matrices
+        :argument: directory - Local directory of the files
+        :return: manifest - Dictionary with the manifest written to manifest.json
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in FILES:
+        np.save(os.path.join(directory, name), np.ascontiguousarray(matrices[name[:-4]]))
+    with open(os.path.join(directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(matrices['manifest'], manifest_file)
+    return matrices['manifest']
+
+def load_matrices(directory: str, mmap_mode: Optional[str] = 'r') -> dict:
+    """ Loads the training matrices, memory-mapped by default so pages are read from disk on first access
+        :argument: directory - Local directory with the files of save_matrices, e.g. the ProcessingInput path
+        :argument: mmap_mode - Memory map mode of np.load, None reads the arrays into memory
+        :return: matrices - Dictionary with features, target, units and offsets arrays and the manifest
+    """
+    with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+        matrices = {'manifest': json.load(manifest_file)}
+    for name in FILES:
+        matrices[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode=mmap_mode)
+    return matrices
+
+def unit_rows(matrices: dict, unit: int) -> tuple:
+    """ Returns the feature and target rows of the unit as views of the mapped arrays """
+    i = int(np.searchsorted(matrices['units'], unit))
+    if i == len(matrices['units']) or matrices['units'][i] != unit:
+        raise KeyError(f"Unit {unit} is not in the training matrices")
+    start, end = matrices['offsets'][i], matrices['offsets'][i + 1]
+    return matrices['features'][start:end], matrices['target'][start:end]
+
+def publish_matrices(data: pd.DataFrame, bucket: str, dataset: str, execution_id: str) -> str:
+    """ Builds and uploads the training matrices of the ingest to a prefix of the execution, then points
+        latest.json at it, so a training started during the upload reads the previous complete set
+        :argument: data - Pandas DataFrame with the curated train or test rows
+        :argument: bucket - Name of the storage bucket
+        :argument: dataset - Name of the curated dataset, train or test
+        :argument: execution_id - Name of the Step Functions execution
+        :return: uri - S3 prefix of the uploaded matrices
+    """
+    s3 = boto3.client('s3')
+    prefix = f"{MATRICES_PREFIX}{dataset}/{execution_id}/"
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = save_matrices(build_matrices(data), directory)
+        for name in FILES + ['manifest.json']:
+            s3.upload_file(os.path.join(directory, name), bucket, prefix + name)
+    uri = f"s3://{bucket}/{prefix}"
+    latest = dict(manifest, uri=uri, execution_id=execution_id,
+                  created_at=datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
+    s3.put_object(Bucket=bucket, Key=f"{MATRICES_PREFIX}{dataset}/latest.json", Body=json.dumps(latest).encode('utf-8'))
+    return uri
@@ -0,0 +1,100 @@
+""" Local simulation of the admission queue in front of the ETL executions and SageMaker jobs
+
+    Runs shared/python/admission.py with the in-memory queue on a simulated clock: a burst of files lands,
+    every landing submits its job, finished jobs and the dispatch schedule start queued ones. A quota below the
+    admission limit makes starts fail like ConcurrentRunsExceededException or ResourceLimitExceeded, those go
+    back to the queue with jittered backoff. Checks that no more jobs run than allowed and every job starts.
+    Run with:
+        python tools/admission_simulation.py --files 40 --limit 4
+        python tools/admission_simulation.py --files 40 --limit 4 --quota 3
+"""
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared', 'python'))
+from admission import AdmissionController, LocalAdmissionQueue, CapacityExceeded
+
+
+class SimulatedJobs:
+    """ Jobs running on the simulated clock, starts over the quota are rejected like the service would """
+    def __init__(self, quota: int, duration: tuple, seed: int):
+        self.now = 0.0
+        self.quota = quota
+        self.duration = duration
+        self.generator = random.Random(seed)
+        self.ends = []
+        self.max_running = 0
+        self.rejected = 0
+
+    def clock(self) -> float:
+        return self.now
+
+    def running(self) -> int:
+        return sum(1 for end in self.ends if end > self.now)
+
+    def start(self, payload: dict) -> dict:
+        if self.running() >= self.quota:
+            self.rejected += 1
+            raise CapacityExceeded(f"{payload['file']} rejected at {self.running()} running jobs")
+        self.ends.append(self.now + self.generator.uniform(*self.duration))
+        self.max_running = max(self.max_running, self.running())
+        return {'file': payload['file'], 'started_at': self.now}
+
+
+def percentile(values: list, share: float) -> float:
+    """ Returns the nearest rank percentile of the values """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate the admission queue on a burst of landed files")
+    parser.add_argument('--files', type=int, default=40)
+    parser.add_argument('--limit', type=int, default=4, help="Admission limit, MaxConcurrentExecutions")
+    parser.add_argument('--quota', type=int, default=None, help="Concurrent runs accepted by the service")
+    parser.add_argument('--burst-seconds', type=float, default=60, help="Time over which the files land")
+    parser.add_argument('--min-duration', type=float, default=120)
+    parser.add_argument('--max-duration', type=float, default=600)
+    parser.add_argument('--dispatch-seconds', type=float, default=60, help="Rate of the dispatch schedule")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    quota = args.quota or args.limit
+    jobs = SimulatedJobs(quota, (args.min_duration, args.max_duration), args.seed)
+    queue = LocalAdmissionQueue(clock=jobs.clock)
+    controller = AdmissionController('simulation', queue, args.limit, jobs.running, sink='local', clock=jobs.clock)
+    random.seed(args.seed)
+    landings = sorted((random.uniform(0, args.burst_seconds), f"file-{i}.csv") for i in range(args.files))
+
+    # Landings, job ends and the dispatch schedule all trigger a dispatch, the clock moves from event to event
+    started = {}
+    next_dispatch = args.dispatch_seconds
+    while len(started) < args.files:
+        pending_ends = [end for end in jobs.ends if end > jobs.now]
+        candidates = [next_dispatch] + pending_ends + [landing for landing, _ in landings[:1]]
+        jobs.now = min(candidates)
+        if landings and landings[0][0] <= jobs.now:
+            _, file_name = landings.pop(0)
+            result = controller.submit({'file': file_name}, start=jobs.start)
+            if not result['queued']:
+                started[result['message_id']] = result['result']
+            continue
+        if jobs.now >= next_dispatch:
+            next_dispatch += args.dispatch_seconds
+        started.update(controller.dispatch(jobs.start))
+        assert jobs.max_running <= min(args.limit, quota), jobs.max_running
+
+    waits = [record['WaitSeconds'] for record in controller.records if 'WaitSeconds' in record]
+    depths = [record['QueueDepth'] for record in controller.records if 'QueueDepth' in record]
+    print(f"files {args.files}, admission limit {args.limit}, service quota {quota}")
+    print(f"max running jobs      {jobs.max_running:10d}")
+    print(f"rejected starts       {jobs.rejected:10d}")
+    print(f"max queue depth       {max(depths):10d}")
+    print(f"wait p50 (s)          {percentile(waits, 0.5):10.1f}")
+    print(f"wait p95 (s)          {percentile(waits, 0.95):10.1f}")
+    print(f"wait max (s)          {max(waits):10.1f}")
+    print(f"last start at (s)     {max(result['started_at'] for result in started.values()):10.1f}")
+    assert len(waits) == args.files and queue.depth() == 0
+    print("Admission simulation checks passed")
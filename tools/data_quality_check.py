@@ -0,0 +1,70 @@
+""" Local check of the key checks of glue_code/data_quality.py against a naive row by row implementation
+
+    Flags duplicate keys and steps back in cycles of repeated unit blocks, shuffled units and adjacent
+    duplicates, where every repeated (unit, cycle) key must be flagged wherever the rows sit in the file.
+    Then compares the flags with a loop that keeps the seen keys and the largest cycle of every unit.
+    Run with:
+        python tools/data_quality_check.py --units 50 --cycles 40
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from common import ROOT, synthetic_cmapss
+
+sys.path.insert(0, os.path.join(ROOT, 'glue_code'))
+from data_quality import DUPLICATE, NON_MONOTONIC, quality_flags
+
+
+def naive_key_flags(data: pd.DataFrame) -> np.ndarray:
+    """ Flags the duplicate keys and steps back one row at a time in file order """
+    flags = np.zeros(len(data), dtype=np.uint8)
+    seen, largest = set(), {}
+    for i, (unit, cycle) in enumerate(zip(data['unit'], data['cycle'])):
+        if (unit, cycle) in seen:
+            flags[i] |= DUPLICATE
+        if unit in largest and cycle < largest[unit]:
+            flags[i] |= NON_MONOTONIC
+        seen.add((unit, cycle))
+        largest[unit] = max(largest.get(unit, cycle), cycle)
+    return flags
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the duplicate key and monotonic cycle checks")
+    parser.add_argument('--units', type=int, default=50)
+    parser.add_argument('--cycles', type=int, default=40)
+    args = parser.parse_args()
+    key_bits = DUPLICATE | NON_MONOTONIC
+
+    # A repeated unit block flags every row of the second block, not only the first one
+    flags, _ = quality_flags(pd.DataFrame({'unit': [1] * 6, 'cycle': [1, 2, 3, 1, 2, 3]}))
+    assert ((flags & DUPLICATE) != 0).tolist() == [False] * 3 + [True] * 3, flags
+    assert ((flags & NON_MONOTONIC) != 0).tolist() == [False] * 3 + [True, True, False], flags
+
+    # Blocks of a unit split by other units are one unit, the later block continues the cycles
+    flags, _ = quality_flags(pd.DataFrame({'unit': [1, 1, 2, 2, 1, 1], 'cycle': [1, 2, 1, 2, 3, 4]}))
+    assert not flags.any(), flags
+    flags, _ = quality_flags(pd.DataFrame({'unit': [1, 1, 2, 2, 1, 1], 'cycle': [1, 2, 1, 2, 2, 3]}))
+    assert (flags != 0).tolist() == [False] * 4 + [True, False], flags
+
+    # Random repeated blocks, adjacent duplicates and steps back match the row by row flags
+    generator = np.random.default_rng(0)
+    data = synthetic_cmapss(args.units, args.cycles)
+    repeated = data.iloc[generator.choice(len(data), len(data) // 10, replace=False)]
+    data = pd.concat([data, repeated]).reset_index(drop=True)
+    data.loc[generator.choice(len(data), len(data) // 20, replace=False), 'cycle'] -= 1
+    flags, _ = quality_flags(data)
+    expected = naive_key_flags(data)
+    assert ((flags & key_bits) == expected).all(), np.flatnonzero((flags & key_bits) != expected)[:10]
+    # No (unit, cycle) key is left twice among the rows passing the checks
+    valid = data[(flags & key_bits) == 0]
+    assert not valid.duplicated(['unit', 'cycle']).any()
+
+    print(f"rows={len(data)} duplicate={int(((flags & DUPLICATE) != 0).sum())} "
+          f"non_monotonic={int(((flags & NON_MONOTONIC) != 0).sum())}")
+    print("Data quality key checks passed")
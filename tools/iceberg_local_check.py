@@ -0,0 +1,162 @@
+""" Local check of the curated Iceberg writes of the transform job with DuckDB standing in for Athena
+
+    Runs curated_iceberg.upsert with S3 and the Glue catalog mocked by moto and the generated Athena statements
+    (CREATE TABLE, MERGE INTO, the $snapshots read and the time travel reads) executed by DuckDB. Checks that the
+    first ingest inserts every row, that a reprocessed file does not duplicate rows, that a corrected file updates
+    the existing rows, that duplicate keys of one batch keep the last row, that a total ingest replaces the rows in
+    one commit and that the incremental read between two snapshots returns the changed rows only.
+    Run with:
+        pip install -r tools/requirements.txt
+        python tools/iceberg_local_check.py
+"""
+import os
+import re
+import sys
+import itertools
+from datetime import datetime
+
+import duckdb
+import pandas as pd
+import awswrangler
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from common import ROOT, synthetic_cmapss, load_module, aws_environment
+from suite import BUCKET, DATABASE, create_storage
+
+sys.path.insert(0, os.path.join(ROOT, 'glue_code'))
+import curated_iceberg
+from curated_iceberg import KEY_COLUMNS, ICEBERG_TABLES, PARTITIONING
+
+
+class DuckDBAthena:
+    """ Executes the Athena statements of curated_iceberg on DuckDB, Iceberg tables are DuckDB tables with a
+        $snapshots table that gets a row and a copy of the table on every write, staged tables are read from
+        the mocked S3 """
+    def __init__(self):
+        self.connection = duckdb.connect()
+        self.snapshot_ids = itertools.count(1)
+
+    def stage_tables(self, sql: str, database: str) -> None:
+        """ Loads the parquet tables of the Glue catalog referenced by the statement into DuckDB """
+        for table in set(re.findall(rf'"{re.escape(database)}"\."(\w+_staging_\w+)"', sql)):
+            data = awswrangler.s3.read_parquet(awswrangler.catalog.get_table_location(database, table))
+            self.connection.register('staged', data)
+            self.connection.execute(f'CREATE OR REPLACE TABLE "{database}"."{table}" AS SELECT * FROM staged')
+            self.connection.unregister('staged')
+
+    def start_query_execution(self, sql: str, database: str, workgroup: str) -> str:
+        """ Runs the statement, the Iceberg specific clauses of the DDL are dropped """
+        self.connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{database}"')
+        if sql.startswith('CREATE TABLE'):
+            table = re.match(r'CREATE TABLE IF NOT EXISTS `[^`]+`\.`([^`]+)`', sql).group(1)
+            self.connection.execute(sql[:sql.index(' PARTITIONED BY')].replace('`', '"'))
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{database}"."{table}$snapshots" '
+                                    f'(snapshot_id BIGINT, committed_at TIMESTAMP)')
+            return 'ddl'
+        self.stage_tables(sql, database)
+        self.connection.execute(sql)
+        # Every write commits a new snapshot of the target table, kept as a copy for the time travel reads
+        table = re.match(r'MERGE INTO "[^"]+"\."([^"]+)"', sql).group(1)
+        snapshot_id = next(self.snapshot_ids)
+        self.connection.execute(f'INSERT INTO "{database}"."{table}$snapshots" VALUES (?, ?)',
+                                [snapshot_id, datetime.utcnow()])
+        self.connection.execute(f'CREATE TABLE "{database}"."{table}${snapshot_id}" AS SELECT * FROM "{database}"."{table}"')
+        return 'dml'
+
+    def wait_query(self, query_execution_id: str) -> dict:
+        """ Statements run synchronously """
+        return {'Status': {'State': 'SUCCEEDED'}}
+
+    def read_sql_query(self, sql: str, database: str, workgroup: str, ctas_approach: bool) -> pd.DataFrame:
+        """ Runs the query and returns the result, time travel reads the copy of the snapshot """
+        return self.connection.execute(re.sub(r'"([^"]+)" FOR VERSION AS OF (\d+)', r'"\1$\2"', sql)).df()
+
+    def read_table(self, table: str) -> pd.DataFrame:
+        """ Returns all rows of the table ordered by the key columns """
+        return self.connection.execute(f'SELECT * FROM "{DATABASE}"."{table}" ORDER BY unit, cycle').df()
+
+
+def curated_data(transform_job, dataset: str, units: int, cycles: int, seed: int = 0) -> tuple:
+    """ Transforms synthetic raw rows like the transform job and returns them with the Athena schema """
+    schema = {"unit": "int", "cycle": "int", "altitude": "double", "mach": "double", "tra": "double"}
+    schema.update({f'sensor_{i}': "double" for i in range(1, 22)})
+    raw_data = synthetic_cmapss(units, cycles, seed).astype({'unit': 'int32', 'cycle': 'int32'})
+    if dataset == 'inference':
+        return transform_job.add_timestamp(raw_data), dict(schema, timestamp='timestamp')
+    return transform_job.create_target(raw_data), dict(schema, rul='int')
+
+def write(transform_job, dataset: str, units: int, cycles: int, seed: int = 0, replace: bool = False) -> tuple:
+    """ Writes the curated rows to the Iceberg table of the dataset like the transform job """
+    data, schema = curated_data(transform_job, dataset, units, cycles, seed)
+    result = curated_iceberg.upsert(data, database=DATABASE, table=ICEBERG_TABLES[dataset], schema=schema,
+                                    location=f"s3://{BUCKET}/curated/iceberg/{dataset}/",
+                                    partitioning=PARTITIONING[dataset],
+                                    staging_path=f"s3://{BUCKET}/curated/iceberg/staging/", workgroup='mlops-iceberg',
+                                    replace=replace)
+    return data, result
+
+
+if __name__ == '__main__':
+    transform_job = load_module('glue_code/transform_job.py', 'transform_job')
+    aws_environment()
+    athena = DuckDBAthena()
+    for name in ['start_query_execution', 'wait_query', 'read_sql_query']:
+        setattr(awswrangler.athena, name, getattr(athena, name))
+    with mock_aws():
+        create_storage()
+        table = ICEBERG_TABLES['inference']
+
+        # First partitioned ingest of the file inserts every row
+        data, result = write(transform_job, 'inference', units=20, cycles=50)
+        assert result['rows_written'] == 1000 and result['total_rows'] == 1000, result
+        first_snapshot = result['snapshot_id']
+        assert first_snapshot is not None
+
+        # Reprocessing the same file does not duplicate rows
+        _, result = write(transform_job, 'inference', units=20, cycles=50)
+        rows = athena.read_table(table)
+        assert result['total_rows'] == 1000 and not rows.duplicated(KEY_COLUMNS).any(), result
+        assert result['snapshot_id'] != first_snapshot
+        reprocessed_snapshot = result['snapshot_id']
+
+        # A corrected file of five units updates their rows in place and keeps the other units
+        correction, result = write(transform_job, 'inference', units=5, cycles=50, seed=1)
+        assert (correction['sensor_2'].values != data[data['unit'] <= 5]['sensor_2'].values).any()
+        rows = athena.read_table(table)
+        assert result['total_rows'] == 1000, result
+        corrected = rows[rows['unit'] <= 5].reset_index(drop=True)
+        assert (corrected['sensor_2'].values == correction['sensor_2'].values).all()
+        kept = rows[rows['unit'] > 5].reset_index(drop=True)
+        assert (kept['sensor_2'].values == data[data['unit'] > 5]['sensor_2'].values).all()
+
+        # The incremental read between the snapshots returns the corrected rows only, without one all rows
+        changes = curated_iceberg.read_changes(DATABASE, table, reprocessed_snapshot, result['snapshot_id'], 'mlops-iceberg')
+        assert len(changes) == 250 and set(changes['unit']) == set(range(1, 6)), changes['unit'].unique()
+        assert len(curated_iceberg.read_changes(DATABASE, table, None, result['snapshot_id'], 'mlops-iceberg')) == 1000
+
+        # Duplicate keys of one batch keep the last row, MERGE allows one source row per key
+        batch = curated_iceberg.prepare_batch(pd.concat([data, correction]), datetime.utcnow())
+        assert len(batch) == 1000 and (batch[batch['unit'] <= 5]['sensor_2'].values == correction['sensor_2'].values).all()
+
+        # A total ingest replaces the table rows in one commit, units removed upstream do not stay in the table
+        write(transform_job, 'train', units=20, cycles=50, replace=True)
+        snapshots_sql = f'SELECT COUNT(*) AS snapshots FROM "{DATABASE}"."{ICEBERG_TABLES["train"]}$snapshots"'
+        before = athena.read_sql_query(snapshots_sql, DATABASE, 'mlops-iceberg', False)['snapshots'].iloc[0]
+        data, result = write(transform_job, 'train', units=15, cycles=40, seed=2, replace=True)
+        after = athena.read_sql_query(snapshots_sql, DATABASE, 'mlops-iceberg', False)['snapshots'].iloc[0]
+        rows = athena.read_table(ICEBERG_TABLES['train'])
+        assert result['total_rows'] == 600 and set(rows['unit']) == set(range(1, 16)), result
+        assert after == before + 1, (before, after)
+        assert (rows['rul'].values == data.sort_values(['unit', 'cycle'])['rul'].values).all()
+
+        # Staging tables are dropped after every write
+        staging = [name for name in awswrangler.catalog.tables(database=DATABASE, limit=None)['Table']
+                   if '_staging_' in name]
+        assert not staging, staging
+
+        snapshots = athena.read_sql_query(f'SELECT COUNT(*) AS snapshots FROM "{DATABASE}"."{table}$snapshots"',
+                                          DATABASE, 'mlops-iceberg', False)['snapshots'].iloc[0]
+        print(f"snapshots={snapshots} inference rows={len(athena.read_table(table))} "
+              f"train rows after total replace={len(rows)}")
+        print("Iceberg upsert and replace checks passed")
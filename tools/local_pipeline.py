@@ -0,0 +1,448 @@
+""" Local end-to-end emulator of the ETL pipeline, runs the real Lambda and Glue job code without AWS
+
+    The landed file goes through the S3 notification -> etl_lambda -> admission queue -> ETL state machine
+    (convert -> transform -> summary -> event -> ledger -> rollup) flow with S3, Glue catalog, DynamoDB
+    and EventBridge mocked by moto, the curated tables are then queryable with DuckDB.
+    Run with:
+        python tools/local_pipeline.py data/train_FD001.csv --ingest-type total --folder train \
+            --query 'SELECT COUNT(*) FROM mlops_curated_train_data'
+    The state machine definition of the synthesized StorageLayer is used with
+        cdk synth StorageLayerStack && python tools/local_pipeline.py ... --template cdk.out/StorageLayerStack.template.json
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+from datetime import datetime
+from contextlib import redirect_stdout
+
+import boto3
+import duckdb
+import awswrangler
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from common import load_module, aws_environment
+from suite import BUCKET, DATABASE, WINDOW_TABLE, create_storage, create_admission_queue, run_script
+
+
+# Default arguments of the Glue Jobs defined in StorageLayer, the profile bucket is set to the output directory.
+# Athena statements are not executed by moto, so curated data is written as parquet tables instead of Iceberg.
+JOBS = {'mlops-convert-job': ('glue_code/convert_job.py', {'--profile': 'off'}),
+        'mlops-transform-job': ('glue_code/transform_job.py', {'--window_table': WINDOW_TABLE, '--window_size': '50',
+                                                               '--profile': 'off', '--curated_format': 'parquet',
+                                                               '--athena_workgroup': 'primary', '--quality_max_bad_rate': '0.1',
+                                                               '--feature_windows': '10,30'}),
+        'mlops-rollup-job': ('glue_code/rollup_job.py', {})}
+
+
+def etl_definition() -> dict:
+    """ Returns the ETL state machine definition of StorageLayer, used when no synthesized template is given """
+    common = {'--database_name.$': '$.database_name', '--file_key.$': '$.file_key', '--bucket.$': '$.bucket',
+              '--file_name.$': '$.file_name', '--ingest_type.$': '$.ingest_type',
+              '--additional-python-modules.$': '$.--additional-python-modules'}
+    timing = {'--trace_id.$': '$.trace_id', '--submitted_at.$': '$$.State.EnteredTime',
+              '--execution_id.$': '$$.Execution.Name', '--profile.$': '$.profile'}
+    spark_workers = {'WorkerType.$': '$.spark_worker_type', 'NumberOfWorkers.$': '$.spark_max_workers'}
+    # Glue Job starts rejected at the concurrent runs limit are retried, a local run never hits the limit
+    retry = [{'ErrorEquals': ['Glue.ConcurrentRunsExceededException'], 'IntervalSeconds': 30, 'MaxAttempts': 10,
+              'BackoffRate': 2, 'MaxDelaySeconds': 300, 'JitterStrategy': 'FULL'}]
+    return {'StartAt': 'EngineChoice', 'States': {
+        'EngineChoice': {'Type': 'Choice', 'Choices': [{'Variable': '$.engine', 'StringEquals': 'spark',
+                                                        'Next': 'ConvertSparkGlueJobStep'}],
+                         'Default': 'ConvertGlueJobStep'},
+        'ConvertSparkGlueJobStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::glue:startJobRun',
+                                    'Parameters': {'JobName': 'mlops-convert-spark-job',
+                                                   'Arguments': {**common, **timing}, **spark_workers},
+                                    'ResultPath': None, 'Next': 'TransformSparkGlueJobStep', 'Retry': retry},
+        'TransformSparkGlueJobStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::glue:startJobRun.sync',
+                                      'Parameters': {'JobName': 'mlops-transform-spark-job',
+                                                     'Arguments': {**common, **timing}, **spark_workers},
+                                      'ResultPath': None, 'Next': 'GetETLSummaryStep', 'Retry': retry},
+        'ConvertGlueJobStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::glue:startJobRun',
+                               'Parameters': {'JobName': 'mlops-convert-job', 'Arguments': {**common, **timing}},
+                               'ResultPath': None, 'Next': 'TransformGlueJobStep', 'Retry': retry},
+        'TransformGlueJobStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::glue:startJobRun.sync',
+                                 'Parameters': {'JobName': 'mlops-transform-job', 'Arguments': {**common, **timing}},
+                                 'ResultPath': None, 'Next': 'GetETLSummaryStep', 'Retry': retry},
+        'GetETLSummaryStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::aws-sdk:s3:getObject',
+                              'Parameters': {'Bucket.$': '$.bucket',
+                                             'Key.$': "States.Format('etl/summaries/{}.json', $$.Execution.Name)"},
+                              'ResultSelector': {'summary.$': 'States.StringToJson($.Body)'},
+                              'ResultPath': '$.etl_summary', 'Next': 'ETLCompletedEventStep'},
+        'ETLCompletedEventStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::events:putEvents',
+                                  'Parameters': {'Entries': [{'Detail.$': '$.etl_summary.summary',
+                                                              'DetailType': 'ETL Completed', 'Source': 'mlops.etl'}]},
+                                  'ResultPath': None, 'Next': 'MarkProcessedStep'},
+        'MarkProcessedStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::aws-sdk:s3:putObject',
+                              'Parameters': {'Bucket.$': '$.bucket',
+                                             'Key.$': "States.Format('manifests/processed/{}/{}', $.file_key, $.etag)",
+                                             'Body.$': 'States.JsonToString($.etl_summary.summary)'},
+                              'ResultPath': None, 'Next': 'RollupChoice'},
+        'RollupChoice': {'Type': 'Choice', 'Choices': [{'Variable': '$.ingest_type', 'StringEquals': 'partitioned',
+                                                        'Next': 'RollupGlueJobStep'}],
+                         'Default': 'ETLProcessSuccess'},
+        'RollupGlueJobStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::glue:startJobRun.sync',
+                              'Parameters': {'JobName': 'mlops-rollup-job', 'Arguments': common},
+                              'ResultPath': None, 'Next': 'ETLProcessSuccess', 'Retry': retry},
+        'ETLProcessSuccess': {'Type': 'Succeed'}}}
+
+def prediction_rollup_definition() -> dict:
+    """ Returns the prediction rollup state machine definition of StorageLayer, used when no synthesized template is given """
+    arguments = {'--database_name.$': '$.database_name', '--bucket.$': '$.bucket',
+                 '--prediction_dates.$': '$.prediction_dates', '--additional-python-modules': 'awswrangler'}
+    retry = [{'ErrorEquals': ['Glue.ConcurrentRunsExceededException'], 'IntervalSeconds': 30, 'MaxAttempts': 10,
+              'BackoffRate': 2, 'MaxDelaySeconds': 300, 'JitterStrategy': 'FULL'}]
+    return {'StartAt': 'PredictionRollupGlueJobStep', 'States': {
+        'PredictionRollupGlueJobStep': {'Type': 'Task', 'Resource': 'arn:aws:states:::glue:startJobRun.sync',
+                                        'Parameters': {'JobName': 'mlops-rollup-job', 'Arguments': arguments},
+                                        'ResultPath': None, 'End': True, 'Retry': retry}}}
+
+def template_definition(path: str, name: str = 'mlops-etl-process') -> dict:
+    """ Reads a state machine definition from the synthesized StorageLayer template
+        :argument: path - Path of the synthesized CloudFormation template
+        :argument: name - Name of the state machine, the ETL state machine by default
+        :return: definition - State machine definition with resource references resolved to names
+    """
+    with open(path) as file:
+        resources = json.load(file)['Resources']
+
+    def resolve(value):
+        if isinstance(value, dict) and 'Fn::Join' in value:
+            separator, parts = value['Fn::Join']
+            return separator.join(str(resolve(part)) for part in parts)
+        if isinstance(value, dict) and 'Ref' in value:
+            pseudo = {'AWS::Partition': 'aws', 'AWS::Region': 'us-east-1', 'AWS::AccountId': '123456789012'}
+            if value['Ref'] in pseudo:
+                return pseudo[value['Ref']]
+            # Glue Jobs are referenced by their logical ID, the emulator runs them by job name
+            return resources.get(value['Ref'], {}).get('Properties', {}).get('Name', value['Ref'])
+        if isinstance(value, dict) and 'Fn::GetAtt' in value:
+            return '.'.join(value['Fn::GetAtt'])
+        if isinstance(value, dict) and 'Fn::ImportValue' in value:
+            return value['Fn::ImportValue']
+        return value
+
+    for resource in resources.values():
+        if resource['Type'] == 'AWS::StepFunctions::StateMachine':
+            if resource['Properties'].get('StateMachineName') == name:
+                return json.loads(resolve(resource['Properties']['DefinitionString']))
+    raise ValueError(f"No {name} state machine found in {path}")
+
+
+def split_arguments(arguments: str) -> list:
+    """ Splits the arguments of an intrinsic function on the top level commas """
+    parts, depth, quoted, current = [], 0, False, ''
+    for i, character in enumerate(arguments):
+        if character == "'" and (i == 0 or arguments[i - 1] != '\\'):
+            quoted = not quoted
+        elif not quoted and character == '(':
+            depth += 1
+        elif not quoted and character == ')':
+            depth -= 1
+        if character == ',' and not quoted and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += character
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+def get_path(path: str, data, context: dict):
+    """ Reads the value of the JsonPath from the state input or, for $$ paths, from the context object """
+    if path.startswith('$$'):
+        data, path = context, path[1:]
+    value = data
+    for key in path[2:].split('.') if path != '$' else []:
+        value = value[key]
+    return value
+
+def evaluate(expression: str, data, context: dict):
+    """ Evaluates the JsonPath or intrinsic function of a '.$' parameter
+        :argument: expression - JsonPath like '$.bucket' or intrinsic like "States.Format('{}', $.x)"
+        :argument: data - State input
+        :argument: context - Context object with Execution and State
+        :return: value - Evaluated value
+    """
+    match = re.fullmatch(r"(States\.\w+)\((.*)\)", expression.strip(), re.DOTALL)
+    if match is None:
+        return get_path(expression, data, context)
+    values = []
+    for argument in split_arguments(match.group(2)):
+        if argument.startswith("'"):
+            values.append(argument[1:-1].replace("\\'", "'"))
+        else:
+            values.append(evaluate(argument, data, context))
+    function = match.group(1)
+    if function == 'States.Format':
+        template = values[0]
+        for value in values[1:]:
+            template = template.replace('{}', str(value), 1)
+        return template
+    if function == 'States.StringToJson':
+        return json.loads(values[0])
+    if function == 'States.JsonToString':
+        return json.dumps(values[0])
+    raise NotImplementedError(f"Intrinsic function {function} is not supported by the emulator")
+
+def resolve_parameters(parameters, data, context: dict):
+    """ Resolves the '.$' keys of the state Parameters or ResultSelector """
+    if isinstance(parameters, dict):
+        resolved = {}
+        for key, value in parameters.items():
+            if key.endswith('.$'):
+                resolved[key[:-2]] = evaluate(value, data, context)
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(parameters, list):
+        return [resolve_parameters(value, data, context) for value in parameters]
+    return parameters
+
+def apply_result_path(data: dict, result, result_path) -> dict:
+    """ Places the task result into the state input as defined by ResultPath, None discards the result """
+    if result_path is None:
+        return data
+    if result_path == '$':
+        return result
+    output = json.loads(json.dumps(data))
+    target = output
+    keys = result_path[2:].split('.')
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = result
+    return output
+
+def choose(state: dict, data: dict, context: dict) -> str:
+    """ Returns the next state of the Choice state """
+    def matches(rule: dict) -> bool:
+        if 'And' in rule:
+            return all(matches(inner) for inner in rule['And'])
+        if 'Or' in rule:
+            return any(matches(inner) for inner in rule['Or'])
+        if 'Not' in rule:
+            return not matches(rule['Not'])
+        value = get_path(rule['Variable'], data, context)
+        for operator in ['StringEquals', 'NumericEquals', 'BooleanEquals']:
+            if operator in rule:
+                return value == rule[operator]
+        raise NotImplementedError(f"Choice rule {rule} is not supported by the emulator")
+    for rule in state['Choices']:
+        if matches(rule):
+            return rule['Next']
+    return state['Default']
+
+
+class LocalStateMachine:
+    """ In-process interpreter of the ETL state machine, tasks run the local job code against the mocked services """
+    def __init__(self, definition: dict, profile_bucket: str):
+        self.definition = definition
+        self.profile_bucket = profile_bucket
+        self.timings = []
+        self.output = []
+
+    def run_glue_job(self, parameters: dict) -> dict:
+        # Spark jobs read and write S3 from the executors, which moto cannot intercept
+        if parameters['JobName'] not in JOBS:
+            raise NotImplementedError(f"Glue Job {parameters['JobName']} is not supported by the emulator, "
+                                      "run the pandas engine")
+        script, defaults = JOBS[parameters['JobName']]
+        arguments = dict(defaults)
+        if '--profile' in defaults:
+            arguments['--profile_bucket'] = self.profile_bucket
+        # Arguments of the job run override the default arguments, as in Glue
+        arguments.update(parameters.get('Arguments', {}))
+        argv = ['job', '--JOB_NAME', parameters['JobName']]
+        for name, value in arguments.items():
+            argv += [name, str(value)]
+        run_script(script, argv)
+        return {'JobRunId': f"jr_{uuid.uuid4().hex}", 'JobName': parameters['JobName']}
+
+    def run_task(self, resource: str, parameters: dict) -> dict:
+        if ':glue:startJobRun' in resource:
+            # Jobs started without .sync run in parallel in AWS, locally every job finishes before the next state
+            return self.run_glue_job(parameters)
+        if resource.endswith(':aws-sdk:s3:getObject'):
+            response = boto3.client('s3').get_object(Bucket=parameters['Bucket'], Key=parameters['Key'])
+            return {'Body': response['Body'].read().decode('utf-8'), 'ContentLength': response['ContentLength']}
+        if resource.endswith(':aws-sdk:s3:putObject'):
+            response = boto3.client('s3').put_object(Bucket=parameters['Bucket'], Key=parameters['Key'],
+                                                     Body=parameters['Body'].encode('utf-8'))
+            return {'ETag': response['ETag']}
+        if resource.endswith(':events:putEvents'):
+            entries = [{'Source': entry['Source'], 'DetailType': entry['DetailType'], 'Detail': json.dumps(entry['Detail'])}
+                       for entry in parameters['Entries']]
+            return boto3.client('events').put_events(Entries=entries)
+        raise NotImplementedError(f"Task resource {resource} is not supported by the emulator")
+
+    def execute(self, execution_name: str, data: dict) -> dict:
+        """ Runs the state machine with the execution input
+            :argument: execution_name - Name of the execution, available as $$.Execution.Name
+            :argument: data - Execution input
+            :return: output - Execution output
+        """
+        context = {'Execution': {'Name': execution_name, 'Input': data,
+                                 'StartTime': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')},
+                   'State': {}}
+        state_name = self.definition['StartAt']
+        while True:
+            state = self.definition['States'][state_name]
+            context['State'] = {'Name': state_name, 'EnteredTime': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+            start = time.perf_counter()
+            captured = io.StringIO()
+            with redirect_stdout(captured):
+                if state['Type'] == 'Task':
+                    parameters = resolve_parameters(state.get('Parameters', {}), data, context)
+                    result = self.run_task(state['Resource'], parameters)
+                    if 'ResultSelector' in state:
+                        result = resolve_parameters(state['ResultSelector'], result, context)
+                    data = apply_result_path(data, result, state.get('ResultPath', '$'))
+                    next_state = state.get('Next')
+                elif state['Type'] == 'Choice':
+                    next_state = choose(state, data, context)
+                elif state['Type'] == 'Pass':
+                    data = apply_result_path(data, state.get('Result', data), state.get('ResultPath', '$'))
+                    next_state = state.get('Next')
+                elif state['Type'] == 'Succeed':
+                    next_state = None
+                else:
+                    raise NotImplementedError(f"State type {state['Type']} is not supported by the emulator")
+            self.timings.append((state_name, time.perf_counter() - start))
+            self.output.append(captured.getvalue())
+            if next_state is None or state.get('End', False):
+                return data
+            state_name = next_state
+
+
+def stage_spans(lines: list) -> list:
+    """ Collects the pipeline timing spans printed by the Lambda and Glue jobs
+        :argument: lines - Captured output lines
+        :return: spans - List of (stage, seconds) tuples
+    """
+    spans = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and 'Stage' in record and 'StageDuration' in record:
+            spans.append((record['Stage'], record['StageDuration']))
+    return spans
+
+def catalog_to_duckdb(directory: str) -> duckdb.DuckDBPyConnection:
+    """ Copies the parquet files of the Glue catalog tables out of the mocked S3 and registers them as DuckDB views,
+        DuckDB stands in for Athena
+        :argument: directory - Local directory the table files are copied to
+        :return: connection - DuckDB connection with one view per catalog table
+    """
+    s3 = boto3.client('s3')
+    connection = duckdb.connect()
+    for page in boto3.client('glue').get_paginator('get_tables').paginate(DatabaseName=DATABASE):
+        for table in page['TableList']:
+            bucket, prefix = table['StorageDescriptor']['Location'][len('s3://'):].split('/', 1)
+            local = os.path.join(directory, table['Name'])
+            for object_page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+                for item in object_page.get('Contents', []):
+                    if item['Key'].endswith('.parquet'):
+                        path = os.path.join(local, os.path.relpath(item['Key'], prefix))
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        s3.download_file(bucket, item['Key'], path)
+            if os.path.isdir(local):
+                connection.execute(f"CREATE VIEW \"{table['Name']}\" AS SELECT * FROM "
+                                   f"read_parquet('{local}/**/*.parquet', hive_partitioning=true, union_by_name=true)")
+    return connection
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the ETL pipeline locally on a raw C-MAPSS file")
+    parser.add_argument('file', help="Local headerless CSV file landing in raw/")
+    parser.add_argument('--ingest-type', choices=['total', 'partitioned'], default='partitioned')
+    parser.add_argument('--folder', choices=['train', 'test', 'inference'], default='inference')
+    parser.add_argument('--template', default=None, help="Synthesized StorageLayer template with the state machine")
+    parser.add_argument('--profile', choices=['off', 'cprofile', 'sampling', 'all'], default='off')
+    parser.add_argument('--output-dir', default=None, help="Directory for profiles and table files")
+    parser.add_argument('--query', action='append', default=[], help="SQL query on the catalog tables, can be repeated")
+    parser.add_argument('--predictions', action='store_true',
+                        help="Write predictions for the ingested inference rows and run the prediction rollup")
+    args = parser.parse_args()
+
+    output_dir = os.path.abspath(args.output_dir or tempfile.mkdtemp(prefix='mlops-local-'))
+    definition = template_definition(args.template) if args.template else etl_definition()
+    with mock_aws():
+        aws_environment(GlueDatabaseName=DATABASE, ProfileMode=args.profile)
+        create_storage()
+        os.environ['AdmissionQueueUrl'] = create_admission_queue('mlops-etl-admission-queue')
+        step_functions = boto3.client('stepfunctions')
+        os.environ['StateMachineArn'] = step_functions.create_state_machine(
+            name='mlops-etl-process', definition=json.dumps(definition),
+            roleArn='arn:aws:iam::123456789012:role/mlops-step-function-role')['stateMachineArn']
+
+        # Land the file and emulate the S3 notification of the storage bucket
+        file_key = f"raw/{args.ingest_type}/csv/{args.folder}/{os.path.basename(args.file)}"
+        total_start = time.perf_counter()
+        with open(args.file, 'rb') as file:
+            etag = boto3.client('s3').put_object(Bucket=BUCKET, Key=file_key, Body=file.read())['ETag'].strip('"')
+        event = {'Records': [{'eventTime': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                              's3': {'bucket': {'name': BUCKET}, 'object': {'key': file_key, 'eTag': etag}}}]}
+        etl_lambda = load_module('lambda_code/etl_lambda/etl_lambda.py', 'etl_lambda')
+        captured = io.StringIO()
+        start = time.perf_counter()
+        with redirect_stdout(captured):
+            etl_lambda.lambda_handler(event, None)
+        lambda_seconds = time.perf_counter() - start
+
+        # Run the started execution with the local interpreter
+        execution_arn = step_functions.list_executions(stateMachineArn=os.environ['StateMachineArn'])['executions'][0]['executionArn']
+        execution = step_functions.describe_execution(executionArn=execution_arn)
+        state_machine = LocalStateMachine(definition, profile_bucket=output_dir)
+        output = state_machine.execute(execution['name'], json.loads(execution['input']))
+
+        if args.predictions:
+            # Emulate a completed inference job writing predictions of the ingested rows with the prediction sink
+            prediction_sink = load_module('shared/python/prediction_sink.py', 'prediction_sink')
+            curated_key = f"curated/{args.ingest_type}/parquet/inference/{os.path.basename(args.file).replace('.csv', '.parquet')}"
+            curated = awswrangler.s3.read_parquet(f"s3://{BUCKET}/{curated_key}", columns=['unit', 'cycle', 'timestamp'])
+            job_name = 'model-inference-local'
+            sink = prediction_sink.PredictionSink(os.path.join(output_dir, 'predictions'), model_version='local', job_name=job_name)
+            sink.write(curated.assign(predicted_rul=(200 - curated['cycle']).astype('float32')))
+            sink.close()
+            for path in sink.files:
+                boto3.client('s3').upload_file(path, BUCKET, f"predictions/{os.path.relpath(path, os.path.join(output_dir, 'predictions'))}")
+            # The inference Lambda starts the prediction rollup when the job completed
+            rollup_definition = (template_definition(args.template, 'mlops-prediction-rollup') if args.template
+                                 else prediction_rollup_definition())
+            os.environ.update(PredictionsBucket=BUCKET, PredictionsPrefix='predictions', PredictionRollupStateMachineArn=
+                              step_functions.create_state_machine(name='mlops-prediction-rollup', definition=json.dumps(rollup_definition),
+                                                                  roleArn='arn:aws:iam::123456789012:role/mlops-step-function-role')['stateMachineArn'])
+            inference_lambda = load_module('lambda_code/inference_lambda/inference_lambda.py', 'inference_lambda')
+            execution = step_functions.describe_execution(executionArn=inference_lambda.start_prediction_rollup(job_name)['executionArn'])
+            LocalStateMachine(rollup_definition, profile_bucket=output_dir).execute(execution['name'], json.loads(execution['input']))
+        total_seconds = time.perf_counter() - total_start
+
+        print(f"{'stage':35s} {'seconds':>10s}")
+        print(f"{'etl_lambda (handler)':35s} {lambda_seconds:10.3f}")
+        for state_name, seconds in state_machine.timings:
+            print(f"{state_name:35s} {seconds:10.3f}")
+        print(f"{'total':35s} {total_seconds:10.3f}")
+        print(f"\n{'span':35s} {'seconds':>10s}")
+        lines = captured.getvalue().splitlines() + [line for text in state_machine.output for line in text.splitlines()]
+        for stage, seconds in stage_spans(lines):
+            print(f"{stage:35s} {seconds:10.3f}")
+        if 'etl_summary' in output:
+            print(f"\nETL summary: {json.dumps(output['etl_summary']['summary'])}")
+
+        connection = catalog_to_duckdb(os.path.join(output_dir, 'tables'))
+        print("\ncatalog tables:")
+        for (name,) in connection.execute("SELECT view_name FROM duckdb_views() WHERE NOT internal ORDER BY 1").fetchall():
+            rows = connection.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            print(f"  {name:40s} {rows:10d} rows")
+        for query in args.query:
+            print(f"\n{query}")
+            print(connection.execute(query).fetchdf().to_string(index=False))
+        print(f"\nprofiles and table files: {output_dir}")
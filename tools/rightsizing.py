@@ -0,0 +1,292 @@
+""" Right-sizing recommendations for the SageMaker jobs and Fargate services
+
+    Collects the CPU, memory and disk utilization and the durations of the past training and inference jobs
+    from the /aws/sagemaker CloudWatch namespaces, and the CPU and memory utilization of the MLflow, Grafana
+    and scoring services from AWS/ECS. A fixture file with the same structure stands in for CloudWatch
+    in local runs. Every workload is classified as cpu, memory or io bound or balanced from its p95 utilization and
+    gets the cheapest size that keeps the p95 below the target utilization. With --apply the recommended
+    sizes are written to instance_profiles.json, which app.py passes to the stacks and the stacks pass to
+    the launchers of the Lambdas, the change takes effect with the next cdk deploy.
+    Run with:
+        python tools/rightsizing.py --fixture tools/fixtures/rightsizing_utilization.json
+        python tools/rightsizing.py --days 14 --output /tmp/utilization.json
+        python tools/rightsizing.py --fixture /tmp/utilization.json --apply
+"""
+import os
+import sys
+import json
+import math
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from aws_black_belt_infrastructure.instance_profiles import PROFILES_PATH, load_profiles, save_profiles
+
+
+# vCPUs, memory in GiB and approximate us-east-1 on-demand price per hour, the prices only rank the candidates
+SAGEMAKER_INSTANCES = {'ml.t3.medium': (2, 4, 0.05), 'ml.t3.large': (2, 8, 0.10), 'ml.t3.xlarge': (4, 16, 0.20),
+                       'ml.m5.large': (2, 8, 0.115), 'ml.m5.xlarge': (4, 16, 0.23), 'ml.m5.2xlarge': (8, 32, 0.461),
+                       'ml.m5.4xlarge': (16, 64, 0.922), 'ml.c5.xlarge': (4, 8, 0.204), 'ml.c5.2xlarge': (8, 16, 0.408),
+                       'ml.c5.4xlarge': (16, 32, 0.816), 'ml.r5.large': (2, 16, 0.151), 'ml.r5.xlarge': (4, 32, 0.302),
+                       'ml.r5.2xlarge': (8, 64, 0.605)}
+# Fargate CPU units and the memory sizes in MiB allowed with them, price per vCPU hour and GiB hour
+FARGATE_SIZES = {256: [512, 1024, 2048], 512: list(range(1024, 4097, 1024)), 1024: list(range(2048, 8193, 1024)),
+                 2048: list(range(4096, 16385, 1024)), 4096: list(range(8192, 30721, 1024))}
+FARGATE_PRICES = (0.04048, 0.004445)
+# Workloads: CloudWatch source, instance families allowed, and whether the job shards its input over instances
+WORKLOADS = {'training': {'kind': 'sagemaker', 'prefix': 'model-training-', 'families': ['ml.m5', 'ml.c5', 'ml.r5'],
+                          'sharded': False},
+             'inference': {'kind': 'sagemaker', 'prefix': 'model-inference-', 'families': ['ml.t3', 'ml.m5', 'ml.c5'],
+                           'sharded': False},
+             'mlflow': {'kind': 'fargate', 'service': 'mlops-mlflow-service'},
+             'grafana': {'kind': 'fargate', 'service': 'mlops-grafana-service'},
+             'scoring': {'kind': 'fargate', 'service': 'mlops-scoring-service'}}
+CLUSTER_NAME = 'mlops-fargate-cluster'
+TARGET_CPU = 0.7
+TARGET_MEMORY = 0.75
+TARGET_DISK = 0.7
+
+
+def metric_values(cloudwatch, namespace: str, dimensions: list, metrics: list, start: datetime, end: datetime,
+                  period: int, statistic: str) -> dict:
+    """ Gets the datapoints of the metrics with one GetMetricData call per page
+        :return: values - Dictionary of metric name to list of values
+    """
+    queries = [{'Id': f"m{i}", 'Label': metric,
+                'MetricStat': {'Metric': {'Namespace': namespace, 'MetricName': metric, 'Dimensions': dimensions},
+                               'Period': period, 'Stat': statistic}} for i, metric in enumerate(metrics)]
+    values = {metric: [] for metric in metrics}
+    for page in cloudwatch.get_paginator('get_metric_data').paginate(MetricDataQueries=queries,
+                                                                     StartTime=start, EndTime=end):
+        for result in page['MetricDataResults']:
+            values[result['Label']] += result['Values']
+    return values
+
+def collect_sagemaker(sagemaker, cloudwatch, prefix: str, since: datetime) -> list:
+    """ Collects the resources, duration and per minute utilization of the finished jobs with the name prefix
+        :argument: sagemaker - Boto3 SageMaker client
+        :argument: cloudwatch - Boto3 CloudWatch client
+        :argument: prefix - Job name prefix of the workload
+        :argument: since - Oldest creation time of the collected jobs
+        :return: runs - List of dictionaries, utilization in percent, CPU summed over the vCPUs like CloudWatch
+    """
+    runs = []
+    listings = [('list_processing_jobs', 'ProcessingJobSummaries', 'ProcessingJobName', 'ProcessingJobs'),
+                ('list_training_jobs', 'TrainingJobSummaries', 'TrainingJobName', 'TrainingJobs')]
+    for operation, key, name_key, namespace in listings:
+        for page in sagemaker.get_paginator(operation).paginate(NameContains=prefix, CreationTimeAfter=since,
+                                                                StatusEquals='Completed'):
+            for summary in page[key]:
+                job_name = summary[name_key]
+                if namespace == 'ProcessingJobs':
+                    job = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+                    resources = job['ProcessingResources']['ClusterConfig']
+                    start, end = job['ProcessingStartTime'], job['ProcessingEndTime']
+                else:
+                    job = sagemaker.describe_training_job(TrainingJobName=job_name)
+                    resources = job['ResourceConfig']
+                    start, end = job['TrainingStartTime'], job['TrainingEndTime']
+                run = {'name': job_name, 'instance_type': resources['InstanceType'],
+                       'instance_count': resources['InstanceCount'], 'volume_size_gb': resources['VolumeSizeInGB'],
+                       'duration_seconds': (end - start).total_seconds(), 'cpu': [], 'memory': [], 'disk': []}
+                # Every instance of the job reports under its own host
+                for host in range(1, resources['InstanceCount'] + 1):
+                    values = metric_values(cloudwatch, f"/aws/sagemaker/{namespace}",
+                                           [{'Name': 'Host', 'Value': f"{job_name}/algo-{host}"}],
+                                           ['CPUUtilization', 'MemoryUtilization', 'DiskUtilization'],
+                                           start, end, period=60, statistic='Average')
+                    run['cpu'] += values['CPUUtilization']
+                    run['memory'] += values['MemoryUtilization']
+                    run['disk'] += values['DiskUtilization']
+                runs.append(run)
+    return runs
+
+def collect_fargate(ecs, cloudwatch, service: str, since: datetime) -> dict:
+    """ Collects the task size and the 5 minute maximum utilization of the Fargate service
+        :argument: ecs - Boto3 ECS client
+        :argument: cloudwatch - Boto3 CloudWatch client
+        :argument: service - Name of the ECS service
+        :argument: since - Start of the collected period
+        :return: usage - Dictionary with task size and utilization in percent of the reserved CPU and memory
+    """
+    service_description = ecs.describe_services(cluster=CLUSTER_NAME, services=[service])['services'][0]
+    task_definition = ecs.describe_task_definition(taskDefinition=service_description['taskDefinition'])['taskDefinition']
+    values = metric_values(cloudwatch, 'AWS/ECS', [{'Name': 'ClusterName', 'Value': CLUSTER_NAME},
+                                                   {'Name': 'ServiceName', 'Value': service}],
+                           ['CPUUtilization', 'MemoryUtilization'], since, datetime.utcnow(), period=300,
+                           statistic='Maximum')
+    return {'cpu': int(task_definition['cpu']), 'memory_mib': int(task_definition['memory']),
+            'tasks': service_description['desiredCount'],
+            'cpu_utilization': values['CPUUtilization'], 'memory_utilization': values['MemoryUtilization']}
+
+def collect(days: int) -> dict:
+    """ Collects the utilization of all workloads from CloudWatch, in the format of the fixture file """
+    import boto3
+    since = datetime.utcnow() - timedelta(days=days)
+    sagemaker, ecs, cloudwatch = boto3.client('sagemaker'), boto3.client('ecs'), boto3.client('cloudwatch')
+    utilization = {'collected_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'days': days, 'workloads': {}}
+    for workload, source in WORKLOADS.items():
+        if source['kind'] == 'sagemaker':
+            runs = collect_sagemaker(sagemaker, cloudwatch, source['prefix'], since)
+            utilization['workloads'][workload] = {'runs': runs}
+        else:
+            utilization['workloads'][workload] = collect_fargate(ecs, cloudwatch, source['service'], since)
+    return utilization
+
+def bound(cpu: float, memory: float) -> str:
+    """ Classifies the workload by the p95 share of the CPU and memory it used """
+    if cpu >= 0.8:
+        return 'cpu'
+    if memory >= 0.8:
+        return 'memory'
+    # Neither resource is busy, the job waits on S3, the network or the database
+    if cpu < 0.3 and memory < 0.5:
+        return 'io'
+    return 'balanced'
+
+def recommend_sagemaker(workload: str, runs: list, profile: dict, min_runs: int) -> dict:
+    """ Recommends the cheapest instance keeping the p95 CPU and memory below the targets
+        :argument: workload - Name of the workload
+        :argument: runs - List of collected runs
+        :argument: profile - Current profile of the workload
+        :argument: min_runs - Runs needed for a recommendation
+        :return: recommendation - Dictionary with the bound, the utilization, the current and recommended profile
+    """
+    source = WORKLOADS[workload]
+    runs = [run for run in runs if run['cpu'] and run['memory']]
+    recommendation = {'workload': workload, 'runs': len(runs), 'current': profile, 'recommended': dict(profile)}
+    if len(runs) < min_runs:
+        recommendation['reason'] = f"insufficient data, {len(runs)} runs with metrics"
+        return recommendation
+    # CloudWatch sums the CPU utilization over the vCPUs of the instance
+    cpu = np.concatenate([np.array(run['cpu']) / (100 * SAGEMAKER_INSTANCES[run['instance_type']][0]) for run in runs])
+    memory = np.concatenate([np.array(run['memory']) / 100 for run in runs])
+    disk = max(max(run['disk'] or [0]) for run in runs) / 100
+    vcpus, memory_gib, price = SAGEMAKER_INSTANCES[profile['instance_type']]
+    cpu_p95, memory_p95 = float(np.percentile(cpu, 95)), float(np.percentile(memory, 95))
+    duration = float(np.mean([run['duration_seconds'] for run in runs]))
+    needed_vcpus = vcpus * profile['instance_count'] * cpu_p95 / TARGET_CPU
+    needed_memory = memory_gib * memory_p95 / TARGET_MEMORY
+    candidates = [(candidate_price, instance_type) for instance_type, (candidate_vcpus, candidate_memory, candidate_price)
+                  in SAGEMAKER_INSTANCES.items()
+                  if any(instance_type.startswith(family + '.') for family in source['families'])
+                  and candidate_vcpus >= needed_vcpus and candidate_memory >= needed_memory]
+    instance_type = min(candidates)[1] if candidates else profile['instance_type']
+    recommendation.update({'bound': bound(cpu_p95, memory_p95), 'cpu_p95': cpu_p95, 'memory_p95': memory_p95,
+                           'disk_max': disk, 'duration_seconds': duration,
+                           'cost_per_run': price * profile['instance_count'] * duration / 3600})
+    recommendation['recommended'].update({'instance_type': instance_type, 'instance_count': 1,
+                                          'volume_size_gb': max(10, 5 * math.ceil(profile['volume_size_gb'] * disk
+                                                                                  / TARGET_DISK / 5))})
+    # CPU bound jobs run shorter on more vCPUs, the others take as long on any instance meeting the targets
+    new_vcpus, _, new_price = SAGEMAKER_INSTANCES[instance_type]
+    new_duration = duration * min(1.0, vcpus / new_vcpus) if recommendation['bound'] == 'cpu' else duration
+    recommendation['recommended_cost_per_run'] = new_price * new_duration / 3600
+    # I/O bound jobs get faster with more instances, not with more cores, for the price of the current instance
+    if recommendation['bound'] == 'io' and candidates:
+        smallest_price, smallest_type = min(candidates)
+        count = int(price * profile['instance_count'] // smallest_price)
+        if count > 1:
+            recommendation['scale_out'] = {'instance_type': smallest_type, 'instance_count': count}
+            recommendation['scale_out_duration_seconds'] = duration / count
+            if source['sharded']:
+                recommendation['recommended'].update(recommendation['scale_out'])
+    return recommendation
+
+def recommend_fargate(workload: str, usage: dict, profile: dict, min_samples: int) -> dict:
+    """ Recommends the cheapest Fargate task size keeping the p95 CPU and memory below the targets
+        :argument: workload - Name of the workload
+        :argument: usage - Dictionary with the collected service utilization
+        :argument: profile - Current profile of the workload
+        :argument: min_samples - Datapoints needed for a recommendation
+        :return: recommendation - Dictionary with the bound, the utilization, the current and recommended profile
+    """
+    samples = min(len(usage['cpu_utilization']), len(usage['memory_utilization']))
+    recommendation = {'workload': workload, 'samples': samples, 'current': profile, 'recommended': dict(profile)}
+    if samples < min_samples:
+        recommendation['reason'] = f"insufficient data, {samples} datapoints"
+        return recommendation
+    # AWS/ECS reports the utilization in percent of the reserved task size
+    cpu_p95 = float(np.percentile(usage['cpu_utilization'], 95)) / 100
+    memory_p95 = float(np.percentile(usage['memory_utilization'], 95)) / 100
+    needed_cpu = usage['cpu'] * cpu_p95 / TARGET_CPU
+    needed_memory = usage['memory_mib'] * memory_p95 / TARGET_MEMORY
+    hourly = lambda cpu, memory: cpu / 1024 * FARGATE_PRICES[0] + memory / 1024 * FARGATE_PRICES[1]
+    candidates = [(hourly(cpu, memory), cpu, memory) for cpu, memories in FARGATE_SIZES.items() for memory in memories
+                  if cpu >= needed_cpu and memory >= needed_memory]
+    _, cpu, memory = min(candidates) if candidates else (None, profile['cpu'], profile['memory_mib'])
+    recommendation.update({'bound': bound(cpu_p95, memory_p95), 'cpu_p95': cpu_p95, 'memory_p95': memory_p95,
+                           'cost_per_task_hour': hourly(usage['cpu'], usage['memory_mib']),
+                           'recommended_cost_per_task_hour': hourly(cpu, memory)})
+    recommendation['recommended'].update({'cpu': cpu, 'memory_mib': memory})
+    return recommendation
+
+def recommend(utilization: dict, profiles: dict, min_runs: int, min_samples: int) -> list:
+    """ Recommends the profiles of all workloads of the utilization file """
+    recommendations = []
+    for workload, usage in utilization['workloads'].items():
+        if WORKLOADS[workload]['kind'] == 'sagemaker':
+            recommendations.append(recommend_sagemaker(workload, usage['runs'], profiles[workload], min_runs))
+        else:
+            recommendations.append(recommend_fargate(workload, usage, profiles[workload], min_samples))
+    return recommendations
+
+def describe(recommendation: dict) -> str:
+    """ Returns the one line summary of the recommendation """
+    current, recommended = recommendation['current'], recommendation['recommended']
+    if 'reason' in recommendation:
+        return f"{recommendation['workload']}: keep the current size, {recommendation['reason']}"
+    bound_text = 'balanced' if recommendation['bound'] == 'balanced' else f"{recommendation['bound']} bound"
+    text = (f"{recommendation['workload']}: {bound_text} "
+            f"(cpu p95 {recommendation['cpu_p95']:.0%}, memory p95 {recommendation['memory_p95']:.0%}), ")
+    if current.get('kind') == 'fargate':
+        text += (f"{current['cpu']} CPU / {current['memory_mib']} MiB -> {recommended['cpu']} CPU / "
+                 f"{recommended['memory_mib']} MiB, ${recommendation['cost_per_task_hour']:.4f} -> "
+                 f"${recommendation['recommended_cost_per_task_hour']:.4f} per task hour")
+    else:
+        text += (f"{current['instance_count']} x {current['instance_type']} {current['volume_size_gb']} GB -> "
+                 f"{recommended['instance_count']} x {recommended['instance_type']} {recommended['volume_size_gb']} GB, "
+                 f"${recommendation['cost_per_run']:.3f} -> ${recommendation['recommended_cost_per_run']:.3f} per run")
+        if 'scale_out' in recommendation:
+            scale_out = recommendation['scale_out']
+            text += (f"; I/O bound, use {scale_out['instance_count']} x {scale_out['instance_type']} for the same price, "
+                     f"about {recommendation['scale_out_duration_seconds'] / 60:.0f} instead of "
+                     f"{recommendation['duration_seconds'] / 60:.0f} min")
+            if not WORKLOADS[recommendation['workload']]['sharded']:
+                text += " once the job shards its input (ShardedByS3Key)"
+    return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recommend instance types and Fargate sizes from the utilization")
+    parser.add_argument('--fixture', default=None, help="Utilization JSON file used instead of CloudWatch")
+    parser.add_argument('--days', type=int, default=14, help="Days of CloudWatch history to collect")
+    parser.add_argument('--output', default=None, help="Writes the collected utilization JSON file")
+    parser.add_argument('--min-runs', type=int, default=3)
+    parser.add_argument('--min-samples', type=int, default=24)
+    parser.add_argument('--profiles', default=PROFILES_PATH, help="Instance profiles JSON file read by app.py")
+    parser.add_argument('--apply', action='store_true', help="Writes the recommended sizes to the profiles file")
+    args = parser.parse_args()
+
+    if args.fixture:
+        with open(args.fixture) as fixture_file:
+            utilization = json.load(fixture_file)
+    else:
+        utilization = collect(args.days)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(utilization, output_file, default=str)
+
+    profiles = load_profiles(args.profiles)
+    recommendations = recommend(utilization, profiles, args.min_runs, args.min_samples)
+    for recommendation in recommendations:
+        print(describe(recommendation))
+    if args.apply:
+        changed = {recommendation['workload']: recommendation['recommended'] for recommendation in recommendations
+                   if recommendation['recommended'] != recommendation['current']}
+        for workload, profile in changed.items():
+            profiles[workload] = profile
+        save_profiles(profiles, args.profiles)
+        print(f"Updated {', '.join(changed) or 'no workloads'} in {args.profiles}, deploy the stacks to apply them")
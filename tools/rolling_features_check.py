@@ -0,0 +1,82 @@
+""" Local check of the rolling window features of the transform job against a naive implementation
+
+    Computes the features of glue_code/rolling_features.py on shuffled synthetic C-MAPSS like data with
+    missing cycles and compares them with a per unit pandas rolling mean and standard deviation and a
+    least squares fit of every window. Then ingests the data in batches like the partitioned inference
+    ingests, every batch continued from the float32 windows of a LocalWindowStore, and compares the
+    appended features with the features of the whole history.
+    Run with:
+        pip install -r tools/requirements.txt
+        python tools/rolling_features_check.py --units 20 --cycles 120
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from common import ROOT, SENSOR_COLUMNS, synthetic_cmapss
+
+sys.path.insert(0, os.path.join(ROOT, 'glue_code'))
+from rolling_features import feature_columns, parse_windows, rolling_features
+from window_store import LocalWindowStore
+
+
+def naive_features(data: pd.DataFrame, windows: list) -> pd.DataFrame:
+    """ Computes the features one unit and one window at a time """
+    data = data.sort_values(['unit', 'cycle']).reset_index(drop=True)
+    features = {}
+    for window in windows:
+        for column in SENSOR_COLUMNS:
+            rolling = data.groupby('unit')[column].rolling(window, min_periods=1)
+            features[f"{column}_mean_{window}"] = rolling.mean().to_numpy()
+            features[f"{column}_std_{window}"] = rolling.std().to_numpy()
+            slopes = []
+            for _, unit_data in data.groupby('unit'):
+                cycles, values = unit_data['cycle'].to_numpy(float), unit_data[column].to_numpy()
+                for i in range(len(unit_data)):
+                    start = max(0, i - window + 1)
+                    slopes.append(np.polyfit(cycles[start:i + 1], values[start:i + 1], 1)[0] if i > start else np.nan)
+            features[f"{column}_slope_{window}"] = slopes
+    return pd.concat([data[['unit', 'cycle']], pd.DataFrame(features)[feature_columns(windows)]], axis=1)
+
+def assert_features_equal(actual: pd.DataFrame, expected: pd.DataFrame, rtol: float, atol: float) -> None:
+    """ Compares the features, NaN where the window has less than 2 cycles on both sides """
+    actual, expected = [data.sort_values(['unit', 'cycle']).reset_index(drop=True) for data in [actual, expected]]
+    assert list(actual.columns) == list(expected.columns)
+    assert (actual[['unit', 'cycle']].to_numpy() == expected[['unit', 'cycle']].to_numpy()).all()
+    for column in actual.columns[2:]:
+        np.testing.assert_allclose(actual[column], expected[column], rtol=rtol, atol=atol, err_msg=column)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the rolling window features against a naive implementation")
+    parser.add_argument('--units', type=int, default=20)
+    parser.add_argument('--cycles', type=int, default=120)
+    parser.add_argument('--windows', default='10,30')
+    parser.add_argument('--window-size', type=int, default=50, help="Cycles kept per unit by the window store")
+    parser.add_argument('--batch-cycles', type=int, default=24, help="Cycles per unit of one inference ingest")
+    args = parser.parse_args()
+    windows = parse_windows(args.windows, max_window=args.window_size)
+
+    # Shuffled rows with missing cycles, the windows count rows and the slope uses the real cycles
+    data = synthetic_cmapss(args.units, args.cycles)
+    data = data.drop(data.sample(frac=0.1, random_state=0).index).sample(frac=1, random_state=1)
+    expected = naive_features(data, windows)
+    actual = rolling_features(data, windows)
+    assert_features_equal(actual, expected, rtol=1e-7, atol=1e-9)
+    print(f"rolling_features: {len(actual)} rows x {len(actual.columns) - 2} features match the naive implementation")
+
+    # Inference batches continued from the float32 windows of the store of the previous batch
+    store = LocalWindowStore(window_size=args.window_size)
+    batches = []
+    for start in range(0, args.cycles, args.batch_cycles):
+        batch = data[(data['cycle'] > start) & (data['cycle'] <= start + args.batch_cycles)]
+        history = store.get_frame([int(unit) for unit in batch['unit'].unique()])
+        batches.append(rolling_features(batch, windows, history=history))
+        store.update(batch)
+    # The stored windows are float32, the features are compared at float32 precision
+    assert_features_equal(pd.concat(batches), actual, rtol=1e-4, atol=1e-4)
+    print(f"incremental: {len(batches)} batches match the features of the whole history")
@@ -0,0 +1,121 @@
+""" Local check that the Spark convert and transform logic gives the same results as the pandas jobs
+
+    Runs glue_code/spark_transforms.py on a local PySpark session against the pandas code of the
+    convert and transform jobs on synthetic C-MAPSS like data: column naming and types, the RUL
+    target of the train data, the per unit timestamps of the inference data, the sensor sketches and
+    the rolling window features.
+    Run with:
+        pip install -r tools/requirements.txt
+        python tools/spark_parity_check.py --units 50 --cycles 120
+"""
+import io
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pyspark.sql import SparkSession
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from common import ROOT, synthetic_cmapss, load_module
+
+sys.path.insert(0, os.path.join(ROOT, 'glue_code'))
+sys.path.insert(0, os.path.join(ROOT, 'shared', 'python'))
+import spark_transforms
+from drift_stats import sensor_sketches
+from drift_sketch import compare
+from rolling_features import rolling_features
+
+
+def pandas_convert(content: bytes, test: bool) -> pd.DataFrame:
+    """ Parses and names the raw csv like glue_code/convert_job.py """
+    raw_data = pd.read_csv(io.BytesIO(content), header=None)
+    sensors_number = len(raw_data.columns) - 5
+    raw_data.columns = ['unit', 'cycle', 'altitude', 'mach', 'tra'] + [f'sensor_{i}' for i in range(1, sensors_number + 1)]
+    if test:
+        raw_data.rename(columns={'sensor_22': 'rul'}, inplace=True)
+    return raw_data
+
+def sorted_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """ Orders the rows by unit and cycle, Spark does not keep the row order of the file """
+    return data.sort_values(['unit', 'cycle']).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the Spark transforms against the pandas jobs")
+    parser.add_argument('--units', type=int, default=50)
+    parser.add_argument('--cycles', type=int, default=120)
+    args = parser.parse_args()
+
+    transform_job = load_module('glue_code/transform_job.py', 'transform_job')
+    spark = (SparkSession.builder.master('local[2]').appName('spark-parity-check')
+             .config('spark.sql.session.timeZone', 'UTC').config('spark.sql.shuffle.partitions', '4').getOrCreate())
+    schema = {"unit": "int", "cycle": "int", "altitude": "double", "mach": "double", "tra": "double"}
+    for i in range(1, 22):
+        schema[f'sensor_{i}'] = "double"
+
+    # Raw C-MAPSS files end with two empty columns, train files have them empty and test files hold the RUL
+    raw_data = synthetic_cmapss(args.units, args.cycles)
+    raw_data['sensor_22'] = np.nan
+    raw_data['sensor_23'] = np.nan
+    with_rul = raw_data.assign(sensor_22=np.arange(len(raw_data)) % 150)
+    with tempfile.TemporaryDirectory() as directory:
+        for name, data, test in [('train', raw_data, False), ('test', with_rul, True)]:
+            content = data.to_csv(header=False, index=False).encode('utf-8')
+            expected = pandas_convert(content, test)
+            # Spark reads the same file from a local path
+            path = os.path.join(directory, f'{name}.csv')
+            with open(path, 'wb') as file:
+                file.write(content)
+            spark_raw = spark_transforms.name_columns(spark.read.csv(path, header=False, inferSchema=True), test=test)
+            actual = spark_raw.toPandas()
+            assert list(actual.columns) == list(expected.columns), (list(actual.columns), list(expected.columns))
+            pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False)
+            print(f"convert {name}: {len(actual)} rows, columns and values match")
+
+    # RUL target of the train data
+    typed = raw_data[list(schema)].astype({column: transform_job.PANDAS_TYPES[column_type]
+                                           for column, column_type in schema.items()})
+    spark_typed = spark_transforms.select_schema(spark.createDataFrame(raw_data[list(schema)]), schema)
+    expected = transform_job.create_target(typed.copy())
+    actual = spark_transforms.create_target(spark_typed).toPandas()
+    pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False)
+    assert str(actual['rul'].dtype) == 'int32'
+    print(f"create_target: {len(actual)} rows match")
+
+    # Per unit timestamps of the inference data, both end at the current time on the last cycle of unit 1
+    expected = transform_job.add_timestamp(typed.copy())
+    current_time = expected.loc[expected['unit'] == 1, 'timestamp'].max().to_pydatetime()
+    actual = spark_transforms.add_timestamp(spark_typed, current_time).toPandas()
+    actual['timestamp'] = pd.to_datetime(actual['timestamp'])
+    pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False)
+    print(f"add_timestamp: {len(actual)} rows match, last timestamp {current_time:%Y-%m-%d %H:%M:%S}")
+
+    # Window tail keeps the last cycles of every unit
+    tail = spark_transforms.window_tail(spark_typed, 50).toPandas()
+    assert len(tail) == args.units * min(50, args.cycles)
+    assert tail.groupby('unit')['cycle'].min().eq(max(1, args.cycles - 49)).all()
+
+    # Sensor sketches merged from the partitions describe the same distributions as the pandas sketches
+    expected = sensor_sketches(typed)
+    actual = spark_transforms.sensor_sketches(spark_typed.repartition(4))
+    assert sorted(actual) == sorted(expected)
+    for column, sketch in actual.items():
+        assert sketch.count == expected[column].count
+        assert np.isclose(sketch.mean, expected[column].mean) and np.isclose(sketch.variance, expected[column].variance)
+    drift = compare(expected, actual, ks_threshold=0.02)
+    assert not drift['drifted'], drift['drifted']
+    print(f"sensor_sketches: {len(actual)} columns match")
+
+    # Rolling window features, the second half of the cycles continues the windows of the first half
+    half = typed[typed['cycle'] <= args.cycles // 2]
+    expected = rolling_features(typed, [10, 30])
+    expected = expected[expected['cycle'] > args.cycles // 2]
+    actual = spark_transforms.rolling_features(spark_typed.filter(spark_typed['cycle'] > args.cycles // 2), [10, 30],
+                                               history=spark.createDataFrame(half)).toPandas()
+    pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False, rtol=1e-6)
+    print(f"rolling_features: {len(actual)} rows match")
+    print("Spark parity checks passed")
+    spark.stop()
@@ -0,0 +1,101 @@
+""" Local simulation of the spot training backend against on-demand training
+
+    Simulates training jobs of the same length on a simulated clock: on-demand jobs run straight through,
+    spot jobs wait for capacity, get interrupted at a random rate and restart either from the last
+    checkpoint or, without checkpoints, from the beginning. Lost time is the restart after an interruption,
+    redone time the training repeated since the last checkpoint. The SecondaryStatusTransitions and billed
+    times of every simulated job are reported with spot_usage of the training Lambda, like /training_status
+    does for real jobs, and the runs are compared by trainings completed for the same budget.
+    Run with:
+        pip install -r tools/requirements.txt
+        python tools/spot_training_simulation.py --jobs 200 --hours 4 --interruptions-per-hour 0.1
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared', 'python'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_code', 'training_lambda'))
+from training_lambda import spot_usage
+
+
+def simulate_job(args: argparse.Namespace, generator: random.Random, spot: bool, checkpoints: bool) -> dict:
+    """ Simulates one training job and returns it in the describe_training_job format
+        :argument: args - Simulation arguments
+        :argument: generator - Random generator of the waits and interruptions
+        :argument: spot - Runs on spot capacity when True, on-demand otherwise
+        :argument: checkpoints - Restarts from the last checkpoint when True, from the beginning otherwise
+        :return: job - Dictionary with TrainingTimeInSeconds, BillableTimeInSeconds and SecondaryStatusTransitions
+    """
+    start = datetime(2026, 1, 1)
+    now, done, work = 0.0, 0.0, args.hours * 3600
+    transitions = []
+
+    def phase(status: str, seconds: float) -> None:
+        nonlocal now
+        transitions.append({'Status': status, 'StartTime': start + timedelta(seconds=now),
+                            'EndTime': start + timedelta(seconds=now + seconds)})
+        now += seconds
+
+    while True:
+        phase('Starting', generator.expovariate(1 / args.capacity_wait) if spot else 60.0)
+        phase('Downloading', args.startup)
+        # Time until the next spot interruption, on-demand instances are not interrupted
+        remaining = work - done
+        until_interruption = generator.expovariate(args.interruptions_per_hour / 3600) if spot else float('inf')
+        if until_interruption >= remaining:
+            phase('Training', remaining)
+            break
+        phase('Training', until_interruption)
+        done += until_interruption
+        # Work after the last checkpoint is lost, without checkpoints all of it
+        done = done - done % (args.checkpoint_minutes * 60) if checkpoints else 0.0
+        phase('Interrupted', 120.0)
+    phase('Uploading', 30.0)
+    # Instances are billed from the image download on, spot time at the discounted price
+    training_seconds = sum((transition['EndTime'] - transition['StartTime']).total_seconds()
+                           for transition in transitions
+                           if transition['Status'] in ['Downloading', 'Training', 'Uploading'])
+    billable_seconds = training_seconds * (1 - args.spot_discount) if spot else training_seconds
+    # Training after an interruption repeats the work since the last checkpoint
+    redone_seconds = sum((transition['EndTime'] - transition['StartTime']).total_seconds()
+                         for transition in transitions if transition['Status'] == 'Training') - work
+    return {'TrainingTimeInSeconds': int(training_seconds), 'BillableTimeInSeconds': int(billable_seconds),
+            'SecondaryStatusTransitions': transitions, 'WallSeconds': now, 'RedoneSeconds': redone_seconds}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate spot training with and without checkpoints")
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--hours', type=float, default=4.0, help="Training time of one job without interruptions")
+    parser.add_argument('--interruptions-per-hour', type=float, default=0.1)
+    parser.add_argument('--checkpoint-minutes', type=float, default=10.0)
+    parser.add_argument('--capacity-wait', type=float, default=300.0, help="Mean wait for spot capacity in seconds")
+    parser.add_argument('--startup', type=float, default=180.0, help="Instance start and image pull in seconds")
+    parser.add_argument('--spot-discount', type=float, default=0.7, help="Spot discount on the on-demand price")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    for name, spot, checkpoints in [('on-demand', False, False), ('spot', True, False),
+                                    ('spot+checkpoints', True, True)]:
+        generator = random.Random(args.seed)
+        jobs = [simulate_job(args, generator, spot, checkpoints) for _ in range(args.jobs)]
+        usages = [spot_usage(job) for job in jobs]
+        results[name] = {'wall_hours': sum(job['WallSeconds'] for job in jobs) / len(jobs) / 3600,
+                         'billable_hours': sum(usage['BillableSeconds'] for usage in usages) / len(jobs) / 3600,
+                         'lost_hours': sum(usage['InterruptionSeconds'] for usage in usages) / len(jobs) / 3600,
+                         'redone_hours': sum(job['RedoneSeconds'] for job in jobs) / len(jobs) / 3600,
+                         'interruptions': sum(usage['Interruptions'] for usage in usages) / len(jobs),
+                         'savings': sum(usage['SpotSavingsPercent'] for usage in usages) / len(jobs)}
+
+    budget = results['on-demand']['billable_hours'] * args.jobs
+    print(f"jobs={args.jobs} hours/job={args.hours} interruptions/hour={args.interruptions_per_hour} "
+          f"checkpoint every {args.checkpoint_minutes} min, budget {budget:.0f} on-demand hours")
+    for name, result in results.items():
+        print(f"{name:17s} wall={result['wall_hours']:6.2f} h  billable={result['billable_hours']:6.2f} h  "
+              f"savings={result['savings']:5.1f} %  interruptions={result['interruptions']:5.2f}  "
+              f"lost={result['lost_hours']:5.2f} h  redone={result['redone_hours']:5.2f} h  "
+              f"trainings for the budget={budget / result['billable_hours']:7.0f}")